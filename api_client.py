@@ -1,38 +1,64 @@
-import http.client
 import json
 import traceback
 
-def get_person_data(doc_number):
+import http_transport
+
+API_BASE_URL = "https://dniruc.apisunat.com"
+
+# Desenlace de una consulta: solo los dos primeros se pueden guardar en caché (person_lookup)
+LOOKUP_FOUND = "found"
+LOOKUP_NOT_FOUND = "not_found"
+LOOKUP_ERROR = "error"
+
+INVALID_DOCUMENT_MESSAGE = "Longitud de documento inválida (debe ser 8 o 11 dígitos)."
+
+
+def document_endpoint(doc_number):
+    """Ruta de la API para un DNI (8 dígitos) o RUC (11 dígitos); None si no es válido."""
+    if len(doc_number) == 8:
+        return f"/dni/{doc_number}"
+    if len(doc_number) == 11:
+        return f"/ruc/{doc_number}"
+    return None
+
+
+def request_person_data(doc_number):
     """
-    Obtiene datos de DNI o RUC usando la API de apisunat.com.
-    Retorna un diccionario con los datos o None si hay error.
+    Consulta directa a la API de apisunat.com.
+    Retorna (resultado, desenlace): LOOKUP_FOUND, LOOKUP_NOT_FOUND (la API respondió que no
+    existe) o LOOKUP_ERROR (red, servidor o documento inválido: no debe guardarse).
     """
     doc_number = str(doc_number).strip()
-    
-    if len(doc_number) == 8:
-        endpoint = f"/dni/{doc_number}"
-    elif len(doc_number) == 11:
-        endpoint = f"/ruc/{doc_number}"
-    else:
-        return {"success": False, "message": "Longitud de documento inválida (debe ser 8 o 11 dígitos)."}
+    endpoint = document_endpoint(doc_number)
+    if endpoint is None:
+        return {"success": False, "message": INVALID_DOCUMENT_MESSAGE}, LOOKUP_ERROR
 
     try:
-        conn = http.client.HTTPSConnection("dniruc.apisunat.com")
-        boundary = ''
-        payload = ''
-        headers = {
-            'Origin': 'https://apisunat.com',
-            'Content-type': 'multipart/form-data; boundary={}'.format(boundary)
-        }
-        conn.request("GET", endpoint, payload, headers)
-        res = conn.getresponse()
-        data = res.read()
-        decoded_data = data.decode("utf-8")
-        
-        json_data = json.loads(decoded_data)
-        return json_data
-
+        # Sesión compartida con keep-alive: las consultas seguidas reutilizan la conexión TLS
+        response = http_transport.get(f"{API_BASE_URL}{endpoint}", headers={'Origin': 'https://apisunat.com'},
+                                      endpoint=f"apisunat.{endpoint.split('/')[1]}", read_timeout=10)
+        json_data = json.loads(response.content.decode("utf-8"))
     except Exception as e:
         print(f"Error en API SUNAT: {e}")
         traceback.print_exc()
-        return {"success": False, "message": f"Error de conexión: {str(e)}"}
\ No newline at end of file
+        return {"success": False, "message": f"Error de conexión: {str(e)}"}, LOOKUP_ERROR
+
+    if not isinstance(json_data, dict):
+        return {"success": False, "message": "Respuesta no reconocida de la API."}, LOOKUP_ERROR
+    if json_data.get("success"):
+        return json_data, LOOKUP_FOUND
+    if response.status_code in (200, 404):
+        json_data.setdefault("message", "No se encontraron datos.")
+        return json_data, LOOKUP_NOT_FOUND
+    # 401, 429, 5xx...: fallo pasajero, se vuelve a consultar la próxima vez
+    json_data.setdefault("message", f"Error de la API (HTTP {response.status_code}).")
+    return json_data, LOOKUP_ERROR
+
+
+def get_person_data(doc_number):
+    """
+    Obtiene datos de DNI o RUC usando la API de apisunat.com, sin caché.
+    Retorna un diccionario con los datos o con success False y el mensaje de error.
+    Las vistas consultan a través de person_lookup (clientes locales y caché primero).
+    """
+    return request_person_data(doc_number)[0]
@@ -0,0 +1,103 @@
+"""
+Servidor HTTP local que imita la API de DNI/RUC de apisunat.com (GET /dni/<n> y
+/ruc/<n>) para probar person_lookup y las vistas sin salir a la red.
+
+Uso manual: python apisunat_stub.py [puerto]  y apuntar api_client.API_BASE_URL a la URL que imprime.
+"""
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_PEOPLE = {
+    "12345678": {"numero": "12345678", "nombre": "JUAN", "apellido_paterno": "PEREZ", "apellido_materno": "ROJAS"},
+    "20123456789": {"numero": "20123456789", "nombre": "COMERCIAL EJEMPLO S.A.C.",
+                    "domicilio": {"direccion": "AV. LIMA 123", "distrito": "LIMA", "provincia": "LIMA",
+                                  "departamento": "LIMA", "ubigeo": "150101"}},
+}
+
+
+class ApisunatStubServer:
+    """
+    Servidor en un hilo propio. Atributos para los escenarios de prueba:
+    people: documento -> datos que devuelve la API (los demás responden 404 "no encontrado").
+    delay: segundos que tarda cada respuesta (para probar consultas simultáneas).
+    status: si se indica (p.ej. 500), todas las consultas responden ese error.
+    requests: lista de rutas recibidas.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, people=None, delay=0.0):
+        self.people = dict(SAMPLE_PEOPLE if people is None else people)
+        self.delay = delay
+        self.status = None
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, path):
+        """(código HTTP, cuerpo JSON) para la ruta recibida."""
+        with self._lock:
+            self.requests.append(path)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.status:
+            return self.status, {"success": False, "message": "Error interno"}
+        match = re.fullmatch(r"/(dni|ruc)/(\d+)", path)
+        if not match:
+            return 400, {"success": False, "message": "Ruta no válida"}
+        data = self.people.get(match.group(2))
+        if data is None:
+            return 404, {"success": False, "message": "No se encontraron resultados"}
+        return 200, {"success": True, "data": data}
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, body = stub.handle(self.path)
+                response = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    server = ApisunatStubServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8090)
+    print(f"API DNI/RUC de prueba en {server.url} (Ctrl+C para salir)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server._server.server_close()
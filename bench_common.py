@@ -0,0 +1,34 @@
+"""
+Base de datos temporal para los benchmarks (y el fixture temp_db de las pruebas): nunca
+tocan database.db, config.json ni sales_state.json reales.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+
+import database
+import state_manager
+
+
+@contextmanager
+def temp_database(directory=None):
+    """
+    Crea y migra una base nueva en `directory` (o en un directorio temporal que se borra al
+    salir) y trabaja con ese directorio como cwd: config.json y database.db son relativos a él.
+    Al salir cierra las conexiones y restaura el cwd, la ruta de la base y STATE_FILE.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = str(directory or tmp)
+        cwd = os.getcwd()
+        state_file = state_manager.STATE_FILE
+        os.chdir(directory)
+        try:
+            state_manager.STATE_FILE = os.path.join(directory, 'sales_state.json')
+            database.set_database_path(os.path.join(directory, 'database.db'))
+            database.setup_database()
+            yield directory
+        finally:
+            database.close_all_connections()
+            database.set_database_path('database.db')
+            state_manager.STATE_FILE = state_file
+            os.chdir(cwd)
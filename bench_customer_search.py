@@ -0,0 +1,73 @@
+"""
+Benchmark de la búsqueda de clientes mientras se escribe: LIKE '%texto%' sobre customers
+y get_all_parties() filtrado en Python (antes) vs. el índice FTS5 customers_fts (ahora).
+
+Uso: python bench_customer_search.py [cantidad_de_clientes]   (por defecto 200000)
+Trabaja sobre una base de datos temporal; no toca database.db.
+"""
+import random
+import sys
+import time
+
+import bench_common
+import database
+
+FIRST = ["José", "María", "Luis", "Ana", "Carlos", "Rosa", "Jorge", "Lucía", "Pedro", "Carmen", "Miguel", "Elena"]
+LAST = ["Pérez", "García", "Quispe", "Flores", "Rodríguez", "Huamán", "Mamani", "Torres", "Díaz", "Chávez", "Ramos"]
+COMPANY = ["Comercial", "Bodega", "Distribuidora", "Inversiones", "Minimarket", "Ferretería"]
+# Lo que teclea el cajero, letra por letra
+TYPED = ["qu", "qui", "quis", "quispe", "quispe ro", "bodega", "bodega san", "2061", "20612345", "lucia tor"]
+LEGACY_LIKE = "SELECT * FROM customers WHERE name LIKE ? OR alias LIKE ? OR doc_number LIKE ? ORDER BY name LIMIT 20"
+
+
+def _seed(count):
+    rnd = random.Random(1)
+    rows = []
+    for i in range(count):
+        if i % 4 == 0:
+            name = f"{rnd.choice(COMPANY)} {rnd.choice(LAST)} {rnd.choice(['SAC', 'EIRL', 'SRL'])}"
+            doc = f"20{600000000 + i}"
+        else:
+            name = f"{rnd.choice(FIRST)} {rnd.choice(LAST)} {rnd.choice(LAST)}"
+            doc = f"{40000000 + i}"
+        rows.append((doc, name, "", f"Jr. {rnd.choice(LAST)} {i % 900}", "Cliente", ""))
+    with database.transaction() as conn:
+        conn.executemany("INSERT INTO customers (doc_number, name, phone, address, type, alias) VALUES (?,?,?,?,?,?)", rows)
+
+
+def _ms(func):
+    start = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def _legacy_filter(typed):
+    term = typed.upper()
+    return [row for row in database.get_all_parties() if any(term in str(v).upper() for v in row[1:])]
+
+
+def main(count):
+    with bench_common.temp_database():
+        elapsed, _ = _ms(lambda: _seed(count))
+        print(f"{count} clientes insertados en {elapsed:.0f} ms (triggers del índice incluidos)")
+
+        def legacy_like(typed):
+            with database.get_connection() as conn:
+                term = f"%{typed}%"
+                return conn.execute(LEGACY_LIKE, (term, term, term)).fetchall()
+
+        print(f"{'consulta':>12} {'LIKE ms':>9} {'FTS ms':>9} {'lista ms':>9} {'FTS ms':>9}")
+        totals = [0.0] * 4
+        for typed in TYPED:
+            times = [_ms(lambda: legacy_like(typed))[0],
+                     _ms(lambda: database.search_customers_general(typed))[0],
+                     _ms(lambda: _legacy_filter(typed))[0],
+                     _ms(lambda: database.search_parties(typed))[0]]
+            totals = [t + x for t, x in zip(totals, times)]
+            print(f"{typed!r:>12} " + " ".join(f"{t:>9.1f}" for t in times))
+        print(f"{'total':>12} " + " ".join(f"{t:>9.1f}" for t in totals))
+        print("(venta: search_customers_general; clientes/proveedores: filtro de la lista)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,98 @@
+"""
+Benchmark de la recarga del catálogo con fotos: foto en la fila de products y traída por
+get_all_products (antes) vs. fotos en product_images y solo image_hash en la consulta
+(ahora); y miniaturas decodificadas en cada dibujo (antes) vs. product_thumbnails (ahora).
+
+Uso: python bench_product_images.py [cantidad_de_productos]   (por defecto 2000)
+Trabaja sobre una base de datos temporal; no toca database.db.
+"""
+import io
+import random
+import sys
+import time
+import tracemalloc
+
+from PIL import Image
+
+import bench_common
+import database
+import product_thumbnails
+
+PHOTO_SIZE = (800, 600)
+# Antes de la v37 la foto estaba en products.image; se reproduce en una copia de la tabla
+LEGACY_QUERY = ("SELECT id, name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, "
+                "category, image, is_active FROM legacy_products WHERE is_active = 1 ORDER BY name")
+
+
+def _photo(rnd):
+    # Ruido: las fotos reales no comprimen como un color plano
+    out = io.BytesIO()
+    Image.frombytes("RGB", PHOTO_SIZE, rnd.randbytes(PHOTO_SIZE[0] * PHOTO_SIZE[1] * 3)).save(out, format="JPEG", quality=80)
+    return out.getvalue()
+
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1e6, result
+
+
+def main(count):
+    with bench_common.temp_database():
+        rnd = random.Random(1)
+        photos = [_photo(rnd) for _ in range(20)]
+        print(f"Generando {count} productos con foto de {PHOTO_SIZE[0]}x{PHOTO_SIZE[1]} "
+              f"(~{sum(map(len, photos)) / len(photos) / 1024:.0f} KB)...")
+        for i in range(count):
+            database.add_product(f"Producto {i:05d}", 1.0, 10, f"C{i}", "NIU", image=photos[i % len(photos)])
+        with database.transaction() as conn:
+            conn.execute("CREATE TABLE legacy_products AS SELECT * FROM products")
+            conn.execute("UPDATE legacy_products SET image = (SELECT image FROM product_images WHERE product_id = legacy_products.id)")
+
+        def legacy():
+            with database.get_connection() as conn:
+                return conn.execute(LEGACY_QUERY).fetchall()
+
+        print(f"{'recarga del catálogo':>24} {'ms':>9} {'MB pico':>9}")
+        for label, func in (("antes (con image)", legacy), ("ahora (image_hash)", database.get_all_products)):
+            elapsed, peak, rows = _measure(func)
+            print(f"{label:>24} {elapsed:>9.1f} {peak:>9.1f}")
+
+        # Miniaturas de una grilla de 200 botones
+        grid = rows[:200]
+        service = product_thumbnails.ThumbnailService(photo_factory=lambda png: png)
+        start = time.perf_counter()
+        for row in grid:
+            service.get(row[0], row[10])
+        service.wait()
+        service.deliver()
+        first = (time.perf_counter() - start) * 1000
+
+        legacy_grid = legacy()[:200]
+
+        def decode_each_render():
+            for row in legacy_grid:
+                with Image.open(io.BytesIO(row[10])) as img:
+                    img.thumbnail(product_thumbnails.THUMBNAIL_SIZE)
+
+        def from_table():
+            for row in grid:
+                Image.open(io.BytesIO(database.get_product_thumbnail(row[0], row[10]))).load()
+
+        def from_memory():
+            for row in grid:
+                service.get(row[0], row[10])
+
+        print(f"{'200 miniaturas':>24} {'ms':>9}")
+        print(f"{'antes (decodificar)':>24} {_measure(decode_each_render)[0]:>9.1f}")
+        print(f"{'generar (1a vez, hilo)':>24} {first:>9.1f}")
+        print(f"{'ahora (tabla)':>24} {_measure(from_table)[0]:>9.1f}")
+        print(f"{'ahora (memoria)':>24} {_measure(from_memory)[0]:>9.1f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,55 @@
+"""
+Benchmark de la búsqueda de productos mientras se escribe: recorrido lineal con
+`in p['name'].lower()` (antes) vs. índice de trigramas de product_search (ahora).
+
+Uso: python bench_product_search.py [cantidad_de_productos]   (por defecto 50000)
+No usa la base de datos: los productos se generan en memoria.
+"""
+import random
+import sys
+import time
+
+import product_search
+
+WORDS = ["Arroz", "Azúcar", "Leche", "Aceite", "Galleta", "Café", "Fideo", "Atún", "Harina", "Jabón",
+         "Detergente", "Gaseosa", "Yogurt", "Mantequilla", "Queso", "Pan", "Chocolate", "Sal", "Avena", "Té"]
+BRANDS = ["Costeño", "Gloria", "Primor", "Nestlé", "Molitalia", "Florida", "Bolívar", "Sapolio", "Laive", "Field"]
+# Lo que teclea el cajero, letra por letra
+TYPED = ["a", "az", "azu", "azuc", "azucar", "azucar r", "glo", "glori", "gloria", "leche glo", "7501", "cafe nes"]
+
+
+def _products(count):
+    rnd = random.Random(1)
+    return [{'id': i, 'name': f"{rnd.choice(WORDS)} {rnd.choice(BRANDS)} {rnd.randint(1, 999)}g",
+             'code': f"{7500000 + i}"} for i in range(count)]
+
+
+def linear(products, typed):
+    query = typed.lower()
+    return [p for p in products if query in p['name'].lower() or query in str(p.get('code', '')).lower()]
+
+
+def main(count):
+    products = sorted(_products(count), key=lambda p: p['name'])
+    start = time.perf_counter()
+    index = product_search.ProductSearchIndex(products)
+    print(f"{count} productos; índice armado en {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"(una vez por cambio de nombres/códigos)")
+
+    print(f"{'consulta':>12} {'antes ms':>9} {'ahora ms':>9} {'coinciden':>10} {'mostrados':>10}")
+    totals = [0.0, 0.0]
+    for typed in TYPED:
+        start = time.perf_counter()
+        before = linear(products, typed)
+        old = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        now = index.search(typed)
+        new = (time.perf_counter() - start) * 1000
+        totals[0] += old
+        totals[1] += new
+        print(f"{typed!r:>12} {old:>9.2f} {new:>9.2f} {len(before):>10} {len(now):>10}")
+    print(f"{'total':>12} {totals[0]:>9.2f} {totals[1]:>9.2f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark: cálculo del texto de los botones de la grilla táctil con
+reservas de otras cajas, consulta por producto vs. ReservationSnapshot.
+
+Uso: python bench_reservations.py
+Trabaja sobre una base de datos temporal; no toca database.db.
+"""
+import textwrap
+import time
+
+import bench_common
+import database
+import state_manager
+
+PRODUCT_COUNTS = (50, 200, 1000)
+REGISTER_COUNTS = (1, 4, 12)
+ITEMS_PER_CART = 15
+MY_CAJA = "1"
+
+
+def _fill_carts(products, registers):
+    for caja in range(2, registers + 2):
+        cart = []
+        for line in range(ITEMS_PER_CART):
+            p = products[(caja * 7 + line) % len(products)]
+            cart.append({'id': p['id'], 'name': p['name'], 'quantity': 1.0, 'price': p['price'], 'subtotal': p['price']})
+        state_manager.save_box_state(caja, {'cart': cart})
+
+
+def _button_text(prod, reserved):
+    wrapped = textwrap.fill(prod['name'], width=20)
+    return f"{wrapped}\nS/ {prod['price']:.2f}\nStock: {prod['stock'] - reserved:.2f}"
+
+
+def render_per_product(products):
+    return [_button_text(p, state_manager.get_global_reserved_quantity(str(p['id']), exclude_caja_id=MY_CAJA)) for p in products]
+
+
+def render_with_snapshot(products):
+    reservations = state_manager.ReservationSnapshot.load(exclude_caja_id=MY_CAJA)
+    return [_button_text(p, reservations.get(p['id'])) for p in products]
+
+
+def _best_of(func, products, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(products)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    with bench_common.temp_database():
+        print(f"{'productos':>9} {'cajas':>5} {'por producto (ms)':>18} {'snapshot (ms)':>14} {'x':>6}")
+        for count in PRODUCT_COUNTS:
+            with database.transaction() as conn:
+                conn.execute("DELETE FROM products")
+                conn.executemany("INSERT INTO products (name, price, stock, code) VALUES (?, ?, ?, ?)",
+                                 [(f"Producto de prueba {i}", 1.5 + i, 100, f"C{i}") for i in range(count)])
+                products = [{'id': r[0], 'name': r[1], 'price': r[2], 'stock': r[3]} for r in
+                            conn.execute("SELECT id, name, price, stock FROM products")]
+            for registers in REGISTER_COUNTS:
+                for caja in range(2, max(REGISTER_COUNTS) + 2):
+                    state_manager.clear_box_state(caja)
+                _fill_carts(products, registers)
+                assert render_per_product(products) == render_with_snapshot(products)
+                slow = _best_of(render_per_product, products)
+                fast = _best_of(render_with_snapshot, products)
+                print(f"{count:>9} {registers:>5} {slow:>18.2f} {fast:>14.2f} {slow / fast:>6.1f}")
+
+
+if __name__ == '__main__':
+    main()
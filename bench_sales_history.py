@@ -0,0 +1,82 @@
+"""
+Benchmark del historial de ventas (ReportsView): subconsulta correlacionada sobre
+sale_details (antes) vs. columna discount_amount precalculada (ahora).
+
+Uso: python bench_sales_history.py [cantidad_de_ventas]
+Trabaja sobre una base de datos temporal; no toca database.db.
+"""
+import random
+import sys
+import time
+
+import bench_common
+import database
+
+DETAILS_PER_SALE = 3
+
+LEGACY_QUERY = """
+    SELECT
+        s.id, s.document_type, s.document_number, strftime('%Y-%m-%d %H:%M:%S', s.sale_date),
+        COALESCE(c.name, 'Cliente Varios'), s.total_amount,
+        (SELECT SUM((sd.price_per_unit - COALESCE(sd.original_price, sd.price_per_unit)) * sd.quantity_sold)
+         FROM sale_details sd WHERE sd.sale_id = s.id) as diff_amount,
+        i.name, i.address, s.sunat_status, s.sunat_note
+    FROM sales s
+    LEFT JOIN customers c ON s.customer_id = c.id
+    LEFT JOIN issuers i ON s.issuer_id = i.id
+    WHERE s.sale_ts >= ? AND s.sale_ts <= ?
+    ORDER BY s.sale_ts DESC
+"""
+
+
+def _generate(count):
+    rnd = random.Random(1)
+    sales, details = [], []
+    for sale_id in range(1, count + 1):
+        sale_ts = f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} {rnd.randint(8, 21):02d}:{rnd.randint(0, 59):02d}:00"
+        lines = []
+        for _ in range(DETAILS_PER_SALE):
+            price = round(rnd.uniform(1, 40), 2)
+            original = rnd.choice([price, price, round(price * 1.1, 2)])
+            qty = rnd.randint(1, 4)
+            lines.append((sale_id, 1, qty, price, qty * price, original))
+        gross = sum(l[5] * l[2] for l in lines)
+        net = sum(l[4] for l in lines)
+        sales.append((sale_id, 1, sale_ts, sale_ts, net, 'BOLETA', f"B001-{sale_id}", gross, gross - net))
+        details.extend(lines)
+    with database.transaction() as conn:
+        conn.executemany("INSERT INTO sales (id, issuer_id, sale_date, sale_ts, total_amount, document_type, document_number, gross_amount, discount_amount) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", sales)
+        conn.executemany("INSERT INTO sale_details (sale_id, product_id, quantity_sold, price_per_unit, subtotal, original_price) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", details)
+
+
+def _best_of(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, len(rows)
+
+
+def main(count):
+    with bench_common.temp_database():
+        print(f"Generando {count} ventas...")
+        _generate(count)
+
+        def legacy(start, end):
+            with database.get_connection() as conn:
+                return conn.execute(LEGACY_QUERY, (start + " 00:00:00", end + " 23:59:59")).fetchall()
+
+        print(f"{'rango':>10} {'filas':>7} {'antes (ms)':>11} {'ahora (ms)':>11} {'x':>6}")
+        for label, start, end in (("1 día", "2025-06-15", "2025-06-15"), ("1 mes", "2025-06-01", "2025-06-30"),
+                                  ("1 año", "2025-01-01", "2025-12-31")):
+            before, rows = _best_of(lambda: legacy(start, end))
+            after, rows_after = _best_of(lambda: database.get_all_sales_with_customer_name(None, None, start, end))
+            assert rows == rows_after
+            print(f"{label:>10} {rows:>7} {before:>11.1f} {after:>11.1f} {before / after:>6.1f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,111 @@
+"""
+Benchmark de los fondos de la grilla táctil (GradientButton): una línea por columna y
+fondo nuevo en cada dibujo (antes) vs. degradado con linear_gradient/composite y caché
+LRU compartido (ahora). Simula cambios de categoría que redibujan N botones de producto.
+
+Uso: python bench_tile_images.py [cantidad_de_botones]   (por defecto 200)
+Si hay pantalla también mide la conversión a PhotoImage; sin pantalla mide solo PIL.
+"""
+import random
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+import tile_images
+
+SWITCHES = 20
+TILE_SIZE = (160, 80)
+RADIUS = 10
+# Gris por defecto y algunos colores personalizados (planos), como en show_products_for_category
+DEFAULT_COLORS = ((224, 224, 224), (189, 189, 189))
+CUSTOM_COLORS = [(0x19, 0x87, 0x54), (0xfd, 0x7e, 0x14), (0x0d, 0x6e, 0xfd), (0xdc, 0x35, 0x45)]
+
+
+def _legacy_tile(width, height, rgb1, rgb2, radius):
+    """Fondo como lo armaba GradientButton._draw antes del caché."""
+    (r1, g1, b1), (r2, g2, b2) = rgb1, rgb2
+    gradient_img = Image.new('RGBA', (width, height))
+    draw_g = ImageDraw.Draw(gradient_img)
+    for x in range(width):
+        r = int(r1 + (r2 - r1) * x / width)
+        g = int(g1 + (g2 - g1) * x / width)
+        b = int(b1 + (b2 - b1) * x / width)
+        draw_g.line((x, 0, x, height), fill=(r, g, b, 255))
+    mask_img = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(mask_img).rounded_rectangle((0, 0, width, height), radius=radius, fill=255)
+    final_img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    final_img.paste(gradient_img, (0, 0), mask_img)
+    return final_img
+
+
+def _tiles(count):
+    rnd = random.Random(1)
+    tiles = []
+    for _ in range(count):
+        if rnd.random() < 0.2:
+            color = rnd.choice(CUSTOM_COLORS)
+            tiles.append((color, color))
+        else:
+            tiles.append(DEFAULT_COLORS)
+    return tiles
+
+
+def _photo_factory():
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+        root = tk.Tk()
+        root.withdraw()
+    except Exception:
+        return None, lambda img: img
+    return root, ImageTk.PhotoImage
+
+
+def _switch_ms(draw, tiles, switches):
+    times = []
+    for _ in range(switches):
+        start = time.perf_counter()
+        refs = [draw(rgb1, rgb2) for rgb1, rgb2 in tiles]
+        times.append((time.perf_counter() - start) * 1000)
+        del refs
+    return times
+
+
+def main(count):
+    tiles = _tiles(count)
+    root, to_photo = _photo_factory()
+    width, height = TILE_SIZE
+
+    def legacy(rgb1, rgb2):
+        return to_photo(_legacy_tile(width, height, rgb1, rgb2, RADIUS))
+
+    def cached(rgb1, rgb2):
+        key = (width, height, rgb1, rgb2, RADIUS, "normal", None)
+        return tile_images.tile_cache.get(key, lambda: to_photo(tile_images.render_tile(width, height, rgb1, rgb2, RADIUS)))
+
+    def vectorised(rgb1, rgb2):
+        return to_photo(tile_images.render_tile(width, height, rgb1, rgb2, RADIUS))
+
+    tile_images.tile_cache.clear()
+    print(f"{count} botones de {width}x{height}, {SWITCHES} cambios de categoría"
+          f"{'' if root else ' (sin pantalla: solo PIL, sin PhotoImage)'}")
+    print(f"{'':>28} {'1er cambio ms':>14} {'cambio ms (mediana)':>20}")
+    results = {}
+    for label, draw in (("antes (línea por columna)", legacy), ("degradado vectorizado", vectorised),
+                        ("ahora (vectorizado + caché)", cached)):
+        times = _switch_ms(draw, tiles, SWITCHES)
+        median = sorted(times)[len(times) // 2]
+        results[label] = median
+        print(f"{label:>28} {times[0]:>14.1f} {median:>20.1f}")
+
+    stats = tile_images.tile_cache.stats()
+    print(f"caché: {stats['size']} fondos, aciertos {stats['hit_rate']:.1%}")
+    before, _, after = results.values()
+    print(f"mejora por cambio de categoría: x{before / after:.0f}")
+    if root:
+        root.destroy()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
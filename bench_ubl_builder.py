@@ -0,0 +1,106 @@
+"""
+Benchmark del armado del Invoice UBL: árbol completo por venta (_build_invoice_xml_full, antes)
+vs. plantilla precompilada por emisor (_build_invoice_xml, ahora). Arma y firma N comprobantes
+sintéticos con un certificado autofirmado y reporta comprobantes por segundo y asignaciones.
+
+Uso: python bench_ubl_builder.py [cantidad_de_comprobantes]   (por defecto 10000)
+Las asignaciones son las de Python (tracemalloc); la memoria interna de libxml2 no se cuenta.
+"""
+import datetime
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+
+import xml_generator
+
+ALLOCATION_SAMPLE = 1000   # comprobantes medidos con tracemalloc (lo enlentece)
+
+
+def _issuer():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "20123456789")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    blob = pkcs12.serialize_key_and_certificates(b"bench", key, cert, None, serialization.BestAvailableEncryption(b"bench"))
+    return {"id": 1, "certificate": blob, "cert_password": "bench"}
+
+
+def _sales(count):
+    rnd = random.Random(1)
+    issuer = {"ruc": "20123456789", "name": "Empresa S.A.C.", "commercial_name": "Bodega", "address": "Jr. Lima 1", "establishment_code": "0000"}
+    sales = []
+    for number in range(1, count + 1):
+        factura = rnd.random() < 0.3
+        customer = ({"doc_number": "20987654321", "name": "Cliente SAC", "address": "Av. Sol 2"} if factura
+                    else {"doc_number": rnd.choice(["", "12345678"]), "name": "Juan Perez", "address": ""})
+        items = [{"description": f"Producto {rnd.randint(1, 500)}", "quantity": rnd.randint(1, 5),
+                  "price_unit_inc_igv": round(rnd.uniform(0.5, 80), 2), "unit_code": "NIU"} for _ in range(rnd.randint(1, 8))]
+        sales.append({
+            "issuer": issuer,
+            "customer": customer,
+            "document": {"type_name": "FACTURA ELECTRÓNICA" if factura else "BOLETA DE VENTA ELECTRÓNICA",
+                         "series": "F001" if factura else "B001", "number": number,
+                         "issue_date": datetime.datetime(2026, 1, 10, 10, 0), "currency": "PEN"},
+            "items": items,
+        })
+    return sales
+
+
+def _run(build, sales, credentials, gen, sign):
+    start = time.perf_counter()
+    for sale in sales:
+        root, _ = build(sale, {})
+        if sign:
+            gen._sign_xml_ubl(root, credentials)
+    return len(sales) / (time.perf_counter() - start)
+
+
+def _allocations(build, sales):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    trees = [build(sale, {})[0] for sale in sales]
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    del trees
+    return blocks / len(sales), peak / len(sales)
+
+
+def main(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        gen = xml_generator.XMLGenerator(tmp)
+        credentials = gen.get_credentials(_issuer())
+        sales = _sales(count)
+        builders = (("antes (árbol completo)", gen._build_invoice_xml_full), ("ahora (plantilla)", gen._build_invoice_xml))
+
+        # Calentamiento: compila la plantilla y carga el firmador
+        for _, build in builders:
+            _run(build, sales[:50], credentials, gen, sign=True)
+
+        print(f"{count} comprobantes ({sum(len(s['items']) for s in sales)} líneas)")
+        print(f"{'':>24} {'armado/s':>10} {'armado+firma/s':>15} {'bloques/doc':>12} {'bytes pico/doc':>15}")
+        results = {}
+        for label, build in builders:
+            built = _run(build, sales, credentials, gen, sign=False)
+            signed = _run(build, sales, credentials, gen, sign=True)
+            blocks, peak = _allocations(build, sales[:ALLOCATION_SAMPLE])
+            results[label] = (built, signed)
+            print(f"{label:>24} {built:>10.0f} {signed:>15.0f} {blocks:>12.1f} {peak:>15.0f}")
+
+        (old_built, old_signed), (new_built, new_signed) = results.values()
+        print(f"mejora: armado x{new_built / old_built:.2f}, armado+firma x{new_signed / old_signed:.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -385,7 +385,7 @@ class CashCountWindow(ttk.Toplevel):
         conn.close()
         
         # 4. Analytics
-        stats = self._get_period_analytics(self.start_time, closing)
+        stats = database.get_period_analytics(self.start_time, closing)
         
         # Add Temp Expenses
         temp_exps = database.get_temp_expenses(self.caja_id)
@@ -442,119 +442,6 @@ class CashCountWindow(ttk.Toplevel):
         
         self.calculate_total()
         
-    def _get_period_analytics(self, start, end):
-        # Fetch Sales and Movements
-        conn = database.create_connection()
-        cur = conn.cursor()
-        
-        # 1. SALES
-        # Fetch ID, payment methods, amounts, date
-        query_sales = """
-            SELECT id, payment_method, amount_paid, payment_method2, amount_paid2, sale_date
-            FROM sales 
-        """
-        cur.execute(query_sales)
-        sales_rows = cur.fetchall()
-        
-        total_gross_sales = 0.0
-        total_discounts = 0.0
-        total_non_cash = 0.0
-        
-        # Helper to parse multiple date formats
-        def parse_date(date_str):
-            if not date_str: return None
-            formats = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%d-%m-%Y"]
-            for fmt in formats:
-                try: return datetime.strptime(str(date_str), fmt)
-                except ValueError: continue
-            return None
-
-        start_dt = parse_date(start)
-        end_dt = parse_date(end)
-        
-        if start_dt and end_dt:
-             for r in sales_rows:
-                 # r: id, pm1, amt1, pm2, amt2, date
-                 s_dt = parse_date(r[5])
-                 if s_dt and start_dt <= s_dt <= end_dt:
-                     sale_id = r[0]
-                     pm1 = r[1]
-                     amt1 = r[2] or 0.0
-                     pm2 = r[3]
-                     amt2 = r[4] or 0.0
-                     
-                     # 1. Non-Cash Calculation
-                     non_cash = 0.0
-                     if pm1 != 'EFECTIVO': non_cash += amt1
-                     if pm2 != 'EFECTIVO': non_cash += amt2
-                     total_non_cash += non_cash
-                     
-                     # 2. Gross and Discount Calculation (All Sales)
-                     cur.execute("SELECT quantity_sold, price_per_unit, original_price FROM sale_details WHERE sale_id=?", (sale_id,))
-                     details = cur.fetchall()
-                     
-                     sale_gross = 0.0
-                     sale_discount = 0.0
-                     
-                     for d in details:
-                         qty = d[0] or 0
-                         price = d[1] or 0.0
-                         orig = d[2] or price # default to price if None
-                         if orig < price: orig = price # sanity check
-                         
-                         line_gross = qty * orig
-                         line_price = qty * price
-                         line_disc = line_gross - line_price
-                         
-                         sale_gross += line_gross
-                         sale_discount += line_disc
-                         
-                     total_gross_sales += sale_gross
-                     total_discounts += sale_discount
-
-
-        # 2. MOVEMENTS
-        query_movs = "SELECT movement_type, total_amount, date_time FROM inventory_movements"
-        cur.execute(query_movs)
-        mov_rows = cur.fetchall()
-        
-        income_add = 0.0
-        purchases = 0.0
-        expenses = 0.0
-        anulados = 0.0
-        returns = 0.0
-        
-        if start_dt and end_dt:
-            for type_, total, m_date_str in mov_rows:
-                m_dt = parse_date(m_date_str)
-                if m_dt and start_dt <= m_dt <= end_dt:
-                    type_upper = type_.upper()
-                    if type_upper == 'INGRESO':
-                        income_add += total
-                    elif type_upper == 'COMPRA':
-                        purchases += total
-                    elif type_upper in ['GASTO', 'SALIDA']:
-                        expenses += total
-                    elif type_upper == 'ANULADO':
-                        anulados += total
-                    elif type_upper in ['DEVOLUCION', 'DEVOLUCIÓN']:
-                        returns += total
-
-        conn.close()
-        
-        return {
-            'total_gross_sales': total_gross_sales,
-            'non_cash_sales': total_non_cash,
-            'discounts': total_discounts,
-            'income_additional': income_add,
-            'purchases': purchases,
-            'expenses': expenses,
-            'anulados': anulados,
-            'returns': returns
-        }
-
-
-
     def calculate_total(self, *args):
         try:
             # 1. Physical Cash
@@ -9,7 +9,7 @@ from PIL import Image, ImageTk
 import io
 import threading
 import threading
-import api_client
+import person_lookup
 import hashlib
 import whatsapp_manager
 import time
@@ -580,7 +580,8 @@ class ConfigView(ttk.Toplevel):
             try:
                 # Mostrar indicador de carga (opcional, por ahora solo en consola)
                 print(f"Buscando RUC: {ruc}")
-                result = api_client.get_person_data(ruc)
+                # Ubigeo y desglose del domicilio: solo los trae la API (o su caché)
+                result = person_lookup.lookup(ruc, prefer_local=False)
                 self.after(0, lambda: self._handle_ruc_result(result))
             except Exception as e:
                 print(f"Error searching RUC: {e}")
@@ -812,8 +813,14 @@ class ConfigView(ttk.Toplevel):
         self.require_login_combo, rl_cont = self.create_rounded_widget(system_frame, ttk.Combobox, variable=self.require_login_var, values=["Si", "No"], width=15, state="readonly")
         rl_cont.grid(row=9, column=1, padx=5, pady=5, sticky="ew")
 
+        # 7. Envío de boletas: una por una (sendBill) o agrupadas en resumen diario / lote
+        ttk.Label(system_frame, text="Envío de Boletas:").grid(row=10, column=0, padx=5, pady=5, sticky="w")
+        self.cpe_batch_mode_var = tk.StringVar(value="Individual")
+        self.cpe_batch_mode_combo, bm_cont = self.create_rounded_widget(system_frame, ttk.Combobox, variable=self.cpe_batch_mode_var, values=["Individual", "Resumen Diario", "Lote"], width=15, state="readonly")
+        bm_cont.grid(row=10, column=1, padx=5, pady=5, sticky="ew")
+
         save_btn = ttk.Button(system_frame, text="💾 Guardar Configuración", command=self.save_system_config, bootstyle="success")
-        save_btn.grid(row=10, column=0, columnspan=3, padx=10, pady=15)
+        save_btn.grid(row=11, column=0, columnspan=3, padx=10, pady=15)
 
         self.load_system_config()
 
@@ -864,6 +871,9 @@ class ConfigView(ttk.Toplevel):
         req_login = config_manager.load_setting('require_login', 'Si')
         self.require_login_var.set(req_login)
 
+        # CPE Batch Mode
+        self.cpe_batch_mode_var.set(config_manager.load_setting('cpe_batch_mode', 'Individual'))
+
     def save_system_config(self):
         mode = self.system_mode_var.get()
         stock_warning = self.stock_warning_var.get()
@@ -889,6 +899,7 @@ class ConfigView(ttk.Toplevel):
         config_manager.save_setting('allow_reprint', allow_reprint)
         config_manager.save_setting('system_theme', theme)
         config_manager.save_setting('json_generation', json_gen)
+        config_manager.save_setting('cpe_batch_mode', self.cpe_batch_mode_var.get())
         
         messagebox.showinfo("Éxito", "Configuración guardada correctamente.\nNota: Algunos cambios (como el tema) requieren reiniciar el sistema.", parent=self)
 
@@ -0,0 +1,10 @@
+import pytest
+
+import bench_common
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Base de datos nueva en un directorio temporal (config.json y database.db son relativos al cwd)."""
+    with bench_common.temp_database(tmp_path):
+        yield tmp_path
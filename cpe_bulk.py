@@ -0,0 +1,310 @@
+"""
+Regeneración masiva de comprobantes electrónicos: vuelve a armar el JSON y el XML firmado
+de muchas ventas (certificado renovado, día con SUNAT caído) y opcionalmente los reenvía.
+
+Uso:
+  python cpe_bulk.py --desde 2026-01-01 --hasta 2026-01-31 [--estado ERROR_CONEXION ...] [--emisor 1]
+                     [--enviar] [--procesos 4] [--por-segundo 2] [--checkpoint cpe_bulk_checkpoint.json] [--reiniciar]
+
+La firma corre en un pool de procesos; los zips quedan en "SEE Electronica/XML". Con --enviar,
+cada zip firmado se envía (sendBill) respetando el límite de envíos por segundo y emisor.
+El avance se guarda en el checkpoint: si se interrumpe, el mismo comando continúa donde quedó.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import database
+
+DEFAULT_CHECKPOINT = "cpe_bulk_checkpoint.json"
+CHECKPOINT_EVERY = 50       # comprobantes entre escrituras del checkpoint
+REPORT_EVERY_SECONDS = 5
+SEND_WORKERS = 4
+
+
+def build_payload(sale_id):
+    """Payload de comprobante (el mismo formato que encola la venta en cpe_jobs) a partir de get_full_sale_data."""
+    full = database.get_full_sale_data(sale_id)
+    if not full:
+        return None
+    sale, details = full["sale"], full["details"]
+    doc_number = sale[4] or ""
+    series, _, number = doc_number.partition("-")
+    customer_doc = sale[6] or ""
+    return {
+        "sale_id": sale_id,
+        "issuer_id": sale[24],
+        "issuer": {
+            "ruc": sale[8] or "20000000001",
+            "name": sale[7],
+            "commercial_name": sale[13] or "",
+            "address": sale[9],
+            "establishment_code": sale[25] or "0000",
+        },
+        "customer": {
+            "doc_type": "6" if len(customer_doc) == 11 else "1",
+            "doc_number": customer_doc,
+            "name": sale[5] or "",
+            "address": sale[26] or "",
+        },
+        "document": {
+            "type_name": sale[3],
+            "series": series,
+            "number": int(number) if number.isdigit() else number,
+            "issue_date": sale[27] or str(sale[0])[:19],
+            "currency": "PEN",
+            "total": sale[1],
+        },
+        "items": [{
+            "description": name,
+            "quantity": quantity,
+            "price_unit_inc_igv": price,
+            "unit_code": unit or "NIU",
+        } for name, quantity, price, _subtotal, unit, _op_type, _original in details],
+        "totals": {},
+    }
+
+
+# --- Procesos de firma: cada uno carga las credenciales de cada emisor una sola vez (caché de xml_generator) ---
+
+_worker = {}
+
+
+def _init_worker(see_dir, issuers):
+    import json_generator
+    import xml_generator
+    _worker["json"] = json_generator.JSONGenerator(os.path.join(see_dir, "JSON Apisunat"))
+    _worker["xml"] = xml_generator.XMLGenerator(see_dir)
+    _worker["issuers"] = issuers
+
+
+def _sign(payload):
+    """Arma el JSON y el zip firmado de un comprobante. Retorna (sale_id, zip_path, zip_filename)."""
+    import cpe_dispatcher
+    sale_data = cpe_dispatcher.build_sale_data(payload)
+    _worker["json"].generate_invoice_json(sale_data)
+    zip_path, zip_filename, _ = _worker["xml"].build_signed_zip(sale_data, _worker["issuers"][payload["issuer_id"]])
+    return payload["sale_id"], zip_path, zip_filename
+
+
+class Checkpoint:
+    """Avance de una corrida en un archivo JSON: ventas firmadas, enviadas y con error, para los mismos filtros."""
+
+    def __init__(self, path, filters, reset=False):
+        self.path = path
+        self.filters = filters
+        self.signed, self.sent, self.failed = set(), set(), {}
+        if os.path.exists(path) and not reset:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("filters") != filters:
+                raise SystemExit(f"El checkpoint {path} es de otra selección {data.get('filters')}; use --reiniciar u otro --checkpoint.")
+            self.signed, self.sent = set(data.get("signed", [])), set(data.get("sent", []))
+            self.failed = {int(k): v for k, v in data.get("failed", {}).items()}
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+
+    def mark(self, sale_id, signed=False, sent=False, error=None):
+        with self._lock:
+            if signed:
+                self.signed.add(sale_id)
+            if sent:
+                self.sent.add(sale_id)
+            if error is None:
+                self.failed.pop(sale_id, None)
+            else:
+                self.failed[sale_id] = error
+            self._pending_writes += 1
+            if self._pending_writes >= CHECKPOINT_EVERY:
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        data = {"filters": self.filters, "signed": sorted(self.signed), "sent": sorted(self.sent),
+                "failed": {str(k): v for k, v in self.failed.items()}}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+        self._pending_writes = 0
+
+
+class BulkRebuild:
+    def __init__(self, base_dir, checkpoint, send=False, processes=None, rate_per_second=2.0):
+        self.see_dir = os.path.join(base_dir, "SEE Electronica")
+        self.checkpoint = checkpoint
+        self.send = send
+        self.processes = processes or os.cpu_count() or 2
+        self.rate_per_second = rate_per_second
+        self.counts = {"signed": 0, "sent": 0, "failed": 0}
+        self._counts_lock = threading.Lock()
+        self._issuers = {}
+        self.pool_error = None
+
+    def _issuer(self, issuer_id):
+        if issuer_id not in self._issuers:
+            self._issuers[issuer_id] = database.get_issuer_by_id(issuer_id) or {}
+        return self._issuers[issuer_id]
+
+    def _count(self, key):
+        with self._counts_lock:
+            self.counts[key] += 1
+
+    def run(self, sale_ids):
+        todo = [sid for sid in sale_ids if sid not in (self.checkpoint.sent if self.send else self.checkpoint.signed)]
+        print(f"{len(sale_ids)} comprobante(s) seleccionados; {len(sale_ids) - len(todo)} ya procesados en el checkpoint.")
+        payloads = {}
+        for sale_id in todo:
+            payload = build_payload(sale_id)
+            if payload is None:
+                self.checkpoint.mark(sale_id, error="Venta no encontrada")
+                continue
+            self._issuer(payload["issuer_id"])
+            payloads[sale_id] = payload
+
+        self.started = time.perf_counter()
+        sender = ThreadPoolExecutor(max_workers=SEND_WORKERS) if self.send else None
+        send_futures = []
+        try:
+            # Ya firmados en una corrida anterior (zip en disco): solo falta el envío
+            if self.send:
+                for sale_id in list(payloads):
+                    if sale_id in self.checkpoint.signed:
+                        payload = payloads.pop(sale_id)
+                        base = self._filename_base(payload)
+                        zip_path = os.path.join(self.see_dir, "XML", f"{base}.zip")
+                        if os.path.exists(zip_path):
+                            send_futures.append(sender.submit(self._submit, payload, zip_path, f"{base}.zip"))
+                        else:
+                            payloads[sale_id] = payload
+
+            # Las carpetas se crean aquí, una vez, y no en paralelo desde cada proceso de firma
+            for folder in ("XML", "CDR", "JSON Apisunat"):
+                os.makedirs(os.path.join(self.see_dir, folder), exist_ok=True)
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                     initargs=(self.see_dir, self._issuers)) as pool:
+                pending = {pool.submit(_sign, payload): payload for payload in payloads.values()}
+                last_report = time.perf_counter()
+                while pending:
+                    done, _ = wait(pending, timeout=REPORT_EVERY_SECONDS, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        payload = pending.pop(future)
+                        try:
+                            sale_id, zip_path, zip_filename = future.result()
+                        except BrokenProcessPool as e:
+                            # Falla el pool, no el comprobante: las ventas sin firmar quedan para la próxima corrida
+                            self.pool_error = str(e)
+                            break
+                        except Exception as e:
+                            self._count("failed")
+                            self.checkpoint.mark(payload["sale_id"], error=f"Firma: {e}")
+                            continue
+                        self._count("signed")
+                        self.checkpoint.mark(sale_id, signed=True)
+                        if sender:
+                            send_futures.append(sender.submit(self._submit, payload, zip_path, zip_filename))
+                    if self.pool_error:
+                        print(f"Se detuvo el pool de firma ({self.pool_error}); {len(pending) + 1} comprobante(s) sin firmar.")
+                        break
+                    if time.perf_counter() - last_report >= REPORT_EVERY_SECONDS:
+                        self.report()
+                        last_report = time.perf_counter()
+            for future in send_futures:
+                future.result()
+        finally:
+            if sender:
+                sender.shutdown(wait=True)
+            self.checkpoint.save()
+        self.report(final=True)
+        return self.counts
+
+    def _filename_base(self, payload):
+        return self._xml_generator()._document_ids(payload["document"], payload["issuer"])[2]
+
+    def _xml_generator(self):
+        if not hasattr(self, "_xml_gen"):
+            import xml_generator
+            self._xml_gen = xml_generator.XMLGenerator(self.see_dir)
+        return self._xml_gen
+
+    def _rate_limiter(self):
+        if not hasattr(self, "_limiter"):
+            import cpe_retry_service
+            self._limiter = cpe_retry_service.IssuerRateLimiter(self.rate_per_second)
+        return self._limiter
+
+    def _submit(self, payload, zip_path, zip_filename):
+        """Envía un zip firmado (sendBill) y guarda el estado SUNAT y el CDR de la venta."""
+        import sunat_response
+        sale_id = payload["sale_id"]
+        issuer = self._issuer(payload["issuer_id"])
+        if not issuer.get("fe_url"):
+            self._count("failed")
+            self.checkpoint.mark(sale_id, error="Emisor sin URL de envío")
+            return
+        sale = database.get_sale_for_retry(sale_id)
+        if sale and sale["sunat_status"] == "ACEPTADO":
+            # Ya validado: reenviarlo solo traería el rechazo "ya registrado"
+            self.checkpoint.mark(sale_id, sent=True)
+            return
+        self._rate_limiter().acquire(payload["issuer_id"])
+        try:
+            response = self._xml_generator()._send_to_pse(zip_path, zip_filename, issuer["fe_url"], issuer)
+        except Exception as e:
+            # Sin respuesta: queda para la próxima corrida (o para el servicio de reintentos)
+            database.update_sale_sunat_status(sale_id, "ERROR_CONEXION", str(e), keep_accepted=True)
+            self._count("failed")
+            self.checkpoint.mark(sale_id, error=f"Envío: {e}")
+            return
+        sunat = sunat_response.parse_response(response)
+        cdr_path = None
+        if sunat.cdr_zip and sunat.response_code:
+            cdr_path = self._xml_generator().save_cdr(sunat.cdr_zip, os.path.splitext(zip_filename)[0])
+        database.update_sale_sunat_status(sale_id, sunat.status or "ERROR_RESPUESTA", sunat.note, cdr_path, keep_accepted=True)
+        self._count("sent")
+        self.checkpoint.mark(sale_id, sent=True)
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        with self._counts_lock:
+            signed, sent, failed = self.counts["signed"], self.counts["sent"], self.counts["failed"]
+        line = f"firmados {signed} ({signed / elapsed:.1f}/s)"
+        if self.send:
+            line += f", enviados {sent} ({sent / elapsed:.1f}/s)"
+        line += f", errores {failed}, {elapsed:.1f} s"
+        print(("Terminado: " if final else "") + line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenera (y opcionalmente reenvía) comprobantes electrónicos en lote.")
+    parser.add_argument("--desde", required=True, help="fecha inicial YYYY-MM-DD")
+    parser.add_argument("--hasta", required=True, help="fecha final YYYY-MM-DD (inclusive)")
+    parser.add_argument("--estado", action="append", help="estado SUNAT a incluir (repetible), p. ej. ERROR_CONEXION; por defecto, todos menos ACEPTADO")
+    parser.add_argument("--emisor", type=int, help="ID del emisor")
+    parser.add_argument("--enviar", action="store_true", help="enviar a SUNAT cada comprobante firmado")
+    parser.add_argument("--procesos", type=int, default=None, help="procesos de firma (por defecto, uno por CPU)")
+    parser.add_argument("--por-segundo", type=float, default=2.0, help="envíos por segundo y emisor")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="archivo de avance")
+    parser.add_argument("--reiniciar", action="store_true", help="ignorar el avance guardado")
+    parser.add_argument("--base-dir", default=os.path.dirname(os.path.abspath(__file__)), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    filters = {"desde": args.desde, "hasta": args.hasta, "estado": sorted(args.estado or []), "emisor": args.emisor}
+    checkpoint = Checkpoint(args.checkpoint, filters, reset=args.reiniciar)
+    database.setup_database()
+    sale_ids = database.get_sales_for_cpe_rebuild(args.desde, args.hasta, args.estado, args.emisor)
+    bulk = BulkRebuild(args.base_dir, checkpoint, send=args.enviar, processes=args.procesos, rate_per_second=args.por_segundo)
+    counts = bulk.run(sale_ids)
+    return 1 if counts["failed"] or bulk.pool_error else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
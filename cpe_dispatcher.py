@@ -0,0 +1,307 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import config_manager
+import database
+import json_generator
+import sunat_response
+
+# Envío por lotes de boletas (ajuste 'cpe_batch_mode'): "Individual" (sendBill), "Resumen Diario" (sendSummary) o "Lote" (sendPack)
+BATCH_MODE_SINGLE = "Individual"
+BATCH_MODE_SUMMARY = "Resumen Diario"
+BATCH_MODE_PACK = "Lote"
+BATCH_MAX_DOCUMENTS = 500       # líneas por resumen / comprobantes por lote
+BATCH_MAX_WAIT_SECONDS = 1800   # antigüedad máxima de una boleta firmada antes de enviar el lote aunque no esté lleno
+BATCH_CYCLE_SECONDS = 60        # frecuencia de armado de lotes y consulta de tickets
+
+
+def parse_sunat_response(xml_result):
+    """Traduce el resultado de XMLGenerator.generate_and_send a (estado, nota)."""
+    if not xml_result.get('success'):
+        return "ERROR_LOCAL", xml_result.get('error', 'Error desconocido')
+
+    sunat = xml_result.get('sunat') or sunat_response.parse_response(xml_result.get('response', ''))
+    if sunat.status is None:
+        return "ERROR_RESPUESTA", sunat.note or "Respuesta SOAP no reconocida."
+    return sunat.status, sunat.note
+
+
+def parse_ticket_status(result):
+    """
+    Traduce la respuesta de check_ticket_status a (estado del lote, nota, zip del CDR).
+    El estado es None mientras SUNAT siga procesando (código 98) o si la consulta no llegó a SUNAT.
+    """
+    if not result.get('success'):
+        return None, result.get('error', ''), None
+    sunat = sunat_response.parse_response(result.get('response', ''))
+    if sunat.kind == "fault":
+        return database.CPE_BATCH_REJECTED, sunat.note, None
+    if sunat.status is None or sunat.pending:
+        return None, sunat.note or "En proceso (SUNAT)", None
+    if sunat.accepted:
+        return database.CPE_BATCH_ACCEPTED, sunat.note if sunat.response_code else "Aceptado (lote)", sunat.cdr_zip
+    return database.CPE_BATCH_REJECTED, sunat.note if sunat.response_code else f"Lote rechazado (código {sunat.status_code})", sunat.cdr_zip
+
+
+def is_batchable(payload, mode):
+    """Las boletas (no sus notas) se agrupan si el modo de envío no es individual."""
+    type_name = payload['document'].get('type_name', '').upper()
+    return mode != BATCH_MODE_SINGLE and "BOLETA" in type_name and "NOTA" not in type_name
+
+
+def build_sale_data(payload):
+    """Reconstruye el dict que esperan JSONGenerator/XMLGenerator a partir del payload guardado en cpe_jobs."""
+    sale_data = dict(payload)
+    document = dict(payload['document'])
+    document['issue_date'] = datetime.strptime(document['issue_date'], "%Y-%m-%d %H:%M:%S")
+    sale_data['document'] = document
+    return sale_data
+
+
+class CPEDispatchService:
+    """
+    Hilos que vacían la tabla cpe_jobs: generan el JSON, firman y envían el XML y
+    guardan el estado SUNAT de la venta. Los listeners se llaman desde esos hilos;
+    la interfaz debe pasar el aviso a su propio hilo (ver SalesTouchView).
+    """
+
+    def __init__(self, base_dir, workers=2, poll_interval=5.0):
+        self.base_dir = base_dir
+        self.see_dir = os.path.join(base_dir, "SEE Electronica")
+        self.json_dir = os.path.join(self.see_dir, "JSON Apisunat")
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.running = False
+        self._wake = threading.Event()
+        self._threads = []
+        self._listeners = []
+        self._listeners_lock = threading.Lock()
+        self._xml_gen = None
+        self._batch_lock = threading.Lock()
+        self._last_batch_cycle = 0.0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        requeued = database.requeue_interrupted_cpe_jobs()
+        if requeued:
+            print(f"CPE Dispatch: {requeued} envío(s) interrumpido(s) vuelven a la cola.")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.worker_loop, name=f"cpe-dispatch-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print("CPE Dispatch Service Started.")
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=self.poll_interval)
+        self._threads = []
+
+    def wake(self):
+        """Avisa a los hilos de que hay un trabajo nuevo (sin esperar al siguiente sondeo)."""
+        self._wake.set()
+
+    def add_listener(self, callback):
+        with self._listeners_lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._listeners_lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def worker_loop(self):
+        while self.running:
+            try:
+                job = database.claim_next_cpe_job()
+            except Exception as e:
+                print(f"Error in CPE Dispatch Loop: {e}")
+                job = None
+            if job is None:
+                self._maybe_run_batches()
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self.process_job(*job)
+
+    def process_job(self, job_id, sale_id, payload):
+        status, note, cdr_path, error = "ERROR_LOCAL", "", None, None
+        issuer = {}
+        try:
+            issuer = database.get_issuer_by_id(payload['issuer_id']) or {}
+            sale_data = build_sale_data(payload)
+
+            gen = json_generator.JSONGenerator(self.json_dir)
+            print(f"JSON Generated: {gen.generate_invoice_json(sale_data)}")
+
+            if is_batchable(payload, config_manager.load_setting('cpe_batch_mode', BATCH_MODE_SINGLE)):
+                # Se firma ahora; el envío va en el siguiente resumen diario / lote (run_batches)
+                zip_path = self._xml_generator().build_signed_zip(sale_data, issuer)[0]
+                database.mark_cpe_job_batched(job_id, sale_id, zip_path)
+                self._notify(self._event(sale_id, payload, "EN_LOTE", "En espera de envío por lote"))
+                return
+
+            xml_result = self._xml_generator().generate_and_send(sale_data, issuer)
+            print(f"XML Process: {xml_result}")
+            status, note = parse_sunat_response(xml_result)
+            cdr_path = xml_result.get('cdr_path')
+        except Exception as e:
+            print(f"Critical CPE Error (sale {sale_id}): {e}")
+            note = error = str(e)
+
+        try:
+            database.finish_cpe_job(job_id, sale_id, status, note, cdr_path, error)
+        except Exception as e:
+            print(f"Error saving CPE status for sale {sale_id}: {e}")
+
+        if status == "RECHAZADO":
+            self._send_rejection_alert(issuer, payload, note)
+        self._notify(self._event(sale_id, payload, status, note))
+
+    def _event(self, sale_id, payload, status, note, batch_id=None):
+        event = {
+            "sale_id": sale_id,
+            "caja_id": payload.get('caja_id'),
+            "document_number": f"{payload['document'].get('series')}-{payload['document'].get('number')}",
+            "type_name": payload['document'].get('type_name', ''),
+            "status": status,
+            "note": note,
+        }
+        if batch_id is not None:
+            event["batch_id"] = batch_id
+        return event
+
+    def _maybe_run_batches(self):
+        # Lo ejecuta un solo hilo a la vez y como mucho cada BATCH_CYCLE_SECONDS
+        if time.monotonic() - self._last_batch_cycle < BATCH_CYCLE_SECONDS:
+            return
+        if not self._batch_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_batch_cycle = time.monotonic()
+            self.run_batches()
+        except Exception as e:
+            print(f"Error in CPE batch cycle: {e}")
+        finally:
+            self._batch_lock.release()
+
+    def run_batches(self, force=False):
+        """Envía los lotes que corresponda y consulta los tickets pendientes."""
+        self.flush_batches(force)
+        self.poll_tickets()
+
+    def flush_batches(self, force=False):
+        """
+        Agrupa las boletas firmadas en espera: por emisor y fecha de emisión para el resumen diario,
+        por emisor para sendPack. Un grupo se envía al llenarse, cuando su boleta más antigua supera
+        BATCH_MAX_WAIT_SECONDS, cuando es de un día anterior o si force=True.
+        """
+        mode = config_manager.load_setting('cpe_batch_mode', BATCH_MODE_SINGLE)
+        kind = "LT" if mode == BATCH_MODE_PACK else "RC"
+        groups = {}
+        for job in database.get_batchable_cpe_jobs():
+            payload = job[2]
+            reference_date = payload['document']['issue_date'][:10] if kind == "RC" else None
+            groups.setdefault((payload['issuer_id'], reference_date), []).append(job)
+
+        today = datetime.now().strftime('%Y-%m-%d')
+        oldest_allowed = (datetime.now() - timedelta(seconds=BATCH_MAX_WAIT_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+        for (issuer_id, reference_date), jobs in groups.items():
+            for start in range(0, len(jobs), BATCH_MAX_DOCUMENTS):
+                chunk = jobs[start:start + BATCH_MAX_DOCUMENTS]
+                due = (force or len(chunk) == BATCH_MAX_DOCUMENTS or (chunk[0][4] or "") <= oldest_allowed
+                       or (reference_date is not None and reference_date < today))
+                if due:
+                    self._send_batch(issuer_id, kind, reference_date, chunk)
+
+    def _send_batch(self, issuer_id, kind, reference_date, jobs):
+        issuer = database.get_issuer_by_id(issuer_id) or {}
+        if not issuer.get('fe_url'):
+            print(f"CPE batch: el emisor {issuer_id} no tiene URL de envío configurada.")
+            return
+        batch_id, sequence = database.create_cpe_batch(issuer_id, kind, reference_date, [job[0] for job in jobs])
+        try:
+            xml_gen = self._xml_generator()
+            if kind == "RC":
+                zip_path, zip_filename = xml_gen.build_daily_summary(issuer, reference_date, [build_sale_data(job[2]) for job in jobs], sequence)
+                result = xml_gen.send_summary(zip_path, zip_filename, issuer['fe_url'], issuer)
+            else:
+                zip_path, zip_filename = xml_gen.build_pack(issuer, [job[3] for job in jobs], sequence)
+                result = xml_gen.send_pack(zip_path, zip_filename, issuer['fe_url'], issuer)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            database.set_cpe_batch_ticket(batch_id, zip_filename, result['ticket'])
+            print(f"CPE batch {zip_filename}: {len(jobs)} comprobante(s), ticket {result['ticket']}")
+        else:
+            database.release_cpe_batch(batch_id, result.get('error', 'Error desconocido'))
+            print(f"CPE batch {batch_id} no enviado: {result.get('error')}")
+
+    def poll_tickets(self):
+        """Consulta los tickets de los lotes enviados y actualiza el estado de sus comprobantes."""
+        for batch in database.get_open_cpe_batches():
+            issuer = database.get_issuer_by_id(batch['issuer_id']) or {}
+            result = self._xml_generator().check_ticket_status(issuer, batch['ticket'], url=issuer.get('fe_url'))
+            status, note, cdr_zip = parse_ticket_status(result)
+            if status is None:
+                continue
+            cdr_path = None
+            if cdr_zip:
+                try:
+                    cdr_path = self._xml_generator().save_cdr(cdr_zip, os.path.splitext(batch['filename'])[0])
+                except Exception as e:
+                    print(f"Error saving CDR: {e}")
+            documents = database.resolve_cpe_batch(batch['id'], status, note, cdr_path)
+            print(f"CPE batch {batch['filename']}: {status} ({len(documents)} comprobante(s))")
+            for sale_id, payload in documents:
+                self._notify(self._event(sale_id, payload, "ACEPTADO" if status == database.CPE_BATCH_ACCEPTED else "RECHAZADO",
+                                         note, batch['id']))
+
+    def _xml_generator(self):
+        # Una instancia por servicio; las credenciales de firma se cachean en xml_generator
+        if self._xml_gen is None:
+            import xml_generator
+            self._xml_gen = xml_generator.XMLGenerator(self.see_dir)
+        return self._xml_gen
+
+    def _send_rejection_alert(self, issuer, payload, note):
+        alert_receivers = issuer.get('cpe_alert_receivers')
+        if not alert_receivers:
+            return
+        try:
+            import whatsapp_manager
+            doc = payload['document']
+            msg = f"⚠ *Alerta CPE Rechazado*\n📄 *{doc.get('type_name')}*: {doc.get('series')}-{doc.get('number')}\n❌ *Error*: {note}"
+            for receiver in alert_receivers.split(','):
+                r = receiver.strip()
+                if r:
+                    whatsapp_manager.baileys_manager.send_message(r, msg)
+        except Exception as e_wa:
+            print(f"WA Alert Error: {e_wa}")
+
+    def _notify(self, event):
+        with self._listeners_lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"CPE listener error: {e}")
+
+
+# Instancia única del proceso; main.py la arranca con el directorio del proyecto
+dispatcher = None
+
+
+def start_dispatcher(base_dir, workers=2):
+    global dispatcher
+    if dispatcher is None:
+        dispatcher = CPEDispatchService(base_dir, workers)
+    dispatcher.start()
+    return dispatcher
@@ -1,23 +1,91 @@
-import time
+import os
+import random
 import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
 import database
-import xml_generator
-import whatsapp_manager
-import os
+import sunat_response
+
+# Espera exponencial entre consultas de un mismo comprobante: 5 min, 10 min, 20 min... hasta 6 h
+RETRY_BASE_SECONDS = 300
+RETRY_MAX_SECONDS = 6 * 3600
+# Consultas getStatusCdr por segundo y emisor (SUNAT limita por usuario SOL)
+ISSUER_RATE_PER_SECOND = 2.0
+
+
+def retry_delay(attempts):
+    """Segundos hasta el siguiente intento tras `attempts` fallidos: exponencial con jitter (mitad fija, mitad aleatoria)."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class IssuerRateLimiter:
+    """Espacia las consultas de un mismo emisor (rate por segundo); emisores distintos no se esperan entre sí."""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(key, now))
+            self._next_slot[key] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
 
 class CPERetryService:
-    def __init__(self, base_dir):
+    """
+    Reconsulta en SUNAT los comprobantes pendientes con un pool de hilos acotado.
+    Cada venta guarda sus intentos y la fecha del siguiente (retry_attempts / next_retry_at).
+    Una sola instancia por proceso: crearla de nuevo devuelve la misma y start() no duplica hilos.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls, *args, **kwargs):
+        with cls._instance_lock:
+            if not cls._instance:
+                cls._instance = super(CPERetryService, cls).__new__(cls)
+            return cls._instance
+
+    def __init__(self, base_dir, workers=4, interval=60, batch_size=50, rate_per_second=ISSUER_RATE_PER_SECOND):
+        if hasattr(self, 'initialized'):
+            return
         self.base_dir = base_dir
         self.running = False
-        self.interval = 3600 # 1 hour
+        self.interval = interval # segundos entre pasadas; cada venta espera además su propio next_retry_at
+        self.batch_size = batch_size
         self.see_dir = os.path.join(base_dir, "SEE Electronica")
+        self.rate_limiter = IssuerRateLimiter(rate_per_second)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpe-retry")
+        self._wake = threading.Event()
+        self._in_flight = {}     # sale_id -> Future
+        self._lock = threading.Lock()
+        self._xml_gen = None
+        self._latencies = deque(maxlen=500)
+        self._checked = 0
+        self._succeeded = 0
+        self._failed = 0
+        self.initialized = True
 
     def start(self):
-        if not self.running:
+        with self._lock:
+            if self.running:
+                return
             self.running = True
-            thread = threading.Thread(target=self.retry_loop, daemon=True)
-            thread.start()
-            print("CPE Retry Service Started.")
+        thread = threading.Thread(target=self.retry_loop, name="cpe-retry-scheduler", daemon=True)
+        thread.start()
+        print("CPE Retry Service Started.")
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
 
     def retry_loop(self):
         while self.running:
@@ -25,96 +93,157 @@ class CPERetryService:
                 self.process_retries()
             except Exception as e:
                 print(f"Error in CPE Retry Loop: {e}")
-            
-            time.sleep(self.interval)
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
 
     def process_retries(self):
-        print("Checking for pending invoices...")
-        pending_invoices = database.get_pending_invoices_for_retry()
-        
-        if not pending_invoices:
-            print("No pending invoices found.")
-            return
+        """Encola en el pool los comprobantes cuyo reintento venció. Retorna los futures encolados."""
+        pending_invoices = database.get_pending_invoices_for_retry(limit=self.batch_size)
+        return [f for f in (self._submit(invoice) for invoice in pending_invoices) if f is not None]
+
+    def retry_now(self, sale_id):
+        """
+        Consulta inmediata pedida desde la interfaz (ReportsView): ignora la espera acumulada.
+        Retorna un Future con el dict de resultado (status, note, response | error).
+        """
+        database.clear_cpe_retry(sale_id)
+        invoice = database.get_sale_for_retry(sale_id)
+        if invoice is None:
+            raise ValueError(f"Venta {sale_id} no encontrada")
+        with self._lock:
+            future = self._in_flight.get(sale_id)
+        return future or self._submit(invoice, manual=True)
+
+    def _submit(self, invoice, manual=False):
+        with self._lock:
+            if invoice['id'] in self._in_flight:
+                return None
+            future = self.executor.submit(self._check_invoice, invoice, manual)
+            self._in_flight[invoice['id']] = future
+        future.add_done_callback(lambda f, sale_id=invoice['id']: self._done(sale_id))
+        return future
+
+    def _done(self, sale_id):
+        with self._lock:
+            self._in_flight.pop(sale_id, None)
+
+    def _xml_generator(self):
+        if self._xml_gen is None:
+            import xml_generator
+            self._xml_gen = xml_generator.XMLGenerator(self.see_dir)
+        return self._xml_gen
+
+    def _check_invoice(self, invoice, manual=False):
+        sale_id = invoice['id']
+        doc_type_full = invoice['document_type'] or ""
+        doc_number = invoice['document_number'] or ""
+        attempts = (invoice.get('retry_attempts') or 0) + 1
+
+        # Get Issuer Data
+        issuer = database.get_issuer_by_id(invoice['issuer_id'])
+        if not issuer:
+            return self._give_up(sale_id, attempts, f"Emisor {invoice['issuer_id']} no encontrado")
+
+        # Prepare Data for check_cdr_status
+        # We need doc type code (01, 03) and series/number split.
+        if "FACTURA" in doc_type_full.upper():
+            type_code = "01"
+        elif "BOLETA" in doc_type_full.upper():
+            type_code = "03"
+        else:
+            return self._give_up(sale_id, attempts, f"Tipo desconocido {doc_type_full}")
+        if "-" not in doc_number:
+            return self._give_up(sale_id, attempts, f"Formato inválido {doc_number}")
+        series, number = doc_number.split("-", 1)
+
+        # Check Status
+        self.rate_limiter.acquire(invoice['issuer_id'])
+        started = time.perf_counter()
+        try:
+            result = self._xml_generator().check_cdr_status(issuer, type_code, series, number)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+            self._checked += 1
 
-        xml_gen = xml_generator.XMLGenerator(self.see_dir)
-        
-        for invoice in pending_invoices:
+        if not result['success']:
+            with self._lock:
+                self._failed += 1
+            next_retry_at = self._schedule(sale_id, attempts)
+            print(f"Retry failed for {sale_id}: {result.get('error')} (siguiente intento {next_retry_at})")
+            return {'status': invoice['sunat_status'], 'note': result.get('error'), 'error': result.get('error'), 'next_retry_at': next_retry_at}
+
+        with self._lock:
+            self._succeeded += 1
+        sunat = sunat_response.parse_response(result['response'])
+        status, note = sunat.status, sunat.note
+        if status is None or sunat.pending:
+            # Sigue en proceso (o respuesta no reconocida): se vuelve a consultar con espera creciente
+            changed = status is not None and invoice['sunat_status'] in ("ERROR_CONEXION", "ERROR_RESPUESTA")
+            next_retry_at = self._schedule(sale_id, attempts, status if changed else None, note if changed else None)
+            return {'status': status or invoice['sunat_status'], 'note': note, 'response': result['response'], 'next_retry_at': next_retry_at}
+
+        cdr_path = None
+        if sunat.cdr_zip and sunat.response_code:
             try:
-                sale_id = invoice['id']
-                doc_type_full = invoice['document_type']
-                doc_number = invoice['document_number']
-                issuer_id = invoice['issuer_id'] # Note: 'issuer_id' key from dict(row)
-                
-                print(f"Retrying Sale ID {sale_id}: {doc_number} ({doc_type_full})")
-                
-                # Get Issuer Data
-                issuer = database.get_issuer_by_id(issuer_id)
-                if not issuer:
-                    print(f"Issuer {issuer_id} not found for Sale {sale_id}. Skipping.")
-                    continue
-
-                # Prepare Data for check_cdr_status
-                # We need doc type code (01, 03) and series/number split.
-                if "FACTURA" in doc_type_full.upper():
-                    type_code = "01"
-                elif "BOLETA" in doc_type_full.upper():
-                    type_code = "03"
-                else:
-                    print(f"Unknown type {doc_type_full}. Skipping.")
-                    continue
-
-                if "-" in doc_number:
-                    series, number = doc_number.split("-")
-                else:
-                    print(f"Invalid format {doc_number}. Skipping.")
-                    continue
-
-                # Check Status
-                result = xml_gen.check_cdr_status(issuer, type_code, series, number)
-                
-                if result['success']:
-                    xml_resp = result['response']
-                    status = "PENDIENTE"
-                    note = ""
-                    
-                    if "applicationResponse" in xml_resp:
-                        status = "ACEPTADO"
-                        note = "Aceptado (Validado por Retry Service)"
-                        # TODO: Extract CDR and save?
-                        # For now, just update status.
-                        
-                    elif "Fault" in xml_resp:
-                        status = "RECHAZADO"
-                        if "<faultstring>" in xml_resp:
-                             note = xml_resp.split("<faultstring>")[1].split("</faultstring>")[0]
-                        elif ":faultstring>" in xml_resp:
-                             note = xml_resp.split(":faultstring>")[1].split("</")[0]
-                        else:
-                             note = "Error SOAP desconocido (Retry)"
-                        
-                        # Trigger WhatsApp Alert
-                        alert_receivers = issuer.get('cpe_alert_receivers')
-                        if alert_receivers:
-                             try:
-                                 msg = f"⚠ *Alerta CPE Rechazado (Reintento)*\n📄 *{doc_number}*\n❌ *Error*: {note}"
-                                 for receiver in alert_receivers.split(','):
-                                     r = receiver.strip()
-                                     if r:
-                                         whatsapp_manager.baileys_manager.send_message(r, msg)
-                             except Exception as e_wa:
-                                 print(f"WA Alert Error: {e_wa}")
-                                 
-                    elif "ticket" in xml_resp:
-                        status = "PENDIENTE" # Still pending
-                        note = "Aún en proceso (SUNAT)"
-                    
-                    # Update DB if status changed (or even if verified pending to update timestamp/note)
-                    if status != "PENDIENTE" or (status == "PENDIENTE" and invoice['sunat_status'] == "ERROR_CONEXION"):
-                        database.update_sale_sunat_status(sale_id, status, note)
-                        print(f"Updated Sale {sale_id} to {status}")
-                
-                else:
-                    print(f"Retry failed for {sale_id}: {result.get('error')}")
-            
-            except Exception as e_inv:
-                print(f"Error processing invoice {invoice.get('id')}: {e_inv}")
+                cdr_path = self._xml_generator().save_cdr(sunat.cdr_zip, f"{issuer.get('ruc', '')}-{type_code}-{series}-{number}")
+            except Exception as e:
+                print(f"Error saving CDR: {e}")
+        database.update_sale_sunat_status(sale_id, status, note, cdr_path)
+        database.clear_cpe_retry(sale_id)
+        print(f"Updated Sale {sale_id} to {status}")
+        if status == "RECHAZADO" and not manual:
+            self._send_rejection_alert(issuer, doc_number, note)
+        return {'status': status, 'note': note, 'response': result['response'], 'cdr_path': cdr_path}
+
+    def _schedule(self, sale_id, attempts, status=None, note=None):
+        next_retry_at = (datetime.now() + timedelta(seconds=retry_delay(attempts))).strftime('%Y-%m-%d %H:%M:%S')
+        database.schedule_cpe_retry(sale_id, attempts, next_retry_at, status, note)
+        return next_retry_at
+
+    def _give_up(self, sale_id, attempts, reason):
+        # Datos incompletos: no tiene sentido insistir pronto; se espera el máximo
+        print(f"Sale {sale_id}: {reason}. Skipping.")
+        next_retry_at = (datetime.now() + timedelta(seconds=RETRY_MAX_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+        database.schedule_cpe_retry(sale_id, attempts, next_retry_at)
+        return {'status': None, 'note': reason, 'error': reason, 'next_retry_at': next_retry_at}
+
+    def _send_rejection_alert(self, issuer, doc_number, note):
+        # Trigger WhatsApp Alert
+        alert_receivers = issuer.get('cpe_alert_receivers')
+        if alert_receivers:
+             try:
+                 import whatsapp_manager
+                 msg = f"⚠ *Alerta CPE Rechazado (Reintento)*\n📄 *{doc_number}*\n❌ *Error*: {note}"
+                 for receiver in alert_receivers.split(','):
+                     r = receiver.strip()
+                     if r:
+                         whatsapp_manager.baileys_manager.send_message(r, msg)
+             except Exception as e_wa:
+                 print(f"WA Alert Error: {e_wa}")
+
+    def metrics(self):
+        """Instantánea: cola (vencidos/programados/en curso), tasa de éxito de las consultas y latencia p95 (ms)."""
+        due, scheduled = database.get_cpe_retry_backlog()
+        with self._lock:
+            latencies = sorted(self._latencies)
+            checked, succeeded, failed = self._checked, self._succeeded, self._failed
+            in_flight = len(self._in_flight)
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000 if latencies else None
+        return {
+            "queue_depth": due,
+            "scheduled": scheduled,
+            "in_flight": in_flight,
+            "checked": checked,
+            "succeeded": succeeded,
+            "failed": failed,
+            "success_rate": succeeded / checked if checked else None,
+            "p95_latency_ms": p95,
+        }
+
+
+def get_service(base_dir=None):
+    """La instancia del proceso (creada con el directorio de la aplicación si aún no existe)."""
+    return CPERetryService(base_dir or os.path.dirname(os.path.abspath(__file__)))
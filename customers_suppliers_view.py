@@ -3,7 +3,7 @@ from ttkbootstrap.constants import *
 import custom_messagebox as messagebox
 from tkinter import simpledialog
 import database
-import api_client
+import person_lookup
 import threading
 from PIL import Image, ImageTk, ImageDraw # Added for custom styles
 import tkinter as tk
@@ -17,6 +17,9 @@ COLOR_PRIMARY_DARK = COLOR_PRIMARY
 COLOR_SECONDARY_DARK = COLOR_SECONDARY
 COLOR_TEXT_LIGHT = COLOR_TEXT
 
+# Espera tras la última tecla antes de buscar (ms)
+SEARCH_DEBOUNCE_MS = 150
+
 class GradientButton(tk.Canvas):
     def __init__(self, master, text, icon, color1, color2, command, text_color="white", height=40, font_args=None, **kwargs):
         if 'corner_radius' in kwargs:
@@ -445,21 +448,22 @@ class CustomersSuppliersView(ttk.Toplevel):
             self.tree.insert("", "end", values=row, tags=(tag,))
 
     def filter_parties(self, event=None):
-        search_term = self.search_var.get().strip().upper()
+        if getattr(self, '_filter_job', None):
+            self.after_cancel(self._filter_job)
+        self._filter_job = self.after(SEARCH_DEBOUNCE_MS, self._apply_party_filter)
+
+    def _apply_party_filter(self):
+        self._filter_job = None
+        search_term = self.search_var.get().strip()
+        if not search_term:
+            self.populate_parties_list()
+            return
         for i in self.tree.get_children():
             self.tree.delete(i)
-        
-        all_parties = database.get_all_parties()
-        filtered_parties = [
-            row for row in all_parties 
-            if search_term in str(row[1]).upper() or # Type
-               search_term in str(row[2]).upper() or # DNI/RUC
-               search_term in str(row[3]).upper() or # Name
-               search_term in str(row[4]).upper() or # Phone
-               search_term in str(row[5]).upper() or # Address
-               search_term in str(row[6]).upper()    # Alias
-        ]
-        
+
+        # Tipo, DNI/RUC, nombre, teléfono, dirección o alias (índice FTS, por relevancia)
+        filtered_parties = database.search_parties(search_term)
+
         if not filtered_parties:
             self.tree.insert("", "end", values=("", "", "No hay coincidencias", "", "", "", ""), tags=('placeholder',))
             self.tree.tag_configure('placeholder', foreground='gray')
@@ -478,7 +482,8 @@ class CustomersSuppliersView(ttk.Toplevel):
         self.address_var.set("BUSCANDO...")
         
         def run_search():
-            result = api_client.get_person_data(doc)
+            # Datos de la API (en caché): aquí se registra o corrige el propio cliente/proveedor
+            result = person_lookup.lookup(doc, prefer_local=False)
             self.after(0, lambda: self._handle_search_result(result))
 
         thread = threading.Thread(target=run_search)
@@ -1,9 +1,16 @@
 import sqlite3
+import json
+import re
 from sqlite3 import Error
 import config_manager
+import db_pool
 from datetime import datetime
 
-DB_VERSION = 30
+DB_VERSION = 40
+DB_PATH = 'database.db'
+
+# Una conexión por hilo, reutilizada por todas las funciones de este módulo.
+_pool = db_pool.ConnectionPool(DB_PATH)
 
 def _add_column_if_not_exists(conn, table_name, column_name, column_def):
     """Añade una columna a una tabla si no existe."""
@@ -18,14 +25,42 @@ def _add_column_if_not_exists(conn, table_name, column_name, column_def):
             print(f"Error al añadir la columna '{column_name}': {e}")
 
 def create_connection():
-    """Crea una conexión a la base de datos SQLite."""
-    conn = None
+    """
+    Obtiene la conexión SQLite del hilo actual.
+    Se mantiene por compatibilidad con los scripts y vistas que hacen
+    conn = create_connection() ... conn.close(): close() la devuelve al pool.
+    """
     try:
-        conn = sqlite3.connect('database.db')
-        return conn
+        return _pool.acquire()
     except Error as e:
         print(e)
-    return conn
+    return None
+
+def get_connection():
+    """Context manager sobre la conexión del hilo: `with get_connection() as conn:`."""
+    return _pool.connection()
+
+def transaction():
+    """Context manager de escritura atómica: `with transaction() as conn:` (BEGIN IMMEDIATE ... COMMIT)."""
+    return _pool.transaction()
+
+def set_database_path(path):
+    """Cambia el archivo de base de datos (cierra las conexiones abiertas)."""
+    global DB_PATH, _customer_search_index
+    DB_PATH = path
+    _customer_search_index = None
+    _pool.set_path(path)
+
+def close_thread_connection():
+    """Cierra la conexión del hilo actual; para hilos de trabajo de larga vida al terminar."""
+    _pool.close_thread_connection()
+
+def close_all_connections():
+    _pool.close_all()
+
+def get_connection_stats():
+    """Contadores del pool: aperturas y cierres reales frente a préstamos reutilizados."""
+    return _pool.stats()
 
 def create_table(conn, create_table_sql):
     """Crea una tabla a partir de la declaración create_table_sql."""
@@ -37,13 +72,175 @@ def create_table(conn, create_table_sql):
 
 
 
-def setup_database():
-    """Crea y actualiza las tablas de la base de datos si es necesario."""
-    conn = create_connection()
-    if conn is None:
-        print("Error! No se pudo crear la conexión a la base de datos.")
+# Formatos de fecha aceptados históricamente en sales.sale_date / inventory_movements.date_time
+TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%d-%m-%Y")
+
+def normalize_timestamp(value):
+    """Convierte una fecha en cualquiera de TIMESTAMP_FORMATS a 'YYYY-MM-DD HH:MM:SS' (None si no se reconoce)."""
+    if not value:
+        return None
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(str(value), fmt).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    return None
+
+def _normalized_timestamp_sql(column):
+    """Expresión SQL equivalente a normalize_timestamp() para los formatos de ancho fijo."""
+    return f"""(CASE
+        WHEN {column} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]' THEN {column}
+        WHEN {column} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' THEN {column} || ' 00:00:00'
+        WHEN {column} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+            THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) || substr({column}, 11)
+        WHEN {column} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]' OR {column} GLOB '[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]'
+            THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-' || substr({column}, 1, 2) || ' 00:00:00'
+    END)"""
+
+# Columna normalizada ('YYYY-MM-DD HH:MM:SS') de cada tabla con fechas en texto libre:
+# (tabla, columna original, columna normalizada). Los rangos se filtran sobre la normalizada.
+TIMESTAMP_COLUMNS = (
+    ("sales", "sale_date", "sale_ts"),
+    ("inventory_movements", "date_time", "date_ts"),
+    ("cash_counts", "start_time", "start_ts"),
+    ("cash_counts", "end_time", "end_ts"),
+    ("expenses_history", "expense_date", "expense_ts"),
+)
+TIMESTAMP_BACKFILL_BATCH = 5000
+
+def _backfill_timestamp_column(conn, table, source, column, batch_size=TIMESTAMP_BACKFILL_BATCH):
+    """Rellena la columna normalizada por tandas de ids, con un commit por tanda."""
+    min_id, max_id = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+    if min_id is None:
+        return
+    for low in range(min_id, max_id + 1, batch_size):
+        conn.execute(f"UPDATE {table} SET {column} = {_normalized_timestamp_sql(source)} WHERE id >= ? AND id < ? AND {column} IS NULL",
+                     (low, low + batch_size))
+        conn.commit()
+
+def create_timestamp_triggers(conn):
+    """Índices sobre las columnas normalizadas y triggers que las completan si un INSERT/UPDATE externo no lo hace."""
+    for table, source, column in TIMESTAMP_COLUMNS:
+        create_table(conn, f"CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table}({column})")
+        create_table(conn, f""" CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}_insert
+                                        AFTER INSERT ON {table}
+                                        WHEN NEW.{column} IS NULL AND NEW.{source} IS NOT NULL
+                                        BEGIN
+                                            UPDATE {table} SET {column} = {_normalized_timestamp_sql(f"NEW.{source}")} WHERE id = NEW.id;
+                                        END; """)
+        create_table(conn, f""" CREATE TRIGGER IF NOT EXISTS trg_{table}_{column}_update
+                                        AFTER UPDATE OF {source} ON {table}
+                                        WHEN NEW.{column} IS OLD.{column}
+                                        BEGIN
+                                            UPDATE {table} SET {column} = {_normalized_timestamp_sql(f"NEW.{source}")} WHERE id = NEW.id;
+                                        END; """)
+
+# Índices secundarios de las consultas frecuentes (ver test_query_plans.py)
+SECONDARY_INDEXES = (
+    # Detalle de una venta; cubre las columnas que suman get_period_analytics y el cálculo de descuentos
+    "CREATE INDEX IF NOT EXISTS idx_sale_details_sale ON sale_details(sale_id, quantity_sold, price_per_unit, original_price)",
+    "CREATE INDEX IF NOT EXISTS idx_sale_details_product ON sale_details(product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_sales_issuer_doctype ON sales(issuer_id, document_type)",
+    "CREATE INDEX IF NOT EXISTS idx_sales_sunat_status ON sales(sunat_status, sale_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_movement_items_movement ON inventory_movement_items(movement_id)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_movements_type_id ON inventory_movements(movement_type, id)",
+    "CREATE INDEX IF NOT EXISTS idx_products_issuer_active_name ON products(issuer_name, issuer_address, is_active, name)",
+    "CREATE INDEX IF NOT EXISTS idx_customers_alias ON customers(alias)",
+    "CREATE INDEX IF NOT EXISTS idx_customers_type_name ON customers(type, name)",
+    "CREATE INDEX IF NOT EXISTS idx_customers_name ON customers(name)",
+    "CREATE INDEX IF NOT EXISTS idx_cash_counts_caja ON cash_counts(caja_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_temp_expenses_caja ON temp_expenses(caja_id, id)",
+)
+
+SALE_AMOUNTS_BACKFILL_BATCH = 5000
+
+def _backfill_sale_amounts(conn, batch_size=SALE_AMOUNTS_BACKFILL_BATCH):
+    """Calcula gross_amount/discount_amount de las ventas existentes a partir de sale_details, por tandas."""
+    min_id, max_id = conn.execute("SELECT MIN(id), MAX(id) FROM sales").fetchone()
+    if min_id is None:
         return
+    for low in range(min_id, max_id + 1, batch_size):
+        conn.execute("""
+            UPDATE sales SET
+                gross_amount = COALESCE((SELECT SUM(COALESCE(sd.original_price, sd.price_per_unit) * sd.quantity_sold)
+                                         FROM sale_details sd WHERE sd.sale_id = sales.id), 0),
+                discount_amount = COALESCE((SELECT SUM((COALESCE(sd.original_price, sd.price_per_unit) - sd.price_per_unit) * sd.quantity_sold)
+                                            FROM sale_details sd WHERE sd.sale_id = sales.id), 0)
+            WHERE id >= ? AND id < ? AND gross_amount IS NULL
+        """, (low, low + batch_size))
+        conn.commit()
+
+def create_secondary_indexes(conn):
+    for sql in SECONDARY_INDEXES:
+        create_table(conn, sql)
+
+# Cola (outbox) de envíos a SUNAT: la fila se escribe en la misma transacción que la venta
+# y la procesan los hilos de cpe_dispatcher.py
+CPE_JOB_PENDING = 'PENDIENTE'
+CPE_JOB_RUNNING = 'EN_PROCESO'
+CPE_JOB_DONE = 'HECHO'
+CPE_JOB_FAILED = 'ERROR'
+# Firmado y a la espera de enviarse dentro de un resumen diario o lote (cpe_batches)
+CPE_JOB_BATCHED = 'EN_LOTE'
+
+# Lotes enviados a SUNAT (sendSummary 'RC' / sendPack 'LT'); se resuelven consultando su ticket
+CPE_BATCH_SENT = 'ENVIADO'
+CPE_BATCH_ACCEPTED = 'ACEPTADO'
+CPE_BATCH_REJECTED = 'RECHAZADO'
+CPE_BATCH_FAILED = 'ERROR'
+
+def create_cpe_jobs_table(conn):
+    create_table(conn, """ CREATE TABLE IF NOT EXISTS cpe_jobs (
+                                    id integer PRIMARY KEY,
+                                    sale_id integer NOT NULL UNIQUE,
+                                    payload text NOT NULL,
+                                    status text NOT NULL DEFAULT 'PENDIENTE',
+                                    attempts integer NOT NULL DEFAULT 0,
+                                    last_error text,
+                                    created_at text,
+                                    updated_at text,
+                                    FOREIGN KEY (sale_id) REFERENCES sales (id)
+                                ); """)
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_cpe_jobs_status ON cpe_jobs(status, id)")
 
+def create_cpe_batches_table(conn):
+    create_table(conn, """ CREATE TABLE IF NOT EXISTS cpe_batches (
+                                    id integer PRIMARY KEY,
+                                    issuer_id integer NOT NULL,
+                                    kind text NOT NULL,
+                                    reference_date text,
+                                    sequence integer NOT NULL,
+                                    filename text,
+                                    ticket text,
+                                    status text NOT NULL,
+                                    note text,
+                                    created_at text,
+                                    updated_at text
+                                ); """)
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_cpe_batches_status ON cpe_batches(status, id)")
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_cpe_batches_issuer_kind ON cpe_batches(issuer_id, kind, created_at)")
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_cpe_jobs_batch ON cpe_jobs(batch_id)")
+
+def _ts_param(value):
+    """Parámetro para comparar contra una columna normalizada (se deja tal cual si no se reconoce)."""
+    return normalize_timestamp(value) or value
+
+def _day_bounds(start_date, end_date):
+    """Límites 'YYYY-MM-DD 00:00:00' / 'YYYY-MM-DD 23:59:59' para filtros por día (None si no se indica)."""
+    start_ts = _ts_param(str(start_date)[:10]) if start_date else None
+    end_ts = _ts_param(str(end_date)[:10])[:10] + " 23:59:59" if end_date else None
+    return start_ts, end_ts
+
+def setup_database():
+    """Crea y actualiza las tablas de la base de datos si es necesario."""
+    with get_connection() as conn:
+        _apply_migrations(conn)
+        # Después de las migraciones: la v30 reconstruye products y se llevaría el trigger
+        create_stock_change_feed(conn)
+        _detect_customer_search_index(conn)
+    prune_stock_changes()
+
+def _apply_migrations(conn):
     current_db_version = config_manager.get_db_version()
 
     if current_db_version < 2:
@@ -397,6 +594,7 @@ def setup_database():
 
     # Always check/create temp_expenses table to avoid missing table errors
     create_temp_expenses_table(conn)
+    create_cart_reservations_tables(conn)
 
     if current_db_version <= 18: 
         # Changed 17 to 18 to force upgrade/check or just ensuring it runs
@@ -604,115 +802,252 @@ def setup_database():
         except Exception as e:
             print(f"Error en migración v30: {e}")
             if conn: conn.rollback()
-            
-    conn.close()
+
+    if current_db_version < 31:
+        print("Actualizando base de datos a versión 31: Columnas de fecha normalizadas...")
+        try:
+            for table, source, column in TIMESTAMP_COLUMNS:
+                _add_column_if_not_exists(conn, table, column, "TEXT")
+                _backfill_timestamp_column(conn, table, source, column)
+            create_timestamp_triggers(conn)
+            conn.commit()
+            config_manager.set_db_version(31)
+            print("Base de datos actualizada a versión 31.")
+        except Exception as e:
+            print(f"Error en migración v31: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 32:
+        print("Actualizando base de datos a versión 32: Índices secundarios...")
+        try:
+            create_secondary_indexes(conn)
+            conn.commit()
+            config_manager.set_db_version(32)
+            print("Base de datos actualizada a versión 32.")
+        except Exception as e:
+            print(f"Error en migración v32: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 33:
+        print("Actualizando base de datos a versión 33: Importe bruto y descuento por venta...")
+        try:
+            _add_column_if_not_exists(conn, "sales", "gross_amount", "REAL")
+            _add_column_if_not_exists(conn, "sales", "discount_amount", "REAL")
+            _backfill_sale_amounts(conn)
+            conn.commit()
+            config_manager.set_db_version(33)
+            print("Base de datos actualizada a versión 33.")
+        except Exception as e:
+            print(f"Error en migración v33: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 34:
+        print("Actualizando base de datos a versión 34: Cola de envío de comprobantes electrónicos...")
+        try:
+            create_cpe_jobs_table(conn)
+            conn.commit()
+            config_manager.set_db_version(34)
+            print("Base de datos actualizada a versión 34.")
+        except Exception as e:
+            print(f"Error en migración v34: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 35:
+        print("Actualizando base de datos a versión 35: Envío de boletas por lotes (resumen diario / sendPack)...")
+        try:
+            _add_column_if_not_exists(conn, "cpe_jobs", "batch_id", "INTEGER")
+            _add_column_if_not_exists(conn, "cpe_jobs", "zip_path", "TEXT")
+            create_cpe_batches_table(conn)
+            conn.commit()
+            config_manager.set_db_version(35)
+            print("Base de datos actualizada a versión 35.")
+        except Exception as e:
+            print(f"Error en migración v35: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 36:
+        print("Actualizando base de datos a versión 36: Reintentos de consulta CPE con espera exponencial...")
+        try:
+            _add_column_if_not_exists(conn, "sales", "retry_attempts", "INTEGER DEFAULT 0")
+            _add_column_if_not_exists(conn, "sales", "next_retry_at", "TEXT")
+            conn.commit()
+            config_manager.set_db_version(36)
+            print("Base de datos actualizada a versión 36.")
+        except Exception as e:
+            print(f"Error en migración v36: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 37:
+        print("Actualizando base de datos a versión 37: Imágenes de productos en tabla aparte y caché de miniaturas...")
+        try:
+            _add_column_if_not_exists(conn, "products", "image_hash", "TEXT")
+            # Las fotos salen de products: con el BLOB en la fila, leer cualquier columna posterior
+            # (image_hash) obliga a SQLite a recorrer las páginas de desborde de la foto.
+            create_table(conn, """ CREATE TABLE IF NOT EXISTS product_images (
+                                        product_id integer PRIMARY KEY,
+                                        image blob NOT NULL
+                                    ); """)
+            cur = conn.cursor()
+            cur.execute("INSERT OR IGNORE INTO product_images (product_id, image) SELECT id, image FROM products WHERE length(image) > 0")
+            # Una imagen por vez: no cargar todas las fotos del catálogo juntas
+            ids = [row[0] for row in cur.execute("SELECT product_id FROM product_images").fetchall()]
+            for product_id in ids:
+                image = cur.execute("SELECT image FROM product_images WHERE product_id = ?", (product_id,)).fetchone()[0]
+                cur.execute("UPDATE products SET image_hash = ?, image = NULL WHERE id = ?", (_image_hash(image), product_id))
+            create_table(conn, """ CREATE TABLE IF NOT EXISTS product_thumbnails (
+                                        product_id integer PRIMARY KEY,
+                                        image_hash text NOT NULL,
+                                        thumbnail blob NOT NULL
+                                    ); """)
+            conn.commit()
+            config_manager.set_db_version(37)
+            print(f"Base de datos actualizada a versión 37: {len(ids)} imágenes indexadas.")
+        except Exception as e:
+            print(f"Error en migración v37: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 38:
+        print("Actualizando base de datos a versión 38: Feed de cambios con ediciones de catálogo...")
+        try:
+            # create_stock_change_feed (tras las migraciones) lo recrea vigilando también código,
+            # categoría, imagen y baja, y agrega el trigger de altas.
+            conn.execute("DROP TRIGGER IF EXISTS trg_stock_changes_products")
+            conn.commit()
+            config_manager.set_db_version(38)
+            print("Base de datos actualizada a versión 38.")
+        except Exception as e:
+            print(f"Error en migración v38: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 39:
+        print("Actualizando base de datos a versión 39: Índice de texto completo de clientes...")
+        try:
+            if create_customer_search_index(conn):
+                conn.execute("INSERT INTO customers_fts(customers_fts) VALUES ('rebuild')")
+                print("Base de datos actualizada a versión 39.")
+            else:
+                # SQLite sin FTS5: las búsquedas siguen con LIKE
+                print("SQLite sin FTS5: la búsqueda de clientes seguirá usando LIKE.")
+            conn.commit()
+            config_manager.set_db_version(39)
+        except Exception as e:
+            print(f"Error en migración v39: {e}")
+            if conn: conn.rollback()
+
+    if current_db_version < 40:
+        print("Actualizando base de datos a versión 40: Caché de consultas DNI/RUC...")
+        try:
+            create_table(conn, """ CREATE TABLE IF NOT EXISTS document_lookups (
+                                        doc_number text PRIMARY KEY,
+                                        found integer NOT NULL,
+                                        response text NOT NULL,
+                                        fetched_at real NOT NULL
+                                    ); """)
+            conn.commit()
+            config_manager.set_db_version(40)
+            print("Base de datos actualizada a versión 40.")
+        except Exception as e:
+            print(f"Error en migración v40: {e}")
+            if conn: conn.rollback()
 
 def add_user(username, password, permissions):
-    conn = create_connection()
-    sql = 'INSERT INTO users(username, password, permissions) VALUES(?,?,?)'
-    cur = conn.cursor()
-    try:
-        cur.execute(sql, (username, password, permissions))
-        conn.commit()
-        return cur.lastrowid
-    except sqlite3.IntegrityError:
-        return None
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        sql = 'INSERT INTO users(username, password, permissions) VALUES(?,?,?)'
+        cur = conn.cursor()
+        try:
+            cur.execute(sql, (username, password, permissions))
+            conn.commit()
+            return cur.lastrowid
+        except sqlite3.IntegrityError:
+            return None
 
 def get_all_users():
-    conn = create_connection()
-    cur = conn.cursor()
-    # Fetch password too (as 4th column)
-    cur.execute("SELECT id, username, permissions, password FROM users WHERE is_active = 1 ORDER BY username")
-    rows = cur.fetchall()
-    print(f"DEBUG: get_all_users fetched {len(rows)} active users.")
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Fetch password too (as 4th column)
+        cur.execute("SELECT id, username, permissions, password FROM users WHERE is_active = 1 ORDER BY username")
+        rows = cur.fetchall()
+        print(f"DEBUG: get_all_users fetched {len(rows)} active users.")
     return rows
 
 def update_user(user_id, username, password, permissions):
-    conn = create_connection()
-    if password:
-        sql = 'UPDATE users SET username = ?, password = ?, permissions = ? WHERE id = ?'
-        params = (username, password, permissions, user_id)
-    else:
-        sql = 'UPDATE users SET username = ?, permissions = ? WHERE id = ?'
-        params = (username, permissions, user_id)
-        
-    cur = conn.cursor()
-    try:
-        cur.execute(sql, params)
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        if password:
+            sql = 'UPDATE users SET username = ?, password = ?, permissions = ? WHERE id = ?'
+            params = (username, password, permissions, user_id)
+        else:
+            sql = 'UPDATE users SET username = ?, permissions = ? WHERE id = ?'
+            params = (username, permissions, user_id)
 
-def delete_user(user_id):
-    conn = create_connection()
-    # Soft delete
-    sql = 'UPDATE users SET is_active = 0 WHERE id=?'
-    try:
         cur = conn.cursor()
-        cur.execute(sql, (user_id,))
-        deleted = cur.rowcount
-        conn.commit()
-        print(f"DEBUG: Soft deleted user {user_id}, rowcount: {deleted}")
-        return deleted > 0
-    except Exception as e:
-        print(f"ERROR deleting user {user_id}: {e}")
-        return False
-    finally:
-        conn.close()
+        try:
+            cur.execute(sql, params)
+            conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+def delete_user(user_id):
+    with get_connection() as conn:
+        # Soft delete
+        sql = 'UPDATE users SET is_active = 0 WHERE id=?'
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, (user_id,))
+            deleted = cur.rowcount
+            conn.commit()
+            print(f"DEBUG: Soft deleted user {user_id}, rowcount: {deleted}")
+            return deleted > 0
+        except Exception as e:
+            print(f"ERROR deleting user {user_id}: {e}")
+            return False
 
 def get_user_by_credentials(username, password_hash):
-    conn = create_connection()
-    cur = conn.cursor()
-    # Case insensitive username check
-    cur.execute("SELECT id, username, permissions FROM users WHERE lower(username) = ? AND password = ? AND is_active = 1", (username.lower(), password_hash))
-    return cur.fetchone()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Case insensitive username check
+        cur.execute("SELECT id, username, permissions FROM users WHERE lower(username) = ? AND password = ? AND is_active = 1", (username.lower(), password_hash))
+        return cur.fetchone()
 
 def user_has_password(user_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT password FROM users WHERE id = ? AND is_active = 1", (user_id,))
-    row = cur.fetchone()
-    if row and row[0]:
-        # Check if hash represents empty string or None
-        empty_hash = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855" # SHA256 of ""
-        return row[0] != empty_hash
-    return False
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT password FROM users WHERE id = ? AND is_active = 1", (user_id,))
+        row = cur.fetchone()
+        if row and row[0]:
+            # Check if hash represents empty string or None
+            empty_hash = "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855" # SHA256 of ""
+            return row[0] != empty_hash
+        return False
 
 def check_user_password(user_id, password_input):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT password FROM users WHERE id = ? AND is_active = 1", (user_id,))
-    row = cur.fetchone()
-    if row:
-        stored_hash = row[0]
-        input_hash = hashlib.sha256(password_input.encode()).hexdigest()
-        return stored_hash == input_hash
-    return False
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT password FROM users WHERE id = ? AND is_active = 1", (user_id,))
+        row = cur.fetchone()
+        if row:
+            stored_hash = row[0]
+            input_hash = hashlib.sha256(password_input.encode()).hexdigest()
+            return stored_hash == input_hash
+        return False
 
 def get_active_user_by_username(username):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, username, permissions, password FROM users WHERE lower(username) = ? AND is_active = 1", (username.lower(),))
-    return cur.fetchone()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, username, permissions, password FROM users WHERE lower(username) = ? AND is_active = 1", (username.lower(),))
+        return cur.fetchone()
 
 def get_users_by_permission(permission_name):
     """
     Returns a list of users (tuple: id, username, permissions) who have the specified permission.
     Permissions are stored as a CSV string.
     """
-    conn = create_connection()
-    cur = conn.cursor()
-    # Fetch all active users and filter in python to avoid complex LIKE queries
-    # Assuming volume is low.
-    cur.execute("SELECT id, username, permissions, password FROM users WHERE is_active = 1")
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Fetch all active users and filter in python to avoid complex LIKE queries
+        # Assuming volume is low.
+        cur.execute("SELECT id, username, permissions, password FROM users WHERE is_active = 1")
+        rows = cur.fetchall()
     
     matching_users = []
     for row in rows:
@@ -725,107 +1060,138 @@ def get_users_by_permission(permission_name):
     return matching_users
 
 def get_user_by_id(user_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, username, permissions, password FROM users WHERE id = ? AND is_active = 1", (user_id,))
-    return cur.fetchone()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, username, permissions, password FROM users WHERE id = ? AND is_active = 1", (user_id,))
+        return cur.fetchone()
+
+
+def _image_hash(image):
+    """Huella de la imagen del producto (clave de su miniatura); None si no tiene imagen."""
+    if not image:
+        return None
+    import hashlib
+    return hashlib.sha1(image).hexdigest()
 
+def _store_product_image(cur, product_id, image):
+    # products.image queda siempre NULL (v37): la foto vive en product_images
+    if image:
+        cur.execute("INSERT OR REPLACE INTO product_images (product_id, image) VALUES (?, ?)", (product_id, image))
+    else:
+        cur.execute("DELETE FROM product_images WHERE product_id = ?", (product_id,))
 
 def add_product(name, price, stock, code, unit_of_measure, operation_type="Gravada", issuer_name=None, issuer_address=None, category="General", image=None):
-    conn = create_connection()
-    sql = 'INSERT INTO products(name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, image) VALUES(?,?,?,?,?,?,?,?,?,?)'
-    cur = conn.cursor()
-    cur.execute(sql, (name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, image))
-    conn.commit()
-    last_id = cur.lastrowid
-    conn.close()
+    with get_connection() as conn:
+        sql = 'INSERT INTO products(name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, image_hash) VALUES(?,?,?,?,?,?,?,?,?,?)'
+        cur = conn.cursor()
+        cur.execute(sql, (name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, _image_hash(image)))
+        last_id = cur.lastrowid
+        if image:
+            _store_product_image(cur, last_id, image)
+        conn.commit()
     return last_id
 
 def get_all_products(issuer_name=None, issuer_address=None):
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    query = "SELECT id, name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, image, is_active FROM products"
-    params = []
-    filters = []
-    
-    if issuer_name and issuer_name != "Todas":
-        filters.append("issuer_name = ?")
-        params.append(issuer_name)
-    
-    if issuer_address and issuer_address != "Todas":
-        filters.append("issuer_address = ?")
-        params.append(issuer_address)
-        
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
-        query += " AND is_active = 1"
-    else:
-        query += " WHERE is_active = 1"
-        
-    query += " ORDER BY name"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Sin fotos: se leen aparte (get_product_image) solo al generar la miniatura
+        query = "SELECT id, name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, image_hash, is_active FROM products"
+        params = []
+        filters = []
+
+        if issuer_name and issuer_name != "Todas":
+            filters.append("issuer_name = ?")
+            params.append(issuer_name)
+
+        if issuer_address and issuer_address != "Todas":
+            filters.append("issuer_address = ?")
+            params.append(issuer_address)
+
+        if filters:
+            query += " WHERE " + " AND ".join(filters)
+            query += " AND is_active = 1"
+        else:
+            query += " WHERE is_active = 1"
+
+        query += " ORDER BY name"
+
+        cur.execute(query, params)
+        rows = cur.fetchall()
     return rows
 
+def get_product_image(product_id):
+    """Imagen original (BLOB) de un producto, o None."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT image FROM product_images WHERE product_id = ?", (product_id,)).fetchone()
+    return row[0] if row else None
+
+def get_product_thumbnail(product_id, image_hash):
+    """Miniatura guardada para esa versión de la imagen del producto, o None."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT thumbnail FROM product_thumbnails WHERE product_id = ? AND image_hash = ?",
+                           (product_id, image_hash)).fetchone()
+    return row[0] if row else None
+
+def save_product_thumbnail(product_id, image_hash, thumbnail):
+    """Guarda la miniatura del producto; reemplaza la de una imagen anterior."""
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO product_thumbnails (product_id, image_hash, thumbnail) VALUES (?, ?, ?)",
+                     (product_id, image_hash, thumbnail))
+
 def get_all_categories():
     """Obtiene todas las categorías únicas de los productos."""
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL AND category != '' ORDER BY category")
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT DISTINCT category FROM products WHERE category IS NOT NULL AND category != '' ORDER BY category")
+        rows = cur.fetchall()
     return [row[0] for row in rows]
 
 def update_product(product_id, name, price, stock, code, unit_of_measure, operation_type, issuer_name=None, issuer_address=None, category="General", image=None):
-    conn = create_connection()
-    # Update image only if provided? No, update_product usually replaces all.
-    # The caller must provide existing image if no change. 
-    # BUT to be safe/lazy: if image is None, we could NOT update it.
-    # However user might want to remove image.
-    # To support removing image, we would pass empty bytes or special flag.
-    # If image is None (default), we assume NO CHANGE to image field.
-    # If image IS provided (bytes), we update it.
-    
-    if image is not None:
-        sql = 'UPDATE products SET name = ?, price = ?, stock = ?, code = ?, unit_of_measure = ?, operation_type = ?, issuer_name = ?, issuer_address = ?, category = ?, image = ? WHERE id = ?'
-        params = (name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, image, product_id)
-    else:
-        sql = 'UPDATE products SET name = ?, price = ?, stock = ?, code = ?, unit_of_measure = ?, operation_type = ?, issuer_name = ?, issuer_address = ?, category = ? WHERE id = ?'
-        params = (name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, product_id)
-        
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        # Update image only if provided? No, update_product usually replaces all.
+        # The caller must provide existing image if no change. 
+        # BUT to be safe/lazy: if image is None, we could NOT update it.
+        # However user might want to remove image.
+        # To support removing image, we would pass empty bytes or special flag.
+        # If image is None (default), we assume NO CHANGE to image field.
+        # If image IS provided (bytes), we update it.
+
+        if image is not None:
+            sql = 'UPDATE products SET name = ?, price = ?, stock = ?, code = ?, unit_of_measure = ?, operation_type = ?, issuer_name = ?, issuer_address = ?, category = ?, image_hash = ? WHERE id = ?'
+            params = (name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, _image_hash(image), product_id)
+        else:
+            sql = 'UPDATE products SET name = ?, price = ?, stock = ?, code = ?, unit_of_measure = ?, operation_type = ?, issuer_name = ?, issuer_address = ?, category = ? WHERE id = ?'
+            params = (name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category, product_id)
+
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        if image is not None:
+            _store_product_image(cur, product_id, image)
+        conn.commit()
 
 def delete_product(product_id):
-    conn = create_connection()
-    # Soft delete: mark as inactive instead of deleting
-    sql = 'UPDATE products SET is_active = 0 WHERE id=?'
-    cur = conn.cursor()
-    cur.execute(sql, (product_id,))
-    compiles = cur.rowcount > 0
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        # Soft delete: mark as inactive instead of deleting
+        sql = 'UPDATE products SET is_active = 0 WHERE id=?'
+        cur = conn.cursor()
+        cur.execute(sql, (product_id,))
+        compiles = cur.rowcount > 0
+        conn.commit()
     return compiles
 
 def decrease_product_stock(product_id, quantity):
-    conn = create_connection()
-    sql = 'UPDATE products SET stock = stock - ? WHERE id = ?'
-    cur = conn.cursor()
-    cur.execute(sql, (quantity, product_id))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        sql = 'UPDATE products SET stock = stock - ? WHERE id = ?'
+        cur = conn.cursor()
+        cur.execute(sql, (quantity, product_id))
+        conn.commit()
 
 def user_has_password(user_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT password FROM users WHERE id = ?", (user_id,))
-    res = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT password FROM users WHERE id = ?", (user_id,))
+        res = cur.fetchone()
     if res:
         # Check if password is NOT the hash of empty string
         import hashlib
@@ -834,11 +1200,10 @@ def user_has_password(user_id):
     return False
 
 def check_user_password(user_id, password_input):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT password FROM users WHERE id = ?", (user_id,))
-    res = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT password FROM users WHERE id = ?", (user_id,))
+        res = cur.fetchone()
     if res:
         import hashlib
         input_hash = hashlib.sha256(password_input.encode()).hexdigest()
@@ -847,88 +1212,133 @@ def check_user_password(user_id, password_input):
 
 def get_product_stock(product_id):
     """Obtiene el stock actual de un producto."""
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT stock FROM products WHERE id = ?", (product_id,))
-    result = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT stock FROM products WHERE id = ?", (product_id,))
+        result = cur.fetchone()
     if result:
         return result[0]
     return 0.0
+def _insert_sale(cur, issuer_id, customer_id, total_amount, cart_items, sale_date_str, observations, doc_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address):
+    """Inserta cabecera y detalles de una venta usando el cursor dado (sin commit)."""
+    # item: {id, name, quantity, price, subtotal, unit_of_measure, original_price}
+    # original_price: fallback to selling price if not set
+    details = [(item['id'], item['quantity'], item['price'], item['subtotal'], item.get('original_price', item['price'])) for item in cart_items]
+
+    # Bruto (a precio original) y descuento guardados en la cabecera para que el historial no sume los detalles
+    gross_amount = sum((original if original is not None else price) * quantity for _, quantity, price, _, original in details)
+    discount_amount = gross_amount - sum(price * quantity for _, quantity, price, _, _ in details)
+
+    sql_sale = '''INSERT INTO sales (issuer_id, customer_id, total_amount, sale_date, sale_ts, observations, document_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address, gross_amount, discount_amount) 
+                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    cur.execute(sql_sale, (issuer_id, customer_id, total_amount, sale_date_str, normalize_timestamp(sale_date_str), observations, doc_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address, gross_amount, discount_amount))
+    sale_id = cur.lastrowid
+
+    cur.executemany("INSERT INTO sale_details (sale_id, product_id, quantity_sold, price_per_unit, subtotal, original_price) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(sale_id, *detail) for detail in details])
+    return sale_id
+
 def record_sale(issuer_id, customer_id, total_amount, cart_items, sale_date_str, observations, doc_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address):
-    conn = create_connection()
-    try:
+    with get_connection() as conn:
+        try:
+            cur = conn.cursor()
+            sale_id = _insert_sale(cur, issuer_id, customer_id, total_amount, cart_items, sale_date_str, observations, doc_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address)
+            conn.commit()
+            return sale_id
+        except Error as e:
+            conn.rollback()
+            print(f"Error al registrar la venta: {e}")
+            raise e
+
+# Signo del movimiento de stock según el tipo de documento (interno) de la venta
+STOCK_DIRECTION_BY_DOC_TYPE = {
+    "BOLETA": -1,
+    "FACTURA": -1,
+    "NOTA DE VENTA": -1,
+    "NOTA_CREDITO_BOLETA": 1,
+    "NOTA_CREDITO_FACTURA": 1,
+}
+
+def checkout(issuer_id, doc_type, customer, cart_items, total_amount, sale_date_str, observations, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address, default_series=None, cpe_payload=None):
+    """
+    Registra una venta completa en una sola transacción (BEGIN IMMEDIATE ... COMMIT):
+    asigna el correlativo, obtiene/crea el cliente, inserta cabecera y detalles,
+    y aplica los movimientos de stock. Si algo falla no queda nada a medias.
+
+    customer: tupla (doc_number, name, phone, address).
+    default_series: serie a crear si el emisor aún no tiene correlativo para doc_type.
+    cpe_payload: datos del comprobante electrónico (ver cpe_dispatcher.py); si se indica,
+    se encola en cpe_jobs dentro de la misma transacción, con la serie y número asignados.
+    Retorna un dict con sale_id, customer_id, series, number y document_number,
+    o None si no hay correlativo configurado.
+    """
+    doc_number, name, phone, address = customer
+    with transaction() as conn:
         cur = conn.cursor()
-        sql_sale = '''INSERT INTO sales (issuer_id, customer_id, total_amount, sale_date, observations, document_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address) 
-                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
-        cur.execute(sql_sale, (issuer_id, customer_id, total_amount, sale_date_str, observations, doc_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address))
-        sale_id = cur.lastrowid
-        
-        # Insertar detalles de la venta
-        for item in cart_items:
-            # item: {id, name, quantity, price, subtotal, unit_of_measure, original_price}
-            original_price = item.get('original_price', item['price']) # Fallback to selling price if not set
-            cur.execute("INSERT INTO sale_details (sale_id, product_id, quantity_sold, price_per_unit, subtotal, original_price) VALUES (?, ?, ?, ?, ?, ?)",
-                        (sale_id, item['id'], item['quantity'], item['price'], item['subtotal'], original_price))
-
-        conn.commit()
-    except Error as e:
-        conn.rollback()
-        print(f"Error al registrar la venta: {e}")
-        raise e
-    finally:
-        if conn:
-            conn.close()
+        allocated = _allocate_correlative(cur, issuer_id, doc_type)
+        if allocated is None and default_series:
+            cur.execute("INSERT INTO correlatives (issuer_id, doc_type, series, current_number) VALUES (?, ?, ?, ?)",
+                        (issuer_id, doc_type, default_series, 0))
+            allocated = _allocate_correlative(cur, issuer_id, doc_type)
+        if allocated is None:
+            return None
+        series, number = allocated
+        document_number = f"{series}-{number}"
+
+        customer_id = _get_or_create_customer(cur, doc_number, name, phone, address)
+        sale_id = _insert_sale(cur, issuer_id, customer_id, total_amount, cart_items, sale_date_str, observations, doc_type, document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address)
+
+        direction = STOCK_DIRECTION_BY_DOC_TYPE.get(doc_type, 0)
+        if direction:
+            cur.executemany("UPDATE products SET stock = stock + ? WHERE id = ?",
+                            [(direction * item['quantity'], item['id']) for item in cart_items])
+
+        if cpe_payload is not None:
+            _enqueue_cpe_job(cur, sale_id, dict(cpe_payload, issuer_id=issuer_id, sale_id=sale_id,
+                                                document=dict(cpe_payload.get('document', {}), series=series, number=number)))
+
+    return {"sale_id": sale_id, "customer_id": customer_id, "series": series, "number": number, "document_number": document_number}
 
 def add_issuer(name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers):
     """Añade un nuevo emisor a la base de datos."""
-    conn = create_connection()
-    try:
-        cur = conn.cursor()
-        cur.execute("INSERT INTO issuers (name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers))
-        conn.commit()
-        return cur.lastrowid
-    except Error as e:
-        print(e)
-    finally:
-        if conn:
-            conn.close()
-    return None
+    with get_connection() as conn:
+        try:
+            cur = conn.cursor()
+            cur.execute("INSERT INTO issuers (name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers))
+            conn.commit()
+            return cur.lastrowid
+        except Error as e:
+            print(e)
+        return None
 
 def get_daily_sales_total(payment_method='EFECTIVO'):
     """Obtiene el total de ventas del día actual para un método de pago específico."""
-    conn = create_connection()
-    total = 0.0
-    try:
-        cur = conn.cursor()
-        # Asumiendo formato de fecha YYYY-MM-DD HH:MM:SS
-        today = datetime.now().strftime('%Y-%m-%d')
-        # SQLite date function extracts YYYY-MM-DD from the datetime string
-        sql = "SELECT SUM(total_amount) FROM sales WHERE payment_method = ? AND date(sale_date) = ?"
-        cur.execute(sql, (payment_method, today))
-        result = cur.fetchone()
-        if result and result[0]:
-            total = result[0]
-            
-        # Also check payment_method2
-        sql2 = "SELECT SUM(amount_paid2) FROM sales WHERE payment_method2 = ? AND date(sale_date) = ?"
-        cur.execute(sql2, (payment_method, today))
-        result2 = cur.fetchone()
-        if result2 and result2[0]:
-            total += result2[0]
-            
-    except Error as e:
-        print(f"Error al obtener total de ventas diarias: {e}")
-    finally:
-        if conn:
-            conn.close()
-    return total
+    with get_connection() as conn:
+        total = 0.0
+        try:
+            cur = conn.cursor()
+            day_start, day_end = _day_bounds(datetime.now(), datetime.now())
+            sql = "SELECT SUM(total_amount) FROM sales WHERE payment_method = ? AND sale_ts BETWEEN ? AND ?"
+            cur.execute(sql, (payment_method, day_start, day_end))
+            result = cur.fetchone()
+            if result and result[0]:
+                total = result[0]
+
+            # Also check payment_method2
+            sql2 = "SELECT SUM(amount_paid2) FROM sales WHERE payment_method2 = ? AND sale_ts BETWEEN ? AND ?"
+            cur.execute(sql2, (payment_method, day_start, day_end))
+            result2 = cur.fetchone()
+            if result2 and result2[0]:
+                total += result2[0]
 
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers FROM issuers WHERE id = ?", (issuer_id,))
-    row = cur.fetchone()
-    conn.close()
+        except Error as e:
+            print(f"Error al obtener total de ventas diarias: {e}")
+        return total
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers FROM issuers WHERE id = ?", (issuer_id,))
+        row = cur.fetchone()
     if row:
         # Convert to dict for easier usage
         columns = [column[0] for column in cur.description]
@@ -937,99 +1347,109 @@ def get_daily_sales_total(payment_method='EFECTIVO'):
 
 def get_all_issuers():
     """Obtiene todos los emisores."""
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers FROM issuers ORDER BY name")
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers FROM issuers ORDER BY name")
+        rows = cur.fetchall()
     return rows
 
+# Funciones a las que se avisa (con el id) cuando un emisor cambia o se elimina; p. ej. la caché de firmas de xml_generator
+_issuer_listeners = []
+
+def add_issuer_listener(callback):
+    if callback not in _issuer_listeners:
+        _issuer_listeners.append(callback)
+
+def _notify_issuer_changed(issuer_id):
+    for callback in list(_issuer_listeners):
+        try:
+            callback(issuer_id)
+        except Exception as e:
+            print(f"Error notifying issuer change: {e}")
+
 def update_issuer(issuer_id, name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers):
     """Actualiza los datos de un emisor existente."""
-    conn = create_connection()
-    sql = ''' UPDATE issuers
-              SET name = ?,
-                  ruc = ?,
-                  address = ?,
-                  commercial_name = ?,
-                  logo = ?,
-                  bank_accounts = ?,
-                  initial_greeting = ?,
-                  final_greeting = ?,
-                  district = ?,
-                  province = ?,
-                  department = ?,
-                  ubigeo = ?,
-                  sol_user = ?,
-                  sol_pass = ?,
-                  certificate = ?,
-                  fe_url = ?,
-                  re_url = ?,
-                  guia_url_envio = ?,
-                  guia_url_consultar = ?,
-                  client_id = ?,
-                  client_secret = ?,
-                  validez_user = ?,
-                  validez_pass = ?,
-                  email = ?,
-                  phone = ?,
-                  default_operation_type = ?,
-                  establishment_code = ?,
-                  cert_password = ?,
-                  cpe_alert_receivers = ?
-              WHERE id = ?'''
-    cur = conn.cursor()
-    cur.execute(sql, (name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers, issuer_id))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        sql = ''' UPDATE issuers
+                  SET name = ?,
+                      ruc = ?,
+                      address = ?,
+                      commercial_name = ?,
+                      logo = ?,
+                      bank_accounts = ?,
+                      initial_greeting = ?,
+                      final_greeting = ?,
+                      district = ?,
+                      province = ?,
+                      department = ?,
+                      ubigeo = ?,
+                      sol_user = ?,
+                      sol_pass = ?,
+                      certificate = ?,
+                      fe_url = ?,
+                      re_url = ?,
+                      guia_url_envio = ?,
+                      guia_url_consultar = ?,
+                      client_id = ?,
+                      client_secret = ?,
+                      validez_user = ?,
+                      validez_pass = ?,
+                      email = ?,
+                      phone = ?,
+                      default_operation_type = ?,
+                      establishment_code = ?,
+                      cert_password = ?,
+                      cpe_alert_receivers = ?
+                  WHERE id = ?'''
+        cur = conn.cursor()
+        cur.execute(sql, (name, ruc, address, commercial_name, logo, bank_accounts, initial_greeting, final_greeting, district, province, department, ubigeo, sol_user, sol_pass, certificate, fe_url, re_url, guia_url_envio, guia_url_consultar, client_id, client_secret, validez_user, validez_pass, email, phone, default_operation_type, establishment_code, cert_password, cpe_alert_receivers, issuer_id))
+        conn.commit()
+    _notify_issuer_changed(issuer_id)
 
 def delete_issuer(issuer_id):
     """Elimina un emisor de la base de datos."""
-    conn = create_connection()
-    sql = 'DELETE FROM issuers WHERE id=?'
-    cur = conn.cursor()
-    cur.execute(sql, (issuer_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        sql = 'DELETE FROM issuers WHERE id=?'
+        cur = conn.cursor()
+        cur.execute(sql, (issuer_id,))
+        conn.commit()
+    _notify_issuer_changed(issuer_id)
 
 def add_party(doc_number, name, phone, address, party_type, alias=""):
-    conn = create_connection()
-    sql = 'INSERT INTO customers (doc_number, name, phone, address, type, alias) VALUES (?,?,?,?,?,?)'
-    cur = conn.cursor()
-    cur.execute(sql, (doc_number, name, phone, address, party_type, alias))
-    conn.commit()
-    return cur.lastrowid
-
+    with get_connection() as conn:
+        sql = 'INSERT INTO customers (doc_number, name, phone, address, type, alias) VALUES (?,?,?,?,?,?)'
+        cur = conn.cursor()
+        cur.execute(sql, (doc_number, name, phone, address, party_type, alias))
+        conn.commit()
+        return cur.lastrowid
+
 def get_all_parties(party_type=None):
-    conn = create_connection()
-    cur = conn.cursor()
-    if party_type:
-        cur.execute("SELECT id, type, doc_number, name, phone, address, alias FROM customers WHERE type = ? ORDER BY name", (party_type,))
-    else:
-        cur.execute("SELECT id, type, doc_number, name, phone, address, alias FROM customers ORDER BY name")
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        if party_type:
+            cur.execute("SELECT id, type, doc_number, name, phone, address, alias FROM customers WHERE type = ? ORDER BY name", (party_type,))
+        else:
+            cur.execute("SELECT id, type, doc_number, name, phone, address, alias FROM customers ORDER BY name")
+        rows = cur.fetchall()
     return rows
 
 def update_party(party_id, doc_number, name, phone, address, party_type, alias=""):
-    conn = create_connection()
-    sql = 'UPDATE customers SET doc_number = ?, name = ?, phone = ?, address = ?, type = ?, alias = ? WHERE id = ?'
-    cur = conn.cursor()
-    cur.execute(sql, (doc_number, name, phone, address, party_type, alias, party_id))
-    conn.commit()
+    with get_connection() as conn:
+        sql = 'UPDATE customers SET doc_number = ?, name = ?, phone = ?, address = ?, type = ?, alias = ? WHERE id = ?'
+        cur = conn.cursor()
+        cur.execute(sql, (doc_number, name, phone, address, party_type, alias, party_id))
+        conn.commit()
 
 def delete_party(party_id):
-    conn = create_connection()
-    sql = 'DELETE FROM customers WHERE id=?'
-    cur = conn.cursor()
-    cur.execute(sql, (party_id,))
-    conn.commit()
+    with get_connection() as conn:
+        sql = 'DELETE FROM customers WHERE id=?'
+        cur = conn.cursor()
+        cur.execute(sql, (party_id,))
+        conn.commit()
 
-def get_or_create_customer(doc_number, name, phone, address):
+def _get_or_create_customer(cur, doc_number, name, phone, address):
     if not doc_number and not name:
         return None
-    conn = create_connection()
-    cur = conn.cursor()
     if doc_number:
         cur.execute("SELECT id, address FROM customers WHERE doc_number = ? AND type = 'Cliente'", (doc_number,))
     else:
@@ -1038,38 +1458,53 @@ def get_or_create_customer(doc_number, name, phone, address):
     if data:
         customer_id, db_address = data
         if not db_address and address:
-            update_party(customer_id, doc_number, name, phone, address, "Cliente")
+            # Mismo efecto que update_party(customer_id, doc_number, name, phone, address, "Cliente")
+            cur.execute('UPDATE customers SET doc_number = ?, name = ?, phone = ?, address = ?, type = ?, alias = ? WHERE id = ?',
+                        (doc_number, name, phone, address, "Cliente", "", customer_id))
         return customer_id
-    else:
-        return add_party(doc_number, name, phone, address, "Cliente", "")
+    cur.execute('INSERT INTO customers (doc_number, name, phone, address, type, alias) VALUES (?,?,?,?,?,?)',
+                (doc_number, name, phone, address, "Cliente", ""))
+    return cur.lastrowid
 
-def get_all_sales():
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id, strftime('%Y-%m-%d %H:%M:%S', sale_date), total_amount FROM sales ORDER BY sale_date DESC")
-    return cur.fetchall()
+def get_or_create_customer(doc_number, name, phone, address):
+    if not doc_number and not name:
+        return None
+    with get_connection() as conn:
+        cur = conn.cursor()
+        customer_id = _get_or_create_customer(cur, doc_number, name, phone, address)
+        conn.commit()
+        return customer_id
 
-def get_all_sales_with_customer_name(issuer_name=None, address=None, start_date=None, end_date=None):
-    """Obtiene todas las ventas con el nombre del cliente, tipo y número de documento."""
-    conn = create_connection()
-    cur = conn.cursor()
-    query = """
-        SELECT
-            s.id,
-            s.document_type,
-            s.document_number,
-            strftime('%Y-%m-%d %H:%M:%S', s.sale_date),
-            COALESCE(c.name, 'Cliente Varios'),
-            s.total_amount,
-            (SELECT SUM((sd.price_per_unit - COALESCE(sd.original_price, sd.price_per_unit)) * sd.quantity_sold) FROM sale_details sd WHERE sd.sale_id = s.id) as diff_amount,
-            i.name as issuer_name,
-            i.address as issuer_address,
-            s.sunat_status,
-            s.sunat_note
-        FROM sales s
-        LEFT JOIN customers c ON s.customer_id = c.id
-        LEFT JOIN issuers i ON s.issuer_id = i.id
-    """
+def get_all_sales():
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT id, strftime('%Y-%m-%d %H:%M:%S', sale_date), total_amount FROM sales ORDER BY sale_date DESC")
+        return cur.fetchall()
+
+SALES_HISTORY_SELECT = """
+            SELECT
+                s.id,
+                s.document_type,
+                s.document_number,
+                strftime('%Y-%m-%d %H:%M:%S', s.sale_date),
+                COALESCE(c.name, 'Cliente Varios'),
+                s.total_amount,
+                0.0 - s.discount_amount as diff_amount,
+                i.name as issuer_name,
+                i.address as issuer_address,
+                s.sunat_status,
+                s.sunat_note,
+                s.sale_ts
+            FROM sales s
+            LEFT JOIN customers c ON s.customer_id = c.id
+            LEFT JOIN issuers i ON s.issuer_id = i.id
+        """
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _sales_history_filters(issuer_name=None, address=None, start_date=None, end_date=None, filter_text=""):
+    """Condiciones WHERE (y sus parámetros) comunes al historial de ventas y sus totales."""
     filters = []
     params = []
     if issuer_name:
@@ -1078,128 +1513,201 @@ def get_all_sales_with_customer_name(issuer_name=None, address=None, start_date=
     if address:
         filters.append("i.address = ?")
         params.append(address)
-    
-    if start_date:
-        filters.append("date(s.sale_date) >= ?")
-        params.append(start_date)
-    if end_date:
-        filters.append("date(s.sale_date) <= ?")
-        params.append(end_date)
-    
+
+    start_ts, end_ts = _day_bounds(start_date, end_date)
+    if start_ts:
+        filters.append("s.sale_ts >= ?")
+        params.append(start_ts)
+    if end_ts:
+        filters.append("s.sale_ts <= ?")
+        params.append(end_ts)
+
+    filter_text = (filter_text or "").strip()
+    if filter_text:
+        # Número de documento, cliente o importe ("1000", "1000.00" o "1,000.00")
+        term = f"%{_escape_like(filter_text)}%"
+        amount_term = f"%{_escape_like(filter_text.replace(',', ''))}%"
+        filters.append("""(s.document_number LIKE ? ESCAPE '\\'
+                           OR casefold(COALESCE(c.name, 'Cliente Varios')) LIKE casefold(?) ESCAPE '\\'
+                           OR printf('%.2f', s.total_amount) LIKE ? ESCAPE '\\'
+                           OR CAST(CAST(s.total_amount AS INTEGER) AS TEXT) = ?)""")
+        params.extend([term, term, amount_term, filter_text])
+    return filters, params
+
+def get_all_sales_with_customer_name(issuer_name=None, address=None, start_date=None, end_date=None):
+    """Obtiene todas las ventas con el nombre del cliente, tipo y número de documento."""
+    filters, params = _sales_history_filters(issuer_name, address, start_date, end_date)
+    query = SALES_HISTORY_SELECT
     if filters:
         query += " WHERE " + " AND ".join(filters)
-        
-    query += " ORDER BY s.sale_date DESC"
-    
-    cur.execute(query, params)
-    return cur.fetchall()
+    query += " ORDER BY s.sale_ts DESC"
 
-def get_full_sale_data(sale_id):
-    """Obtiene todos los datos de una venta para la vista previa del ticket."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    # Datos de la venta, cliente y emisor
-    cur.execute("""
-        SELECT 
-            s.sale_date, s.total_amount, s.observations, s.document_type, s.document_number,
-            c.name as customer_name, c.doc_number as customer_doc,
-            i.name as issuer_name, i.ruc as issuer_ruc, i.address as issuer_address,
-            i.district, i.province, i.department,
-            i.commercial_name, i.bank_accounts, i.initial_greeting, i.final_greeting, i.logo, i.email, i.phone,
-            s.payment_method as payment_method1, s.amount_paid as amount_paid1, s.payment_method2, s.amount_paid2
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        return cur.fetchall()
+
+def get_sales_history_page(issuer_name=None, address=None, start_date=None, end_date=None, filter_text="", after=None, limit=200):
+    """
+    Página del historial de ventas, de la más reciente a la más antigua.
+    `after` es el cursor (sale_ts, id) de la última fila de la página anterior; cada fila
+    termina con sale_ts, así que el cursor siguiente es (row[-1], row[0]).
+    """
+    filters, params = _sales_history_filters(issuer_name, address, start_date, end_date, filter_text)
+    if after is not None:
+        after_ts, after_id = after
+        if after_ts is None:
+            # Las ventas sin fecha reconocible van al final
+            filters.append("s.sale_ts IS NULL AND s.id < ?")
+            params.append(after_id)
+        else:
+            filters.append("(s.sale_ts < ? OR (s.sale_ts = ? AND s.id < ?) OR s.sale_ts IS NULL)")
+            params.extend([after_ts, after_ts, after_id])
+
+    query = SALES_HISTORY_SELECT
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    query += " ORDER BY s.sale_ts DESC, s.id DESC LIMIT ?"
+    params.append(limit)
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        return cur.fetchall()
+
+def get_sales_history_totals(issuer_name=None, address=None, start_date=None, end_date=None, filter_text=""):
+    """Cantidad de ventas, total final y suma de descuentos/adicionales del historial filtrado."""
+    filters, params = _sales_history_filters(issuer_name, address, start_date, end_date, filter_text)
+    query = """
+        SELECT COUNT(*), COALESCE(SUM(s.total_amount), 0), COALESCE(SUM(0.0 - s.discount_amount), 0)
         FROM sales s
         LEFT JOIN customers c ON s.customer_id = c.id
         LEFT JOIN issuers i ON s.issuer_id = i.id
-        WHERE s.id = ?
-    """, (sale_id,))
-    sale_data = cur.fetchone()
-    if not sale_data:
-        return None
+    """
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+
+    with get_connection() as conn:
+        return conn.execute(query, params).fetchone()
+
+def get_full_sale_data(sale_id):
+    """Obtiene todos los datos de una venta para la vista previa del ticket."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Datos de la venta, cliente y emisor
+        cur.execute("""
+            SELECT 
+                s.sale_date, s.total_amount, s.observations, s.document_type, s.document_number,
+                c.name as customer_name, c.doc_number as customer_doc,
+                i.name as issuer_name, i.ruc as issuer_ruc, i.address as issuer_address,
+                i.district, i.province, i.department,
+                i.commercial_name, i.bank_accounts, i.initial_greeting, i.final_greeting, i.logo, i.email, i.phone,
+                s.payment_method as payment_method1, s.amount_paid as amount_paid1, s.payment_method2, s.amount_paid2,
+                s.issuer_id, i.establishment_code, s.customer_address, s.sale_ts
+            FROM sales s
+            LEFT JOIN customers c ON s.customer_id = c.id
+            LEFT JOIN issuers i ON s.issuer_id = i.id
+            WHERE s.id = ?
+        """, (sale_id,))
+        sale_data = cur.fetchone()
+        if not sale_data:
+            return None
+
+        # Detalles de la venta (productos)
+        cur.execute("""
+            SELECT p.name, sd.quantity_sold, sd.price_per_unit, sd.subtotal, p.unit_of_measure, p.operation_type, sd.original_price
+            FROM sale_details sd
+            JOIN products p ON sd.product_id = p.id
+            WHERE sd.sale_id = ?
+        """, (sale_id,))
+        details = cur.fetchall()
 
-    # Detalles de la venta (productos)
-    cur.execute("""
-        SELECT p.name, sd.quantity_sold, sd.price_per_unit, sd.subtotal, p.unit_of_measure, p.operation_type, sd.original_price
-        FROM sale_details sd
-        JOIN products p ON sd.product_id = p.id
-        WHERE sd.sale_id = ?
-    """, (sale_id,))
-    details = cur.fetchall()
-    
-    conn.close()
-    
     return {"sale": sale_data, "details": details}
 
 
+def get_sales_for_cpe_rebuild(start_date, end_date, statuses=None, issuer_id=None):
+    """
+    IDs de boletas y facturas emitidas entre dos fechas (YYYY-MM-DD, inclusive), opcionalmente
+    filtradas por estado SUNAT y emisor, en orden de emisión. Para regenerar comprobantes en lote (cpe_bulk.py).
+    Sin estados indicados se omiten las ya ACEPTADO: su zip y su CDR son los que SUNAT validó.
+    """
+    query = """
+        SELECT id FROM sales
+        WHERE sale_ts >= ? AND sale_ts <= ?
+          AND (document_type LIKE '%BOLETA%' OR document_type LIKE '%FACTURA%')
+    """
+    params = [f"{start_date} 00:00:00", f"{end_date} 23:59:59"]
+    if statuses:
+        query += f" AND sunat_status IN ({','.join('?' * len(statuses))})"
+        params.extend(statuses)
+    else:
+        query += " AND COALESCE(sunat_status, '') != 'ACEPTADO'"
+    if issuer_id is not None:
+        query += " AND issuer_id = ?"
+        params.append(issuer_id)
+    query += " ORDER BY sale_ts, id"
+    with get_connection() as conn:
+        return [row[0] for row in conn.execute(query, params).fetchall()]
+
 def get_sale_details_by_sale_id(sale_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    sql = "SELECT p.name, sd.quantity_sold, sd.price_per_unit, sd.subtotal, p.unit_of_measure, p.operation_type FROM sale_details sd JOIN products p ON sd.product_id = p.id WHERE sd.sale_id = ?"
-    cur.execute(sql, (sale_id,))
-    return cur.fetchall()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        sql = "SELECT p.name, sd.quantity_sold, sd.price_per_unit, sd.subtotal, p.unit_of_measure, p.operation_type FROM sale_details sd JOIN products p ON sd.product_id = p.id WHERE sd.sale_id = ?"
+        cur.execute(sql, (sale_id,))
+        return cur.fetchall()
 
 def get_correlative(issuer_id, doc_type):
     """Obtiene la serie y el número actual para un emisor y tipo de documento."""
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT series, current_number FROM correlatives WHERE issuer_id = ? AND doc_type = ?", (issuer_id, doc_type))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT series, current_number FROM correlatives WHERE issuer_id = ? AND doc_type = ?", (issuer_id, doc_type))
+        row = cur.fetchone()
     return row if row else (None, 0)
 
 def set_correlative(issuer_id, doc_type, series, number):
     """Establece o actualiza el correlativo para un emisor y tipo de documento."""
-    conn = create_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("""
-            INSERT INTO correlatives (issuer_id, doc_type, series, current_number)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(issuer_id, doc_type) DO UPDATE SET
-            series = excluded.series,
-            current_number = excluded.current_number
-        """, (issuer_id, doc_type, series, number))
-        conn.commit()
-    except Error as e:
-        print(f"Error al establecer el correlativo: {e}")
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("""
+                INSERT INTO correlatives (issuer_id, doc_type, series, current_number)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(issuer_id, doc_type) DO UPDATE SET
+                series = excluded.series,
+                current_number = excluded.current_number
+            """, (issuer_id, doc_type, series, number))
+            conn.commit()
+        except Error as e:
+            print(f"Error al establecer el correlativo: {e}")
+
+def _allocate_correlative(cur, issuer_id, doc_type):
+    """Incrementa el correlativo dentro de la transacción en curso. Retorna (serie, número) o None."""
+    cur.execute("SELECT series, current_number FROM correlatives WHERE issuer_id = ? AND doc_type = ?", (issuer_id, doc_type))
+    row = cur.fetchone()
+    if not row:
+        return None
+    series, current_number = row
+    next_number = current_number + 1
+    cur.execute("UPDATE correlatives SET current_number = ? WHERE issuer_id = ? AND doc_type = ?", (next_number, issuer_id, doc_type))
+    return series, next_number
 
 def get_next_correlative(issuer_id, doc_type):
     """
     Obtiene el siguiente número de correlativo para un tipo de documento y emisor,
     y lo incrementa en la base de datos de forma atómica.
     """
-    conn = create_connection()
-    cur = conn.cursor()
-    next_number = -1
-    series = ""
     try:
-        conn.isolation_level = 'EXCLUSIVE'
-        conn.execute('BEGIN EXCLUSIVE')
-
-        cur.execute("SELECT series, current_number FROM correlatives WHERE issuer_id = ? AND doc_type = ?", (issuer_id, doc_type))
-        row = cur.fetchone()
-
-        if row:
-            series, current_number = row
-            next_number = current_number + 1
-            cur.execute("UPDATE correlatives SET current_number = ? WHERE issuer_id = ? AND doc_type = ?", (next_number, issuer_id, doc_type))
-            conn.commit()
-            with open("debug_log.txt", "a") as f: f.write(f"DB NEXT: Updated {doc_type} to {next_number} (Series {series})\n")
-        else:
-            conn.rollback()
-            return None, -1
-            
+        with transaction() as conn:
+            allocated = _allocate_correlative(conn.cursor(), issuer_id, doc_type)
     except Error as e:
         print(f"Error al obtener el siguiente correlativo: {e}")
-        if conn:
-            conn.rollback()
         return None, -1
-    finally:
-        if conn:
-            conn.close()
-            
+
+    if allocated is None:
+        return None, -1
+    series, next_number = allocated
+    with open("debug_log.txt", "a") as f: f.write(f"DB NEXT: Updated {doc_type} to {next_number} (Series {series})\n")
     return series, next_number
 
 def get_last_issued_correlative(issuer_id, doc_type):
@@ -1207,234 +1715,319 @@ def get_last_issued_correlative(issuer_id, doc_type):
     return 0 
 
 def get_correlative(issuer_id, doc_type):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT series, current_number FROM correlatives WHERE issuer_id = ? AND doc_type = ?", (issuer_id, doc_type))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT series, current_number FROM correlatives WHERE issuer_id = ? AND doc_type = ?", (issuer_id, doc_type))
+        row = cur.fetchone()
     if row:
         with open("debug_log.txt", "a") as f: f.write(f"DB READ: {doc_type} -> {row[1]} (Series {row[0]})\n")
         return row[0], row[1]
     return None, -1
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT MAX(CAST(SUBSTR(document_number, INSTR(document_number, '-') + 1) AS INTEGER))
-        FROM sales
-        WHERE issuer_id = ? AND document_type = ?
-    """, (issuer_id, doc_type))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT MAX(CAST(SUBSTR(document_number, INSTR(document_number, '-') + 1) AS INTEGER))
+            FROM sales
+            WHERE issuer_id = ? AND document_type = ?
+        """, (issuer_id, doc_type))
+        row = cur.fetchone()
     return row[0] if row and row[0] is not None else 0
 
 def is_code_unique(code, issuer_name=None, issuer_address=None):
     """Verifica si un código de producto es único dentro de la misma empresa/dirección."""
-    conn = create_connection()
-    cur = conn.cursor()
-    # Check uniqueness only within the same issuer_name AND issuer_address
-    cur.execute(
-        "SELECT id FROM products WHERE code = ? AND issuer_name = ? AND issuer_address = ? AND is_active = 1",
-        (code, issuer_name, issuer_address)
-    )
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Check uniqueness only within the same issuer_name AND issuer_address
+        cur.execute(
+            "SELECT id FROM products WHERE code = ? AND issuer_name = ? AND issuer_address = ? AND is_active = 1",
+            (code, issuer_name, issuer_address)
+        )
+        row = cur.fetchone()
     return row is None
 
 def get_customer_by_alias(alias):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM customers WHERE alias LIKE ?", ('%' + alias + '%',))
-    return cur.fetchall()
-
-def search_customers_general(query):
-    conn = create_connection()
-    cur = conn.cursor()
-    search_term = f"%{query}%"
-    cur.execute("""
-        SELECT * FROM customers 
-        WHERE name LIKE ? OR alias LIKE ? OR doc_number LIKE ?
-        ORDER BY name
-        LIMIT 20
-    """, (search_term, search_term, search_term))
-    return cur.fetchall()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM customers WHERE alias LIKE ?", ('%' + alias + '%',))
+        return cur.fetchall()
+
+# --- Búsqueda de clientes/proveedores ---
+# customers_fts indexa customers (contenido externo, sin duplicar el texto) y los triggers
+# lo mantienen al día. Cada palabra tecleada se busca como prefijo, sin tildes, y los
+# resultados salen por relevancia (bm25) con el documento exacto primero.
+
+CUSTOMER_SEARCH_LIMIT = 20
+PARTY_SEARCH_LIMIT = 500
+# Columnas de customers_fts y su peso en bm25
+_CUSTOMER_FTS_COLUMNS = ("name", "alias", "doc_number", "phone", "address", "type")
+_CUSTOMER_FTS_WEIGHTS = "10.0, 8.0, 10.0, 2.0, 1.0, 0.5"
+# Si la base tiene customers_fts (None: aún no se comprobó). Sin FTS5 se busca con LIKE.
+_customer_search_index = None
+
+def create_customer_search_index(conn):
+    """Crea customers_fts y sus triggers; devuelve False si este SQLite no trae FTS5."""
+    columns = ", ".join(_CUSTOMER_FTS_COLUMNS)
+    new_values = ", ".join(f"NEW.{c}" for c in _CUSTOMER_FTS_COLUMNS)
+    old_values = ", ".join(f"OLD.{c}" for c in _CUSTOMER_FTS_COLUMNS)
+    try:
+        conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5(
+                             {columns}, content='customers', content_rowid='id',
+                             tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    except sqlite3.OperationalError as e:
+        print(f"Índice de clientes no disponible: {e}")
+        _detect_customer_search_index(conn)
+        return False
+    create_table(conn, f""" CREATE TRIGGER IF NOT EXISTS trg_customers_fts_insert AFTER INSERT ON customers
+                                        BEGIN
+                                            INSERT INTO customers_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+                                        END; """)
+    create_table(conn, f""" CREATE TRIGGER IF NOT EXISTS trg_customers_fts_delete AFTER DELETE ON customers
+                                        BEGIN
+                                            INSERT INTO customers_fts (customers_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+                                        END; """)
+    create_table(conn, f""" CREATE TRIGGER IF NOT EXISTS trg_customers_fts_update AFTER UPDATE ON customers
+                                        BEGIN
+                                            INSERT INTO customers_fts (customers_fts, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+                                            INSERT INTO customers_fts (rowid, {columns}) VALUES (NEW.id, {new_values});
+                                        END; """)
+    return True
+
+def _detect_customer_search_index(conn):
+    """Comprueba una vez por base si customers_fts existe y se puede usar."""
+    global _customer_search_index
+    try:
+        _customer_search_index = bool(conn.execute("PRAGMA table_info(customers_fts)").fetchall())
+    except sqlite3.OperationalError:
+        # Creada con FTS5 pero abierta con un SQLite que no lo trae
+        _customer_search_index = False
+    return _customer_search_index
+
+def _customer_match_query(text, columns=None):
+    """Texto tecleado -> consulta MATCH de FTS5: cada palabra como prefijo, sin operadores del usuario."""
+    words = re.findall(r"[^\W_]+", text or "")
+    if not words:
+        return None
+    match = " ".join(f'"{word}"*' for word in words)
+    return f"{{{' '.join(columns)}}} : ({match})" if columns else match
+
+def _search_customers(select, query, limit, columns=None):
+    with get_connection() as conn:
+        match = _customer_match_query(query, columns)
+        if match is None:
+            return []
+        if _customer_search_index is None:
+            _detect_customer_search_index(conn)
+        if _customer_search_index:
+            # Otros errores (base bloqueada...) se propagan: un LIKE encontraría otra cosa
+            return conn.execute(f"""
+                SELECT {select} FROM customers_fts f JOIN customers c ON c.id = f.rowid
+                WHERE customers_fts MATCH ?
+                ORDER BY c.doc_number = ? DESC, bm25(customers_fts, {_CUSTOMER_FTS_WEIGHTS}), c.name
+                LIMIT ?
+            """, (match, query.strip(), limit)).fetchall()
+        # SQLite sin FTS5 (no hay customers_fts): LIKE '%texto%' sobre las mismas columnas
+        term = f"%{query.strip()}%"
+        fields = columns or _CUSTOMER_FTS_COLUMNS
+        where = " OR ".join(f"c.{f} LIKE ?" for f in fields)
+        return conn.execute(f"SELECT {select} FROM customers c WHERE {where} ORDER BY c.name LIMIT ?",
+                            (*[term] * len(fields), limit)).fetchall()
+
+def search_customers_general(query, limit=CUSTOMER_SEARCH_LIMIT):
+    """Clientes por nombre, alias o DNI/RUC (prefijo de cada palabra); columnas de SELECT * FROM customers."""
+    return _search_customers("c.*", query, limit, columns=("name", "alias", "doc_number"))
+
+def search_parties(query, limit=PARTY_SEARCH_LIMIT):
+    """Como get_all_parties, pero solo los que coinciden con `query` en cualquier columna, por relevancia."""
+    return _search_customers("c.id, c.type, c.doc_number, c.name, c.phone, c.address, c.alias", query, limit)
+
+def get_party_by_doc_number(doc_number):
+    """Cliente/proveedor con ese DNI/RUC (columnas de get_all_parties) o None."""
+    with get_connection() as conn:
+        return conn.execute("SELECT id, type, doc_number, name, phone, address, alias FROM customers WHERE doc_number = ?",
+                            (doc_number,)).fetchone()
+
+# --- Caché de consultas DNI/RUC (person_lookup) ---
+
+def get_document_lookup(doc_number):
+    """(found, response_json, fetched_at) de la última consulta guardada para el documento, o None."""
+    with get_connection() as conn:
+        return conn.execute("SELECT found, response, fetched_at FROM document_lookups WHERE doc_number = ?",
+                            (doc_number,)).fetchone()
+
+def save_document_lookup(doc_number, found, response, fetched_at):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO document_lookups (doc_number, found, response, fetched_at) VALUES (?, ?, ?, ?)",
+                     (doc_number, 1 if found else 0, response, fetched_at))
 
 if __name__ == '__main__':
     setup_database()
 def get_next_movement_number(movement_type):
     """Obtiene el siguiente número correlativo para un tipo de movimiento (INGRESO/SALIDA)."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    prefix = "IN" if movement_type == "INGRESO" else ("AN" if movement_type == "ANULADO" else "SA")
-    
-    # Buscar el último número usado para este tipo
-    cur.execute("SELECT movement_number FROM inventory_movements WHERE movement_type = ? ORDER BY id DESC LIMIT 1", (movement_type,))
-    last_row = cur.fetchone()
-    
-    if last_row:
-        last_number_str = last_row[0] # Ej: "IN-5"
-        try:
-            last_seq = int(last_number_str.split('-')[1])
-            next_seq = last_seq + 1
-        except (IndexError, ValueError):
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        prefix = "IN" if movement_type == "INGRESO" else ("AN" if movement_type == "ANULADO" else "SA")
+
+        # Buscar el último número usado para este tipo
+        cur.execute("SELECT movement_number FROM inventory_movements WHERE movement_type = ? ORDER BY id DESC LIMIT 1", (movement_type,))
+        last_row = cur.fetchone()
+
+        if last_row:
+            last_number_str = last_row[0] # Ej: "IN-5"
+            try:
+                last_seq = int(last_number_str.split('-')[1])
+                next_seq = last_seq + 1
+            except (IndexError, ValueError):
+                next_seq = 1
+        else:
             next_seq = 1
-    else:
-        next_seq = 1
-        
-    return f"{prefix}-{next_seq}"
+
+        return f"{prefix}-{next_seq}"
 
 def record_movement(movement_type, reason, issuer_id, issuer_address, items, total_amount, date_time):
     """Registra un movimiento de inventario y actualiza el stock."""
-    conn = create_connection()
-    try:
-        cur = conn.cursor()
-        
-        # 1. Obtener número correlativo
-        movement_number = get_next_movement_number(movement_type) # Note: This is slightly risky for concurrency but acceptable for single-user
-        
-        # 2. Insertar movimiento cabecera
-        sql_movement = ''' INSERT INTO inventory_movements(movement_type, movement_number, date_time, reason, issuer_id, issuer_address, total_amount)
-                           VALUES(?,?,?,?,?,?,?) '''
-        cur.execute(sql_movement, (movement_type, movement_number, date_time, reason, issuer_id, issuer_address, total_amount))
-        movement_id = cur.lastrowid
-        
-        # 3. Insertar items y actualizar stock
-        sql_item = ''' INSERT INTO inventory_movement_items(movement_id, product_id, quantity, unit_of_measure, price, subtotal)
-                       VALUES(?,?,?,?,?,?) '''
-                       
-        for item in items:
-            # item: {id, quantity, price, subtotal, unit_of_measure}
-            cur.execute(sql_item, (movement_id, item['id'], item['quantity'], item['unit_of_measure'], item['price'], item['subtotal']))
-            
-            # Actualizar Stock
-            if movement_type == "INGRESO":
-                sql_update_stock = "UPDATE products SET stock = stock + ? WHERE id = ?"
-            elif movement_type in ["SALIDA", "ANULADO"]: # Both subtract stock?
-                # User scenario: "Anulado" in Sales usually means Sale Voided (Stock Returns).
-                # But here in "Movements" context (Ingresos/Salidas), "Anulado" is often used as "Baja/Merma".
-                # If the user selects "ANULADO" via the button "Anulado" in Sales View...
-                # Wait. The "Anulado" button in Sales View is for "Registrar Anulado" (voiding a current attempt? or recording a past void?).
-                # If I am in Sales View, I haven't sold it yet (it's in cart).
-                # If I click "Anulado", I am opening a dialog to register a movement.
-                # If I register products there, what does it mean?
-                # Usually "Anulado" means "Item Damaged/Voided". So Stock goes DOWN.
-                # If I wanted to return stock, I would do "Ingreso".
-                # So "ANULADO" behaving like "SALIDA" (Decreasing Stock) is safer default for "Merma".
-                sql_update_stock = "UPDATE products SET stock = stock - ? WHERE id = ?"
-            else:
-                 sql_update_stock = "UPDATE products SET stock = stock - ? WHERE id = ?" # Default to substract
-                
-            cur.execute(sql_update_stock, (item['quantity'], item['id']))
-            
-        conn.commit()
-        return movement_number
-    except Error as e:
-        conn.rollback()
-        print(f"Error recording movement: {e}")
-        raise
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        try:
+            cur = conn.cursor()
+
+            # 1. Obtener número correlativo
+            movement_number = get_next_movement_number(movement_type) # Note: This is slightly risky for concurrency but acceptable for single-user
+
+            # 2. Insertar movimiento cabecera
+            sql_movement = ''' INSERT INTO inventory_movements(movement_type, movement_number, date_time, date_ts, reason, issuer_id, issuer_address, total_amount)
+                               VALUES(?,?,?,?,?,?,?,?) '''
+            cur.execute(sql_movement, (movement_type, movement_number, date_time, normalize_timestamp(date_time), reason, issuer_id, issuer_address, total_amount))
+            movement_id = cur.lastrowid
+
+            # 3. Insertar items y actualizar stock
+            sql_item = ''' INSERT INTO inventory_movement_items(movement_id, product_id, quantity, unit_of_measure, price, subtotal)
+                           VALUES(?,?,?,?,?,?) '''
+
+            for item in items:
+                # item: {id, quantity, price, subtotal, unit_of_measure}
+                cur.execute(sql_item, (movement_id, item['id'], item['quantity'], item['unit_of_measure'], item['price'], item['subtotal']))
+
+                # Actualizar Stock
+                if movement_type == "INGRESO":
+                    sql_update_stock = "UPDATE products SET stock = stock + ? WHERE id = ?"
+                elif movement_type in ["SALIDA", "ANULADO"]: # Both subtract stock?
+                    # User scenario: "Anulado" in Sales usually means Sale Voided (Stock Returns).
+                    # But here in "Movements" context (Ingresos/Salidas), "Anulado" is often used as "Baja/Merma".
+                    # If the user selects "ANULADO" via the button "Anulado" in Sales View...
+                    # Wait. The "Anulado" button in Sales View is for "Registrar Anulado" (voiding a current attempt? or recording a past void?).
+                    # If I am in Sales View, I haven't sold it yet (it's in cart).
+                    # If I click "Anulado", I am opening a dialog to register a movement.
+                    # If I register products there, what does it mean?
+                    # Usually "Anulado" means "Item Damaged/Voided". So Stock goes DOWN.
+                    # If I wanted to return stock, I would do "Ingreso".
+                    # So "ANULADO" behaving like "SALIDA" (Decreasing Stock) is safer default for "Merma".
+                    sql_update_stock = "UPDATE products SET stock = stock - ? WHERE id = ?"
+                else:
+                     sql_update_stock = "UPDATE products SET stock = stock - ? WHERE id = ?" # Default to substract
+
+                cur.execute(sql_update_stock, (item['quantity'], item['id']))
+
+            conn.commit()
+            return movement_number
+        except Error as e:
+            conn.rollback()
+            print(f"Error recording movement: {e}")
+            raise
 
 def get_movements(filter_type="TODOS", start_date=None, end_date=None, issuer_id=None, address=None):
     """Obtiene el historial de movimientos."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = "SELECT id, movement_type, movement_number, date_time, reason, total_amount, issuer_id, issuer_address FROM inventory_movements"
-    conditions = []
-    params = []
-    
-    if filter_type != "TODOS":
-        conditions.append("movement_type = ?")
-        params.append(filter_type)
-        
-    if start_date and end_date:
-        # Asumiendo que date_time es 'YYYY-MM-DD HH:MM:SS'
-        conditions.append("date(date_time) BETWEEN ? AND ?")
-        params.append(start_date)
-        params.append(end_date)
+    with get_connection() as conn:
+        cur = conn.cursor()
 
-    if issuer_id is not None:
-        conditions.append("issuer_id = ?")
-        params.append(issuer_id)
-        
-    if address and address != "TODOS":
-        conditions.append("issuer_address = ?")
-        params.append(address)
-        
-    if conditions:
-        sql += " WHERE " + " AND ".join(conditions)
-        
-    sql += " ORDER BY id DESC"
-    
-    cur.execute(sql, params)
-    return cur.fetchall()
+        sql = "SELECT id, movement_type, movement_number, date_time, reason, total_amount, issuer_id, issuer_address FROM inventory_movements"
+        conditions = []
+        params = []
+
+        if filter_type != "TODOS":
+            conditions.append("movement_type = ?")
+            params.append(filter_type)
+
+        if start_date and end_date:
+            conditions.append("date_ts BETWEEN ? AND ?")
+            params.extend(_day_bounds(start_date, end_date))
+
+        if issuer_id is not None:
+            conditions.append("issuer_id = ?")
+            params.append(issuer_id)
+
+        if address and address != "TODOS":
+            conditions.append("issuer_address = ?")
+            params.append(address)
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        sql += " ORDER BY id DESC"
+
+        cur.execute(sql, params)
+        return cur.fetchall()
 
 def get_movement_items(movement_id):
     """Obtiene los detalles de un movimiento."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = """
-        SELECT p.name, i.quantity, i.unit_of_measure, i.price, i.subtotal
-        FROM inventory_movement_items i
-        JOIN products p ON i.product_id = p.id
-        WHERE i.movement_id = ?
-    """
-    cur.execute(sql, (movement_id,))
-    return cur.fetchall()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        sql = """
+            SELECT p.name, i.quantity, i.unit_of_measure, i.price, i.subtotal
+            FROM inventory_movement_items i
+            JOIN products p ON i.product_id = p.id
+            WHERE i.movement_id = ?
+        """
+        cur.execute(sql, (movement_id,))
+        return cur.fetchall()
 
 def get_movement_full_data(movement_id):
     """Obtiene todos los datos de un movimiento para la vista previa del ticket."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    # Datos del movimiento y emisor
-    cur.execute("""
-        SELECT 
-            m.id, m.movement_type, m.movement_number, m.date_time, m.reason, m.total_amount,
-            i.name as issuer_name, i.ruc as issuer_ruc, i.address as issuer_address,
-            i.district, i.province, i.department,
-            i.commercial_name, i.bank_accounts, i.initial_greeting, i.final_greeting, i.logo, i.email, i.phone
-        FROM inventory_movements m
-        LEFT JOIN issuers i ON m.issuer_id = i.id
-        WHERE m.id = ?
-    """, (movement_id,))
-    movement_data = cur.fetchone()
-    
-    if not movement_data:
-        conn.close()
-        return None
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Datos del movimiento y emisor
+        cur.execute("""
+            SELECT 
+                m.id, m.movement_type, m.movement_number, m.date_time, m.reason, m.total_amount,
+                i.name as issuer_name, i.ruc as issuer_ruc, i.address as issuer_address,
+                i.district, i.province, i.department,
+                i.commercial_name, i.bank_accounts, i.initial_greeting, i.final_greeting, i.logo, i.email, i.phone
+            FROM inventory_movements m
+            LEFT JOIN issuers i ON m.issuer_id = i.id
+            WHERE m.id = ?
+        """, (movement_id,))
+        movement_data = cur.fetchone()
+
+        if not movement_data:
+            return None
+
+        # Detalles del movimiento (productos)
+        cur.execute("""
+            SELECT p.name, i.quantity, i.unit_of_measure, i.price, i.subtotal
+            FROM inventory_movement_items i
+            JOIN products p ON i.product_id = p.id
+            WHERE i.movement_id = ?
+        """, (movement_id,))
+        details = cur.fetchall()
 
-    # Detalles del movimiento (productos)
-    cur.execute("""
-        SELECT p.name, i.quantity, i.unit_of_measure, i.price, i.subtotal
-        FROM inventory_movement_items i
-        JOIN products p ON i.product_id = p.id
-        WHERE i.movement_id = ?
-    """, (movement_id,))
-    details = cur.fetchall()
-    
-    conn.close()
-    
     return {"movement": movement_data, "details": details}
 
 def get_daily_sales_total(payment_method='EFECTIVO'):
     """Calcula el total de ventas del día actual para un método de pago específico."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    
-    sql = """
-        SELECT SUM(total_amount) 
-        FROM sales 
-        WHERE date(sale_date) = ? AND payment_method = ?
-    """
-    
-    cur.execute(sql, (today, payment_method))
-    result = cur.fetchone()[0]
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        day_start, day_end = _day_bounds(datetime.now(), datetime.now())
+
+        sql = """
+            SELECT SUM(total_amount) 
+            FROM sales 
+            WHERE sale_ts BETWEEN ? AND ? AND payment_method = ?
+        """
+
+        cur.execute(sql, (day_start, day_end, payment_method))
+        result = cur.fetchone()[0]
     
     return result if result else 0.0
 
@@ -1463,93 +2056,89 @@ def create_cash_counts_table(conn):
 
 def get_last_closure(caja_id):
     """Obtiene el último cierre de caja para una caja específica."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = "SELECT * FROM cash_counts WHERE caja_id = ? ORDER BY id DESC LIMIT 1"
-    cur.execute(sql, (caja_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        sql = "SELECT * FROM cash_counts WHERE caja_id = ? ORDER BY id DESC LIMIT 1"
+        cur.execute(sql, (caja_id,))
+        row = cur.fetchone()
     return row
 
 def save_cash_count(data):
     """Guarda un nuevo arqueo de caja."""
-    conn = create_connection()
-    try:
-        cur = conn.cursor()
-        sql = """ INSERT INTO cash_counts(caja_id, start_time, end_time, user_id, system_cash, counted_cash, difference, correlative,
-                                          initial_balance, system_cards, expenses, counted_cards, change_next_day, collected_total, details_json,
-                                          opening_time, accumulated_cash, stock_value, sales_cash, income_additional, purchases, anulados, returns, withdrawal)
-                  VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) """
-        cur.execute(sql, (data['caja_id'], data['start_time'], data['end_time'], data['user_id'], 
-                          data['system_cash'], data['counted_cash'], data['difference'], data['correlative'],
-                          data.get('initial_balance', 0.0), data.get('system_cards', 0.0), data.get('expenses', 0.0),
-                          data.get('counted_cards', 0.0), data.get('change_next_day', 0.0), data.get('collected_total', 0.0),
-                          data.get('details_json', '{}'),
-                          data.get('opening_time', ''),
-                          data.get('accumulated_cash', 0.0),
-                          data.get('stock_value', 0.0),
-                          data.get('sales_cash', 0.0),
-                          data.get('income_additional', 0.0),
-                          data.get('purchases', 0.0),
-                          data.get('anulados', 0.0),
-                          data.get('returns', 0.0),
-                          data.get('withdrawal', 0.0)))
-        conn.commit()
-        
-        # Transfer temp expenses to history
-        if cur.lastrowid:
-            transfer_temp_to_history(data['caja_id'], cur.lastrowid)
-            
-        return cur.lastrowid
-    except Error as e:
-        print(e)
-        return None
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        try:
+            cur = conn.cursor()
+            sql = """ INSERT INTO cash_counts(caja_id, start_time, end_time, user_id, system_cash, counted_cash, difference, correlative,
+                                              initial_balance, system_cards, expenses, counted_cards, change_next_day, collected_total, details_json,
+                                              opening_time, accumulated_cash, stock_value, sales_cash, income_additional, purchases, anulados, returns, withdrawal,
+                                              start_ts, end_ts)
+                      VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) """
+            cur.execute(sql, (data['caja_id'], data['start_time'], data['end_time'], data['user_id'], 
+                              data['system_cash'], data['counted_cash'], data['difference'], data['correlative'],
+                              data.get('initial_balance', 0.0), data.get('system_cards', 0.0), data.get('expenses', 0.0),
+                              data.get('counted_cards', 0.0), data.get('change_next_day', 0.0), data.get('collected_total', 0.0),
+                              data.get('details_json', '{}'),
+                              data.get('opening_time', ''),
+                              data.get('accumulated_cash', 0.0),
+                              data.get('stock_value', 0.0),
+                              data.get('sales_cash', 0.0),
+                              data.get('income_additional', 0.0),
+                              data.get('purchases', 0.0),
+                              data.get('anulados', 0.0),
+                              data.get('returns', 0.0),
+                              data.get('withdrawal', 0.0),
+                              normalize_timestamp(data['start_time']), normalize_timestamp(data['end_time'])))
+            conn.commit()
+
+            # Transfer temp expenses to history
+            if cur.lastrowid:
+                transfer_temp_to_history(data['caja_id'], cur.lastrowid)
+
+            return cur.lastrowid
+        except Error as e:
+            print(e)
+            return None
 
 def get_cash_counts_history(caja_id):
     """Obtiene el historial de arqueos para una caja."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = "SELECT id, end_time, user_id, correlative, difference FROM cash_counts WHERE caja_id = ? ORDER BY id DESC"
-    cur.execute(sql, (caja_id,))
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        sql = "SELECT id, end_time, user_id, correlative, difference FROM cash_counts WHERE caja_id = ? ORDER BY id DESC"
+        cur.execute(sql, (caja_id,))
+        rows = cur.fetchall()
     return rows
 
 def get_cash_count_by_id(record_id):
-    conn = create_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    
-    sql = "SELECT * FROM cash_counts WHERE id = ?"
-    cur.execute(sql, (record_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+
+        sql = "SELECT * FROM cash_counts WHERE id = ?"
+        cur.execute(sql, (record_id,))
+        row = cur.fetchone()
     return dict(row) if row else None
 
 def get_sales_total_in_range(start_time, end_time, caja_id, payment_method='EFECTIVO'):
     """Calcula el total de ventas en un rango de fechas."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    # Note: We might want to filter by caja_id if sales are per-caja, but currently sales table doesn't seem to have caja_id?
-    # Checking sales table schema... It has user_id but maybe not caja_id?
-    # Assuming for now we count ALL sales or we need to add caja_id to sales?
-    # The user requirement implies "ventas de esos rangos".
-    # If sales don't have caja_id, we count global sales.
-    
-    sql = """
-        SELECT SUM(total_amount) 
-        FROM sales 
-        WHERE sale_date > ? AND sale_date <= ? AND payment_method = ?
-    """
-    
-    cur.execute(sql, (start_time, end_time, payment_method))
-    result = cur.fetchone()[0]
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Note: We might want to filter by caja_id if sales are per-caja, but currently sales table doesn't seem to have caja_id?
+        # Checking sales table schema... It has user_id but maybe not caja_id?
+        # Assuming for now we count ALL sales or we need to add caja_id to sales?
+        # The user requirement implies "ventas de esos rangos".
+        # If sales don't have caja_id, we count global sales.
+
+        sql = """
+            SELECT SUM(total_amount) 
+            FROM sales 
+            WHERE sale_ts > ? AND sale_ts <= ? AND payment_method = ?
+        """
+
+        cur.execute(sql, (_ts_param(start_time), _ts_param(end_time), payment_method))
+        result = cur.fetchone()[0]
     
     return result if result else 0.0
 
@@ -1564,45 +2153,171 @@ def create_temp_expenses_table(conn):
                                     ); """)
 
 def add_temp_expense(caja_id, expense_date, detail, amount, detail_2=""):
-    conn = create_connection()
-    # Check if detail_2 column exists (handled by migration, but query needs to match schema)
-    # We assume migration runs first.
-    sql = 'INSERT INTO temp_expenses(caja_id, expense_date, detail, amount, detail_2) VALUES(?,?,?,?,?)'
-    cur = conn.cursor()
-    cur.execute(sql, (caja_id, expense_date, detail, amount, detail_2))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        # Check if detail_2 column exists (handled by migration, but query needs to match schema)
+        # We assume migration runs first.
+        sql = 'INSERT INTO temp_expenses(caja_id, expense_date, detail, amount, detail_2) VALUES(?,?,?,?,?)'
+        cur = conn.cursor()
+        cur.execute(sql, (caja_id, expense_date, detail, amount, detail_2))
+        conn.commit()
 
 def get_temp_expenses(caja_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    # Check if detail_2 exists to avoid error if migration failed? 
-    # Optimistic: assume it exists.
-    try:
-        cur.execute("SELECT id, expense_date, detail, amount, detail_2 FROM temp_expenses WHERE caja_id = ? ORDER BY id", (caja_id,))
-    except:
-        # Fallback for old schema if something weird happens (shouldn't if setup runs)
-        cur.execute("SELECT id, expense_date, detail, amount FROM temp_expenses WHERE caja_id = ? ORDER BY id", (caja_id,))
-        # Pad results
-        rows = cur.fetchall()
-        # Adapt rows to include empty detail_2
-        return [(r[0], r[1], r[2], r[3], "") for r in rows]
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Check if detail_2 exists to avoid error if migration failed? 
+        # Optimistic: assume it exists.
+        try:
+            cur.execute("SELECT id, expense_date, detail, amount, detail_2 FROM temp_expenses WHERE caja_id = ? ORDER BY id", (caja_id,))
+        except:
+            # Fallback for old schema if something weird happens (shouldn't if setup runs)
+            cur.execute("SELECT id, expense_date, detail, amount FROM temp_expenses WHERE caja_id = ? ORDER BY id", (caja_id,))
+            # Pad results
+            rows = cur.fetchall()
+            # Adapt rows to include empty detail_2
+            return [(r[0], r[1], r[2], r[3], "") for r in rows]
 
-    return cur.fetchall()
+        return cur.fetchall()
 
 def delete_temp_expense(expense_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM temp_expenses WHERE id = ?", (expense_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM temp_expenses WHERE id = ?", (expense_id,))
+        conn.commit()
 
 def clear_temp_expenses(caja_id):
-    conn = create_connection()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM temp_expenses WHERE caja_id = ?", (caja_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM temp_expenses WHERE caja_id = ?", (caja_id,))
+        conn.commit()
+
+# --- Carritos en curso (reservas entre cajas) ---
+
+def create_cart_reservations_tables(conn):
+    """Estado de cada caja: cabecera (cliente, pago...) y una fila por línea del carrito."""
+    create_table(conn, """ CREATE TABLE IF NOT EXISTS box_states (
+                                        caja_id text PRIMARY KEY,
+                                        data text NOT NULL DEFAULT '{}'
+                                    ); """)
+    create_table(conn, """ CREATE TABLE IF NOT EXISTS cart_reservations (
+                                        caja_id text NOT NULL,
+                                        line integer NOT NULL,
+                                        product_id text,
+                                        quantity real NOT NULL DEFAULT 0,
+                                        item text NOT NULL,
+                                        PRIMARY KEY (caja_id, line)
+                                    ); """)
+    create_table(conn, "CREATE INDEX IF NOT EXISTS idx_cart_reservations_product ON cart_reservations(product_id, caja_id, quantity)")
+    create_table(conn, """ CREATE VIEW IF NOT EXISTS reserved_quantities AS
+                                        SELECT product_id, caja_id, SUM(quantity) AS quantity
+                                        FROM cart_reservations
+                                        GROUP BY product_id, caja_id; """)
+    # Se llama durante las migraciones: los triggers de products los crea setup_database al final
+    create_stock_change_feed(conn, watch_products=False)
+
+# --- Feed de cambios de stock/reservas ---
+# Cada cambio de stock, precio o nombre de un producto y cada línea de carrito que
+# cambia deja una fila con una versión creciente. Las cajas solo comparan la última
+# versión vista y refrescan los productos afectados.
+
+STOCK_CHANGES_KEEP = 5000
+
+def create_stock_change_feed(conn, watch_products=True):
+    """
+    Tabla del feed y sus triggers. Con watch_products=False solo los de carritos: los de
+    products nombran columnas (image_hash...) que una base antigua aún no tiene, y harían
+    fallar las migraciones que reconstruyen tablas.
+    """
+    create_table(conn, """ CREATE TABLE IF NOT EXISTS stock_changes (
+                                        version integer PRIMARY KEY AUTOINCREMENT,
+                                        product_id text
+                                    ); """)
+    if watch_products:
+        _create_product_change_triggers(conn)
+    create_table(conn, """ CREATE TRIGGER IF NOT EXISTS trg_stock_changes_cart_insert
+                                        AFTER INSERT ON cart_reservations
+                                        BEGIN
+                                            INSERT INTO stock_changes (product_id) VALUES (NEW.product_id);
+                                        END; """)
+    create_table(conn, """ CREATE TRIGGER IF NOT EXISTS trg_stock_changes_cart_update
+                                        AFTER UPDATE OF product_id, quantity ON cart_reservations
+                                        BEGIN
+                                            INSERT INTO stock_changes (product_id) SELECT NEW.product_id UNION SELECT OLD.product_id;
+                                        END; """)
+    create_table(conn, """ CREATE TRIGGER IF NOT EXISTS trg_stock_changes_cart_delete
+                                        AFTER DELETE ON cart_reservations
+                                        BEGIN
+                                            INSERT INTO stock_changes (product_id) VALUES (OLD.product_id);
+                                        END; """)
+
+def _create_product_change_triggers(conn):
+    # También alimenta al catálogo compartido (product_catalog): ediciones, altas y bajas de productos
+    create_table(conn, """ CREATE TRIGGER IF NOT EXISTS trg_stock_changes_products
+                                        AFTER UPDATE OF stock, price, name, code, unit_of_measure, operation_type, issuer_name,
+                                                        issuer_address, category, image_hash, is_active ON products
+                                        WHEN OLD.stock IS NOT NEW.stock OR OLD.price IS NOT NEW.price OR OLD.name IS NOT NEW.name
+                                             OR OLD.code IS NOT NEW.code OR OLD.unit_of_measure IS NOT NEW.unit_of_measure
+                                             OR OLD.operation_type IS NOT NEW.operation_type OR OLD.issuer_name IS NOT NEW.issuer_name
+                                             OR OLD.issuer_address IS NOT NEW.issuer_address OR OLD.category IS NOT NEW.category
+                                             OR OLD.image_hash IS NOT NEW.image_hash OR OLD.is_active IS NOT NEW.is_active
+                                        BEGIN
+                                            INSERT INTO stock_changes (product_id) VALUES (CAST(NEW.id AS TEXT));
+                                        END; """)
+    create_table(conn, """ CREATE TRIGGER IF NOT EXISTS trg_stock_changes_products_insert
+                                        AFTER INSERT ON products
+                                        BEGIN
+                                            INSERT INTO stock_changes (product_id) VALUES (CAST(NEW.id AS TEXT));
+                                        END; """)
+
+def prune_stock_changes(keep=STOCK_CHANGES_KEEP):
+    """Conserva solo las últimas `keep` versiones del feed."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM stock_changes WHERE version <= (SELECT MAX(version) FROM stock_changes) - ?", (keep,))
+
+def get_stock_version():
+    """Última versión del feed de cambios (0 si está vacío)."""
+    with get_connection() as conn:
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM stock_changes").fetchone()[0]
+
+def get_stock_changes_since(version):
+    """
+    Devuelve (versión_actual, {product_id (str)}) con los productos cambiados después de `version`.
+    El conjunto es None si `version` es None o ya fue recortada del feed (hay que refrescar todo).
+    """
+    with get_connection() as conn:
+        current, oldest = conn.execute("SELECT COALESCE((SELECT MAX(version) FROM stock_changes), 0), "
+                                        "COALESCE((SELECT MIN(version) FROM stock_changes), 0)").fetchone()
+        if version is None or (oldest and version < oldest - 1):
+            return current, None
+        if version >= current:
+            return current, set()
+        rows = conn.execute("SELECT DISTINCT product_id FROM stock_changes WHERE version > ? AND product_id IS NOT NULL", (version,))
+        return current, {row[0] for row in rows}
+
+def get_products_by_ids(product_ids):
+    """Filas de los productos indicados, mismas columnas que get_all_products (incluye los inactivos)."""
+    ids = [int(pid) for pid in product_ids if str(pid).isdigit()]
+    rows = []
+    with get_connection() as conn:
+        # Por tandas para no superar el límite de parámetros de SQLite
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(conn.execute("SELECT id, name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, "
+                                     f"category, image_hash, is_active FROM products WHERE id IN ({placeholders})", chunk))
+    return rows
+
+def get_products_live_data(product_ids):
+    """Nombre, precio y stock actuales de los productos indicados: {id: (name, price, stock)}."""
+    ids = [int(pid) for pid in product_ids if str(pid).isdigit()]
+    result = {}
+    with get_connection() as conn:
+        # Por tandas para no superar el límite de parámetros de SQLite
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for p_id, name, price, stock in conn.execute(f"SELECT id, name, price, stock FROM products WHERE id IN ({placeholders})", chunk):
+                result[p_id] = (name, price, stock)
+    return result
 
 # --- Expenses History ---
 
@@ -1620,75 +2335,71 @@ def create_expenses_history_table(conn):
 
 def transfer_temp_to_history(caja_id, cash_count_id):
     """Mueve los gastos temporales al histórico al cerrar caja."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    # Get temps
-    temps = get_temp_expenses(caja_id)
-    
-    # Insert into history
-    sql = "INSERT INTO expenses_history(caja_id, cash_count_id, expense_date, detail, detail_2, amount) VALUES (?, ?, ?, ?, ?, ?)"
-    for t in temps:
-        # t: id, date, detail, amount, detail_2 
-        # Note: get_temp_expenses returns specific columns.
-        # If it returns 5 cols: id(0), date(1), detail(2), amount(3), detail_2(4)
-        detail_2 = t[4] if len(t) > 4 else ""
-        cur.execute(sql, (caja_id, cash_count_id, t[1], t[2], detail_2, t[3]))
-        
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Get temps
+        temps = get_temp_expenses(caja_id)
+
+        # Insert into history
+        sql = "INSERT INTO expenses_history(caja_id, cash_count_id, expense_date, expense_ts, detail, detail_2, amount) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        for t in temps:
+            # t: id, date, detail, amount, detail_2 
+            # Note: get_temp_expenses returns specific columns.
+            # If it returns 5 cols: id(0), date(1), detail(2), amount(3), detail_2(4)
+            detail_2 = t[4] if len(t) > 4 else ""
+            cur.execute(sql, (caja_id, cash_count_id, t[1], normalize_timestamp(t[1]), t[2], detail_2, t[3]))
+
+        conn.commit()
 
 def get_expenses_history(filter_text=None):
     """Obtiene el historial de gastos con filtro opcional."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = "SELECT expense_date, detail, detail_2, amount FROM expenses_history"
-    
-    # Order by date desc
-    
-    if filter_text and filter_text.strip():
-        term = f"%{filter_text.strip()}%"
-        sql += " WHERE detail LIKE ? OR detail_2 LIKE ? OR amount LIKE ? OR expense_date LIKE ?"
-        params = (term, term, term, term)
-        sql += " ORDER BY id DESC" # Assuming ID correlates with time or add date sort
-        cur.execute(sql, params)
-    else:
-        sql += " ORDER BY id DESC"
-        cur.execute(sql)
-        
-    return cur.fetchall()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        sql = "SELECT expense_date, detail, detail_2, amount FROM expenses_history"
+
+        # Order by date desc
+
+        if filter_text and filter_text.strip():
+            term = f"%{filter_text.strip()}%"
+            sql += " WHERE detail LIKE ? OR detail_2 LIKE ? OR amount LIKE ? OR expense_date LIKE ?"
+            params = (term, term, term, term)
+            sql += " ORDER BY id DESC" # Assuming ID correlates with time or add date sort
+            cur.execute(sql, params)
+        else:
+            sql += " ORDER BY id DESC"
+            cur.execute(sql)
+
+        return cur.fetchall()
 
 def get_unique_expense_details():
     """Obtiene una lista de detalles únicos (detalle 1) del histórico de gastos."""
-    conn = create_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT DISTINCT detail FROM expenses_history ORDER BY detail")
-        rows = cur.fetchall()
-        return [row[0] for row in rows if row[0]]
-    except Exception as e:
-        print(f"Error fetching unique details: {e}")
-        return []
-    finally:
-        conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT DISTINCT detail FROM expenses_history ORDER BY detail")
+            rows = cur.fetchall()
+            return [row[0] for row in rows if row[0]]
+        except Exception as e:
+            print(f"Error fetching unique details: {e}")
+            return []
 
 
 def get_movement_totals_by_type_in_range(start_time, end_time):
     """Obtiene los totales por tipo de movimiento en un rango de fechas."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = """
-        SELECT movement_type, SUM(total_amount)
-        FROM inventory_movements
-        WHERE date_time >= ? AND date_time <= ?
-        GROUP BY movement_type
-    """
-    
-    cur.execute(sql, (start_time, end_time))
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        sql = """
+            SELECT movement_type, SUM(total_amount)
+            FROM inventory_movements
+            WHERE date_ts >= ? AND date_ts <= ?
+            GROUP BY movement_type
+        """
+
+        cur.execute(sql, (_ts_param(start_time), _ts_param(end_time)))
+        rows = cur.fetchall()
     
     totals = {}
     for row in rows:
@@ -1698,93 +2409,313 @@ def get_movement_totals_by_type_in_range(start_time, end_time):
     return totals
 
 
+def get_period_analytics(start, end):
+    """Totales de ventas y movimientos entre start y end (ambos inclusive) para el arqueo de caja."""
+    stats = {
+        'total_gross_sales': 0.0,
+        'non_cash_sales': 0.0,
+        'discounts': 0.0,
+        'income_additional': 0.0,
+        'purchases': 0.0,
+        'expenses': 0.0,
+        'anulados': 0.0,
+        'returns': 0.0
+    }
+    start_ts = normalize_timestamp(start)
+    end_ts = normalize_timestamp(end)
+    if not start_ts or not end_ts:
+        return stats
+
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # Pagos distintos de efectivo (un método de pago vacío también cuenta como no efectivo)
+        cur.execute("""
+            SELECT COALESCE(SUM(CASE WHEN s.payment_method IS NOT 'EFECTIVO' THEN COALESCE(s.amount_paid, 0) ELSE 0 END
+                              + CASE WHEN s.payment_method2 IS NOT 'EFECTIVO' THEN COALESCE(s.amount_paid2, 0) ELSE 0 END), 0)
+            FROM sales s
+            WHERE s.sale_ts BETWEEN ? AND ?
+        """, (start_ts, end_ts))
+        stats['non_cash_sales'] = cur.fetchone()[0]
+
+        # Bruto = cantidad x precio original (nunca menor que el precio cobrado); descuento = bruto - cobrado
+        cur.execute("""
+            SELECT COALESCE(SUM(qty * orig), 0), COALESCE(SUM(qty * orig - qty * price), 0)
+            FROM (
+                SELECT COALESCE(d.quantity_sold, 0) AS qty,
+                       COALESCE(d.price_per_unit, 0) AS price,
+                       MAX(COALESCE(NULLIF(d.original_price, 0), d.price_per_unit, 0), COALESCE(d.price_per_unit, 0)) AS orig
+                FROM sales s
+                JOIN sale_details d ON d.sale_id = s.id
+                WHERE s.sale_ts BETWEEN ? AND ?
+            )
+        """, (start_ts, end_ts))
+        stats['total_gross_sales'], stats['discounts'] = cur.fetchone()
+
+        cur.execute("""
+            SELECT movement_type, SUM(total_amount)
+            FROM inventory_movements
+            WHERE date_ts BETWEEN ? AND ?
+            GROUP BY movement_type
+        """, (start_ts, end_ts))
+        movement_rows = cur.fetchall()
+
+    # Pocas filas (una por tipo); se clasifican en Python para respetar upper() con acentos
+    for movement_type, total in movement_rows:
+        type_upper = (movement_type or "").upper()
+        if type_upper == 'INGRESO':
+            stats['income_additional'] += total or 0.0
+        elif type_upper == 'COMPRA':
+            stats['purchases'] += total or 0.0
+        elif type_upper in ['GASTO', 'SALIDA']:
+            stats['expenses'] += total or 0.0
+        elif type_upper == 'ANULADO':
+            stats['anulados'] += total or 0.0
+        elif type_upper in ['DEVOLUCION', 'DEVOLUCIÓN']:
+            stats['returns'] += total or 0.0
+    return stats
+
 def get_product_ranking_in_range(start_time, end_time):
     """Obtiene el ranking de productos más vendidos en un rango."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = """
-        SELECT p.name, SUM(d.quantity_sold) as total_qty
-        FROM sale_details d
-        JOIN sales s ON d.sale_id = s.id
-        JOIN products p ON d.product_id = p.id
-        WHERE s.sale_date > ? AND s.sale_date <= ?
-        GROUP BY p.name
-        ORDER BY total_qty DESC
-    """
-    
-    cur.execute(sql, (start_time, end_time))
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        sql = """
+            SELECT p.name, SUM(d.quantity_sold) as total_qty
+            FROM sale_details d
+            JOIN sales s ON d.sale_id = s.id
+            JOIN products p ON d.product_id = p.id
+            WHERE s.sale_ts > ? AND s.sale_ts <= ?
+            GROUP BY p.name
+            ORDER BY total_qty DESC
+        """
+
+        cur.execute(sql, (_ts_param(start_time), _ts_param(end_time)))
+        rows = cur.fetchall()
     return rows
 
 def get_discount_details_in_range(start_time, end_time):
     """Obtiene detalles de productos con descuento (original_price > price_per_unit)."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    # We want: Name, Discount Amount (Total or Unit?), Qty, Unit Price (Sold), Subtotal (Sold)
-    # User asked cols: DESC., CANT., UNIT., SUBT.
-    # DESC probably means Discount Amount?
-    # Logic: Unit Discount = Original - Price. Total Desc = Unit Desc * Qty.
-    
-    sql = """
-        SELECT p.name, (d.original_price - d.price_per_unit) as unit_discount, d.quantity_sold, d.price_per_unit, d.subtotal
-        FROM sale_details d
-        JOIN sales s ON d.sale_id = s.id
-        JOIN products p ON d.product_id = p.id
-        WHERE s.sale_date > ? AND s.sale_date <= ?
-        AND d.original_price > d.price_per_unit
-    """
-    
-    cur.execute(sql, (start_time, end_time))
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # We want: Name, Discount Amount (Total or Unit?), Qty, Unit Price (Sold), Subtotal (Sold)
+        # User asked cols: DESC., CANT., UNIT., SUBT.
+        # DESC probably means Discount Amount?
+        # Logic: Unit Discount = Original - Price. Total Desc = Unit Desc * Qty.
+
+        sql = """
+            SELECT p.name, (d.original_price - d.price_per_unit) as unit_discount, d.quantity_sold, d.price_per_unit, d.subtotal
+            FROM sale_details d
+            JOIN sales s ON d.sale_id = s.id
+            JOIN products p ON d.product_id = p.id
+            WHERE s.sale_ts > ? AND s.sale_ts <= ?
+            AND d.original_price > d.price_per_unit
+        """
+
+        cur.execute(sql, (_ts_param(start_time), _ts_param(end_time)))
+        rows = cur.fetchall()
     return rows
 
 def get_documents_summary_in_range(start_time, end_time):
     """Obtiene resumen de documentos emitidos."""
-    conn = create_connection()
-    cur = conn.cursor()
-    
-    sql = """
-        SELECT document_type, COUNT(*), SUM(total_amount)
-        FROM sales
-        WHERE sale_date > ? AND sale_date <= ?
-        GROUP BY document_type
-    """
-    
-    cur.execute(sql, (start_time, end_time))
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        sql = """
+            SELECT document_type, COUNT(*), SUM(total_amount)
+            FROM sales
+            WHERE sale_ts > ? AND sale_ts <= ?
+            GROUP BY document_type
+        """
+
+        cur.execute(sql, (_ts_param(start_time), _ts_param(end_time)))
+        rows = cur.fetchall()
     return rows
 
-def get_pending_invoices_for_retry():
-    """Obtiene facturas pendientes de validación con más de 2 días de antigüedad o error de conexión."""
-    conn = create_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    # Selección de facturas PENDIENTE con > 2 días o ERROR_CONEXION (cualquier fecha)
-    # Nota: datetime('now', '-2 days') calcula la fecha límite
-    query = """
-        SELECT id, document_type, document_number, issuer_id, sunat_status 
-        FROM sales 
-        WHERE 
-            (sunat_status = 'PENDIENTE' AND sale_date <= datetime('now', '-2 days'))
-            OR 
-            (sunat_status = 'ERROR_CONEXION')
+def update_sale_sunat_status(sale_id, status, note="", cdr_path=None, keep_accepted=False):
+    """
+    Guarda el estado SUNAT de una venta (y la ruta del CDR si se recibió).
+    Con keep_accepted, una venta ya ACEPTADO no cambia (un reenvío responde "ya registrado").
+    Retorna True si se actualizó.
     """
-    cur.execute(query)
-    rows = cur.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    query = "UPDATE sales SET sunat_status = ?, sunat_note = ?, cdr_path = COALESCE(?, cdr_path) WHERE id = ?"
+    if keep_accepted:
+        query += " AND COALESCE(sunat_status, '') != 'ACEPTADO'"
+    with transaction() as conn:
+        return conn.execute(query, (status, note, cdr_path, sale_id)).rowcount > 0
+
+def _enqueue_cpe_job(cur, sale_id, payload):
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cur.execute("INSERT INTO cpe_jobs (sale_id, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (sale_id, json.dumps(payload, default=str), CPE_JOB_PENDING, now, now))
+    return cur.lastrowid
+
+def claim_next_cpe_job():
+    """Toma el trabajo pendiente más antiguo y lo marca EN_PROCESO. Retorna (id, sale_id, payload) o None."""
+    with transaction() as conn:
+        row = conn.execute("SELECT id, sale_id, payload FROM cpe_jobs WHERE status = ? ORDER BY id LIMIT 1",
+                           (CPE_JOB_PENDING,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cpe_jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                     (CPE_JOB_RUNNING, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), row[0]))
+    return row[0], row[1], json.loads(row[2])
+
+def finish_cpe_job(job_id, sale_id, status, note="", cdr_path=None, error=None):
+    """Registra el resultado del envío: estado SUNAT de la venta y cierre del trabajo, en una transacción."""
+    with transaction() as conn:
+        update_sale_sunat_status(sale_id, status, note, cdr_path)
+        conn.execute("UPDATE cpe_jobs SET status = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                     (CPE_JOB_FAILED if error else CPE_JOB_DONE, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id))
+
+def mark_cpe_job_batched(job_id, sale_id, zip_path):
+    """El comprobante ya está firmado; queda a la espera del siguiente resumen diario o lote."""
+    with transaction() as conn:
+        update_sale_sunat_status(sale_id, "PENDIENTE", "En espera de envío por lote")
+        conn.execute("UPDATE cpe_jobs SET status = ?, zip_path = ?, updated_at = ? WHERE id = ?",
+                     (CPE_JOB_BATCHED, zip_path, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id))
+
+def get_batchable_cpe_jobs():
+    """Trabajos firmados que aún no pertenecen a un lote: lista de (id, sale_id, payload, zip_path, created_at)."""
+    with get_connection() as conn:
+        rows = conn.execute("SELECT id, sale_id, payload, zip_path, created_at FROM cpe_jobs WHERE status = ? AND batch_id IS NULL ORDER BY id",
+                            (CPE_JOB_BATCHED,)).fetchall()
+    return [(job_id, sale_id, json.loads(payload), zip_path, created_at) for job_id, sale_id, payload, zip_path, created_at in rows]
+
+def create_cpe_batch(issuer_id, kind, reference_date, job_ids):
+    """Agrupa los trabajos en un lote nuevo. Retorna (batch_id, sequence); sequence es el correlativo del día por emisor y tipo."""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with transaction() as conn:
+        sequence = conn.execute("SELECT COUNT(*) FROM cpe_batches WHERE issuer_id = ? AND kind = ? AND created_at >= ?",
+                                (issuer_id, kind, now[:10])).fetchone()[0] + 1
+        cur = conn.execute("INSERT INTO cpe_batches (issuer_id, kind, reference_date, sequence, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (issuer_id, kind, reference_date, sequence, CPE_BATCH_SENT, now, now))
+        batch_id = cur.lastrowid
+        conn.executemany("UPDATE cpe_jobs SET batch_id = ? WHERE id = ?", [(batch_id, job_id) for job_id in job_ids])
+    return batch_id, sequence
+
+def set_cpe_batch_ticket(batch_id, filename, ticket):
+    """Registra el ticket con el que SUNAT aceptó el lote para proceso; las ventas pasan a mostrarlo en su nota."""
+    with transaction() as conn:
+        conn.execute("UPDATE cpe_batches SET filename = ?, ticket = ?, updated_at = ? WHERE id = ?",
+                     (filename, ticket, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), batch_id))
+        conn.execute("UPDATE sales SET sunat_note = ? WHERE id IN (SELECT sale_id FROM cpe_jobs WHERE batch_id = ?)",
+                     (f"Ticket: {ticket} ({filename})", batch_id))
+
+def release_cpe_batch(batch_id, error):
+    """El envío del lote falló: se marca con error y sus trabajos vuelven a esperar el siguiente lote."""
+    with transaction() as conn:
+        conn.execute("UPDATE cpe_batches SET status = ?, note = ?, updated_at = ? WHERE id = ?",
+                     (CPE_BATCH_FAILED, error, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), batch_id))
+        conn.execute("UPDATE cpe_jobs SET batch_id = NULL, last_error = ? WHERE batch_id = ?", (error, batch_id))
+
+def get_open_cpe_batches():
+    """Lotes enviados cuyo ticket aún no se resolvió, como diccionarios."""
+    with get_connection() as conn:
+        cur = conn.execute("SELECT id, issuer_id, kind, reference_date, sequence, filename, ticket, status, created_at FROM cpe_batches "
+                           "WHERE status = ? AND ticket IS NOT NULL ORDER BY id", (CPE_BATCH_SENT,))
+        columns = [column[0] for column in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def resolve_cpe_batch(batch_id, status, note="", cdr_path=None):
+    """
+    Cierra un lote con el resultado de su ticket: estado SUNAT de cada venta incluida y sus trabajos HECHO.
+    Retorna [(sale_id, payload), ...] de los comprobantes del lote.
+    """
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    sale_status = "ACEPTADO" if status == CPE_BATCH_ACCEPTED else "RECHAZADO"
+    with transaction() as conn:
+        rows = conn.execute("SELECT sale_id, payload FROM cpe_jobs WHERE batch_id = ? ORDER BY id", (batch_id,)).fetchall()
+        conn.execute("UPDATE cpe_batches SET status = ?, note = ?, updated_at = ? WHERE id = ?", (status, note, now, batch_id))
+        conn.execute("UPDATE sales SET sunat_status = ?, sunat_note = ?, cdr_path = COALESCE(?, cdr_path) "
+                     "WHERE id IN (SELECT sale_id FROM cpe_jobs WHERE batch_id = ?)", (sale_status, note, cdr_path, batch_id))
+        conn.execute("UPDATE cpe_jobs SET status = ?, updated_at = ? WHERE batch_id = ?", (CPE_JOB_DONE, now, batch_id))
+    return [(sale_id, json.loads(payload)) for sale_id, payload in rows]
+
+def requeue_interrupted_cpe_jobs():
+    """Devuelve a la cola los trabajos que quedaron EN_PROCESO (cierre del programa durante un envío)."""
+    with transaction() as conn:
+        return conn.execute("UPDATE cpe_jobs SET status = ? WHERE status = ?", (CPE_JOB_PENDING, CPE_JOB_RUNNING)).rowcount
+
+def get_cpe_job(sale_id):
+    """Trabajo de envío de una venta como diccionario (o None)."""
+    with get_connection() as conn:
+        cur = conn.execute("SELECT id, sale_id, payload, status, attempts, last_error, created_at, updated_at FROM cpe_jobs WHERE sale_id = ?", (sale_id,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return dict(zip([column[0] for column in cur.description], row))
+
+# Comprobantes que el servicio de reintentos vuelve a consultar en SUNAT:
+# PENDIENTE con más de 2 días de antigüedad, ERROR_CONEXION o ERROR_RESPUESTA (sin estado
+# claro, p.ej. CDR ilegible; cualquier fecha).
+# Las boletas que esperan su resumen diario o lote (trabajo EN_LOTE) no se enviaron con
+# sendBill: getStatusCdr no las conoce y su estado lo fija resolve_cpe_batch.
+_RETRY_CANDIDATES_SQL = f"""
+    ((sunat_status = 'PENDIENTE' AND sale_ts <= datetime('now', 'localtime', '-2 days'))
+     OR
+     (sunat_status IN ('ERROR_CONEXION', 'ERROR_RESPUESTA')))
+    AND NOT EXISTS (SELECT 1 FROM cpe_jobs WHERE cpe_jobs.sale_id = sales.id AND cpe_jobs.status = '{CPE_JOB_BATCHED}')
+"""
+
+def get_pending_invoices_for_retry(now=None, limit=None):
+    """
+    Comprobantes pendientes de validación cuyo próximo reintento ya venció (next_retry_at),
+    del que lleva más tiempo esperando al más reciente.
+    """
+    now = now or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    query = f"""
+        SELECT id, document_type, document_number, issuer_id, sunat_status, retry_attempts
+        FROM sales
+        WHERE {_RETRY_CANDIDATES_SQL}
+          AND (next_retry_at IS NULL OR next_retry_at <= ?)
+        ORDER BY COALESCE(next_retry_at, sale_ts)
+    """
+    params = [now]
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    with get_connection() as conn:
+        cur = conn.execute(query, params)
+        columns = [column[0] for column in cur.description]
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+def get_cpe_retry_backlog(now=None):
+    """(vencidos, programados): comprobantes a reintentar ya y los que esperan su próximo intento."""
+    now = now or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with get_connection() as conn:
+        return conn.execute(f"""
+            SELECT COALESCE(SUM(next_retry_at IS NULL OR next_retry_at <= ?), 0),
+                   COALESCE(SUM(next_retry_at > ?), 0)
+            FROM sales WHERE {_RETRY_CANDIDATES_SQL}
+        """, (now, now)).fetchone()
+
+def schedule_cpe_retry(sale_id, attempts, next_retry_at, status=None, note=None):
+    """Programa el siguiente reintento de la venta (y opcionalmente actualiza su estado SUNAT)."""
+    with transaction() as conn:
+        conn.execute("UPDATE sales SET retry_attempts = ?, next_retry_at = ?, "
+                     "sunat_status = COALESCE(?, sunat_status), sunat_note = COALESCE(?, sunat_note) WHERE id = ?",
+                     (attempts, next_retry_at, status, note, sale_id))
+
+def clear_cpe_retry(sale_id):
+    """Olvida la espera acumulada: el comprobante vuelve a consultarse en la siguiente pasada."""
+    with transaction() as conn:
+        conn.execute("UPDATE sales SET retry_attempts = 0, next_retry_at = NULL WHERE id = ?", (sale_id,))
+
+def get_sale_for_retry(sale_id):
+    """Datos de una venta que necesita el servicio de reintentos, como diccionario (o None)."""
+    with get_connection() as conn:
+        cur = conn.execute("SELECT id, document_type, document_number, issuer_id, sunat_status, sunat_note, retry_attempts "
+                           "FROM sales WHERE id = ?", (sale_id,))
+        row = cur.fetchone()
+        return dict(zip([column[0] for column in cur.description], row)) if row else None
 
 def get_issuer_by_id(issuer_id):
     """Obtiene un emisor por su ID como diccionario."""
-    conn = create_connection()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM issuers WHERE id = ?", (issuer_id,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM issuers WHERE id = ?", (issuer_id,))
+        row = cur.fetchone()
     return dict(row) if row else None
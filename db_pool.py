@@ -0,0 +1,224 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Pragmas aplicados una sola vez por conexión física.
+# journal_mode=WAL permite lectores concurrentes mientras otra caja/hilo escribe.
+# synchronous=NORMAL es seguro con WAL (solo un checkpoint puede perderse ante un corte de luz).
+DEFAULT_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+class PooledConnection:
+    """
+    Préstamo de la conexión del hilo actual.
+    Expone la API habitual de sqlite3.Connection, pero close() devuelve la
+    conexión al pool en lugar de cerrarla. row_factory es propio de cada préstamo,
+    así que un llamador que use sqlite3.Row no afecta a los demás.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._released = False
+        self.row_factory = None
+
+    def cursor(self):
+        cur = self._raw.cursor()
+        cur.row_factory = self.row_factory
+        return cur
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        self._raw.commit()
+        self._pool._count("commits")
+
+    def rollback(self):
+        self._raw.rollback()
+
+    @property
+    def in_transaction(self):
+        return self._raw.in_transaction
+
+    @property
+    def total_changes(self):
+        return self._raw.total_changes
+
+    def close(self):
+        self._pool.release(self)
+
+    def __del__(self):
+        # Préstamos olvidados sin close() (p.ej. en scripts) no deben dejar el contador colgado.
+        try:
+            self._pool.release(self)
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._pool.release(self)
+        return False
+
+
+class ConnectionPool:
+    """Mantiene una conexión SQLite por hilo (UI, reintentos CPE, WhatsApp, correo...)."""
+
+    def __init__(self, db_path, pragmas=DEFAULT_PRAGMAS, timeout=5.0):
+        self.db_path = db_path
+        self.pragmas = pragmas
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = {}  # thread ident -> (thread, raw connection)
+        self._stats = {"opened": 0, "closed": 0, "acquired": 0, "released": 0, "commits": 0}
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _open(self):
+        # check_same_thread=False solo para poder cerrar conexiones de hilos muertos
+        # desde otro hilo; cada conexión sigue siendo usada únicamente por su dueño.
+        raw = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        for pragma in self.pragmas:
+            try:
+                raw.execute(pragma)
+            except sqlite3.Error as e:
+                print(f"Aviso: no se pudo aplicar '{pragma}': {e}")
+        # LIKE de SQLite solo ignora mayúsculas en ASCII: casefold(x) LIKE casefold(?) compara "PEÑA" con "peña"
+        raw.create_function("casefold", 1, _casefold, deterministic=True)
+        with self._lock:
+            self._stats["opened"] += 1
+            self._connections[threading.get_ident()] = (threading.current_thread(), raw)
+        self._prune_dead_threads()
+        return raw
+
+    def _prune_dead_threads(self):
+        """Cierra las conexiones de hilos que ya terminaron (workers de WhatsApp/correo)."""
+        with self._lock:
+            dead = [ident for ident, (thread, _) in self._connections.items() if not thread.is_alive()]
+            stale = [self._connections.pop(ident)[1] for ident in dead]
+        for raw in stale:
+            self._close_raw(raw)
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._stats["closed"] += 1
+
+    def acquire(self):
+        """Devuelve un préstamo de la conexión del hilo actual, abriéndola si hace falta."""
+        raw = getattr(self._local, "raw", None)
+        if raw is None:
+            raw = self._open()
+            self._local.raw = raw
+            self._local.depth = 0
+        self._local.depth += 1
+        with self._lock:
+            self._stats["acquired"] += 1
+        return PooledConnection(self, raw)
+
+    def release(self, handle):
+        if handle._released:
+            return
+        handle._released = True
+        with self._lock:
+            self._stats["released"] += 1
+        if getattr(self._local, "raw", None) is not handle._raw:
+            # Préstamo de una conexión ya reemplazada (reset del pool); nada que hacer.
+            return
+        self._local.depth = max(0, self._local.depth - 1)
+        # Al soltar el préstamo más externo, lo no confirmado se descarta igual que
+        # ocurría al cerrar la conexión.
+        if self._local.depth == 0 and handle._raw.in_transaction:
+            handle._raw.rollback()
+
+    @contextmanager
+    def connection(self):
+        """Context manager: `with pool.connection() as conn: ...`"""
+        handle = self.acquire()
+        try:
+            yield handle
+        finally:
+            handle.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Transacción de escritura: BEGIN IMMEDIATE al entrar, un único COMMIT al salir
+        y ROLLBACK si ocurre una excepción. Si ya hay una transacción abierta en el
+        hilo, el bloque se integra en ella (el commit lo hace el bloque externo).
+        """
+        handle = self.acquire()
+        try:
+            if handle.in_transaction:
+                yield handle
+                return
+            handle.execute("BEGIN IMMEDIATE")
+            try:
+                yield handle
+            except BaseException:
+                handle.rollback()
+                raise
+            handle.commit()
+        finally:
+            handle.close()
+
+    def close_thread_connection(self):
+        """Cierra la conexión del hilo actual (llamar al terminar un worker de larga vida)."""
+        raw = getattr(self._local, "raw", None)
+        if raw is None:
+            return
+        self._local.raw = None
+        self._local.depth = 0
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+        self._close_raw(raw)
+
+    def close_all(self):
+        """Cierra todas las conexiones (salida de la aplicación o cambio de base de datos)."""
+        with self._lock:
+            conns = [raw for _, raw in self._connections.values()]
+            self._connections.clear()
+        for raw in conns:
+            self._close_raw(raw)
+        self._local = threading.local()
+
+    def set_path(self, db_path):
+        self.close_all()
+        self.db_path = db_path
+
+    def stats(self):
+        """Contadores de aperturas/cierres reales frente a préstamos."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["open_connections"] = len(self._connections)
+        snapshot["reused"] = snapshot["acquired"] - snapshot["opened"]
+        return snapshot
+
+    def reset_stats(self):
+        with self._lock:
+            for key in self._stats:
+                self._stats[key] = 0
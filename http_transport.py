@@ -0,0 +1,164 @@
+"""
+Transporte HTTP compartido para las integraciones (SUNAT, apisunat, servicio de WhatsApp).
+
+Una requests.Session por host mantiene las conexiones abiertas (keep-alive), así cada
+consulta no paga de nuevo el handshake TCP/TLS. Tiempos de conexión y de lectura
+separados, reintentos solo en llamadas idempotentes e histograma de latencia por endpoint.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+# Conexiones abiertas por host: cubre los hilos del envío de CPE y del servicio de reintentos
+POOL_MAXSIZE = 8
+RETRY_TOTAL = 2
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (502, 503, 504)
+# retry=RETRY_NONE: ni siquiera los fallos de conexión (sondeos de estado que la UI espera)
+RETRY_NONE = "none"
+
+# Límites (ms) de las cubetas del histograma de latencia
+LATENCY_BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+
+class LatencyHistogram:
+    """Cuenta de llamadas por cubeta de latencia; los percentiles se estiman con el límite de la cubeta."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms, error=False):
+        index = next((i for i, limit in enumerate(self.buckets) if elapsed_ms <= limit), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.errors += 1 if error else 0
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": self.total_ms / self.count if self.count else None,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "max_ms": self.max_ms,
+            "buckets": dict(zip([*map(str, self.buckets), "inf"], self.counts)),
+        }
+
+
+_sessions = {}       # (scheme, host, reintenta) -> requests.Session
+_histograms = {}     # endpoint -> LatencyHistogram
+_lock = threading.Lock()
+
+
+def _build_session(retry):
+    session = requests.Session()
+    if retry == RETRY_NONE:
+        retries = Retry(0, raise_on_status=False)
+    elif retry:
+        retries = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF, status_forcelist=RETRY_STATUS,
+                        allowed_methods=None, raise_on_status=False)
+    else:
+        # Sin reintento de lectura: un envío que llegó al servidor no debe repetirse.
+        # Los fallos de conexión sí se reintentan, la petición no salió.
+        retries = Retry(total=RETRY_TOTAL, connect=RETRY_TOTAL, read=0, status=0, other=0,
+                        backoff_factor=RETRY_BACKOFF, allowed_methods=None, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session(url, retry=True):
+    """Sesión compartida para el host de la URL (se crea la primera vez)."""
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc, retry if retry == RETRY_NONE else bool(retry))
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _build_session(retry)
+        return session
+
+
+def request(method, url, endpoint=None, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, retry=None, **kwargs):
+    """
+    Petición HTTP por la sesión del host. endpoint: nombre para las estadísticas (por defecto host + ruta).
+    retry: None reintenta solo métodos idempotentes; True para consultas por POST (getStatus) que pueden repetirse;
+    False solo reintenta la conexión (envíos a SUNAT); RETRY_NONE no reintenta nada.
+    """
+    method = method.upper()
+    if retry is None:
+        retry = method in _IDEMPOTENT_METHODS
+    if endpoint is None:
+        parts = urlsplit(url)
+        endpoint = f"{parts.netloc}{parts.path}"
+    session = get_session(url, retry)
+    started = time.perf_counter()
+    error = True
+    try:
+        response = session.request(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+        error = response.status_code >= 500
+        return response
+    finally:
+        _observe(endpoint, (time.perf_counter() - started) * 1000, error)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def _observe(endpoint, elapsed_ms, error):
+    with _lock:
+        histogram = _histograms.get(endpoint)
+        if histogram is None:
+            histogram = _histograms[endpoint] = LatencyHistogram()
+        histogram.observe(elapsed_ms, error)
+
+
+def get_latency_stats():
+    """Resumen por endpoint: llamadas, errores (excepción o 5xx), promedio, p50/p95, máximo y cubetas."""
+    with _lock:
+        return {endpoint: histogram.snapshot() for endpoint, histogram in _histograms.items()}
+
+
+def reset_stats():
+    with _lock:
+        _histograms.clear()
+
+
+def close_all():
+    """Cierra las sesiones abiertas (al salir del programa)."""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
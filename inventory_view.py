@@ -6,6 +6,7 @@ from tkinter import filedialog
 from PIL import Image, ImageTk, ImageDraw, ImageFont # Added ImageDraw, ImageFont
 import io
 import database
+import product_catalog
 import random
 import string
 import json
@@ -837,8 +838,10 @@ class InventoryView(ttk.Toplevel):
         config_manager.save_setting("last_inventory_issuer", issuer_filter)
         config_manager.save_setting("last_inventory_address", address_filter)
         
-        # Pass filters to database function
-        products = database.get_all_products(issuer_filter, address_filter)
+        # Catálogo compartido con las vistas de venta; las ediciones llegan como deltas
+        catalog = product_catalog.get_catalog(issuer_filter, address_filter)
+        catalog.sync()
+        products = catalog.rows()
         
         total_stock = 0.0
         total_value = 0.0
@@ -846,7 +849,7 @@ class InventoryView(ttk.Toplevel):
         groups = set()
 
         for row in products:
-            # row: id(0), name(1), price(2), stock(3), code(4), um(5), op(6), iss(7), addr(8), cat(9), img(10), active(11)
+            # row: id(0), name(1), price(2), stock(3), code(4), um(5), op(6), iss(7), addr(8), cat(9), img_hash(10), active(11)
             is_active = row[11]
             # Ensure strict filtering
             if is_active == 0 or str(is_active) == '0':
@@ -5,8 +5,7 @@ from datetime import datetime, timedelta
 class JSONGenerator:
     def __init__(self, output_dir):
         self.output_dir = output_dir
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
+        os.makedirs(self.output_dir, exist_ok=True)
 
     def generate_invoice_json(self, sale_data):
         """
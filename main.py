@@ -15,6 +15,8 @@ import whatsapp_manager
 import config_manager
 import theme_manager # Import entire module or specific function
 import cpe_retry_service
+import cpe_dispatcher
+import http_transport
 import os
 
 class MainWindow(ttk.Window):
@@ -405,6 +407,8 @@ class MainWindow(ttk.Window):
         if self.sales_window and self.sales_window.winfo_exists():
             for tab in self.sales_window.sales_tabs:
                 tab.load_issuers_from_db()
+                if hasattr(tab, 'load_stock_warning_limit'):
+                    tab.load_stock_warning_limit()
 
     def verify_identity(self, permission=None):
         """
@@ -508,8 +512,9 @@ def main():
     retry_service = cpe_retry_service.CPERetryService(base_dir)
     retry_service.start()
 
-    retry_service = cpe_retry_service.CPERetryService(base_dir)
-    retry_service.start()
+    # Envío de comprobantes encolados en cpe_jobs (fuera del hilo de la interfaz)
+    print("Iniciando cola de envío de CPE...")
+    cpe_dispatcher.start_dispatcher(base_dir)
 
     # 1. Initialize Main App (Hidden)
     # We pass None initially, then set it after login
@@ -572,7 +577,9 @@ def main():
             if messagebox.askokcancel("Salir", "¿Desea salir de la aplicación?"):
                 print("Cerrando aplicación y deteniendo servicios...")
                 whatsapp_manager.baileys_manager.stop_service()
-                retry_service.running = False 
+                retry_service.stop()
+                database.close_all_connections()
+                http_transport.close_all()
                 app.destroy()
         
         app.protocol("WM_DELETE_WINDOW", on_closing)
@@ -581,7 +588,9 @@ def main():
         # Failure: Destroy app
         print("Login cancelado o fallido.")
         whatsapp_manager.baileys_manager.stop_service()
-        retry_service.running = False
+        retry_service.stop()
+        database.close_all_connections()
+        http_transport.close_all()
         try:
             app.destroy()
         except:
@@ -4,6 +4,8 @@ import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 import custom_messagebox as messagebox
 import database
+import product_catalog
+import product_search
 import json
 import os
 from datetime import datetime
@@ -42,6 +44,9 @@ class TouchMovementDialog(ttk.Toplevel):
         self.product_colors = {}
         self.group_mapping = {} # Name -> ID
         self.code_map = {} # Code -> Product Data
+        self.products_by_id = {}
+        self.current_group = None
+        self._search_job = None
         
         # UI Setup
         self.columnconfigure(0, weight=7) # Products
@@ -71,7 +76,10 @@ class TouchMovementDialog(ttk.Toplevel):
         
         issuer_name = row[0] if row else "TODOS"
         
-        raw_products = database.get_all_products(issuer_name, self.address)
+        self.catalog = product_catalog.get_catalog(issuer_name, self.address)
+        self.catalog.sync()
+        self.catalog.prepare_search()
+        raw_products = self.catalog.rows()
         self.products = {}
         for p in raw_products:
              # id, name, price, stock, code, um, group_id, group_name ...
@@ -87,6 +95,7 @@ class TouchMovementDialog(ttk.Toplevel):
                 'group_name': p[9] if len(p) > 9 else "Sin Grupo" # Category is at index 9
              }
              self.products[p[1]] = p_data
+             self.products_by_id[p[0]] = p_data
              
              # Populate Code Map
              if p[4]: # if code exists
@@ -253,11 +262,13 @@ class TouchMovementDialog(ttk.Toplevel):
             self.update_group_grid()
             
     def show_products(self, group_name):
-        for w in self.products_frame.winfo_children(): w.destroy()
-        
+        self.current_group = group_name
         # Filter products
-        items = [p for p in self.products.values() if p.get('group_name') == group_name]
-        
+        self._show_product_buttons([p for p in self.products.values() if p.get('group_name') == group_name])
+
+    def _show_product_buttons(self, items):
+        for w in self.products_frame.winfo_children(): w.destroy()
+
         # Grid Layout
         ROW_SIZE = 4
         for i, item in enumerate(items):
@@ -431,11 +442,29 @@ class TouchMovementDialog(ttk.Toplevel):
         self.after(10, self.scan_entry.focus_set)
 
     def check_scan_input(self, event):
-        """Checks if current input matches a product code exactly (Instant Scan)."""
+        """Instant Scan on an exact code match; otherwise a (debounced) search by name or code."""
         code = self.scan_entry.get().strip()
-        if not code: return
+        if self._search_job:
+            self.after_cancel(self._search_job)
+            self._search_job = None
+        if not code:
+            # Búsqueda borrada: vuelve el grupo que estaba abierto
+            if self.current_group is not None and event.keysym in ('BackSpace', 'Delete'):
+                self.show_products(self.current_group)
+            return
         
         # Immediate match check
         if code in self.code_map:
              self.add_to_cart(self.code_map[code])
              self.scan_entry.delete(0, tk.END)
+             return
+
+        # Por nombre o código, cuando deja de escribir
+        self._search_job = self.after(product_search.SEARCH_DEBOUNCE_MS, lambda: self._run_search(code))
+
+    def _run_search(self, query):
+        self._search_job = None
+        if self.scan_entry.get().strip() != query:
+            return
+        results = [self.products_by_id.get(entry['id']) for entry in self.catalog.search(query)]
+        self._show_product_buttons([p for p in results if p is not None])
@@ -4,6 +4,7 @@ from ttkbootstrap.widgets import DateEntry
 import custom_messagebox as messagebox
 import tkinter as tk
 import database
+import product_catalog
 from datetime import datetime
 import json
 import config_manager
@@ -568,7 +569,9 @@ class MovementsView(ttk.Toplevel):
         d_filter = dir_val if dir_val and dir_val != "Todas" else None
         
         try:
-             raw = database.get_all_products(e_filter, d_filter)
+             catalog = product_catalog.get_catalog(e_filter, d_filter)
+             catalog.sync()
+             raw = catalog.rows()
         except AttributeError:
              raw = []
         
@@ -0,0 +1,196 @@
+"""
+Consulta de DNI/RUC con caché, para la venta, clientes/proveedores y la configuración
+del emisor.
+
+Orden: la tabla customers (si se prefiere lo local), luego las respuestas de la API ya
+guardadas en document_lookups (FOUND_TTL; los "no encontrado" duran NOT_FOUND_TTL) y por
+último la API. Varias consultas simultáneas del mismo documento comparten una sola
+llamada, y prefetch() la adelanta en segundo plano (p.ej. al completar los dígitos).
+Los errores de red o del servidor no se guardan.
+"""
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import api_client
+import database
+
+FOUND_TTL = 30 * 24 * 3600      # los datos del padrón cambian poco
+NOT_FOUND_TTL = 24 * 3600       # un DNI recién inscrito aparece en la API al día siguiente
+PREFETCH_WORKERS = 2
+# Un DNI (8 dígitos) puede ser el comienzo de un RUC: se adelanta solo si deja de escribir
+PREFETCH_DEBOUNCE_MS = 700
+
+SOURCE_LOCAL = "local"
+SOURCE_CACHE = "cache"
+SOURCE_API = "api"
+
+
+def _local_result(row):
+    # Misma forma que la respuesta de la API: las vistas leen data['nombre'] y data['domicilio']
+    _, _, doc_number, name, _, address, _ = row
+    return {"success": True, "source": SOURCE_LOCAL,
+            "data": {"numero": doc_number, "nombre": name, "domicilio": {"direccion": address or ""}}}
+
+
+class PersonLookup:
+    """lookup() es bloqueante (llamarlo desde un hilo, no desde el de Tk); prefetch() no."""
+
+    def __init__(self, fetch=None, found_ttl=FOUND_TTL, not_found_ttl=NOT_FOUND_TTL, clock=time.time):
+        self._fetch = fetch or api_client.request_person_data
+        self.found_ttl = found_ttl
+        self.not_found_ttl = not_found_ttl
+        self._clock = clock
+        self._inflight = {}             # doc_number -> Future de la llamada en curso
+        self._lock = threading.Lock()
+        self._executor = None
+        self._prefetching = set()
+        self.stats = {"local": 0, "cache": 0, "negative": 0, "api": 0, "coalesced": 0}
+
+    def lookup(self, doc_number, prefer_local=True):
+        """Resultado con la forma de api_client.get_person_data, más 'source' (local, cache o api)."""
+        doc_number = str(doc_number).strip()
+        if api_client.document_endpoint(doc_number) is None:
+            return {"success": False, "message": api_client.INVALID_DOCUMENT_MESSAGE}
+        if prefer_local:
+            row = database.get_party_by_doc_number(doc_number)
+            if row and row[3]:
+                self._count("local")
+                return _local_result(row)
+        cached = self._cached(doc_number)
+        if cached is not None:
+            return cached
+        return self._fetch_once(doc_number)
+
+    def prefetch(self, doc_numbers, prefer_local=True):
+        """Encarga en segundo plano las consultas que no estén ya resueltas ni en curso."""
+        for doc_number in doc_numbers:
+            doc_number = str(doc_number).strip()
+            if api_client.document_endpoint(doc_number) is None:
+                continue
+            with self._lock:
+                if doc_number in self._inflight:
+                    continue
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="person-lookup")
+                task = self._executor.submit(self._prefetch_one, doc_number, prefer_local)
+                self._prefetching.add(task)
+            task.add_done_callback(self._prefetch_done)
+
+    def _prefetch_one(self, doc_number, prefer_local):
+        try:
+            self.lookup(doc_number, prefer_local)
+        except Exception as e:
+            print(f"Error adelantando la consulta de {doc_number}: {e}")
+
+    def _prefetch_done(self, task):
+        with self._lock:
+            self._prefetching.discard(task)
+
+    def wait(self, timeout=None):
+        """Espera a que terminen los prefetch encargados (pruebas)."""
+        with self._lock:
+            tasks = list(self._prefetching)
+        wait(tasks, timeout)
+
+    def _cached(self, doc_number):
+        entry = database.get_document_lookup(doc_number)
+        if entry is None:
+            return None
+        found, response, fetched_at = entry
+        if self._clock() - fetched_at > (self.found_ttl if found else self.not_found_ttl):
+            return None
+        self._count("cache" if found else "negative")
+        result = json.loads(response)
+        result["source"] = SOURCE_CACHE
+        return result
+
+    def _fetch_once(self, doc_number):
+        with self._lock:
+            future = self._inflight.get(doc_number)
+            owner = future is None
+            if owner:
+                future = self._inflight[doc_number] = Future()
+            else:
+                self.stats["coalesced"] += 1
+        if not owner:
+            return dict(future.result())
+
+        try:
+            # Otro hilo pudo terminar y guardarla entre la lectura de la caché y este punto
+            result = self._cached(doc_number)
+            if result is None:
+                self._count("api")
+                result, outcome = self._fetch(doc_number)
+                if outcome in (api_client.LOOKUP_FOUND, api_client.LOOKUP_NOT_FOUND):
+                    database.save_document_lookup(doc_number, outcome == api_client.LOOKUP_FOUND,
+                                                  json.dumps(result), self._clock())
+                result = dict(result, source=SOURCE_API)
+            future.set_result(result)
+            return dict(result)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(doc_number, None)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+
+class TypingPrefetch:
+    """
+    Adelanta la consulta del documento que se escribe en un campo: un RUC completo enseguida,
+    un DNI cuando el campo deja de cambiar (con after/after_cancel del widget), para no
+    pagar una consulta por los 8 primeros dígitos de cada RUC.
+    """
+
+    def __init__(self, widget, service=None, delay_ms=PREFETCH_DEBOUNCE_MS):
+        self._widget = widget
+        self._service = service
+        self.delay_ms = delay_ms
+        self._job = None
+
+    def typed(self, doc_number, ruc_only=False):
+        """Llamar en cada cambio del campo; ruc_only si el comprobante exige RUC (factura)."""
+        if self._job is not None:
+            self._widget.after_cancel(self._job)
+            self._job = None
+        doc_number = str(doc_number).strip()
+        if not doc_number.isdigit():
+            return
+        if len(doc_number) == 11:
+            self._prefetch(doc_number)
+        elif len(doc_number) == 8 and not ruc_only:
+            self._job = self._widget.after(self.delay_ms, lambda: self._settled(doc_number))
+
+    def _settled(self, doc_number):
+        self._job = None
+        self._prefetch(doc_number)
+
+    def _prefetch(self, doc_number):
+        (self._service or get_service()).prefetch([doc_number])
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Servicio compartido por las vistas del proceso."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PersonLookup()
+        return _service
+
+
+def lookup(doc_number, prefer_local=True):
+    return get_service().lookup(doc_number, prefer_local)
+
+
+def prefetch(doc_numbers, prefer_local=True):
+    get_service().prefetch(doc_numbers, prefer_local)
@@ -0,0 +1,226 @@
+"""
+Catálogo de productos en memoria, compartido por las vistas del proceso.
+
+Se lee completo una sola vez por filtro (emisor, dirección) y después se mantiene con
+deltas: sync() consulta el feed de cambios de la base (stock_changes: ventas,
+movimientos, reservas y ediciones de inventario) y relee solo los productos tocados.
+Los diccionarios de cada producto se actualizan en el lugar y cada cambio sube
+data_version; cada vista recuerda la versión que ya aplicó y pide changes_since().
+El índice de búsqueda solo se rearma cuando cambian nombres, códigos o categorías.
+"""
+import threading
+from collections import deque
+
+import database
+import product_search
+
+# Versiones de cambios que se recuerdan para las vistas que sincronizan con retraso
+CHANGE_LOG_SIZE = 256
+
+# Campos que ubican al producto en los índices por código, categoría y nombre
+_INDEXED_FIELDS = ('name', 'code', 'category')
+
+
+def _product(row):
+    p_id, name, price, stock, code, um, op_type, i_name, i_addr, category, image_hash, is_active = row
+    return {'id': p_id, 'name': name, 'price': price, 'stock': stock, 'code': code, 'unit_of_measure': um,
+            'operation_type': op_type, 'issuer_name': i_name, 'issuer_address': i_addr, 'category': category,
+            'image_hash': image_hash, 'is_active': is_active}
+
+
+def _row(p):
+    """Tupla con las columnas de get_all_products, para las vistas que trabajan por posición."""
+    return (p['id'], p['name'], p['price'], p['stock'], p['code'], p['unit_of_measure'], p['operation_type'],
+            p['issuer_name'], p['issuer_address'], p['category'], p['image_hash'], p['is_active'])
+
+
+def _filter_value(value):
+    # Igual que get_all_products: "Todas" o vacío es sin filtro
+    return value if value and value != "Todas" else None
+
+
+class ProductCatalog:
+    """Productos activos de un emisor/dirección: por id, por código, por categoría y por nombre."""
+
+    def __init__(self, issuer_name=None, issuer_address=None):
+        self.issuer_name = _filter_value(issuer_name)
+        self.issuer_address = _filter_value(issuer_address)
+        self.by_id = {}
+        self.by_code = {}
+        self.by_category = {}
+        self.names = []
+        self._ordered = []
+        self.data_version = 0
+        self.index_version = 0
+        self._search_index = None
+        self._search_version = None
+        self._search_warming = None
+        self.feed_version = None
+        self.loaded = False
+        self.full_loads = 0
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self._lock = threading.RLock()
+
+    def load(self):
+        """Lectura completa (primera vez, o si el feed se recortó desde la última sincronización)."""
+        with self._lock:
+            # La versión se toma antes de leer: un cambio intermedio se vuelve a aplicar, no se pierde
+            feed_version = database.get_stock_version()
+            rows = database.get_all_products(self.issuer_name, self.issuer_address)
+            self.by_id = {row[0]: _product(row) for row in rows}
+            self._reindex()
+            self.feed_version = feed_version
+            self.loaded = True
+            self.full_loads += 1
+            self._record(None)
+
+    def sync(self):
+        """Aplica los cambios de la base desde la última lectura; devuelve los ids afectados (None si recargó todo)."""
+        with self._lock:
+            if not self.loaded:
+                self.load()
+                return None
+            version, changed_ids = database.get_stock_changes_since(self.feed_version)
+            if changed_ids is None:
+                self.load()
+                return None
+            self.feed_version = version
+            return self.refresh(changed_ids) if changed_ids else set()
+
+    def refresh(self, product_ids):
+        """Relee los productos indicados y los aplica como deltas (altas, ediciones y bajas)."""
+        with self._lock:
+            ids = {int(p_id) for p_id in product_ids if str(p_id).isdigit()}
+            rows = {row[0]: row for row in database.get_products_by_ids(ids)}
+            changed = set()
+            reindex = False
+            for p_id in ids:
+                row = rows.get(p_id)
+                current = self.by_id.get(p_id)
+                if row is None or not row[11] or not self._matches(row):
+                    if current is not None:
+                        del self.by_id[p_id]
+                        changed.add(p_id)
+                        reindex = True
+                    continue
+                product = _product(row)
+                if current is None:
+                    self.by_id[p_id] = product
+                    reindex = True
+                else:
+                    reindex = reindex or any(current[f] != product[f] for f in _INDEXED_FIELDS)
+                    # Mismo diccionario: quien lo tenga referenciado ve el cambio
+                    current.update(product)
+                # También sin cambios en la fila (p.ej. reservas de otra caja): la vista lo redibuja
+                changed.add(p_id)
+            if reindex:
+                self._reindex()
+            if changed:
+                self._record(changed)
+            return changed
+
+    def changes_since(self, version):
+        """(data_version, ids cambiados después de `version`); None si la vista debe reconstruirse entera."""
+        with self._lock:
+            if version == self.data_version:
+                return version, set()
+            if version is None or not self._changes or self._changes[0][0] > version + 1:
+                return self.data_version, None
+            ids = set()
+            for entry_version, changed in self._changes:
+                if entry_version > version:
+                    if changed is None:
+                        return self.data_version, None
+                    ids |= changed
+            return self.data_version, ids
+
+    def search_index(self):
+        """Índice de búsqueda por nombre/código; se arma la primera vez que se pide tras un reindex."""
+        with self._lock:
+            if self._search_version == self.index_version:
+                return self._search_index
+            version, ordered = self.index_version, self._ordered
+        # Fuera del candado: con 50k productos tarda medio segundo y sync() no debe esperarlo
+        index = product_search.ProductSearchIndex(ordered)
+        with self._lock:
+            if version == self.index_version:
+                self._search_index, self._search_version = index, version
+        return index
+
+    def prepare_search(self):
+        """Arma el índice en segundo plano para que la primera tecla no lo espere."""
+        with self._lock:
+            if self.index_version in (self._search_version, self._search_warming):
+                return
+            self._search_warming = self.index_version
+        threading.Thread(target=self.search_index, name="product-search-index", daemon=True).start()
+
+    def search(self, query, limit=product_search.SEARCH_LIMIT):
+        """Productos del catálogo que coinciden con `query`, los mejores primero."""
+        return self.search_index().search(query, limit)
+
+    def products(self):
+        """Productos ordenados por nombre (el orden de get_all_products)."""
+        return list(self._ordered)
+
+    def rows(self):
+        return [_row(p) for p in self._ordered]
+
+    def get(self, product_id):
+        return self.by_id.get(int(product_id))
+
+    def find_code(self, code):
+        return self.by_code.get(str(code).strip())
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def _matches(self, row):
+        return ((self.issuer_name is None or row[7] == self.issuer_name) and
+                (self.issuer_address is None or row[8] == self.issuer_address))
+
+    def _reindex(self):
+        self.index_version += 1
+        self._ordered = sorted(self.by_id.values(), key=lambda p: (p['name'], p['id']))
+        self.names = [p['name'] for p in self._ordered]
+        self.by_code = {}
+        self.by_category = {}
+        for p in self._ordered:
+            code = str(p['code']).strip() if p['code'] else ""
+            if code:
+                self.by_code[code] = p
+            self.by_category.setdefault(p['category'] or "General", []).append(p)
+
+    def _record(self, changed):
+        self.data_version += 1
+        self._changes.append((self.data_version, changed))
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(issuer_name=None, issuer_address=None):
+    """Catálogo compartido para ese filtro; la primera vez se lee completo."""
+    key = (_filter_value(issuer_name), _filter_value(issuer_address))
+    with _catalogs_lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            catalog = _catalogs[key] = ProductCatalog(*key)
+    if not catalog.loaded:
+        catalog.load()
+    return catalog
+
+
+def sync_all():
+    """Sincroniza todos los catálogos abiertos (tras una edición de inventario, por ejemplo)."""
+    with _catalogs_lock:
+        catalogs = list(_catalogs.values())
+    for catalog in catalogs:
+        catalog.sync()
+
+
+def reset():
+    """Olvida los catálogos cargados (cambio de base de datos, pruebas)."""
+    with _catalogs_lock:
+        _catalogs.clear()
@@ -0,0 +1,128 @@
+"""
+Búsqueda de productos por nombre o código mientras se escribe (venta, venta táctil y
+movimientos).
+
+El texto se normaliza (minúsculas, sin tildes: "Azúcar" encuentra "azucar") y cada
+palabra del nombre y del código se indexa por trigramas y por sus prefijos de 1 y 2
+letras. Una consulta solo revisa los productos de su trigrama (o prefijo) menos común,
+no el catálogo entero. El índice se arma una vez por versión de índices del catálogo
+(ProductCatalog.search_index); los cambios de stock no lo invalidan.
+"""
+import heapq
+import unicodedata
+
+# Resultados que se muestran como mucho (botones o lista del combobox)
+SEARCH_LIMIT = 60
+# Espera tras la última tecla antes de buscar (ms)
+SEARCH_DEBOUNCE_MS = 150
+# Con menos candidatos ya no conviene intersectar más listas: se verifican directamente
+_VERIFY_BELOW = 256
+
+# Orden de los resultados: código exacto, código que empieza, nombre que empieza,
+# todas las palabras por prefijo, y por último contiene en cualquier parte
+RANK_CODE = 0
+RANK_CODE_PREFIX = 1
+RANK_NAME_PREFIX = 2
+RANK_WORD_PREFIX = 3
+RANK_CONTAINS = 4
+
+
+def normalize(text):
+    """Minúsculas, sin tildes y con un solo espacio: 'Azúcar  RUBIA' -> 'azucar rubia'."""
+    if not text:
+        return ""
+    text = str(text)
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.casefold().split())
+
+
+def _trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class ProductSearchIndex:
+    """Índice de trigramas y prefijos sobre nombre y código de una lista de productos (dicts)."""
+
+    def __init__(self, products):
+        self.products = list(products)   # en el orden del catálogo (por nombre): desempata
+        self._names = []
+        self._codes = []
+        self._text = []                   # " nombre código": las palabras empiezan tras un espacio
+        self._postings = {}               # trigrama o prefijo corto -> posiciones (ascendentes)
+        postings = self._postings
+        for pos, product in enumerate(self.products):
+            name = normalize(product.get('name'))
+            code = normalize(product.get('code'))
+            text = f" {name} {code}" if code else f" {name}"
+            self._names.append(name)
+            self._codes.append(code)
+            self._text.append(text)
+            keys = set()
+            for word in text.split():
+                keys.update([word[i:i + 3] for i in range(len(word) - 2)])
+                keys.add(word[:1])
+                keys.add(word[:2])
+            for key in keys:
+                posting = postings.get(key)
+                if posting is None:
+                    postings[key] = [pos]
+                else:
+                    posting.append(pos)
+
+    def __len__(self):
+        return len(self.products)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Productos que contienen todas las palabras de la consulta, los mejores primero."""
+        query = normalize(query)
+        if not query:
+            return []
+        tokens = query.split()
+        candidates, exact = self._candidates(tokens)
+        if not candidates:
+            return []
+        if not exact:
+            # Palabras de 1-2 letras: solo al inicio de una palabra ("ar" no trae "harina")
+            texts = self._text
+            candidates = [pos for pos in candidates
+                          if all((tok in texts[pos]) if len(tok) > 2 else (" " + tok in texts[pos]) for tok in tokens)]
+        ranked = [(self._rank(pos, query, tokens), pos) for pos in candidates]
+        return [self.products[pos] for _, pos in heapq.nsmallest(limit, ranked)]
+
+    def _candidates(self, tokens):
+        """(posiciones candidatas, si ya son exactamente las que coinciden sin verificar)."""
+        lists = []
+        exact = True
+        for tok in tokens:
+            keys = _trigrams(tok) if len(tok) > 2 else (tok,)
+            # Un trigrama o un prefijo corto es exacto; una palabra más larga hay que verificarla
+            exact = exact and len(tok) <= 3
+            for key in keys:
+                posting = self._postings.get(key)
+                if not posting:
+                    return (), True
+                lists.append(posting)
+        lists.sort(key=len)
+        if len(lists) == 1:
+            return lists[0], exact
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            if len(candidates) < _VERIFY_BELOW:
+                return candidates, False
+            candidates.intersection_update(posting)
+        return candidates, exact
+
+    def _rank(self, pos, query, tokens):
+        code = self._codes[pos]
+        if code == query:
+            return RANK_CODE
+        if code.startswith(query):
+            return RANK_CODE_PREFIX
+        if self._names[pos].startswith(query):
+            return RANK_NAME_PREFIX
+        text = self._text[pos]
+        if all(" " + tok in text for tok in tokens):
+            return RANK_WORD_PREFIX
+        return RANK_CONTAINS
@@ -0,0 +1,149 @@
+"""
+Miniaturas de productos para los botones de la venta táctil.
+
+Las consultas de productos ya no traen la foto (solo su image_hash). La miniatura de
+50 px se genera una sola vez por (producto, hash) en un hilo de trabajo, se guarda en
+la tabla product_thumbnails y en memoria se conservan como mucho PHOTO_CACHE_SIZE
+PhotoImage (LRU). Las PhotoImage se crean en el hilo de Tk, en deliver().
+"""
+import io
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+THUMBNAIL_SIZE = (50, 50)
+PHOTO_CACHE_SIZE = 256
+
+
+def make_thumbnail(image, size=THUMBNAIL_SIZE):
+    """PNG de la miniatura de una imagen (bytes); conserva la proporción."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image)) as img:
+        img.thumbnail(size)
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        out = io.BytesIO()
+        img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _photo_image(png):
+    from PIL import Image, ImageTk
+    return ImageTk.PhotoImage(Image.open(io.BytesIO(png)))
+
+
+class ThumbnailService:
+    """
+    get() devuelve la PhotoImage si ya está en memoria o encarga la miniatura al hilo de
+    trabajo y devuelve None; deliver(), llamado desde el hilo de Tk, entrega las listas.
+    """
+
+    def __init__(self, size=THUMBNAIL_SIZE, max_photos=PHOTO_CACHE_SIZE, photo_factory=None):
+        self.size = size
+        self.max_photos = max_photos
+        self._photo_factory = photo_factory or _photo_image
+        self._photos = OrderedDict()      # (product_id, image_hash) -> PhotoImage
+        self._pending = set()
+        self._failed = set()              # imágenes ilegibles: no se reintentan
+        self._callbacks = {}
+        self._ready = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+        self.generated = 0
+
+    def get(self, product_id, image_hash, on_ready=None):
+        if not image_hash:
+            return None
+        key = (str(product_id), image_hash)
+        photo = self._photos.get(key)
+        if photo is not None:
+            self._photos.move_to_end(key)
+            return photo
+        if key in self._failed:
+            return None
+        if on_ready:
+            self._callbacks.setdefault(key, set()).add(on_ready)
+        if key not in self._pending:
+            self._pending.add(key)
+            self._executor.submit(self._load, key)
+        return None
+
+    @property
+    def pending(self):
+        return bool(self._pending)
+
+    def _load(self, key):
+        """Hilo de trabajo: miniatura guardada o, si no hay, generada desde la foto original."""
+        product_id, image_hash = key
+        try:
+            data = database.get_product_thumbnail(product_id, image_hash)
+            image = database.get_product_image(product_id) if data is None else None
+        except Exception as e:
+            # P.ej. "database is locked": no se marca como fallida, el próximo get() la vuelve a pedir
+            print(f"Error leyendo la miniatura del producto {product_id}: {e}")
+            self._ready.put((key, None, True))
+            return
+        if image:
+            try:
+                data = make_thumbnail(image, self.size)
+            except Exception as e:
+                print(f"Error generando miniatura del producto {product_id}: {e}")
+            else:
+                self.generated += 1
+                try:
+                    database.save_product_thumbnail(product_id, image_hash, data)
+                except Exception as e:
+                    # Se muestra igual; se vuelve a generar en la próxima sesión
+                    print(f"Error guardando la miniatura del producto {product_id}: {e}")
+        self._ready.put((key, data, False))
+
+    def deliver(self):
+        """Hilo de Tk: crea las PhotoImage de las miniaturas listas y avisa a quien las pidió."""
+        delivered = 0
+        while True:
+            try:
+                key, data, retry = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            self._pending.discard(key)
+            if retry:
+                # Los avisos pendientes se conservan para cuando se vuelva a pedir
+                continue
+            callbacks = self._callbacks.pop(key, ())
+            photo = None
+            if data is not None:
+                try:
+                    photo = self._photo_factory(data)
+                except Exception as e:
+                    print(f"Error cargando miniatura del producto {key[0]}: {e}")
+            if photo is None:
+                self._failed.add(key)
+                continue
+            self._photos[key] = photo
+            if len(self._photos) > self.max_photos:
+                # Los botones que la muestran conservan su propia referencia
+                self._photos.popitem(last=False)
+            delivered += 1
+            for callback in callbacks:
+                callback(key[0], photo)
+        return delivered
+
+    def wait(self, timeout=None):
+        """Espera a que el hilo termine lo encargado (pruebas y benchmarks)."""
+        self._executor.submit(lambda: None).result(timeout)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Servicio compartido por las vistas del proceso."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ThumbnailService()
+        return _service
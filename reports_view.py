@@ -15,6 +15,8 @@ try:
 except ImportError:
     win32print = None
 import xml_generator
+import cpe_retry_service
+import sunat_response
 import os
 import re
 
@@ -27,6 +29,10 @@ COLOR_ACCENT_BLUE = COLOR_ACCENT
 COLOR_TEXT_LIGHT = COLOR_TEXT
 COLOR_TEXT_DARK = "#333333"
 
+# Historial de ventas: filas por página y fracción desplazada a partir de la cual se carga la siguiente
+SALES_PAGE_SIZE = 200
+SALES_PAGE_PREFETCH = 0.9
+
 class GradientFrame(tk.Canvas):
     def __init__(self, parent, color1, color2, text="", text_color="white", shadow_color=None, font_size=20, anchor="center", **kwargs):
         super().__init__(parent, **kwargs)
@@ -460,12 +466,12 @@ class ReportsView(ttk.Toplevel):
         
         # Scrollbar needs to be defined first or packed side right
         # Scrollbar needs to be defined first or packed side right
-        sales_scrollbar = ttk.Scrollbar(st_frame, orient=VERTICAL)
-        sales_scrollbar.pack(side="right", fill="y")
+        self.sales_scrollbar = ttk.Scrollbar(st_frame, orient=VERTICAL)
+        self.sales_scrollbar.pack(side="right", fill="y")
         
-        self.sales_tree = ttk.Treeview(st_frame, columns=("ID", "Tipo", "Número", "Fecha", "Cliente", "TotalOriginal", "TotalFinal", "DescAdic"), show="tree headings", displaycolumns=("Tipo", "Número", "Fecha", "Cliente", "TotalOriginal", "TotalFinal", "DescAdic"), yscrollcommand=sales_scrollbar.set)
+        self.sales_tree = ttk.Treeview(st_frame, columns=("ID", "Tipo", "Número", "Fecha", "Cliente", "TotalOriginal", "TotalFinal", "DescAdic"), show="tree headings", displaycolumns=("Tipo", "Número", "Fecha", "Cliente", "TotalOriginal", "TotalFinal", "DescAdic"), yscrollcommand=self._on_sales_scroll)
         self.sales_tree.pack(side="left", fill="both", expand=True)
-        sales_scrollbar.config(command=self.sales_tree.yview)
+        self.sales_scrollbar.config(command=self.sales_tree.yview)
 
         self.sales_tree.heading("#0", text="Estado", anchor="center", command=lambda: self.treeview_sort_column(self.sales_tree, "#0", False))
         self.sales_tree.column("#0", width=60, anchor="center", stretch=False)
@@ -679,25 +685,33 @@ class ReportsView(ttk.Toplevel):
              if len(parts) != 2:
                   messagebox.showerror("Error", "Formato de número inválido.", parent=self)
                   return
-             series, number = parts
-             result = xml_gen.check_cdr_status(issuer, type_code, series, number)
-             
+             # getStatusCdr via el servicio de reintentos: respeta el límite por emisor,
+             # actualiza el estado de la venta y no bloquea la interfaz mientras SUNAT responde
+             future = cpe_retry_service.get_service().retry_now(sale_id)
+             self._wait_soap_result(future)
+             return
+
+        self._show_soap_result(result)
+
+    def _wait_soap_result(self, future):
+        if not future.done():
+            self.after(200, lambda: self._wait_soap_result(future))
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'error': str(e)}
+        self._show_soap_result(result)
+
+    def _show_soap_result(self, result):
         if result:
-             msg = result.get('response') or result.get('error')
-             
-             # Clean up message (Extract FaultString or Description)
-             clean_msg = msg
-             if msg:
-
-                 # Try to find SOAP Fault String
-                 fault_match = re.search(r'<[^:]*?:?faultstring>(.*?)</[^:]*?:?faultstring>', msg, re.IGNORECASE | re.DOTALL)
-                 if fault_match:
-                     clean_msg = f"Resultado:\n{fault_match.group(1).strip()}"
-                 else:
-                     # Try to find CDR Description
-                     desc_match = re.search(r'<[^:]*?:?Description>(.*?)</[^:]*?:?Description>', msg, re.IGNORECASE | re.DOTALL)
-                     if desc_match:
-                         clean_msg = f"Resultado:\n{desc_match.group(1).strip()}"
+             if result.get('response'):
+                 sunat = sunat_response.parse_response(result['response'])
+                 clean_msg = f"Resultado:\n{sunat.note}" if sunat.note else result['response']
+                 if sunat.response_code:
+                     clean_msg += f"\n(Código {sunat.response_code})"
+             else:
+                 clean_msg = result.get('error')
 
              messagebox.showinfo("Respuesta SUNAT", clean_msg, parent=self)
 
@@ -984,106 +998,23 @@ class ReportsView(ttk.Toplevel):
 
     def populate_sales_list(self, issuer_name=None, address=None, start_date=None, end_date=None, filter_text=""):
         for i in self.sales_tree.get_children(): self.sales_tree.delete(i)
-        
-        sales_data = database.get_all_sales_with_customer_name(issuer_name, address, start_date, end_date)
-        
-        
-        total_filtered = 0.0
-        total_base = 0.0
-        total_diff = 0.0
-        
-        if not sales_data:
+        self.sales_notes = {}
+        self.sales_statuses = {}
 
-            self.sales_tree.insert("", "end", values=("", "", "No hay ventas para este filtro", "", "", "", "", ""), tags=('placeholder',))
-        else:
-            self.sales_notes = {}
-            self.sales_statuses = {}
-            for i, row in enumerate(sales_data):
-                tag_stripe = 'oddrow' if i % 2 == 1 else 'evenrow'
-                # row: id, doc_type, doc_number, date, customer_name, total_amount, diff_amount, issuer_name, issuer_address, sunat_status, sunat_note
-                sale_id = row[0]
-                doc_type = row[1]
-                doc_number = row[2]
-                date_str = row[3] 
-                customer = row[4] or ""
-                total = row[5]
-                diff = row[6] if row[6] is not None else 0.0
-                sunat_status = row[9] if len(row) > 9 else None
-                sunat_note = row[10] if len(row) > 10 else ""
-                
-                # --- Filtering Logic ---
-                if filter_text:
-                    ft = filter_text.lower()
-                    # Clean amount for comparison (remove commas)
-                    total_str_clean = f"{total:.2f}".replace(",", "") # 1000.00
-                    total_str_int = f"{int(total)}" # 1000
-                    
-                    match = False
-                    # 1. Series/Number (doc_number)
-                    if doc_number and ft in str(doc_number).lower(): match = True
-                    # 2. Customer Name
-                    elif customer and ft in customer.lower(): match = True
-                    # 3. Amount (Exact match or close string match?)
-                    # User asked for "1,000.00 or 1000 or 1000.00"
-                    # We check if the filter text is contained in the formatted amount or matches clean versions
-                    elif ft in total_str_clean or ft == total_str_int: match = True
-                    # Also check if user typed "1,000.00" exactly
-                    elif ft in f"{total:,.2f}".lower(): match = True
-                    
-                    if not match:
-                        continue
+        # Filtros y totales se resuelven en SQL; las filas se cargan por páginas al desplazarse
+        self._sales_filters = (issuer_name, address, start_date, end_date, filter_text)
+        self._sales_cursor = None
+        self._sales_exhausted = False
+        self._sales_loading = False
 
-                # --- Date Formatting (DD/MM/YYYY) ---
-                try:
-                    # Try parsing assuming standard SQL format YYYY-MM-DD HH:MM:SS
-                    date_obj = datetime.strptime(str(date_str), "%Y-%m-%d %H:%M:%S")
-                    formatted_date = date_obj.strftime("%d/%m/%Y")
-                except ValueError:
-                    try:
-                        # Try YYYY-MM-DD
-                        date_obj = datetime.strptime(str(date_str), "%Y-%m-%d")
-                        formatted_date = date_obj.strftime("%d/%m/%Y")
-                    except ValueError:
-                        formatted_date = str(date_str) # Fallback
-
-                total_normal = total - diff
-                
-                desc_adic_str = f"S/ {diff:,.2f}"
-                total_original_str = f"S/ {total_normal:,.2f}" 
-                total_final_str = f"S/ {total:,.2f}" 
-                
-                # Order: ID, Tipo, Número, Fecha, Cliente, TotalOriginal, DescAdic, TotalFinal
-                formatted_row = (sale_id, doc_type, doc_number, formatted_date, customer, total_original_str, desc_adic_str, total_final_str)
-                # Add 'Activo' tag for sorting purposes
-                # Status Icon
-                icon = self.status_icon # Default Green for 'ACEPTADO' or empty
-                if sunat_status == 'PENDIENTE':
-                    icon = self.status_icon_pending
-                elif sunat_status == 'RECHAZADO':
-                    icon = self.status_icon_rejected
-                elif sunat_status == 'ACEPTADO':
-                    icon = self.status_icon
-                else: 
-                     # If no status but is Boleta/Factura, maybe pending logic? Or just no icon if old?
-                     # User wants icons for Factura/Boleta.
-                     doc_type_upper = doc_type.upper()
-                     if "FACTURA" in doc_type_upper or "BOLETA" in doc_type_upper:
-                         if "NOTA" not in doc_type_upper:
-                             if not sunat_status:
-                                 icon = self.status_icon_pending 
-                         else:
-                             icon = ""
-                     else:
-                         icon = ""
+        count, total_filtered, total_diff = database.get_sales_history_totals(*self._sales_filters)
+        total_base = total_filtered - total_diff
 
-                # Store for tooltip
-                item_iid = self.sales_tree.insert("", "end", text="", image=icon, values=formatted_row, tags=('Activo', tag_stripe))
-                self.sales_notes[item_iid] = sunat_note
-                self.sales_statuses[item_iid] = sunat_status or "Sin Estado"
-                total_filtered += total
-                total_base += total_normal
-                total_diff += diff
-                
+        if not count:
+            self._sales_exhausted = True
+            self.sales_tree.insert("", "end", values=("", "", "No hay ventas para este filtro", "", "", "", "", ""), tags=('placeholder',))
+        else:
+            self.load_next_sales_page()
             self._adjust_column_widths(self.sales_tree)
         
         self.lbl_sum_total.config(text=f"Total: S/ {total_base:,.2f}")
@@ -1097,6 +1028,75 @@ class ReportsView(ttk.Toplevel):
         self.ticket_preview.delete("1.0", tk.END)
         self.ticket_preview.config(state="disabled")
 
+    def _on_sales_scroll(self, first, last):
+        """yscrollcommand del historial: mueve la barra y pide la página siguiente al acercarse al final."""
+        self.sales_scrollbar.set(first, last)
+        if float(last) >= SALES_PAGE_PREFETCH and not getattr(self, '_sales_exhausted', True) and not self._sales_loading:
+            self._sales_loading = True
+            self.after_idle(self.load_next_sales_page)
+
+    def load_next_sales_page(self):
+        self._sales_loading = False
+        if self._sales_exhausted:
+            return
+        rows = database.get_sales_history_page(*self._sales_filters, after=self._sales_cursor, limit=SALES_PAGE_SIZE)
+        if len(rows) < SALES_PAGE_SIZE:
+            self._sales_exhausted = True
+        if not rows:
+            return
+        self._sales_cursor = (rows[-1][11], rows[-1][0])
+
+        offset = len(self.sales_tree.get_children())
+        for i, row in enumerate(rows, start=offset):
+            tag_stripe = 'oddrow' if i % 2 == 1 else 'evenrow'
+            # row: id, doc_type, doc_number, date, customer_name, total_amount, diff_amount, issuer_name, issuer_address, sunat_status, sunat_note, sale_ts
+            sale_id = row[0]
+            doc_type = row[1] or ""
+            doc_number = row[2]
+            customer = row[4] or ""
+            total = row[5]
+            diff = row[6] if row[6] is not None else 0.0
+            sunat_status = row[9]
+            sunat_note = row[10]
+            sale_ts = row[11]
+
+            # --- Date Formatting (DD/MM/YYYY) --- sale_ts siempre es 'YYYY-MM-DD HH:MM:SS'
+            formatted_date = f"{sale_ts[8:10]}/{sale_ts[5:7]}/{sale_ts[0:4]}" if sale_ts else str(row[3])
+
+            total_normal = total - diff
+            
+            desc_adic_str = f"S/ {diff:,.2f}"
+            total_original_str = f"S/ {total_normal:,.2f}" 
+            total_final_str = f"S/ {total:,.2f}" 
+            
+            # Order: ID, Tipo, Número, Fecha, Cliente, TotalOriginal, DescAdic, TotalFinal
+            formatted_row = (sale_id, doc_type, doc_number, formatted_date, customer, total_original_str, desc_adic_str, total_final_str)
+            # Status Icon
+            icon = self.status_icon # Default Green for 'ACEPTADO' or empty
+            if sunat_status == 'PENDIENTE':
+                icon = self.status_icon_pending
+            elif sunat_status == 'RECHAZADO':
+                icon = self.status_icon_rejected
+            elif sunat_status == 'ACEPTADO':
+                icon = self.status_icon
+            else: 
+                 # If no status but is Boleta/Factura, maybe pending logic? Or just no icon if old?
+                 # User wants icons for Factura/Boleta.
+                 doc_type_upper = doc_type.upper()
+                 if "FACTURA" in doc_type_upper or "BOLETA" in doc_type_upper:
+                     if "NOTA" not in doc_type_upper:
+                         if not sunat_status:
+                             icon = self.status_icon_pending 
+                     else:
+                         icon = ""
+                 else:
+                     icon = ""
+
+            # Add 'Activo' tag for sorting purposes; store note/status for tooltip
+            item_iid = self.sales_tree.insert("", "end", text="", image=icon, values=formatted_row, tags=('Activo', tag_stripe))
+            self.sales_notes[item_iid] = sunat_note
+            self.sales_statuses[item_iid] = sunat_status or "Sin Estado"
+
     def on_sale_select(self, event):
         for i in self.details_tree.get_children(): self.details_tree.delete(i)
         selected_item = self.sales_tree.focus()
@@ -9,7 +9,13 @@ from datetime import datetime
 import config_manager
 import json
 import textwrap
-import json_generator
+import queue
+import cpe_dispatcher
+import tile_images
+import product_thumbnails
+import product_catalog
+import product_search
+from tile_pool import TilePool
 from sales_view import SalesView, FONT_FAMILY, FONT_SIZE_NORMAL, FONT_SIZE_LARGE, FONT_SIZE_HEADER
 from theme_manager import (
     COLOR_PRIMARY, COLOR_SECONDARY, COLOR_ACCENT, COLOR_TEXT, 
@@ -35,6 +41,13 @@ import state_manager
 from movements_touch_dialog import TouchMovementDialog
 GROUP_ORDER_FILE = 'group_order.json'
 PRODUCT_ORDER_FILE = 'product_order.json'
+# Sondeo del feed de cambios de stock (ms): mínimo tras un cambio, máximo con la caja ociosa
+STOCK_POLL_MIN_MS = 500
+STOCK_POLL_MAX_MS = 5000
+# Revisión de los resultados de envío a SUNAT que dejan los hilos de cpe_dispatcher (ms)
+CPE_EVENTS_POLL_MS = 500
+# Entrega de miniaturas de productos generadas en segundo plano (ms)
+THUMBNAIL_POLL_MS = 100
 
 from PIL import ImageDraw, ImageFont
 
@@ -146,6 +159,8 @@ class GradientButton(tk.Canvas):
         if 'border_color' in kwargs:
              self.border_color = kwargs.pop('border_color')
              redraw = True
+        if 'command' in kwargs:
+             self._command = kwargs.pop('command')
 
         # Handle style mapping to colors (Emulation for Product Buttons)
         if 'style' in kwargs:
@@ -170,7 +185,17 @@ class GradientButton(tk.Canvas):
 
     def config(self, **kwargs):
         self.configure(**kwargs)
-        
+
+    _OPTION_ATTRS = {'text': 'text', 'image': 'image', 'color1': '_color1', 'color2': '_color2',
+                     'text_color': '_text_color', 'border_color': 'border_color'}
+
+    def update_options(self, **kwargs):
+        """Aplica solo las opciones que cambian (un único redibujo); devuelve si hubo cambios."""
+        changed = {k: v for k, v in kwargs.items() if getattr(self, self._OPTION_ATTRS[k]) != v}
+        if changed:
+            self.configure(**changed)
+        return bool(changed)
+
     def cget(self, key):
         if key == "text":
             return self.text
@@ -215,9 +240,12 @@ class GradientButton(tk.Canvas):
         
         return color
 
-    def _draw(self, width, height):
-        self.delete("all")
-        
+    def _tile_state(self):
+        state = "pressed" if self._is_pressed else "hover" if self._is_hover else "normal"
+        return state + "+focus" if self._is_focused else state
+
+    def _render_tile(self, width, height):
+        """Arma el fondo (degradado, esquinas, borde, foco) para el estado actual."""
         # Determine current colors
         if self._is_pressed:
             # Darken
@@ -230,12 +258,7 @@ class GradientButton(tk.Canvas):
         else:
             c1 = self._resolve_color(self._color1)
             c2 = self._resolve_color(self._color2)
-            
-        # Draw Gradient Rounded Rectangle using PIL
-        # 1. Create Gradient Image
-        gradient_img = Image.new('RGBA', (width, height))
-        draw_g = ImageDraw.Draw(gradient_img)
-        
+
         # Horizontal Gradient
         try:
             r1, g1, b1 = self.winfo_rgb(c1)
@@ -244,37 +267,22 @@ class GradientButton(tk.Canvas):
             # Fallback if somehow still invalid
             r1, g1, b1 = 200, 200, 200
             r2, g2, b2 = 100, 100, 100
-            
-        r1, g1, b1 = r1//256, g1//256, b1//256
-        r2, g2, b2 = r2//256, g2//256, b2//256
-        
-        for x in range(width):
-            r = int(r1 + (r2 - r1) * x / width)
-            g = int(g1 + (g2 - g1) * x / width)
-            b = int(b1 + (b2 - b1) * x / width)
-            draw_g.line((x, 0, x, height), fill=(r, g, b, 255))
 
-        # 2. Mask for Rounded Corners
-        mask_img = Image.new('L', (width, height), 0)
-        draw_mask = ImageDraw.Draw(mask_img)
-        
-        draw_mask.rounded_rectangle((0, 0, width, height), radius=self.corner_radius, fill=255)
-        
-        final_img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-        final_img.paste(gradient_img, (0, 0), mask_img)
-        
-        # Draw Border if needed (Overlay)
+        border_rgb = None
         if self.border_color:
-             draw_final = ImageDraw.Draw(final_img)
              br, bg, bb = self.winfo_rgb(self.border_color)
-             br, bg, bb = br//256, bg//256, bb//256
-             draw_final.rounded_rectangle((0, 0, width-1, height-1), radius=self.corner_radius, outline=(br, bg, bb, 255), width=2, fill=None)
-        
-        if self._is_focused:
-             draw_final = ImageDraw.Draw(final_img)
-             draw_final.rounded_rectangle((1, 1, width-2, height-2), radius=self.corner_radius, outline="white", width=3, fill=None)
-        
-        self.image_ref = ImageTk.PhotoImage(final_img)
+             border_rgb = (br//256, bg//256, bb//256)
+
+        tile = tile_images.render_tile(width, height, (r1//256, g1//256, b1//256), (r2//256, g2//256, b2//256),
+                                       self.corner_radius, border_rgb, self._is_focused)
+        return ImageTk.PhotoImage(tile)
+
+    def _draw(self, width, height):
+        self.delete("all")
+
+        # Fondo desde el caché compartido: la grilla repite los mismos tamaños y colores
+        key = (width, height, self._color1, self._color2, self.corner_radius, self._tile_state(), self.border_color)
+        self.image_ref = tile_images.tile_cache.get(key, lambda: self._render_tile(width, height))
         self.create_image(0, 0, image=self.image_ref, anchor='nw')
         
         # Draw Product Image if present (Right Side)
@@ -363,6 +371,7 @@ class SalesTouchView(SalesView):
             self.caja_id = str(caja_id)
         else:
             self.caja_id = config_manager.load_setting('caja_id', '1')
+        self.load_stock_warning_limit()
         
         # --- Layout Configuration ---
         # --- Layout Configuration ---
@@ -498,7 +507,39 @@ class SalesTouchView(SalesView):
         self.customer_doc_var.trace_add("write", lambda *args: self._persist_state())
         self.customer_name_var.trace_add("write", lambda *args: self._persist_state())
 
+        # --- Resultados de envíos a SUNAT (llegan desde los hilos de cpe_dispatcher) ---
+        self._cpe_events = queue.Queue()
+        if cpe_dispatcher.dispatcher:
+            cpe_dispatcher.dispatcher.add_listener(self._cpe_events.put)
+            self.bind("<Destroy>", self._on_destroy_cpe_listener, add="+")
+        self.after(CPE_EVENTS_POLL_MS, self._poll_cpe_events)
 
+    def _on_destroy_cpe_listener(self, event):
+        if event.widget is self and cpe_dispatcher.dispatcher:
+            cpe_dispatcher.dispatcher.remove_listener(self._cpe_events.put)
+
+    def _poll_cpe_events(self):
+        # Tk solo puede usarse desde su hilo: los avisos se encolan y se muestran aquí
+        while True:
+            try:
+                event = self._cpe_events.get_nowait()
+            except queue.Empty:
+                break
+            # Los resultados de lotes (cientos de boletas a la vez) no se anuncian uno por uno
+            if event.get('caja_id') == self.caja_id and 'batch_id' not in event:
+                self._show_cpe_result(event)
+        self.after(CPE_EVENTS_POLL_MS, self._poll_cpe_events)
+
+    def _show_cpe_result(self, event):
+        status, note = event['status'], event['note']
+        if status == "RECHAZADO":
+            messagebox.showerror("RECHAZADO", f"SUNAT Rechazó el comprobante {event['document_number']}:\n{note}", parent=self)
+        elif status == "PENDIENTE":
+            messagebox.showwarning("PENDIENTE", f"Envío de {event['document_number']} procesado. Estado: PENDIENTE\n{note}", parent=self)
+        elif status == "ACEPTADO":
+            messagebox.showinfo("ACEPTADO", f"Documento {event['document_number']} ACEPTADO por SUNAT.", parent=self)
+        else:
+            print(f"CPE {event['document_number']}: {status} {note}")
 
     def load_group_order(self, issuer_id=None, address=None):
         if not hasattr(self, 'caja_id'):
@@ -701,6 +742,8 @@ class SalesTouchView(SalesView):
         # Check configure of White.TFrame? I haven't defined it.
         # Let's just pack buttons.
         self.category_frame.pack(fill="x", padx=10, pady=10)
+        self.category_tile_pool = TilePool(self.category_frame, self._new_category_tile, padx=2, pady=2, sticky="ew")
+        self._pagination_state = None
         
         # Pagination for groups
         self.pagination_frame = ttk.Frame(groups_container)
@@ -784,6 +827,10 @@ class SalesTouchView(SalesView):
         
         # 1. Store window_id to resize it
         self.grid_window_id = canvas.create_window((0, 0), window=self.product_grid_frame, anchor="nw")
+        # Botones de producto reutilizables: se reasignan al cambiar de categoría o buscar
+        self.product_tile_pool = TilePool(self.product_grid_frame, self._new_product_tile, row_weight=True, padx=5, pady=5, sticky="nsew")
+        self.thumbnails = product_thumbnails.get_service()
+        self._thumbnail_poll_job = None
         
         # 2. Resize frame when canvas resizes
         def _on_canvas_configure(event):
@@ -1090,59 +1137,23 @@ class SalesTouchView(SalesView):
                                  corner_radius=15, height=60, icon="💳", font_size=12)
         pay_btn.pack(fill="x", pady=(10, 0))
 
+    def load_stock_warning_limit(self):
+        # Se lee al cargar la vista y al cerrar la configuración, no en cada refresco de stock
+        self.stock_warning_limit = config_manager.load_setting('stock_warning_limit', 0)
+
     def load_products_from_db(self, issuer_name=None, issuer_address=None):
-        all_products_rows = database.get_all_products(issuer_name, issuer_address)
-        # row: id, name, price, stock, code, unit_of_measure, operation_type, issuer_name, issuer_address, category
-        
-        self.products = {}
-        self.products_by_category = {}
-        # Clear cache for polling
-        self._id_to_product_map = {}
-        
-        for row in all_products_rows:
-            p_id, name, price, stock, code, um, op_type, i_name, i_addr, category, image, is_active = row
-            category = category or "General"
-            
-            product_data = {
-                'id': p_id, 'name': name, 'price': price, 'stock': stock, 
-                'code': code, 'unit_of_measure': um, 'category': category,
-                'image': image
-            }
-            self.products[name] = product_data
-            
-            if category not in self.products_by_category:
-                self.products_by_category[category] = []
-            self.products_by_category[category].append(product_data)
-            
-        # --- CRITICAL FIX: Sync Local Memory Stock with Current Cart ---
-        # When reloading from DB, we get raw stock. We must subtract what is currently in OUR cart.
-        if hasattr(self, 'cart') and self.cart:
-            for item in self.cart:
-                p_name = item.get('name')
-                if p_name and p_name in self.products:
-                    qty = item.get('quantity', 0)
-                    self.products[p_name]['stock'] -= qty
-        
-        # Also Check Persistent State if Cart is Empty (Initial Load Case)
-        # If this is a fresh window, self.cart might be empty, but sales_state.json has data.
-        # We should logically restore the cart here if needed, OR relies on another loader.
-        # To be safe for "Stock Sync", we look at state file to see if WE have items.
-        # But populating self.cart has side effects (UI treeview). We shouldn't do it implicitly here unless standard.
-        # Assuming User's "Cart has items" means 'self.cart' is populated.
-        
-        self.refresh_category_buttons()
-        self.refresh_category_buttons()
-        # User requested NO pre-selected group in Touch Mode
-        self.show_products_for_category(None)
-        
-        # --- Create Code Map for Scanning ---
-        self.product_code_map = {}
-        for name, data in self.products.items():
-            code = data.get('code')
-            if code:
-                code_str = str(code).strip()
-                if code_str:
-                     self.product_code_map[code_str] = name
+        self.load_stock_warning_limit()
+        catalog = product_catalog.get_catalog(issuer_name, issuer_address)
+        if catalog is getattr(self, 'catalog', None) and self.products:
+            # Mismo catálogo (p.ej. tras una venta): solo los productos que cambiaron
+            self._sync_products()
+        else:
+            self.catalog = catalog
+            catalog.sync()
+            self._build_product_views()
+            self.refresh_category_buttons()
+            # User requested NO pre-selected group in Touch Mode
+            self.show_products_for_category(None)
 
         # Start Polling for Stock Updates (Auto-Sync)
         if hasattr(self, 'start_stock_polling'):
@@ -1152,12 +1163,72 @@ class SalesTouchView(SalesView):
         if hasattr(self, 'scan_entry'):
              self.scan_entry.focus_set()
 
+    def _product_view(self, entry, in_my_cart):
+        # Copia propia de la vista: el stock es el de BD menos lo que hay en NUESTRO carrito
+        return {
+            'id': entry['id'], 'name': entry['name'], 'price': entry['price'],
+            'stock': entry['stock'] - in_my_cart.get(str(entry['id']), 0),
+            'code': entry['code'], 'unit_of_measure': entry['unit_of_measure'],
+            'category': entry['category'] or "General", 'image_hash': entry['image_hash']
+        }
+
+    def _cart_quantities(self):
+        in_my_cart = {}
+        for item in getattr(self, 'cart', None) or []:
+            in_my_cart[str(item.get('id'))] = in_my_cart.get(str(item.get('id')), 0) + item.get('quantity', 0)
+        return in_my_cart
+
+    def _build_product_views(self):
+        """Arma products, products_by_category y product_code_map desde el catálogo compartido."""
+        in_my_cart = self._cart_quantities()
+        self.products = {}
+        self.products_by_category = {}
+        self._id_to_product_map = {}
+        self.product_code_map = {}
+        for entry in self.catalog.products():
+            product_data = self._product_view(entry, in_my_cart)
+            self.products[product_data['name']] = product_data
+            self._id_to_product_map[str(product_data['id'])] = product_data
+            self.products_by_category.setdefault(product_data['category'], []).append(product_data)
+        for code_str, entry in self.catalog.by_code.items():
+            self.product_code_map[code_str] = entry['name']
+        self._catalog_version = self.catalog.data_version
+        self.catalog.prepare_search()
+
+    def _sync_products(self):
+        """
+        Trae al catálogo los cambios de la BD y los aplica a esta vista producto por producto.
+        Devuelve los ids (str) afectados, o None si la vista se reconstruyó entera.
+        """
+        self.catalog.sync()
+        version, changed_ids = self.catalog.changes_since(self._catalog_version)
+        if version == self._catalog_version:
+            return set()
+
+        rebuild = changed_ids is None
+        in_my_cart = self._cart_quantities()
+        for p_id in changed_ids or ():
+            entry = self.catalog.by_id.get(p_id)
+            view = self._id_to_product_map.get(str(p_id))
+            if entry is None and view is None:
+                continue
+            if entry is None or view is None or view['name'] != entry['name'] or view['code'] != entry['code'] \
+                    or view['category'] != (entry['category'] or "General"):
+                # Alta, baja o cambio de nombre/código/categoría: se rearman los índices de la vista
+                rebuild = True
+                break
+            view.update(self._product_view(entry, in_my_cart))
+        self._catalog_version = version
+
+        if rebuild:
+            self._build_product_views()
+            self.refresh_category_buttons()
+            current = getattr(self, 'current_category', None)
+            self.show_products_for_category(current if current in self.products_by_category else None)
+            return None
+        return {str(p_id) for p_id in changed_ids}
+
     def refresh_category_buttons(self):
-        for widget in self.category_frame.winfo_children():
-            widget.destroy()
-        for widget in self.pagination_frame.winfo_children():
-            widget.destroy()
-            
         categories = sorted(list(self.products_by_category.keys()))
         
         # Apply saved order
@@ -1175,11 +1246,6 @@ class SalesTouchView(SalesView):
         # Update self.group_order to reflect current reality (including new categories)
         self.group_order = ordered_categories
         
-        # Assign styles to categories
-        for i, cat in enumerate(ordered_categories):
-             # We just need the index to determine the style
-             pass
-        
         self.save_group_order()
         
         total_pages = (len(ordered_categories) + self.categories_per_page - 1) // self.categories_per_page
@@ -1194,59 +1260,28 @@ class SalesTouchView(SalesView):
         
         # Grid layout for categories (2 rows, 7 columns)
         columns_per_row = 7
-        for i, cat in enumerate(current_categories):
-            row = i // columns_per_row
-            col = i % columns_per_row
-            
-            # Determine global index for color consistency and gradient style
-            try:
-                cat_global_idx = self.group_order.index(cat)
-            except ValueError:
-                cat_global_idx = i
-            
+        items = []
+        for cat in current_categories:
             custom_color = getattr(self, 'group_colors', {}).get(cat)
             if custom_color:
                  base_color = custom_color
-                 # Auto-adjust text color for custom background if needed?
-                 # For now assume white text for custom colors as they are usually dark/vibrant
             else:
                  # Decouple color from order: Use Name Hash for consistent color
-                 # style_idx = cat_global_idx % len(POS_GRP_COLORS) 
                  # Use sum of chars for stable determinism
                  style_idx = sum(ord(c) for c in cat) % len(POS_GRP_COLORS)
                  base_color = POS_GRP_COLORS[style_idx]
-            
-            # Create GradientButton for Group
-            # Darken base color slightly for gradient effect
-            def darken(hex_c, factor=0.8):
-                # Basic mapping if needed, or just let GradientButton auto-darken if we pass same color
-                # But GradientButton takes color1, color2.
-                # Let's pass the same color and let it auto-manage or just pass something compatible.
-                # We can try to darken custom.
-                return hex_c
-            
-            btn = GradientButton(
-                self.category_frame,
-                text=cat,
-                command=lambda c=cat: self.show_products_for_category(c),
-                color1=base_color,
-                color2=base_color, # It will look flat-ish or we can improve logic. GradientButton._draw handles hover/press.
-                width=100, # Approx
-                height=50,
-                corner_radius=10,
-                text_color="white"
-            )
+            # Same color on both ends: GradientButton._draw handles hover/press.
+            items.append((cat, {"text": cat, "color1": base_color, "color2": base_color}))
 
-            btn.grid(row=row, column=col, padx=2, pady=2, sticky="ew")
-            
-            # Bind Drag and Drop events
-            btn.bind("<ButtonPress-1>", lambda e, c=cat, b=btn: self.start_drag(e, c, b, "category"))
-            # Note: Motion and Release are bound globally in start_drag
-            
-            # Context Menu
-            btn.bind("<Button-3>", lambda e, c=cat: self.show_group_context_menu(e, c))
-            
-            self.category_frame.columnconfigure(col, weight=1)
+        # Los botones ya creados se reasignan; solo se redibujan los que cambian
+        self.category_tile_pool.update(items, columns_per_row)
+
+        # Las páginas solo se rehacen si cambia la cantidad o la página activa
+        if self._pagination_state == (total_pages, self.current_category_page):
+            return
+        self._pagination_state = (total_pages, self.current_category_page)
+        for widget in self.pagination_frame.winfo_children():
+            widget.destroy()
 
         # Pagination Controls
         if total_pages > 1:
@@ -1295,6 +1330,25 @@ class SalesTouchView(SalesView):
                 # Bind hover event for page switching during drag
                 btn.bind("<Enter>", lambda e, page=p: self.on_page_hover(e, page))
 
+    def _new_category_tile(self, options):
+        btn = GradientButton(
+            self.category_frame,
+            width=100, # Approx
+            height=50,
+            corner_radius=10,
+            text_color="white",
+            **options
+        )
+        btn.configure(command=lambda: self.show_products_for_category(btn.data))
+
+        # Bind Drag and Drop events
+        btn.bind("<ButtonPress-1>", lambda e: self.start_drag(e, btn.data, btn, "category"))
+        # Note: Motion and Release are bound globally in start_drag
+
+        # Context Menu
+        btn.bind("<Button-3>", lambda e: self.show_group_context_menu(e, btn.data))
+        return btn
+
     def change_category_page(self, page):
         if self.current_category_page == page:
             return
@@ -1319,12 +1373,11 @@ class SalesTouchView(SalesView):
         
         if new_cols != self.last_cols:
              self.last_cols = new_cols
-             # Trigger reload if category selected
-             if hasattr(self, 'current_category') and self.current_category:
-                 if hasattr(self, '_reflow_job') and self._reflow_job:
-                     self.after_cancel(self._reflow_job)
-                 
-                 self._reflow_job = self.after(200, lambda: self.show_products_for_category(self.current_category))
+             # Reubica los botones visibles (categoría o búsqueda) sin recrearlos
+             if hasattr(self, '_reflow_job') and self._reflow_job:
+                 self.after_cancel(self._reflow_job)
+             
+             self._reflow_job = self.after(200, lambda: self.product_tile_pool.relayout(self.last_cols))
 
     def show_group_context_menu(self, event, category):
         menu = tk.Menu(self, tearoff=0)
@@ -1917,14 +1970,9 @@ class SalesTouchView(SalesView):
         d.bind('<Return>', confirm)
 
     def show_products_for_category(self, category):
-        # Clear previous buttons and references
-        for widget in self.product_grid_frame.winfo_children():
-            widget.destroy()
-        self.product_buttons = {}
-        self.product_image_refs = [] # Clear image refs
-            
         self.current_category = category # Store for responsive update
         if not category or category not in self.products_by_category:
+            self._show_product_tiles([])
             return
             
         products = self.products_by_category[category]
@@ -1951,68 +1999,25 @@ class SalesTouchView(SalesView):
         
         products = ordered_products
         
-        # Grid layout
-        # Calculate columns dynamically
-        width = self.product_grid_frame.winfo_width()
-        if width <= 100: 
-             # Approximation if not rendered yet
-             s_width = self.winfo_screenwidth()
-             # Left pane is approx 70% or split? 
-             # SalesTouchView usually is full screen. Paned layout.
-             width = s_width * 0.65 
-        
-        # Target button width approx 160-180px + padding
-        columns = max(4, int(width / 185)) 
+        # Reservas de las otras cajas: una sola lectura para toda la grilla
+        reservations = state_manager.ReservationSnapshot.load(exclude_caja_id=self.caja_id)
 
-        for i, prod in enumerate(products):
-            row = i // columns
-            col = i % columns
-            
-            # Button content
-            current_stock_mem = prod.get('stock', 0)
+        items = []
+        for prod in products:
             p_id = str(prod['id'])
             
             # --- VISUAL SYNC: Subtract reservations from OTHER registers ---
             # We want to see what is TRULY available.
-            # current_stock_mem already has MY cart items subtracted (if local logic works).
+            # stock already has MY cart items subtracted (if local logic works).
             # Now subtract what others have.
-            reserved_others = state_manager.get_global_reserved_quantity(str(prod['id']), exclude_caja_id=self.caja_id)
-            effective_visual_stock = current_stock_mem - reserved_others
+            effective_visual_stock = prod.get('stock', 0) - reservations.get(p_id)
             
             # Wrap product name to ensure it fits (e.g., 20 chars per line)
             wrapped_name = textwrap.fill(prod['name'], width=20)
             
             text = f"{wrapped_name}\nS/ {prod['price']:.2f}\nStock: {effective_visual_stock:.2f}"
-            
-            # Determine style based on stock or custom color
-            custom_color = self.product_colors.get(p_id)
-            
-            if custom_color:
-                style_name = f"CustomProduct_{p_id}.TButton"
-                style = ttk.Style.get_instance()
-                # Create dynamic style
-            # Old styling/button code removed
 
-            
-            # Prepare Image argument
-            photo_for_btn = None
-            if prod.get('image'):
-                try:
-                    img = Image.open(io.BytesIO(prod['image']))
-                    # Resize to fit button height (e.g. 50-60px)
-                    img.thumbnail((50, 50)) # Smaller to fit on right
-                    photo = ImageTk.PhotoImage(img)
-                    
-                    # Store reference to prevent GC
-                    if not hasattr(self, 'product_image_refs'):
-                        self.product_image_refs = []
-                    self.product_image_refs.append(photo)
-                    
-                    photo_for_btn = photo
-                except Exception as e:
-                    print(f"Error loading image for {prod['name']}: {e}")
-
-            # Determine style/color based on stock
+            # Determine style/color based on custom color
             custom_color = self.product_colors.get(p_id)
             
             # Default Colors
@@ -2025,102 +2030,79 @@ class SalesTouchView(SalesView):
                 c2 = custom_color # Flat color for custom
                 # White text for custom colors (likely dark) - simplified assumption or check brightness
                 txt_col = "white" 
-            # GradientButton for Product
-            btn = GradientButton(
-                self.product_grid_frame,
-                text=text,
-                command=lambda p=prod: self.add_product_to_cart(p), 
-                color1=c1,
-                color2=c2,
-                text_color=txt_col,
-                width=160,
-                height=80,
-                corner_radius=10,
-                border_color=None,
-                image=photo_for_btn # Pass image
-            )
-            
-            # Bind Drag
-            btn.bind("<ButtonPress-1>", lambda e, p=prod, b=btn: self.start_drag(e, p, b, "product"))
-            # Context Menu
-            btn.bind("<Button-3>", lambda e, p=prod: self.show_product_context_menu(e, p))
-            
-            btn.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
-            
-            # Store button reference
-            try:
-                self.product_buttons[int(prod['id'])] = btn
-            except:
-                self.product_buttons[prod['id']] = btn
-            
-            # Configure grid weights
-            self.product_grid_frame.columnconfigure(col, weight=1)
-            self.product_grid_frame.rowconfigure(row, weight=1)
+
+            items.append((prod, {"text": text, "color1": c1, "color2": c2, "text_color": txt_col,
+                                 "image": self._product_photo(prod)}))
+
+        self._show_product_tiles(items)
 
         # Start Polling IF not started
         if not hasattr(self, '_polling_active'):
              self.start_stock_polling()
 
     def start_stock_polling(self):
+        # Se llama tras cada recarga de productos; un solo ciclo de sondeo a la vez.
+        if getattr(self, '_stock_poll_job', None):
+            try:
+                self.after_cancel(self._stock_poll_job)
+            except Exception:
+                pass
         self._polling_active = True
-        self._poll_stock_updates()
+        self._stock_poll_interval = STOCK_POLL_MIN_MS
+        self._stock_poll_job = self.after(self._stock_poll_interval, self._poll_stock_updates)
 
     def _poll_stock_updates(self):
-        if not hasattr(self, '_polling_active') or not self._polling_active:
+        self._stock_poll_job = None
+        if not getattr(self, '_polling_active', False):
             return
-            
+
+        changed = False
         try:
-            # Check visible buttons
-            if hasattr(self, 'product_buttons') and self.product_buttons:
-                # Load all states ONCE
-                all_states = state_manager.load_all_states()
-                
-                # Build quick ID map if needed
-                if not hasattr(self, '_id_to_product_map') or not self._id_to_product_map:
-                     self._id_to_product_map = {str(p['id']): p for p in self.products.values()}
+            changed = self._refresh_changed_stock()
+        except Exception as e:
+            print(f"Error polling stock updates: {e}")
 
-                for p_id_key, btn in self.product_buttons.items():
-                    # Check if button still exists
-                    if not btn.winfo_exists(): continue
+        # Intervalo adaptativo: rápido mientras hay actividad, se espacia si la caja está ociosa.
+        if changed:
+            self._stock_poll_interval = STOCK_POLL_MIN_MS
+        else:
+            self._stock_poll_interval = min(self._stock_poll_interval * 2, STOCK_POLL_MAX_MS)
+        self._stock_poll_job = self.after(self._stock_poll_interval, self._poll_stock_updates)
 
-                    p_data = self._id_to_product_map.get(str(p_id_key))
-                    if p_data:
-                        current_mem = p_data.get('stock', 0)
-                        
-                        # Calculate Reserved
-                        reserved_others = 0.0
-                        for c_id, data in all_states.items():
-                            if str(c_id) == str(self.caja_id): continue
-                            for item in data.get('cart', []):
-                                if str(item.get('id')) == str(p_id_key):
-                                    reserved_others += float(item.get('quantity', 0))
-                        
-                        effective = current_mem - reserved_others
-                        
-                        # Reconstruct text
-                        wrapped = textwrap.fill(p_data['name'], width=20)
-                        price = p_data['price']
-                        expected_text = f"{wrapped}\nS/ {price:.2f}\nStock: {effective:.2f}"
-                        
-                        if btn.cget('text') != expected_text:
-                             btn.configure(text=expected_text)
-                             
-                             stock_warning_limit = config_manager.load_setting('stock_warning_limit', 0)
-                             custom_color = self.product_colors.get(str(p_id_key))
-                             
-                             if not custom_color:
-                                 if stock_warning_limit > 0 and effective <= stock_warning_limit:
-                                     try:
-                                         if btn.cget('style') != "ProductLowStock.TButton":
-                                            btn.configure(style="ProductLowStock.TButton")
-                                     except: pass
-                                 # (Reseting normal style omitted for brevity/stability)
-            
-        except Exception as e:
-            pass
-            
-        # Schedule next poll (Faster: 0.5s to 1s for better UX)
-        self.after(1000, self._poll_stock_updates)
+    def _refresh_changed_stock(self):
+        """Sincroniza el catálogo con el feed de cambios y redibuja solo los botones de productos afectados."""
+        if not getattr(self, 'catalog', None):
+            return False
+        changed_ids = self._sync_products()
+        if changed_ids is not None and not changed_ids:
+            return False
+
+        buttons = getattr(self, 'product_buttons', None) or {}
+        if changed_ids is None:
+            # Vista reconstruida: refrescar todos los visibles
+            targets = {str(p_id): btn for p_id, btn in buttons.items()}
+        else:
+            targets = {str(p_id): btn for p_id, btn in buttons.items() if str(p_id) in changed_ids}
+        if not targets:
+            return True
+
+        reservations = state_manager.ReservationSnapshot.load(exclude_caja_id=self.caja_id)
+        stock_warning_limit = self.stock_warning_limit
+
+        for p_id, btn in targets.items():
+            if not btn.winfo_exists(): continue
+            p_data = self._id_to_product_map.get(p_id)
+            if not p_data: continue
+
+            effective = p_data.get('stock', 0) - reservations.get(p_id)
+            wrapped = textwrap.fill(p_data['name'], width=20)
+            expected_text = f"{wrapped}\nS/ {p_data['price']:.2f}\nStock: {effective:.2f}"
+
+            if btn.cget('text') != expected_text:
+                btn.configure(text=expected_text)
+                if not self.product_colors.get(p_id) and stock_warning_limit > 0 and effective <= stock_warning_limit:
+                    btn.configure(style="ProductLowStock.TButton")
+        return True
 
     def update_total(self):
         self.total = sum(item['subtotal'] for item in self.cart)
@@ -2283,7 +2265,7 @@ class SalesTouchView(SalesView):
                     # Update Style based on new stock, ONLY if not custom
                     custom_color = self.product_colors.get(str(p_id_int))
                     if not custom_color:
-                        stock_warning_limit = config_manager.load_setting('stock_warning_limit', 0)
+                        stock_warning_limit = self.stock_warning_limit
                         if stock_warning_limit > 0 and new_stock <= stock_warning_limit:
                              btn.configure(style="ProductLowStock.TButton")
                         else:
@@ -2348,7 +2330,7 @@ class SalesTouchView(SalesView):
                         
                         custom_color = self.product_colors.get(str(p_id_int))
                         if not custom_color:
-                            warning_limit = config_manager.load_setting('stock_warning_limit', 0)
+                            warning_limit = self.stock_warning_limit
                             if warning_limit > 0 and new_stock <= warning_limit:
                                 btn.configure(style="ProductLowStock.TButton")
                             else:
@@ -2781,17 +2763,17 @@ class SalesTouchView(SalesView):
         if not doc:
             return
 
-        import api_client
+        import person_lookup
         
         try:
             self.customer_name_var.set("Buscando...")
             
             # Run in thread to avoid freezing UI? 
             # For simplicity in this edit, we'll run synchronously or use the existing async pattern if possible.
-            # But api_client might be blocking. 
+            # But the lookup might be blocking (solo si no está en clientes ni en la caché).
             # Let's just call it directly for now as per previous pattern, but handle UI updates.
             
-            result = api_client.get_person_data(doc)
+            result = person_lookup.lookup(doc)
             
             if result and result.get("success"):
                 data = result.get("data", {})
@@ -2868,29 +2850,6 @@ class SalesTouchView(SalesView):
             messagebox.showerror("Error Crítico", "El emisor seleccionado ya no es válido.", parent=modal)
             return
 
-        series, number = database.get_next_correlative(issuer_id, internal_doc_type)
-        
-        # Only apply fallback if the correlative row doesn't exist at all (series is None)
-        if series is None and internal_doc_type == "NOTA DE VENTA":
-            # Row doesn't exist in correlatives table - insert default
-            try:
-                import database as db_module
-                conn = db_module.create_connection()
-                cur = conn.cursor()
-                cur.execute("INSERT INTO correlatives (issuer_id, doc_type, series, current_number) VALUES (?, ?, ?, ?)",
-                           (issuer_id, "NOTA DE VENTA", "NV01", 0))
-                conn.commit()
-                conn.close()
-                # Now try again
-                series, number = database.get_next_correlative(issuer_id, internal_doc_type)
-            except Exception as e:
-                print(f"Error insertando correlativo NOTA DE VENTA: {e}")
-                pass
-
-        if not series or number == -1:
-            messagebox.showerror("Error de Configuración", f"No se ha configurado un correlativo para '{doc_type_full}'.\nPor favor, configúrelo en el módulo de Configuración.", parent=modal)
-            return
-            
         # --- Validaciones de Monto ---
         customer_doc = self.customer_doc_var.get().strip()
         customer_name = self.customer_name_var.get().strip()
@@ -2913,11 +2872,7 @@ class SalesTouchView(SalesView):
         customer_phone = "" 
         observations = ""
         
-        # Ensure customer exists
-        customer_id = database.get_or_create_customer(customer_doc, customer_name, customer_phone, customer_address)
-        
         sale_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        sale_document_number = f"{series}-{number}"
         
         payment_method = self.payment_method_var.get()
         try:
@@ -2933,7 +2888,6 @@ class SalesTouchView(SalesView):
         self.last_payment_method = payment_method
         self.last_amount_received = amount_paid
         self.last_change = amount_paid - self.total if amount_paid >= self.total else 0.0
-        self.last_sale_document_number = sale_document_number
         self.last_doc_type = doc_type_full
         
         # Discount logic
@@ -2945,13 +2899,62 @@ class SalesTouchView(SalesView):
         elif difference < -0.001:
             self.last_discount_text = f"DSCTO.: S/ {abs(difference):.2f}"
             
+        # --- Comprobante electrónico: se encola con la venta y lo envía cpe_dispatcher ---
+        cpe_payload = None
+        json_config = config_manager.load_setting('json_generation', 'Si')
+        if json_config == 'Si' and internal_doc_type != "NOTA DE VENTA":
+            current_issuer_data = {}
+            for i_data in self.issuers.get(issuer_name, []):
+                if i_data['id'] == issuer_id:
+                    current_issuer_data = i_data
+                    break
+            cpe_payload = {
+                "caja_id": self.caja_id,
+                "issuer": {
+                    "ruc": current_issuer_data.get('ruc') or "20000000001",
+                    "name": issuer_name,
+                    "commercial_name": current_issuer_data.get('commercial_name', ''),
+                    "address": selected_address,
+                    "establishment_code": current_issuer_data.get('establishment_code') or "0000"
+                },
+                "customer": {
+                    "doc_type": "6" if len(customer_doc) == 11 else "1",
+                    "doc_number": customer_doc,
+                    "name": customer_name,
+                    "address": customer_address
+                },
+                "document": {
+                    "type_name": doc_type_full,
+                    "issue_date": sale_date,
+                    "currency": "PEN",
+                    "total": self.total
+                },
+                "items": [{
+                    "description": item['name'],
+                    "quantity": item['quantity'],
+                    "price_unit_inc_igv": item['price'],
+                    "unit_code": item.get('unit_of_measure', 'NIU')
+                } for item in self.cart],
+                "totals": {}
+            }
+
         try:
-            sale_id = database.record_sale(issuer_id, customer_id, self.total, self.cart, sale_date, observations, internal_doc_type, sale_document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address)
-            
-            if internal_doc_type in ["BOLETA", "FACTURA", "NOTA DE VENTA"]:
-                for item in self.cart: database.decrease_product_stock(item['id'], item['quantity'])
-            elif internal_doc_type in ["NOTA_CREDITO_BOLETA", "NOTA_CREDITO_FACTURA"]:
-                for item in self.cart: database.increase_product_stock(item['id'], item['quantity'])
+            # Correlativo, cliente, venta, detalles, stock y envío pendiente en una sola transacción
+            sale = database.checkout(issuer_id, internal_doc_type,
+                                     (customer_doc, customer_name, customer_phone, customer_address),
+                                     self.cart, self.total, sale_date, observations,
+                                     payment_method, amount_paid, payment_method2, amount_paid2,
+                                     payment_destination, customer_address,
+                                     default_series="NV01" if internal_doc_type == "NOTA DE VENTA" else None,
+                                     cpe_payload=cpe_payload)
+            if sale is None:
+                messagebox.showerror("Error de Configuración", f"No se ha configurado un correlativo para '{doc_type_full}'.\nPor favor, configúrelo en el módulo de Configuración.", parent=modal)
+                return
+
+            sale_id = sale['sale_id']
+            series, number = sale['series'], sale['number']
+            sale_document_number = sale['document_number']
+            self.last_sale_document_number = sale_document_number
             
             config_manager.save_setting('last_issuer_id', issuer_id)
             
@@ -2976,158 +2979,12 @@ class SalesTouchView(SalesView):
                 except Exception as print_error:
                     print(f"Printing error: {print_error}")
 
-            # --- JSON Generation for Electronic Invoicing ---
-            json_config = config_manager.load_setting('json_generation', 'Si')
-            print(f"DEBUG: JSON Config: '{json_config}', Internal Doc Type: '{internal_doc_type}'")
-            if json_config == 'Si' and internal_doc_type != "NOTA DE VENTA":
-                try:
-                    # Re-find issuer data to get RUC
-                    issuer_ruc = ""
-                    current_issuer_data = {}
-                    if issuer_name in self.issuers:
-                        for i_data in self.issuers[issuer_name]:
-                            if i_data['id'] == issuer_id:
-                                current_issuer_data = i_data
-                                issuer_ruc = i_data.get('ruc', '20000000001')
-                                establishment_code = i_data.get('establishment_code', '0000')
-                                commercial_name = i_data.get('commercial_name', '')
-                                break
-                    if not issuer_ruc: issuer_ruc = "20000000001"
-                    if not establishment_code: establishment_code = "0000"
-                    
-                    json_sale_data = {
-                        "issuer": {
-                            "ruc": issuer_ruc,
-                            "name": issuer_name,
-                            "commercial_name": commercial_name,
-                            "address": selected_address,
-                            "establishment_code": establishment_code
-                        },
-                        "customer": {
-                            "doc_type": "6" if len(customer_doc) == 11 else "1",
-                            "doc_number": customer_doc,
-                            "name": customer_name,
-                            "address": customer_address
-                        },
-                        "document": {
-                            "type_name": doc_type_full,
-                            "series": series,
-                            "number": number,
-                            "issue_date": datetime.strptime(sale_date, "%Y-%m-%d %H:%M:%S"),
-                            "currency": "PEN",
-                            "total": self.total
-                        },
-                        "items": [],
-                        "totals": {} 
-                    }
-                    
-                    # Map Items
-                    for item in self.cart: 
-                        json_sale_data["items"].append({
-                            "description": item['name'],
-                            "quantity": item['quantity'],
-                            "price_unit_inc_igv": item['price'],
-                            "unit_code": item.get('unit_of_measure', 'NIU')
-                        })
-
-                    # Generate
-                    # Generate
-                    base_project_dir = r"c:\Users\USUARIO\Mi unidad (eddiejhersson1@gmail.com)\Proyecto tkinter"
-                    json_dir = os.path.join(base_project_dir, "SEE Electronica", "JSON Apisunat")
-                    
-                    gen = json_generator.JSONGenerator(json_dir)
-                    json_path = gen.generate_invoice_json(json_sale_data)
-                    print(f"JSON Generated: {json_path}")
-                    
-                    # --- XML Generation, Signing & Sending ---
-                    try:
-                        import xml_generator
-                        base_see_dir = os.path.join(base_project_dir, "SEE Electronica")
-                        xml_gen = xml_generator.XMLGenerator(base_see_dir)
-                        xml_result = xml_gen.generate_and_send(json_sale_data, current_issuer_data)
-                        print(f"XML Process: {xml_result}")
-                        
-                        status = "PENDIENTE"
-                        note = ""
-                        cdr_path = None
-
-                        if not xml_result.get('success'):
-                            status = "ERROR_LOCAL"
-                            note = xml_result.get('error', 'Error desconocido')
-                            # messagebox.showwarning("Alerta Facturación", f"Error en envío XML: {note}", parent=modal)
-                        else:
-                            # Parse SOAP Response
-                            xml_resp = xml_result.get('response', '')
-                            try:
-                                # Simplistic parsing to find status
-                                if "Fault" in xml_resp:
-                                    status = "RECHAZADO"
-                                    if "<faultstring>" in xml_resp:
-                                        note = xml_resp.split("<faultstring>")[1].split("</faultstring>")[0]
-                                    elif ":faultstring>" in xml_resp: # ns handling
-                                        note = xml_resp.split(":faultstring>")[1].split("</")[0]
-                                    else:
-                                        note = "Error SOAP desconocido"
-                                    
-                                    # Show Msg
-                                    messagebox.showerror("RECHAZADO", f"SUNAT Rechazó el comprobante:\n{note}", parent=modal)
-
-                                    # WhatsApp Alert
-                                    alert_receivers = current_issuer_data.get('cpe_alert_receivers')
-                                    # Note: current_issuer_data comes from self.issuers cache. 
-                                    # If DB updated but cache not, it might missing.
-                                    # Safe look up from DB directly if critical?
-                                    # For now assume cache is okay after restart context.
-                                    if alert_receivers:
-                                        try:
-                                            import whatsapp_manager
-                                            msg = f"⚠ *Alerta CPE Rechazado*\n📄 *{doc_type_full}*: {series}-{number}\n❌ *Error*: {note}"
-                                            for receiver in alert_receivers.split(','):
-                                                r = receiver.strip()
-                                                if r:
-                                                    whatsapp_manager.baileys_manager.send_message(r, msg)
-                                        except Exception as e_wa:
-                                            print(f"WA Alert Error: {e_wa}")
-
-                                elif "ticket" in xml_resp:
-                                    status = "PENDIENTE"
-                                    if "<ticket>" in xml_resp:
-                                        note = "Ticket: " + xml_resp.split("<ticket>")[1].split("</ticket>")[0]
-                                    messagebox.showwarning("PENDIENTE", f"Envío procesado. Estado: PENDIENTE\n{note}", parent=modal)
-
-                                elif "applicationResponse" in xml_resp:
-                                    status = "ACEPTADO"
-                                    note = "Aceptado correctamente"
-                                    
-                                    # Extract CDR?
-                                    # Saving CDR is done via checking getStatusCdr later usually, but getStatus returns CDR.
-                                    # If we have applicationResponse (CDR), we should save it.
-                                    # It's base64 inside <applicationResponse>.
-                                    # For now, just mark status.
-                                    messagebox.showinfo("ACEPTADO", "Documento ACEPTADO por SUNAT.", parent=modal)
-
-                                else:
-                                    # Unknown response
-                                    status = "ERROR_RESPUESTA"
-                                    note = "Respuesta SOAP no reconocida."
-
-                            except Exception as e_parse:
-                                status = "ERROR_PARSEO"
-                                note = str(e_parse)
-
-                        # Update DB
-                        database.update_sale_sunat_status(sale_id, status, note, cdr_path)
-                            
-                    except Exception as e_xml:
-                        print(f"Critical XML Error: {e_xml}")
-                    
-                except Exception as e_json:
-                    print(f"Error generating JSON: {e_json}")
-                    # We do not block the sale for this error, just log/notify
-            
+            if cpe_payload is not None and cpe_dispatcher.dispatcher:
+                cpe_dispatcher.dispatcher.wake()
+
             modal.destroy()
+            # reset_system vuelve a cargar los productos (solo los cambiados, vía el catálogo compartido)
             self.reset_system()
-            self.load_products_from_db()
             
         except Exception as e:
             messagebox.showerror("Error Crítico", f"Ocurrió un error al procesar la venta.\n{e}", parent=modal)
@@ -3224,110 +3081,121 @@ class SalesTouchView(SalesView):
                 self.handle_scan()
                 return
 
-            # Fuzzy Search
-            # Filter products by name or code
-            search_query = code.lower()
-            filtered_products = []
-            
-            for p in self.products.values():
-                if search_query in p['name'].lower() or search_query in str(p.get('code', '')).lower():
-                    filtered_products.append(p)
-            
-            # Display Results
-            self._display_search_results(filtered_products)
+            # Fuzzy Search: se espera a que termine de escribir (el lector de códigos no llega aquí)
+            self._schedule_search(code)
 
         except Exception as e:
             print(f"Search Error: {e}")
 
+    def _schedule_search(self, query):
+        if getattr(self, '_search_job', None):
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(product_search.SEARCH_DEBOUNCE_MS, lambda: self._run_search(query))
+
+    def _run_search(self, query):
+        self._search_job = None
+        if self.scan_var.get().strip() != query:
+            return
+        try:
+            # Índice del catálogo compartido; se muestran las copias de esta vista (stock del carrito)
+            results = [self._id_to_product_map.get(str(entry['id'])) for entry in self.catalog.search(query)]
+            self._display_search_results([p for p in results if p is not None])
+        except Exception as e:
+            print(f"Search Error: {e}")
+
     def _display_search_results(self, products):
-        # Clear grid
-        for widget in self.product_grid_frame.winfo_children():
-            widget.destroy()
-        self.product_buttons = {}
-        
-        # Grid layout logic (Copying from show_products_for_category)
-        width = self.product_grid_frame.winfo_width()
-        if width <= 100: width = self.winfo_screenwidth() * 0.65 
-        columns = max(4, int(width / 185)) 
+        reservations = state_manager.ReservationSnapshot.load(exclude_caja_id=self.caja_id)
+        stock_warning_limit = self.stock_warning_limit
 
-        for i, prod in enumerate(products):
-            row = i // columns
-            col = i % columns
-            
-            # Button content
-            current_stock_mem = prod.get('stock', 0)
+        items = []
+        for prod in products:
             p_id = str(prod['id'])
             
             # --- VISUAL SYNC ---
-            reserved_others = state_manager.get_global_reserved_quantity(str(prod['id']), exclude_caja_id=self.caja_id)
-            effective_visual_stock = current_stock_mem - reserved_others
+            effective_visual_stock = prod.get('stock', 0) - reservations.get(p_id)
             
             wrapped_name = textwrap.fill(prod['name'], width=20)
             text = f"{wrapped_name}\nS/ {prod['price']:.2f}\nStock: {effective_visual_stock:.2f}"
             
             # Style
             custom_color = self.product_colors.get(p_id)
-            c1 = "#e0e0e0"
-            c2 = "#bdbdbd"
-            txt_col = "#333333"
-            
             if custom_color:
                 c1 = custom_color
                 c2 = custom_color
                 txt_col = "white" 
+            elif stock_warning_limit > 0 and effective_visual_stock <= stock_warning_limit:
+                c1 = POS_ACCENT_RED
+                c2 = POS_ACCENT_RED
+                txt_col = "white"
             else:
-                stock_warning_limit = config_manager.load_setting('stock_warning_limit', 0)
-                if stock_warning_limit > 0 and effective_visual_stock <= stock_warning_limit:
-                    c1 = POS_ACCENT_RED
-                    c2 = POS_ACCENT_RED
-                    txt_col = "white"
-                else:
-                    c1 = "#f8f9fa" 
-                    c2 = "#e0e0e0"
-                    txt_col = "black"
+                c1 = "#f8f9fa" 
+                c2 = "#e0e0e0"
+                txt_col = "black"
 
-            # Prepare Image (simplified, no cache list mgmt for now to be safe/fast, or rely on GC? cache list is safer)
-            # We must manage self.product_image_refs!
-            if i == 0: self.product_image_refs = [] # Reset on start of render loop? No, this function runs once per search.
-            
-            photo_for_btn = None
-            if prod.get('image'):
-                try:
-                    img = Image.open(io.BytesIO(prod['image']))
-                    img.thumbnail((50, 50))
-                    photo = ImageTk.PhotoImage(img)
-                    self.product_image_refs.append(photo)
-                    photo_for_btn = photo
-                except: pass
+            items.append((prod, {"text": text, "color1": c1, "color2": c2, "text_color": txt_col,
+                                 "image": self._product_photo(prod)}))
 
-            btn = GradientButton(
-                self.product_grid_frame,
-                text=text,
-                command=lambda p=prod: self.add_product_to_cart(p), 
-                color1=c1,
-                color2=c2,
-                text_color=txt_col,
-                width=160,
-                height=80,
-                corner_radius=10,
-                image=photo_for_btn
-            )
-            
-            # Rebind Drag/Context
-            btn.bind("<ButtonPress-1>", lambda e, p=prod, b=btn: self.start_drag(e, p, b, "product"))
-            btn.bind("<Button-3>", lambda e, p=prod: self.show_product_context_menu(e, p))
-            
-            btn.grid(row=row, column=col, padx=5, pady=5, sticky="nsew")
-            
-            try:
-                self.product_buttons[int(prod['id'])] = btn
-            except:
-                self.product_buttons[prod['id']] = btn
-            
-            self.product_grid_frame.columnconfigure(col, weight=1)
-            self.product_grid_frame.rowconfigure(row, weight=1)
+        self._show_product_tiles(items)
+
+    def _product_grid_columns(self):
+        # Calculate columns dynamically
+        width = self.product_grid_frame.winfo_width()
+        if width <= 100: 
+             # Approximation if not rendered yet (SalesTouchView is usually full screen)
+             width = self.winfo_screenwidth() * 0.65 
+        # Target button width approx 160-180px + padding
+        return max(4, int(width / 185))
 
+    def _show_product_tiles(self, items):
+        """Muestra los productos reutilizando los botones del pool: solo se tocan los que cambian."""
+        tiles = self.product_tile_pool.update(items, self._product_grid_columns())
+        self.last_cols = self.product_tile_pool.columns
 
+        # Store button references by product ID
+        self.product_buttons = {}
+        for btn in tiles:
+            try:
+                self.product_buttons[int(btn.data['id'])] = btn
+            except:
+                self.product_buttons[btn.data['id']] = btn
+
+    def _new_product_tile(self, options):
+        btn = GradientButton(
+            self.product_grid_frame,
+            width=160,
+            height=80,
+            corner_radius=10,
+            border_color=None,
+            **options
+        )
+        # El botón se reasigna a otros productos: los eventos leen el producto actual en btn.data
+        btn.configure(command=lambda: self.add_product_to_cart(btn.data))
+        # Bind Drag
+        btn.bind("<ButtonPress-1>", lambda e: self.start_drag(e, btn.data, btn, "product"))
+        # Context Menu
+        btn.bind("<Button-3>", lambda e: self.show_product_context_menu(e, btn.data))
+        return btn
+
+    def _product_photo(self, prod):
+        """Miniatura del producto si ya está lista; si no, se pide en segundo plano y llega luego."""
+        photo = self.thumbnails.get(prod['id'], prod.get('image_hash'), self._on_thumbnail_ready)
+        if photo is None and self.thumbnails.pending and not self._thumbnail_poll_job:
+            self._thumbnail_poll_job = self.after(THUMBNAIL_POLL_MS, self._poll_thumbnails)
+        return photo
+
+    def _poll_thumbnails(self):
+        self._thumbnail_poll_job = None
+        self.thumbnails.deliver()
+        if self.thumbnails.pending:
+            self._thumbnail_poll_job = self.after(THUMBNAIL_POLL_MS, self._poll_thumbnails)
+
+    def _on_thumbnail_ready(self, product_id, photo):
+        try:
+            btn = self.product_buttons.get(int(product_id))
+        except ValueError:
+            btn = self.product_buttons.get(product_id)
+        if btn and btn.winfo_exists() and str(btn.data['id']) == str(product_id):
+            btn.update_options(image=photo)
 
     def _persist_state(self):
         state = {
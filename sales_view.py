@@ -13,6 +13,9 @@ from PIL import Image
 import qrcode
 import utils
 import state_manager
+import product_catalog
+import product_search
+import person_lookup
 
 try:
     import win32print
@@ -526,6 +529,7 @@ class SalesView(ttk.Frame):
         self.address_combo.bind("<<ComboboxSelected>>", self.on_address_select)
         self.customer_name_var.trace_add('write', lambda *args: self.update_ticket_preview())
         self.customer_doc_var.trace_add('write', lambda *args: self.update_ticket_preview())
+        self.customer_doc_var.trace_add('write', lambda *args: self._prefetch_customer_doc())
         self.doc_type_combo.bind("<<ComboboxSelected>>", self.on_doc_type_select)
         self.customer_doc_entry.bind("<Return>", self.search_customer)
         self.customer_doc_entry.bind("<KP_Enter>", self.search_customer)
@@ -666,7 +670,16 @@ class SalesView(ttk.Frame):
         if len(search_term) < 2:
             return
 
-        # Buscar en DB
+        # Buscar en DB (índice FTS) cuando deja de escribir, no en cada tecla
+        if getattr(self, '_customer_search_job', None):
+            self.after_cancel(self._customer_search_job)
+        self._customer_search_job = self.after(product_search.SEARCH_DEBOUNCE_MS,
+                                               lambda: self._run_customer_search(search_term))
+
+    def _run_customer_search(self, search_term):
+        self._customer_search_job = None
+        if self.customer_name_var.get().strip() != search_term:
+            return
         results = database.search_customers_general(search_term)
         
         # Actualizar valores del combobox
@@ -675,8 +688,8 @@ class SalesView(ttk.Frame):
         self.customer_search_results = {} # Guardar referencia para recuperar datos al seleccionar
         
         for row in results:
-            # row: id, type, doc_number, name, phone, address, alias
-            display_text = f"{row[3]} | {row[2]}"
+            # row (SELECT * FROM customers): id, doc_number, name, phone, address, type, alias
+            display_text = f"{row[2]} | {row[1]}"
             if row[6]: # Si tiene alias
                 display_text += f" ({row[6]})"
             
@@ -761,15 +774,19 @@ class SalesView(ttk.Frame):
         self.customer_doc_entry.select_range(0, 'end')
         self.save_state()
 
+    def _prefetch_customer_doc(self):
+        # Con el documento completo la consulta se adelanta: al pulsar Enter ya está en caché
+        if not hasattr(self, '_doc_prefetch'):
+            self._doc_prefetch = person_lookup.TypingPrefetch(self)
+        self._doc_prefetch.typed(self.customer_doc_var.get(), ruc_only="FACTURA" in self.doc_type_var.get())
+
     def fetch_customer_data(self, doc):
-        # Usar el nuevo cliente de API
-        import api_client
-        
         try:
             self.after(0, lambda: self.customer_name_var.set("Buscando..."))
             
             # Ejecutar búsqueda (esto ya corre en un thread separado desde search_customer)
-            result = api_client.get_person_data(doc)
+            # Clientes locales, luego la caché de consultas y por último la API
+            result = person_lookup.lookup(doc)
             
             if result and result.get("success"):
                 data = result.get("data", {})
@@ -1807,7 +1824,6 @@ class SalesView(ttk.Frame):
         if self.total > 2000 and internal_doc_type in ["BOLETA", "FACTURA"]:
              if not messagebox.askyesno("Advertencia de Bancarización", "Esta seguro de emitir el comprobante electrónico ya que supera los 2000 soles y necesita ser bancarizado?", parent=self.winfo_toplevel()):
                  return
-        customer_id = database.get_or_create_customer(customer_doc, customer_name, customer_phone, customer_address)
         sale_date = self.datetime_var.get()
         
         # PREVIEW Number for Prompt
@@ -1841,25 +1857,20 @@ class SalesView(ttk.Frame):
         
         if messagebox.askyesno("Confirmar Venta", f"Se generará el documento '{sale_document_number_preview}' por un total de S/ {self.total:.2f}. ¿Desea continuar?", parent=self.winfo_toplevel()):
             try:
-                # NOW Increment the counter Transactionally
-                final_series, final_number = database.get_next_correlative(issuer_id, internal_doc_type)
-                
-                # Use the actual reserved number
-                sale_document_number = f"{final_series}-{final_number}"
-                
+                # NOW reserve the number, customer, sale and stock in one transaction
+                sale = database.checkout(issuer_id, internal_doc_type,
+                                         (customer_doc, customer_name, customer_phone, customer_address),
+                                         self.cart, self.total, sale_date, observations,
+                                         payment_method, amount_paid, payment_method2, amount_paid2,
+                                         payment_destination, customer_address,
+                                         default_series="NV01" if internal_doc_type == "NOTA DE VENTA" else None)
+                if sale is None:
+                    messagebox.showerror("Error de Configuración", f"No se ha configurado un correlativo para '{doc_type_full}'.\nPor favor, configúrelo en el módulo de Configuración.", parent=self.winfo_toplevel())
+                    return
+
                 # Update stored doc number for printing with the REAL one
+                sale_document_number = sale['document_number']
                 self.last_sale_document_number = sale_document_number
-                
-                # Determine Document Type for Database Storage
-                db_doc_type = internal_doc_type
-                if internal_doc_type == "NOTA DE VENTA" and doc_type_full == "NOTA DE VENTA":
-                    db_doc_type = "NOTA DE VENTA"
-
-                database.record_sale(issuer_id, customer_id, self.total, self.cart, sale_date, observations, db_doc_type, sale_document_number, payment_method, amount_paid, payment_method2, amount_paid2, payment_destination, customer_address)
-                if internal_doc_type in ["BOLETA", "FACTURA", "NOTA DE VENTA"]:
-                    for item in self.cart: database.decrease_product_stock(item['id'], item['quantity'])
-                elif internal_doc_type in ["NOTA_CREDITO_BOLETA", "NOTA_CREDITO_FACTURA"]:
-                    for item in self.cart: database.increase_product_stock(item['id'], item['quantity'])
                 config_manager.save_setting('last_issuer_id', issuer_id)
                 # messagebox.showinfo("Éxito", f"{doc_type_full} generada con el número {sale_document_number}.", parent=self.winfo_toplevel()) # Removed or keep? User might want confirmation
                 # Just show message, then print, then reset.
@@ -1893,8 +1904,13 @@ class SalesView(ttk.Frame):
         self.product_combo.focus()
 
     def load_products_from_db(self, issuer_name=None, issuer_address=None):
-        all_products_rows = database.get_all_products(issuer_name, issuer_address)
-        self.products = {row[1]: {'id': row[0], 'price': row[2], 'stock': row[3], 'code': row[4], 'unit_of_measure': row[5]} for row in all_products_rows}
+        # Catálogo compartido: solo se releen los productos cambiados desde la última vez
+        catalog = product_catalog.get_catalog(issuer_name, issuer_address)
+        catalog.sync()
+        self.catalog = catalog
+        catalog.prepare_search()
+        self.products = {p['name']: {'id': p['id'], 'price': p['price'], 'stock': p['stock'], 'code': p['code'], 'unit_of_measure': p['unit_of_measure']}
+                         for p in catalog.products()}
         if hasattr(self, 'product_combo'):
              self.product_combo['values'] = list(self.products.keys())
              self.product_var.set("") # Clear selection when reloading
@@ -2124,24 +2140,25 @@ class SalesView(ttk.Frame):
 
     def filter_products(self, event):
         typed = self.product_combo.get()
-        all_product_names = list(self.products.keys())
         if not typed:
-            self.product_combo['values'] = all_product_names
+            self.product_combo['values'] = list(self.products.keys())
             if event.keysym == 'Down':
                 self.product_combo.event_generate('<Down>')
-        else:
-            # Search by Name OR Code
-            filtered_list = []
-            for name, data in self.products.items():
-                code = data.get('code', '')
-                if code is None: code = ""
-                
-                if typed.lower() in name.lower() or typed.lower() in str(code).lower():
-                    filtered_list.append(name)
-            
-            self.product_combo['values'] = filtered_list
-            if filtered_list:
-                self.product_combo.event_generate('<Down>')
+            return
+        # Search by Name OR Code, una vez que deja de escribir
+        if getattr(self, '_filter_job', None):
+            self.after_cancel(self._filter_job)
+        self._filter_job = self.after(product_search.SEARCH_DEBOUNCE_MS, lambda: self._apply_product_filter(typed))
+
+    def _apply_product_filter(self, typed):
+        self._filter_job = None
+        catalog = getattr(self, 'catalog', None)
+        if catalog is None or self.product_combo.get() != typed:
+            return
+        filtered_list = [p['name'] for p in catalog.search(typed) if p['name'] in self.products]
+        self.product_combo['values'] = filtered_list
+        if filtered_list:
+            self.product_combo.event_generate('<Down>')
 
     def open_cash_count(self):
         # Check permissions
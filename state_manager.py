@@ -1,77 +1,187 @@
 import json
 import os
-import time
+import threading
+
+import database
 
 # Use absolute path relative to this script
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Formato anterior (un único JSON para todas las cajas); se importa una vez y se renombra.
 STATE_FILE = os.path.join(BASE_DIR, 'sales_state.json')
 
-def load_all_states():
+# El estado vive en SQLite (tablas box_states y cart_reservations) para que varias
+# cajas/procesos escriban a la vez sin reescribir el estado de las demás.
+# Cada caja recuerda lo último que guardó y solo escribe las líneas que cambiaron.
+_lock = threading.Lock()
+_schema_ready = set()   # rutas de BD ya preparadas en este proceso
+_saved = {}             # (db_path, caja_id) -> (meta_json, {line: (product_id, quantity, item_json)})
+
+
+def _ensure_schema():
+    db_path = database.DB_PATH
+    if db_path in _schema_ready:
+        return
+    with _lock:
+        if db_path in _schema_ready:
+            return
+        with database.get_connection() as conn:
+            database.create_cart_reservations_tables(conn)
+            _import_legacy_file(conn)
+        _schema_ready.add(db_path)
+
+
+def _import_legacy_file(conn):
+    """Migra sales_state.json (si existe) a las tablas la primera vez."""
     if not os.path.exists(STATE_FILE):
-        return {}
-    
-    # Retry mechanism for robustness
-    max_retries = 3
-    for attempt in range(max_retries):
+        return
+    if conn.execute("SELECT 1 FROM box_states LIMIT 1").fetchone():
+        return
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        states = json.loads(content) if content else {}
+    except Exception as e:
+        print(f"Error importing legacy state: {e}")
+        return
+
+    for caja_id, data in states.items():
+        meta_json, rows = _split_state(data)
+        conn.execute("INSERT OR REPLACE INTO box_states (caja_id, data) VALUES (?, ?)", (str(caja_id), meta_json))
+        conn.executemany("INSERT OR REPLACE INTO cart_reservations (caja_id, line, product_id, quantity, item) VALUES (?, ?, ?, ?, ?)",
+                         [(str(caja_id), line, *row) for line, row in rows.items()])
+    conn.commit()
+    try:
+        os.replace(STATE_FILE, STATE_FILE + '.migrated')
+    except OSError as e:
+        print(f"Could not rename legacy state file: {e}")
+
+
+def _split_state(data):
+    """Separa la cabecera (todo menos el carrito) de las líneas del carrito."""
+    meta = {k: v for k, v in data.items() if k != 'cart'}
+    rows = {}
+    for line, item in enumerate(data.get('cart') or []):
         try:
-            with open(STATE_FILE, 'r', encoding='utf-8') as f:
-                # Validate content isn't empty on read
-                content = f.read().strip()
-                if not content: return {}
-                return json.loads(content)
-        except Exception as e:
-            if attempt == max_retries - 1:
-                print(f"Error loading state after retries: {e}")
-                return {}
-            time.sleep(0.05) # Wait 50ms before retry
-    return {}
+            quantity = float(item.get('quantity', 0))
+        except (TypeError, ValueError):
+            quantity = 0.0
+        product_id = item.get('id')
+        rows[line] = (str(product_id) if product_id is not None else None, quantity, json.dumps(item))
+    return json.dumps(meta), rows
+
+
+def _load_saved(conn, caja_id):
+    row = conn.execute("SELECT data FROM box_states WHERE caja_id = ?", (caja_id,)).fetchone()
+    meta_json = row[0] if row else None
+    rows = {line: (product_id, quantity, item) for line, product_id, quantity, item in
+            conn.execute("SELECT line, product_id, quantity, item FROM cart_reservations WHERE caja_id = ?", (caja_id,))}
+    return meta_json, rows
+
+
+def load_all_states():
+    _ensure_schema()
+    states = {}
+    with database.get_connection() as conn:
+        for caja_id, data in conn.execute("SELECT caja_id, data FROM box_states"):
+            try:
+                states[caja_id] = json.loads(data) if data else {}
+            except ValueError:
+                states[caja_id] = {}
+            states[caja_id]['cart'] = []
+        for caja_id, item in conn.execute("SELECT caja_id, item FROM cart_reservations ORDER BY caja_id, line"):
+            states.setdefault(caja_id, {'cart': []})['cart'].append(json.loads(item))
+    return states
+
 
 def save_box_state(caja_id, data):
-    states = load_all_states()
-    states[str(caja_id)] = data
+    _ensure_schema()
+    caja_id = str(caja_id)
+    key = (database.DB_PATH, caja_id)
+    meta_json, rows = _split_state(data)
     try:
-        with open(STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(states, f, indent=4)
+        with database.transaction() as conn:
+            if key not in _saved:
+                _saved[key] = _load_saved(conn, caja_id)
+            old_meta, old_rows = _saved[key]
+
+            if meta_json != old_meta:
+                conn.execute("INSERT OR REPLACE INTO box_states (caja_id, data) VALUES (?, ?)", (caja_id, meta_json))
+
+            changed = [(caja_id, line, *row) for line, row in rows.items() if old_rows.get(line) != row]
+            removed = [(caja_id, line) for line in old_rows if line not in rows]
+            if changed:
+                # Upsert (no REPLACE) para que el trigger del feed vea también el producto anterior de la línea
+                conn.executemany("INSERT INTO cart_reservations (caja_id, line, product_id, quantity, item) VALUES (?, ?, ?, ?, ?) "
+                                 "ON CONFLICT(caja_id, line) DO UPDATE SET product_id = excluded.product_id, "
+                                 "quantity = excluded.quantity, item = excluded.item", changed)
+            if removed:
+                conn.executemany("DELETE FROM cart_reservations WHERE caja_id = ? AND line = ?", removed)
+        _saved[key] = (meta_json, rows)
     except Exception as e:
+        _saved.pop(key, None)
         print(f"Error saving state: {e}")
 
+
 def clear_box_state(caja_id):
-    states = load_all_states()
-    if str(caja_id) in states:
-        del states[str(caja_id)]
-        try:
-            with open(STATE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(states, f, indent=4)
-        except Exception as e:
-            print(f"Error clearing state: {e}")
+    _ensure_schema()
+    caja_id = str(caja_id)
+    try:
+        with database.transaction() as conn:
+            conn.execute("DELETE FROM cart_reservations WHERE caja_id = ?", (caja_id,))
+            conn.execute("DELETE FROM box_states WHERE caja_id = ?", (caja_id,))
+        _saved[(database.DB_PATH, caja_id)] = (None, {})
+    except Exception as e:
+        _saved.pop((database.DB_PATH, caja_id), None)
+        print(f"Error clearing state: {e}")
+
 
 def has_pending_items():
-    states = load_all_states()
-    for caja_id, data in states.items():
-        if data.get('cart') and len(data['cart']) > 0:
-            return True
-    return False
+    _ensure_schema()
+    with database.get_connection() as conn:
+        return conn.execute("SELECT 1 FROM cart_reservations LIMIT 1").fetchone() is not None
+
 
 def get_global_reserved_quantity(product_id, exclude_caja_id=None):
     """
     Calcula la cantidad total de un producto que está 'reservada' en los carritos
     de otras cajas (o todas si exclude_caja_id es None).
     """
-    states = load_all_states()
-    total_reserved = 0.0
-    
-    for caja_id, data in states.items():
-        # Skip our own caja (since we calculate our own addition separately or it's not relevant for 'others')
-        if exclude_caja_id is not None and str(caja_id) == str(exclude_caja_id):
-            continue
-            
-        cart = data.get('cart', [])
-        for item in cart:
-            try:
-                # Check ID match (converting to str/int to be safe)
-                if str(item.get('id')) == str(product_id):
-                    total_reserved += float(item.get('quantity', 0))
-            except:
-                pass
-                
-    return total_reserved
+    _ensure_schema()
+    sql = "SELECT COALESCE(SUM(quantity), 0) FROM cart_reservations WHERE product_id = ?"
+    params = [str(product_id)]
+    if exclude_caja_id is not None:
+        sql += " AND caja_id != ?"
+        params.append(str(exclude_caja_id))
+    with database.get_connection() as conn:
+        return float(conn.execute(sql, params).fetchone()[0])
+
+
+def get_reserved_quantities(exclude_caja_id=None):
+    """Reservas de todos los productos en una sola consulta: {product_id (str): cantidad}."""
+    _ensure_schema()
+    sql = "SELECT product_id, SUM(quantity) FROM reserved_quantities"
+    params = []
+    if exclude_caja_id is not None:
+        sql += " WHERE caja_id != ?"
+        params.append(str(exclude_caja_id))
+    sql += " GROUP BY product_id"
+    with database.get_connection() as conn:
+        return {product_id: float(qty or 0) for product_id, qty in conn.execute(sql, params) if product_id is not None}
+
+
+class ReservationSnapshot:
+    """Reservas de las demás cajas leídas una sola vez por pasada de dibujado de la grilla."""
+
+    def __init__(self, quantities, exclude_caja_id=None):
+        self.quantities = quantities
+        self.exclude_caja_id = exclude_caja_id
+
+    @classmethod
+    def load(cls, exclude_caja_id=None):
+        return cls(get_reserved_quantities(exclude_caja_id), exclude_caja_id)
+
+    def get(self, product_id):
+        return self.quantities.get(str(product_id), 0.0)
+
+    def __len__(self):
+        return len(self.quantities)
@@ -0,0 +1,198 @@
+"""
+Decodificador único de las respuestas SOAP de SUNAT (sendBill, sendSummary/sendPack,
+getStatus, getStatusCdr) y del CDR que traen en base64.
+
+Las respuestas se leen con iterparse (incremental, sin depender del prefijo de
+namespace que use el servidor) y el CDR se descomprime en memoria para leer el
+ResponseCode, la descripción y las observaciones del ApplicationResponse.
+"""
+import base64
+import binascii
+import io
+import zipfile
+
+try:
+    from lxml import etree
+    _PARSER_OPTIONS = {"resolve_entities": False, "no_network": True}
+except ImportError:
+    # Solo se usa iterparse, que ElementTree también implementa (sin resolver entidades externas)
+    import xml.etree.ElementTree as etree
+    _PARSER_OPTIONS = {}
+
+# Estados de la venta (sales.sunat_status) que se derivan de la respuesta
+STATUS_ACCEPTED = "ACEPTADO"
+STATUS_REJECTED = "RECHAZADO"
+STATUS_PENDING = "PENDIENTE"
+
+# getStatus: 98 = en proceso, 0 = procesado correctamente, 99 = procesado con errores
+TICKET_IN_PROCESS = "98"
+# statusCode que indican aceptación: 0 (getStatus), 0001 (getStatusCdr, existe y está aceptado)
+_ACCEPTED_STATUS_CODES = {"0", "0001"}
+# statusCode que indican rechazo: 99 (getStatus, procesado con errores), 0002 (getStatusCdr, existe y está rechazado)
+_REJECTED_STATUS_CODES = {"99", "0002"}
+
+
+class SunatResponse:
+    """
+    Resultado de decodificar una respuesta de SUNAT.
+    kind: 'cdr' (trae CDR), 'ticket', 'status' (getStatus/getStatusCdr sin CDR), 'fault' o 'unknown'.
+    status: ACEPTADO / RECHAZADO / PENDIENTE, o None si la respuesta no se reconoce.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.kind = "unknown"
+        self.status = None
+        self.note = ""
+        self.fault_code = None
+        self.fault_string = None
+        self.ticket = None
+        self.status_code = None       # statusCode de getStatus / getStatusCdr
+        self.status_message = None
+        self.response_code = None     # cbc:ResponseCode del CDR
+        self.description = None       # cbc:Description del CDR
+        self.notes = []               # cbc:Note del CDR (observaciones)
+        self.reference_id = None      # comprobante al que responde el CDR
+        self.cdr_zip = None           # bytes del zip del CDR, listo para guardar
+        self.cdr_error = None         # motivo si el CDR vino pero no se pudo leer
+
+    @property
+    def accepted(self):
+        return self.status == STATUS_ACCEPTED
+
+    @property
+    def rejected(self):
+        return self.status == STATUS_REJECTED
+
+    @property
+    def pending(self):
+        return self.status == STATUS_PENDING
+
+    def __repr__(self):
+        return f"SunatResponse(kind={self.kind!r}, status={self.status!r}, note={self.note!r})"
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1] if isinstance(tag, str) else ""
+
+
+def _iter_elements(data):
+    """(nombre local, texto) de cada elemento al cerrarse; libera los ya leídos."""
+    for _, element in etree.iterparse(io.BytesIO(data), events=("end",), **_PARSER_OPTIONS):
+        yield _local(element.tag), (element.text or "").strip()
+        element.clear()
+
+
+def parse_response(raw):
+    """Decodifica la respuesta SOAP (texto o bytes) en un SunatResponse."""
+    result = SunatResponse(raw)
+    if not raw:
+        return result
+    data = raw.encode('utf-8') if isinstance(raw, str) else raw
+    cdr_b64 = None
+    try:
+        for name, text in _iter_elements(data):
+            if name == "faultcode":
+                result.fault_code = text
+            elif name == "faultstring":
+                result.fault_string = text
+            elif name == "applicationResponse" or name == "content":
+                cdr_b64 = text or cdr_b64
+            elif name == "ticket":
+                result.ticket = text
+            elif name == "statusCode":
+                result.status_code = text
+            elif name == "statusMessage":
+                result.status_message = text
+    except etree.ParseError as e:
+        result.note = f"Respuesta no es XML válido: {e}"
+        return result
+
+    if result.fault_string is not None or result.fault_code is not None:
+        result.kind = "fault"
+        result.status = STATUS_REJECTED
+        result.note = result.fault_string or result.fault_code or "Error SOAP desconocido"
+        return result
+
+    if cdr_b64:
+        result.kind = "cdr"
+        _read_cdr(result, cdr_b64)
+        if result.status is None:
+            # CDR ilegible: solo decide el statusCode de getStatusCdr. SUNAT también envía CDR al
+            # rechazar, así que en sendBill el estado queda sin definir y se vuelve a consultar.
+            if result.status_code in _REJECTED_STATUS_CODES:
+                result.status = STATUS_REJECTED
+                result.note = result.status_message or f"Rechazado (código {result.status_code})"
+            elif result.status_code in _ACCEPTED_STATUS_CODES:
+                result.status = STATUS_ACCEPTED
+                result.note = result.status_message or "Aceptado correctamente"
+            else:
+                result.note = result.cdr_error
+        return result
+
+    if result.ticket and result.status_code is None:
+        result.kind = "ticket"
+        result.status = STATUS_PENDING
+        result.note = f"Ticket: {result.ticket}"
+    elif result.status_code is not None:
+        result.kind = "status"
+        if result.status_code in _ACCEPTED_STATUS_CODES:
+            result.status = STATUS_ACCEPTED
+        elif result.status_code in _REJECTED_STATUS_CODES:
+            result.status = STATUS_REJECTED
+        else:
+            result.status = STATUS_PENDING
+        result.note = "En proceso (SUNAT)" if result.status_code == TICKET_IN_PROCESS else (result.status_message or f"Código {result.status_code}")
+    return result
+
+
+def _read_cdr(result, cdr_b64):
+    """Descomprime el CDR en memoria y completa response_code, description y notes."""
+    try:
+        result.cdr_zip = base64.b64decode(cdr_b64, validate=False)
+    except (binascii.Error, ValueError) as e:
+        result.cdr_error = f"CDR no es base64 válido: {e}"
+        return
+    try:
+        with zipfile.ZipFile(io.BytesIO(result.cdr_zip)) as zf:
+            names = [n for n in zf.namelist() if n.lower().endswith(".xml")]
+            if not names:
+                result.cdr_error = "El zip del CDR no contiene XML"
+                return
+            cdr_xml = zf.read(names[0])
+    except zipfile.BadZipFile as e:
+        result.cdr_error = f"CDR no es un zip válido: {e}"
+        return
+
+    # El ApplicationResponse trae un cbc:ResponseCode/Description por cada DocumentResponse;
+    # en un comprobante individual hay uno solo, se toma el primero.
+    try:
+        for name, text in _iter_elements(cdr_xml):
+            if name == "ResponseCode" and result.response_code is None:
+                result.response_code = text
+            elif name == "Description" and result.description is None:
+                result.description = text
+            elif name == "Note" and text:
+                result.notes.append(text)
+            elif name == "ReferenceID" and result.reference_id is None:
+                result.reference_id = text
+    except etree.ParseError as e:
+        result.cdr_error = f"XML del CDR inválido: {e}"
+        return
+
+    if result.response_code is None:
+        result.cdr_error = "CDR sin ResponseCode"
+        return
+    result.status = STATUS_ACCEPTED if is_accepted_code(result.response_code) else STATUS_REJECTED
+    result.note = result.description or f"Código {result.response_code}"
+    if result.notes:
+        result.note += " | Observaciones: " + "; ".join(result.notes)
+
+
+def is_accepted_code(response_code):
+    """0 aceptado; 4000 en adelante aceptado con observaciones; 0100-3999 excepción o rechazo."""
+    try:
+        code = int(response_code)
+    except (TypeError, ValueError):
+        return False
+    return code == 0 or code >= 4000
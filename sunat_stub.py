@@ -0,0 +1,149 @@
+"""
+Servidor SOAP local que imita los servicios de SUNAT (sendBill, sendSummary, sendPack,
+getStatus) para probar el envío de comprobantes sin salir a la red.
+
+Uso manual: python sunat_stub.py [puerto]  y configurar en el emisor la URL que imprime.
+"""
+import base64
+import io
+import re
+import sys
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _cdr_zip(filename_base, response_code="0", description="La Comunicacion ha sido aceptada", notes=()):
+    """CDR mínimo (zip con R-<archivo>.xml) en base64."""
+    note_xml = "".join(f"<cbc:Note>{note}</cbc:Note>" for note in notes)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        zf.writestr(f"R-{filename_base}.xml",
+                    '<ar:ApplicationResponse xmlns:ar="urn:oasis:names:specification:ubl:schema:xsd:ApplicationResponse-2" '
+                    'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+                    'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+                    f'{note_xml}<cac:DocumentResponse><cac:Response><cbc:ReferenceID>{filename_base}</cbc:ReferenceID>'
+                    f'<cbc:ResponseCode>{response_code}</cbc:ResponseCode><cbc:Description>{description}</cbc:Description>'
+                    '</cac:Response></cac:DocumentResponse></ar:ApplicationResponse>')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def _envelope(body):
+    return ('<soap-env:Envelope xmlns:soap-env="http://schemas.xmlsoap.org/soap/envelope/">'
+            f'<soap-env:Body>{body}</soap-env:Body></soap-env:Envelope>')
+
+
+def _fault(code, message):
+    return _envelope(f"<soap-env:Fault><faultcode>soap-env:Client.{code}</faultcode><faultstring>{message}</faultstring></soap-env:Fault>")
+
+
+class SunatStubServer:
+    """
+    Servidor en un hilo propio. Atributos para los escenarios de prueba:
+    pending_polls: veces que getStatus responde 98 (en proceso) antes de resolver cada ticket.
+    ticket_status: código final de los tickets ('0' aceptado, '99' con errores).
+    fault: si se indica (código, mensaje), todas las operaciones responden con ese SOAP Fault.
+    requests: lista de (operación, fileName o ticket) recibidas.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, pending_polls=1, ticket_status="0"):
+        self.pending_polls = pending_polls
+        self.ticket_status = ticket_status
+        self.fault = None
+        self.requests = []
+        self.files = {}          # fileName -> bytes del zip recibido
+        self._tickets = {}       # ticket -> [fileName, consultas]
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/ol-ti-itcpfegem/billService"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, operation, body):
+        """Respuesta SOAP (texto) para la operación recibida."""
+        if self.fault:
+            return _fault(*self.fault)
+        if operation in ("sendBill", "sendSummary", "sendPack"):
+            filename = _tag(body, "fileName")
+            content = _tag(body, "contentFile")
+            with self._lock:
+                self.requests.append((operation, filename))
+                self.files[filename] = base64.b64decode(content) if content else b""
+                if operation == "sendBill":
+                    name = filename[:-4] if filename.endswith(".zip") else filename
+                    return _envelope(f"<br:sendBillResponse xmlns:br=\"http://service.sunat.gob.pe\">"
+                                     f"<applicationResponse>{_cdr_zip(name, description='La Factura ha sido aceptada')}</applicationResponse>"
+                                     f"</br:sendBillResponse>")
+                ticket = str(len(self._tickets) + 1).rjust(15, "0")
+                self._tickets[ticket] = [filename, 0]
+            return _envelope(f"<br:{operation}Response xmlns:br=\"http://service.sunat.gob.pe\"><ticket>{ticket}</ticket></br:{operation}Response>")
+        if operation == "getStatus":
+            ticket = _tag(body, "ticket")
+            with self._lock:
+                self.requests.append((operation, ticket))
+                if ticket not in self._tickets:
+                    return _fault("0127", "El ticket no existe")
+                entry = self._tickets[ticket]
+                entry[1] += 1
+                if entry[1] <= self.pending_polls:
+                    return _envelope("<br:getStatusResponse xmlns:br=\"http://service.sunat.gob.pe\"><status><statusCode>98</statusCode></status></br:getStatusResponse>")
+                name = entry[0][:-4] if entry[0].endswith(".zip") else entry[0]
+            code = self.ticket_status
+            cdr = _cdr_zip(name, "0" if code == "0" else "2000", "Aceptado" if code == "0" else "Rechazado")
+            return _envelope(f"<br:getStatusResponse xmlns:br=\"http://service.sunat.gob.pe\"><status>"
+                             f"<statusCode>{code}</statusCode><content>{cdr}</content></status></br:getStatusResponse>")
+        return _fault("0100", f"Operación no soportada: {operation}")
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8', 'replace')
+                operation = (self.headers.get('SOAPAction') or '').strip('"').replace('urn:', '')
+                if not operation:
+                    match = re.search(r'<(?:\w+:)?Body>\s*<(?:\w+:)?(\w+)', body)
+                    operation = match.group(1) if match else ''
+                response = stub.handle(operation, body).encode('utf-8')
+                self.send_response(500 if b"Fault>" in response else 200)
+                self.send_header('Content-Type', 'text/xml;charset=UTF-8')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _tag(body, name):
+    match = re.search(rf'<(?:\w+:)?{name}>(.*?)</(?:\w+:)?{name}>', body, re.DOTALL)
+    return match.group(1).strip() if match else None
+
+
+if __name__ == "__main__":
+    server = SunatStubServer(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8089)
+    print(f"Servidor SUNAT de prueba en {server.url} (Ctrl+C para salir)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server._server.server_close()
@@ -0,0 +1,101 @@
+import pytest
+
+import database
+
+
+def _seed(issuer_id=1):
+    database.set_correlative(issuer_id, "BOLETA", "B001", 10)
+    p1 = database.add_product("Arroz", 4.0, 50, "A1", "KGM")
+    p2 = database.add_product("Azucar", 3.0, 20, "A2", "KGM")
+    return p1, p2
+
+
+def _cart(p1, p2):
+    return [
+        {'id': p1, 'name': 'Arroz', 'quantity': 2, 'price': 4.0, 'subtotal': 8.0, 'original_price': 4.5},
+        {'id': p2, 'name': 'Azucar', 'quantity': 5, 'price': 3.0, 'subtotal': 15.0},
+    ]
+
+
+def _checkout(cart, doc_type="BOLETA", customer=("12345678", "Juan Perez", "", ""), **kwargs):
+    return database.checkout(1, doc_type, customer, cart, 23.0, "2026-01-10 10:00:00", "",
+                             "EFECTIVO", 23.0, None, 0.0, "CAJA", "", **kwargs)
+
+
+def test_checkout_writes_everything_with_one_commit(temp_db):
+    p1, p2 = _seed()
+    database._pool.reset_stats()
+
+    sale = _checkout(_cart(p1, p2))
+
+    assert database.get_connection_stats()["commits"] == 1
+    assert sale["document_number"] == "B001-11"
+    assert database.get_correlative(1, "BOLETA") == ("B001", 11)
+    assert database.get_product_stock(p1) == 48
+    assert database.get_product_stock(p2) == 15
+    details = database.get_sale_details_by_sale_id(sale["sale_id"])
+    assert [d[1] for d in details] == [2, 5]
+    assert database.get_or_create_customer("12345678", "Juan Perez", "", "") == sale["customer_id"]
+
+
+def test_checkout_credit_note_returns_stock(temp_db):
+    p1, p2 = _seed()
+    database.set_correlative(1, "NOTA_CREDITO_BOLETA", "BC01", 0)
+    _checkout(_cart(p1, p2), doc_type="NOTA_CREDITO_BOLETA")
+    assert database.get_product_stock(p1) == 52
+
+
+def test_checkout_without_correlative(temp_db):
+    p1, p2 = _seed()
+    assert _checkout(_cart(p1, p2), doc_type="FACTURA") is None
+
+    sale = _checkout(_cart(p1, p2), doc_type="NOTA DE VENTA", default_series="NV01")
+    assert sale["document_number"] == "NV01-1"
+
+
+def test_checkout_failure_rolls_back_everything(temp_db):
+    p1, p2 = _seed()
+    cart = _cart(p1, p2)
+    del cart[1]['subtotal']  # falla al preparar los detalles, después de asignar el correlativo
+
+    with pytest.raises(KeyError):
+        _checkout(cart)
+
+    assert database.get_correlative(1, "BOLETA") == ("B001", 10)
+    assert database.get_product_stock(p1) == 50
+    assert database.get_all_parties() == []
+
+
+def _legacy_diff(sale_id):
+    with database.get_connection() as conn:
+        return conn.execute("SELECT SUM((sd.price_per_unit - COALESCE(sd.original_price, sd.price_per_unit)) * sd.quantity_sold) "
+                            "FROM sale_details sd WHERE sd.sale_id = ?", (sale_id,)).fetchone()[0]
+
+
+def test_sale_stores_gross_and_discount(temp_db):
+    p1, p2 = _seed()
+    sale = _checkout(_cart(p1, p2))
+
+    with database.get_connection() as conn:
+        gross, discount = conn.execute("SELECT gross_amount, discount_amount FROM sales WHERE id = ?", (sale["sale_id"],)).fetchone()
+    assert gross == pytest.approx(2 * 4.5 + 5 * 3.0)
+    assert discount == pytest.approx(1.0)
+
+    history = database.get_all_sales_with_customer_name()
+    assert history[0][6] == pytest.approx(_legacy_diff(sale["sale_id"]))
+
+
+def test_backfill_sale_amounts(temp_db):
+    p1, p2 = _seed()
+    sale_ids = [_checkout(_cart(p1, p2))["sale_id"] for _ in range(5)]
+    with database.transaction() as conn:
+        conn.execute("UPDATE sales SET gross_amount = NULL, discount_amount = NULL")
+
+    with database.get_connection() as conn:
+        database._backfill_sale_amounts(conn, batch_size=2)
+        rows = conn.execute("SELECT id, gross_amount, discount_amount FROM sales ORDER BY id").fetchall()
+
+    assert [r[0] for r in rows] == sale_ids
+    for sale_id, gross, discount in rows:
+        assert gross == pytest.approx(24.0)
+        assert -discount == pytest.approx(_legacy_diff(sale_id))
@@ -0,0 +1,104 @@
+import json
+import os
+
+import pytest
+
+import cpe_bulk
+import database
+from test_signing_credentials import _pkcs12
+
+
+def _seed(fe_url, certificate=None):
+    issuer_id = database.add_issuer("Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", "", fe_url, "", "", "",
+                                    "", "", "", "", "", "", "Gravada", "0000", "", "")
+    if certificate:
+        database.update_issuer(issuer_id, "Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", certificate,
+                               fe_url, "", "", "", "", "", "", "", "", "", "Gravada", "0000", "clave", "")
+    database.set_correlative(issuer_id, "BOLETA", "B001", 10)
+    pid = database.add_product("Arroz", 4.0, 50, "A1", "KGM")
+    cart = [{'id': pid, 'name': 'Arroz', 'quantity': 2, 'price': 4.0, 'subtotal': 8.0}]
+    sale_ids = []
+    for day in (10, 11, 12):
+        sale = database.checkout(issuer_id, "BOLETA", ("12345678", "Juan Perez", "", "Av. Sol 2"), cart, 8.0, f"2026-01-{day} 10:00:00", "",
+                                 "EFECTIVO", 8.0, None, 0.0, "CAJA", "Av. Sol 2")
+        database.update_sale_sunat_status(sale["sale_id"], "ERROR_CONEXION", "sin conexión")
+        sale_ids.append(sale["sale_id"])
+    return issuer_id, sale_ids
+
+
+def test_build_payload_from_sale(temp_db):
+    issuer_id, sale_ids = _seed("")
+    payload = cpe_bulk.build_payload(sale_ids[0])
+
+    assert payload["issuer_id"] == issuer_id and payload["issuer"]["ruc"] == "20123456789"
+    assert payload["document"] == {"type_name": "BOLETA", "series": "B001", "number": 11, "issue_date": "2026-01-10 10:00:00",
+                                   "currency": "PEN", "total": 8.0}
+    assert payload["customer"]["address"] == "Av. Sol 2"
+    assert payload["items"] == [{"description": "Arroz", "quantity": 2, "price_unit_inc_igv": 4.0, "unit_code": "KGM"}]
+    assert database.get_sales_for_cpe_rebuild("2026-01-11", "2026-01-12", ["ERROR_CONEXION"], issuer_id) == sale_ids[1:]
+
+
+def test_bulk_rebuild_signs_sends_and_resumes(temp_db, tmp_path):
+    for module in ("lxml", "signxml", "cryptography", "requests"):
+        pytest.importorskip(module)
+    from sunat_stub import SunatStubServer
+
+    checkpoint = str(tmp_path / "avance.json")
+    args = ["--desde", "2026-01-01", "--hasta", "2026-01-31", "--estado", "ERROR_CONEXION", "--enviar",
+            "--procesos", "2", "--por-segundo", "100", "--checkpoint", checkpoint, "--base-dir", str(tmp_path)]
+    with SunatStubServer() as stub:
+        _, sale_ids = _seed(stub.url, _pkcs12("clave"))
+        assert cpe_bulk.main(args) == 0
+        assert sorted(name for _, name in stub.requests) == [f"20123456789-03-B001-000000{n}.zip" for n in (11, 12, 13)]
+
+        # Segunda corrida con la misma selección: el checkpoint ya tiene todo enviado
+        assert cpe_bulk.main(args) == 0
+        assert len(stub.requests) == 3
+
+    with database.get_connection() as conn:
+        rows = conn.execute("SELECT sunat_status, cdr_path FROM sales ORDER BY id").fetchall()
+    assert [status for status, _ in rows] == ["ACEPTADO"] * 3
+    assert all(path.endswith(".zip") for _, path in rows)
+    assert (tmp_path / "SEE Electronica" / "XML" / "20123456789-03-B001-00000011.zip").exists()
+    with open(checkpoint, encoding="utf-8") as f:
+        assert json.load(f)["sent"] == sale_ids
+
+
+def test_accepted_sales_are_left_untouched(temp_db, tmp_path):
+    _, sale_ids = _seed("http://127.0.0.1:9")
+    accepted = sale_ids[0]
+    database.update_sale_sunat_status(accepted, "ACEPTADO", "La Boleta ha sido aceptada", "cdr.zip")
+    assert database.get_sales_for_cpe_rebuild("2026-01-01", "2026-01-31") == sale_ids[1:]
+
+    # Seleccionada a propósito: no se reenvía ni se rebaja su estado
+    bulk = cpe_bulk.BulkRebuild(str(tmp_path), cpe_bulk.Checkpoint(str(tmp_path / "avance.json"), {}), send=True)
+    bulk._submit(cpe_bulk.build_payload(accepted), str(tmp_path / "x.zip"), "x.zip")
+    assert not database.update_sale_sunat_status(accepted, "RECHAZADO", "ya registrado", keep_accepted=True)
+    with database.get_connection() as conn:
+        row = conn.execute("SELECT sunat_status, sunat_note, cdr_path FROM sales WHERE id = ?", (accepted,)).fetchone()
+    assert row == ("ACEPTADO", "La Boleta ha sido aceptada", "cdr.zip")
+    assert bulk.counts["failed"] == 0
+
+
+def _crash(payload):
+    os._exit(1)
+
+
+def test_broken_pool_is_reported_once_and_leaves_sales_for_next_run(temp_db, tmp_path, monkeypatch):
+    _, sale_ids = _seed("http://127.0.0.1:9")
+    monkeypatch.setattr(cpe_bulk, "_sign", _crash)
+    checkpoint = cpe_bulk.Checkpoint(str(tmp_path / "avance.json"), {})
+    bulk = cpe_bulk.BulkRebuild(str(tmp_path), checkpoint, processes=2)
+    counts = bulk.run(sale_ids)
+    assert bulk.pool_error
+    assert counts == {"signed": 0, "sent": 0, "failed": 0}
+    assert checkpoint.failed == {} and checkpoint.signed == set()
+    assert (tmp_path / "SEE Electronica" / "JSON Apisunat").is_dir()
+
+
+def test_checkpoint_rejects_a_different_selection(tmp_path):
+    path = str(tmp_path / "avance.json")
+    cpe_bulk.Checkpoint(path, {"desde": "2026-01-01"}).save()
+    with pytest.raises(SystemExit):
+        cpe_bulk.Checkpoint(path, {"desde": "2026-02-01"})
+    assert cpe_bulk.Checkpoint(path, {"desde": "2026-02-01"}, reset=True).signed == set()
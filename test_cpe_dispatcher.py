@@ -0,0 +1,269 @@
+import sys
+import types
+
+import pytest
+
+import cpe_dispatcher
+import database
+from sunat_stub import _cdr_zip, _envelope, _fault
+
+
+def _payload():
+    return {
+        "caja_id": "1",
+        "issuer": {"ruc": "20123456789", "name": "Empresa", "commercial_name": "", "address": "Jr. Lima 1", "establishment_code": "0000"},
+        "customer": {"doc_type": "1", "doc_number": "12345678", "name": "Juan Perez", "address": ""},
+        "document": {"type_name": "BOLETA DE VENTA ELECTRÓNICA", "issue_date": "2026-01-10 10:00:00", "currency": "PEN", "total": 8.0},
+        "items": [{"description": "Arroz", "quantity": 2, "price_unit_inc_igv": 4.0, "unit_code": "KGM"}],
+        "totals": {},
+    }
+
+
+def _send_bill_response(cdr_b64):
+    return _envelope(f'<br:sendBillResponse xmlns:br="http://service.sunat.gob.pe"><applicationResponse>{cdr_b64}</applicationResponse></br:sendBillResponse>')
+
+
+def _seed():
+    database.set_correlative(1, "BOLETA", "B001", 10)
+    return database.add_product("Arroz", 4.0, 50, "A1", "KGM")
+
+
+def _checkout(pid=None, **kwargs):
+    cart = [{'id': pid or _seed(), 'name': 'Arroz', 'quantity': 2, 'price': 4.0, 'subtotal': 8.0}]
+    return database.checkout(1, "BOLETA", ("12345678", "Juan Perez", "", ""), cart, 8.0, "2026-01-10 10:00:00", "",
+                             "EFECTIVO", 8.0, None, 0.0, "CAJA", "", **kwargs)
+
+
+def _fake_xml_generator(monkeypatch, result):
+    sent = []
+
+    class XMLGenerator:
+        def __init__(self, base_dir):
+            pass
+
+        def generate_and_send(self, sale_data, issuer_data):
+            sent.append(sale_data)
+            return result
+
+    monkeypatch.setitem(sys.modules, "xml_generator", types.SimpleNamespace(XMLGenerator=XMLGenerator))
+    return sent
+
+
+def test_checkout_enqueues_job_in_same_transaction(temp_db):
+    pid = _seed()
+    database._pool.reset_stats()
+    sale = _checkout(pid, cpe_payload=_payload())
+
+    assert database.get_connection_stats()["commits"] == 1
+    job = database.get_cpe_job(sale["sale_id"])
+    assert job["status"] == database.CPE_JOB_PENDING
+    assert '"series": "B001"' in job["payload"] and '"number": 11' in job["payload"]
+
+
+def test_checkout_without_payload_has_no_job(temp_db):
+    sale = _checkout()
+    assert database.get_cpe_job(sale["sale_id"]) is None
+
+
+def test_worker_sends_and_records_status(temp_db, tmp_path, monkeypatch):
+    sale = _checkout(cpe_payload=_payload())
+    cdr = _cdr_zip("B001-11", "0", "La Boleta numero B001-11, ha sido aceptada")
+    sent = _fake_xml_generator(monkeypatch, {"success": True, "response": _send_bill_response(cdr), "cdr_path": "CDR/R-1.zip"})
+    service = cpe_dispatcher.CPEDispatchService(str(tmp_path))
+    events = []
+    service.add_listener(events.append)
+
+    service.process_job(*database.claim_next_cpe_job())
+
+    assert sent[0]["document"]["series"] == "B001"
+    assert sent[0]["document"]["issue_date"].year == 2026
+    assert database.get_cpe_job(sale["sale_id"])["status"] == database.CPE_JOB_DONE
+    with database.get_connection() as conn:
+        row = conn.execute("SELECT sunat_status, sunat_note, cdr_path FROM sales WHERE id = ?", (sale["sale_id"],)).fetchone()
+    assert row == ("ACEPTADO", "La Boleta numero B001-11, ha sido aceptada", "CDR/R-1.zip")
+    assert events == [{"sale_id": sale["sale_id"], "caja_id": "1", "document_number": "B001-11",
+                       "type_name": "BOLETA DE VENTA ELECTRÓNICA", "status": "ACEPTADO", "note": "La Boleta numero B001-11, ha sido aceptada"}]
+    assert database.claim_next_cpe_job() is None
+
+
+def test_interrupted_jobs_are_requeued(temp_db):
+    sale = _checkout(cpe_payload=_payload())
+    job_id, sale_id, payload = database.claim_next_cpe_job()
+    assert database.get_cpe_job(sale["sale_id"])["status"] == database.CPE_JOB_RUNNING
+
+    assert database.requeue_interrupted_cpe_jobs() == 1
+    assert database.claim_next_cpe_job()[0] == job_id
+    assert database.get_cpe_job(sale["sale_id"])["attempts"] == 2
+
+
+def test_parse_sunat_response():
+    assert cpe_dispatcher.parse_sunat_response({"success": False, "error": "sin certificado"}) == ("ERROR_LOCAL", "sin certificado")
+    assert cpe_dispatcher.parse_sunat_response({"success": True, "response": _fault("2800", "2800")}) == ("RECHAZADO", "2800")
+    assert cpe_dispatcher.parse_sunat_response({"success": True, "response": _envelope("<ticket>123</ticket>")}) == ("PENDIENTE", "Ticket: 123")
+    assert cpe_dispatcher.parse_sunat_response({"success": True, "response": _send_bill_response(_cdr_zip("B001-11", "2800", "Documento rechazado"))}) == \
+        ("RECHAZADO", "Documento rechazado")
+    assert cpe_dispatcher.parse_sunat_response({"success": True, "response": "No URL configured"})[0] == "ERROR_RESPUESTA"
+
+
+class _BatchXMLGenerator:
+    """XMLGenerator de prueba: firma "en falso" y envía los lotes al servidor SUNAT local (sin HTTP)."""
+
+    def __init__(self, stub, directory):
+        self.stub = stub
+        self.directory = directory
+        self.summaries = []
+
+    def _zip(self, name):
+        path = self.directory / name
+        path.write_bytes(b"PK")
+        return str(path)
+
+    def build_signed_zip(self, sale_data, issuer_data):
+        base = f"{issuer_data['ruc']}-03-{sale_data['document']['series']}-{sale_data['document']['number']}"
+        return self._zip(f"{base}.zip"), f"{base}.zip", base
+
+    def build_daily_summary(self, issuer_data, reference_date, documents, sequence):
+        self.summaries.append((reference_date, [d['document']['number'] for d in documents]))
+        name = f"{issuer_data['ruc']}-RC-{reference_date.replace('-', '')}-{sequence}.zip"
+        return self._zip(name), name
+
+    def send_summary(self, zip_path, zip_filename, url, issuer_data):
+        response = self.stub.handle("sendSummary", f"<fileName>{zip_filename}</fileName><contentFile>UEs=</contentFile>")
+        return {"success": True, "ticket": response.split("<ticket>")[1].split("</ticket>")[0], "response": response}
+
+    def check_ticket_status(self, issuer_data, ticket, url=None):
+        return {"success": True, "response": self.stub.handle("getStatus", f"<ticket>{ticket}</ticket>")}
+
+    def save_cdr(self, cdr_b64, filename_base):
+        return self._zip(f"R-{filename_base}.zip")
+
+
+def test_boletas_are_sent_in_a_daily_summary(temp_db, tmp_path):
+    import config_manager
+    from sunat_stub import SunatStubServer
+
+    config_manager.save_setting('cpe_batch_mode', cpe_dispatcher.BATCH_MODE_SUMMARY)
+    database.add_issuer("Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", "", "http://stub", "", "", "",
+                        "", "", "", "", "", "", "Gravada", "0000", "", "")
+    pid = _seed()
+    sales = [_checkout(pid, cpe_payload=_payload()) for _ in range(3)]
+
+    stub = SunatStubServer(pending_polls=1)
+    service = cpe_dispatcher.CPEDispatchService(str(tmp_path))
+    service._xml_gen = _BatchXMLGenerator(stub, tmp_path)
+    events = []
+    service.add_listener(events.append)
+
+    while (job := database.claim_next_cpe_job()) is not None:
+        service.process_job(*job)
+    assert [e["status"] for e in events] == ["EN_LOTE"] * 3
+    assert stub.requests == []
+
+    # Boletas de un día anterior: el resumen se envía sin esperar a llenarse
+    service.flush_batches()
+    assert service._xml_gen.summaries == [("2026-01-10", [11, 12, 13])]
+    assert stub.requests == [("sendSummary", "20123456789-RC-20260110-1.zip")]
+    assert database.get_batchable_cpe_jobs() == []
+
+    service.poll_tickets()   # 98: sigue en proceso
+    assert database.get_open_cpe_batches()[0]["ticket"] == "000000000000001"
+    service.poll_tickets()   # 0: aceptado
+
+    assert database.get_open_cpe_batches() == []
+    with database.get_connection() as conn:
+        statuses = conn.execute("SELECT sunat_status FROM sales ORDER BY id").fetchall()
+    assert statuses == [("ACEPTADO",)] * 3
+    assert all(database.get_cpe_job(s["sale_id"])["status"] == database.CPE_JOB_DONE for s in sales)
+    assert [e["status"] for e in events[3:]] == ["ACEPTADO"] * 3 and all("batch_id" in e for e in events[3:])
+
+
+def test_failed_batch_send_returns_jobs_to_the_queue(temp_db, tmp_path):
+    import config_manager
+    from sunat_stub import SunatStubServer
+
+    config_manager.save_setting('cpe_batch_mode', cpe_dispatcher.BATCH_MODE_SUMMARY)
+    database.add_issuer("Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", "", "http://stub", "", "", "",
+                        "", "", "", "", "", "", "Gravada", "0000", "", "")
+    _checkout(cpe_payload=_payload())
+    service = cpe_dispatcher.CPEDispatchService(str(tmp_path))
+    service._xml_gen = _BatchXMLGenerator(SunatStubServer(), tmp_path)
+    service.process_job(*database.claim_next_cpe_job())
+
+    service._xml_gen.send_summary = lambda *args: {"success": False, "error": "timeout"}
+    service.flush_batches(force=True)
+
+    jobs = database.get_batchable_cpe_jobs()
+    assert len(jobs) == 1
+    assert database.get_open_cpe_batches() == []
+
+
+def test_batched_boletas_are_left_out_of_the_retry_service(temp_db, tmp_path):
+    import config_manager
+    from sunat_stub import SunatStubServer
+
+    config_manager.save_setting('cpe_batch_mode', cpe_dispatcher.BATCH_MODE_SUMMARY)
+    database.add_issuer("Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", "", "http://stub", "", "", "",
+                        "", "", "", "", "", "", "Gravada", "0000", "", "")
+    pid = _seed()
+    batched = _checkout(pid, cpe_payload=_payload())["sale_id"]
+    unsent = _checkout(pid)["sale_id"]
+    database.update_sale_sunat_status(unsent, "PENDIENTE", "")
+    service = cpe_dispatcher.CPEDispatchService(str(tmp_path))
+    service._xml_gen = _BatchXMLGenerator(SunatStubServer(), tmp_path)
+    service.process_job(*database.claim_next_cpe_job())
+
+    # El lote falla y sus trabajos vuelven a esperar: siguen fuera de los reintentos por comprobante
+    service._xml_gen.send_summary = lambda *args: {"success": False, "error": "timeout"}
+    service.flush_batches(force=True)
+
+    assert database.get_cpe_job(batched)["status"] == database.CPE_JOB_BATCHED
+    assert [row["id"] for row in database.get_pending_invoices_for_retry()] == [unsent]
+    assert database.get_cpe_retry_backlog() == (1, 0)
+
+
+def test_parse_ticket_status():
+    assert cpe_dispatcher.parse_ticket_status({"success": True, "response": _envelope("<status><statusCode>98</statusCode></status>")})[0] is None
+    assert cpe_dispatcher.parse_ticket_status({"success": True, "response": _envelope("<status><statusCode>0</statusCode><content>UEs=</content></status>")}) == \
+        (database.CPE_BATCH_ACCEPTED, "Aceptado (lote)", b"PK")
+    assert cpe_dispatcher.parse_ticket_status({"success": True, "response": _envelope("<status><statusCode>99</statusCode></status>")})[0] == database.CPE_BATCH_REJECTED
+    assert cpe_dispatcher.parse_ticket_status({"success": False, "error": "timeout"})[0] is None
+
+
+def test_stub_server_speaks_soap_over_http():
+    import urllib.request
+    from sunat_stub import SunatStubServer
+
+    def post(stub, action, body):
+        request = urllib.request.Request(stub.url, data=f"<soapenv:Envelope><soapenv:Body>{body}</soapenv:Body></soapenv:Envelope>".encode(),
+                                         headers={"SOAPAction": f"urn:{action}", "Content-Type": "text/xml"})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.read().decode()
+
+    with SunatStubServer(pending_polls=0) as stub:
+        response = post(stub, "sendPack", "<ser:sendPack><fileName>20123456789-LT-20260110-1.zip</fileName><contentFile>UEs=</contentFile></ser:sendPack>")
+        ticket = response.split("<ticket>")[1].split("</ticket>")[0]
+        status = post(stub, "getStatus", f"<ser:getStatus><ticket>{ticket}</ticket></ser:getStatus>")
+
+    assert "<statusCode>0</statusCode>" in status
+    assert stub.files["20123456789-LT-20260110-1.zip"] == b"PK"
+
+
+def test_xml_generator_batch_calls_against_stub(tmp_path):
+    for module in ("lxml", "signxml", "cryptography", "requests"):
+        pytest.importorskip(module)
+    import xml_generator
+    from sunat_stub import SunatStubServer
+
+    issuer = {"ruc": "20123456789", "sol_user": "MODDATOS", "sol_pass": "moddatos"}
+    zip_path = tmp_path / "20123456789-RC-20260110-1.zip"
+    zip_path.write_bytes(b"PK")
+    gen = xml_generator.XMLGenerator(str(tmp_path))
+
+    with SunatStubServer(pending_polls=1) as stub:
+        sent = gen.send_summary(str(zip_path), zip_path.name, stub.url, issuer)
+        first = gen.check_ticket_status(issuer, sent["ticket"], url=stub.url)
+        second = gen.check_ticket_status(issuer, sent["ticket"], url=stub.url)
+
+    assert sent["success"] and stub.requests[0] == ("sendSummary", zip_path.name)
+    assert cpe_dispatcher.parse_ticket_status(first)[0] is None
+    assert cpe_dispatcher.parse_ticket_status(second)[0] == database.CPE_BATCH_ACCEPTED
@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+import cpe_retry_service
+import database
+from sunat_stub import _cdr_zip, _envelope, _fault
+
+
+@pytest.fixture
+def service(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(cpe_retry_service.CPERetryService, "_instance", None)
+    service = cpe_retry_service.CPERetryService(str(tmp_path), workers=2, rate_per_second=1000)
+    yield service
+    service.stop()
+    service.executor.shutdown(wait=True)
+
+
+def _status_cdr(cdr_b64):
+    return _envelope(f'<br:getStatusCdrResponse xmlns:br="http://service.sunat.gob.pe"><statusCdr><content>{cdr_b64}</content>'
+                     '<statusCode>0004</statusCode><statusMessage>La constancia existe</statusMessage></statusCdr></br:getStatusCdrResponse>')
+
+
+class _FakeXMLGenerator:
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+        self.saved = {}
+
+    def save_cdr(self, cdr_zip, filename_base):
+        self.saved[filename_base] = cdr_zip
+        return f"CDR/R-{filename_base}.zip"
+
+    def check_cdr_status(self, issuer, type_code, series, number):
+        self.calls.append((type_code, series, number))
+        return self.results.pop(0) if len(self.results) > 1 else self.results[0]
+
+
+def _sale(status="ERROR_CONEXION"):
+    issuer_id = database.add_issuer("Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", "", "", "", "", "",
+                                    "", "", "", "", "", "", "Gravada", "0000", "", "")
+    database.set_correlative(issuer_id, "BOLETA", "B001", 10)
+    pid = database.add_product("Arroz", 4.0, 50, "A1", "KGM")
+    cart = [{'id': pid, 'name': 'Arroz', 'quantity': 1, 'price': 4.0, 'subtotal': 4.0}]
+    sale = database.checkout(issuer_id, "BOLETA", ("12345678", "Juan Perez", "", ""), cart, 4.0, "2026-01-10 10:00:00", "",
+                             "EFECTIVO", 4.0, None, 0.0, "CAJA", "")
+    database.update_sale_sunat_status(sale["sale_id"], status, "sin conexión")
+    return sale["sale_id"]
+
+
+def _retry_state(sale_id):
+    with database.get_connection() as conn:
+        return conn.execute("SELECT sunat_status, retry_attempts, next_retry_at FROM sales WHERE id = ?", (sale_id,)).fetchone()
+
+
+def test_constructor_returns_the_same_service(service, tmp_path):
+    assert cpe_retry_service.CPERetryService(str(tmp_path)) is service
+    assert cpe_retry_service.get_service() is service
+
+
+def test_connection_errors_back_off_until_the_next_retry(service):
+    sale_id = _sale()
+    service._xml_gen = _FakeXMLGenerator({"success": False, "error": "timeout"})
+
+    [future] = service.process_retries()
+    assert future.result()["error"] == "timeout"
+    status, attempts, next_retry_at = _retry_state(sale_id)
+    assert (status, attempts) == ("ERROR_CONEXION", 1)
+    assert next_retry_at > time.strftime('%Y-%m-%d %H:%M:%S')
+
+    # Aún no vence: la siguiente pasada no lo vuelve a consultar
+    assert service.process_retries() == []
+    assert database.get_cpe_retry_backlog() == (0, 1)
+
+
+def test_accepted_response_clears_the_schedule(service):
+    sale_id = _sale()
+    service._xml_gen = _FakeXMLGenerator({"success": True, "response": _status_cdr(_cdr_zip("B001-11", "0", "La Boleta numero B001-11, ha sido aceptada"))})
+    database.schedule_cpe_retry(sale_id, 3, "2000-01-01 00:00:00")
+
+    [future] = service.process_retries()
+    assert future.result()["status"] == "ACEPTADO"
+    assert service._xml_gen.calls == [("03", "B001", "11")]
+    assert _retry_state(sale_id) == ("ACEPTADO", 0, None)
+    assert list(service._xml_gen.saved) == ["20123456789-03-B001-11"]
+    with database.get_connection() as conn:
+        assert conn.execute("SELECT sunat_note, cdr_path FROM sales WHERE id = ?", (sale_id,)).fetchone() == \
+            ("La Boleta numero B001-11, ha sido aceptada", "CDR/R-20123456789-03-B001-11.zip")
+
+    metrics = service.metrics()
+    assert metrics["queue_depth"] == 0 and metrics["success_rate"] == 1.0
+    assert metrics["p95_latency_ms"] is not None
+
+
+def test_unrecognised_send_response_is_checked_again(service):
+    # sendBill trajo un CDR ilegible: el estado lo decide getStatusCdr
+    sale_id = _sale("ERROR_RESPUESTA")
+    service._xml_gen = _FakeXMLGenerator({"success": True, "response": _status_cdr(_cdr_zip("B001-11", "2800", "Rechazado"))})
+
+    [future] = service.process_retries()
+    assert future.result()["status"] == "RECHAZADO"
+    assert _retry_state(sale_id) == ("RECHAZADO", 0, None)
+
+
+def test_retry_now_ignores_the_backoff(service):
+    sale_id = _sale()
+    service._xml_gen = _FakeXMLGenerator({"success": True, "response": _fault("2800", "2800")})
+    database.schedule_cpe_retry(sale_id, 5, "2999-01-01 00:00:00")
+
+    result = service.retry_now(sale_id).result(timeout=5)
+    assert (result["status"], result["note"]) == ("RECHAZADO", "2800")
+    assert _retry_state(sale_id) == ("RECHAZADO", 0, None)
+
+
+def test_retry_delay_grows_with_jitter():
+    delays = [cpe_retry_service.retry_delay(attempt) for attempt in (1, 2, 3, 20)]
+    base = cpe_retry_service.RETRY_BASE_SECONDS
+    assert base / 2 <= delays[0] <= base
+    assert base <= delays[1] <= 2 * base
+    assert 2 * base <= delays[2] <= 4 * base
+    assert delays[3] <= cpe_retry_service.RETRY_MAX_SECONDS
+
+
+def test_rate_limiter_spaces_calls_per_issuer():
+    limiter = cpe_retry_service.IssuerRateLimiter(20)   # 50 ms entre consultas del mismo emisor
+    stamps = []
+
+    def call(key):
+        limiter.acquire(key)
+        stamps.append((key, time.monotonic()))
+
+    threads = [threading.Thread(target=call, args=(key,)) for key in (1, 1, 1, 2)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    same_issuer = sorted(stamp for key, stamp in stamps if key == 1)
+    assert same_issuer[2] - started >= 0.09
+    assert [stamp for key, stamp in stamps if key == 2][0] - started < 0.05
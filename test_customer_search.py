@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+
+import config_manager
+import database
+
+
+def _names(rows, index=3):
+    return [row[index] for row in rows]
+
+
+def _seed():
+    database.add_party("20123456789", "Comercial Ñandú SAC", "999111222", "Av. Perú 120", "Cliente", "NANDU")
+    database.add_party("10456789012", "Bodega Santa Rosa", "", "Jr. Cusco 5", "Proveedor", "")
+    database.add_party("45678912", "José Pérez Rosales", "", "", "Cliente", "PEPE")
+
+
+def test_prefix_search_ignores_accents_and_case(temp_db):
+    _seed()
+    assert _names(database.search_parties("nandu")) == ["Comercial Ñandú SAC"]
+    assert _names(database.search_parties("jose per")) == ["José Pérez Rosales"]
+    assert _names(database.search_parties("2012")) == ["Comercial Ñandú SAC"]
+    assert _names(database.search_parties("proveedor")) == ["Bodega Santa Rosa"]
+    # Los caracteres de la sintaxis de FTS5 se ignoran
+    assert _names(database.search_parties('"perez" (* -')) == ["José Pérez Rosales"]
+    assert database.search_parties("xyz") == [] and database.search_parties("  ") == []
+
+
+def test_general_search_ranks_and_limits(temp_db):
+    _seed()
+    # SELECT * FROM customers: id, doc_number, name, phone, address, type, alias
+    rows = database.search_customers_general("ros")
+    assert sorted(_names(rows, 2)) == ["Bodega Santa Rosa", "José Pérez Rosales"]
+    assert len(database.search_customers_general("ros", limit=1)) == 1
+    # Solo nombre, alias y documento: la dirección no cuenta aquí
+    assert database.search_customers_general("cusco") == []
+    assert _names(database.search_parties("cusco")) == ["Bodega Santa Rosa"]
+
+    database.add_party("4567", "Rosa Documento", "", "", "Cliente", "")
+    assert database.search_customers_general("4567")[0][2] == "Rosa Documento"
+
+
+def test_index_follows_inserts_updates_and_deletes(temp_db):
+    _seed()
+    database.update_party(2, "10456789012", "Minimarket Lucía", "", "Jr. Cusco 5", "Proveedor")
+    assert database.search_parties("bodega") == []
+    assert _names(database.search_parties("lucia")) == ["Minimarket Lucía"]
+    database.delete_party(2)
+    assert database.search_parties("lucia") == []
+    # Clientes creados al vender también entran
+    with database.transaction() as conn:
+        database._get_or_create_customer(conn.cursor(), "70000001", "Ana Torres", "", "")
+    assert _names(database.search_customers_general("torres"), 2) == ["Ana Torres"]
+
+
+def test_migration_indexes_existing_customers(temp_db):
+    _seed()
+    with database.transaction() as conn:
+        for trigger in ("insert", "update", "delete"):
+            conn.execute(f"DROP TRIGGER trg_customers_fts_{trigger}")
+        conn.execute("DROP TABLE customers_fts")
+    # El índice se comprobó al abrir la base: un error de la consulta FTS no cambia a LIKE
+    with pytest.raises(sqlite3.OperationalError):
+        database.search_parties("Santa")
+
+    # Sin índice (SQLite sin FTS5) se busca con LIKE
+    with database.get_connection() as conn:
+        assert database._detect_customer_search_index(conn) is False
+    assert _names(database.search_parties("Santa")) == ["Bodega Santa Rosa"]
+
+    config_manager.set_db_version(38)
+    database.setup_database()
+    assert _names(database.search_parties("santa")) == ["Bodega Santa Rosa"]
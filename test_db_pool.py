@@ -0,0 +1,58 @@
+import threading
+
+import database
+
+
+def test_connection_is_reused_across_calls(temp_db):
+    database._pool.reset_stats()
+    for i in range(20):
+        database.add_product(f"P{i}", 1.0, 10, f"C{i}", "NIU")
+    database.get_all_products()
+    database.get_all_categories()
+
+    stats = database.get_connection_stats()
+    assert stats["opened"] == 0
+    assert stats["acquired"] == 22
+    assert stats["acquired"] == stats["released"]
+
+
+def test_wal_mode_enabled(temp_db):
+    with database.get_connection() as conn:
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode.lower() == "wal"
+
+
+def test_uncommitted_work_is_discarded_on_release(temp_db):
+    with database.get_connection() as conn:
+        conn.execute("INSERT INTO products(name, price, stock) VALUES ('X', 1, 1)")
+    assert database.get_all_products() == []
+
+
+def test_row_factory_is_per_handle(temp_db):
+    database.add_product("P", 1.0, 1, "C", "NIU")
+    with database.get_connection() as conn:
+        conn.row_factory = database.sqlite3.Row
+        row = conn.cursor().execute("SELECT name FROM products").fetchone()
+        assert row["name"] == "P"
+    # Otros préstamos del mismo hilo siguen recibiendo tuplas
+    assert isinstance(database.get_all_products()[0], tuple)
+
+
+def test_one_connection_per_thread(temp_db):
+    database._pool.reset_stats()
+    results = []
+
+    def worker():
+        results.append(database.get_product_stock(1))
+        database.close_thread_connection()
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = database.get_connection_stats()
+    assert results == [0.0, 0.0, 0.0]
+    assert stats["opened"] == 3
+    assert stats["closed"] == 3
@@ -0,0 +1,93 @@
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+import http_transport
+
+
+@pytest.fixture
+def flaky_server():
+    """Servidor local que responde 503 a las primeras `failures` peticiones y cuenta las conexiones abiertas."""
+    state = {"failures": 0, "hits": 0, "connections": set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            state["hits"] += 1
+            state["connections"].add(self.client_address)
+            status = 503 if state["hits"] <= state["failures"] else 200
+            body = b'{"ok": true}'
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        do_GET = do_POST = _reply
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_address[1]}"
+    http_transport.close_all()
+    http_transport.reset_stats()
+    yield state
+    http_transport.close_all()
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_to_a_host_reuse_the_connection(flaky_server):
+    for _ in range(5):
+        assert http_transport.get(flaky_server["url"] + "/status", endpoint="local.status").status_code == 200
+
+    assert len(flaky_server["connections"]) == 1
+    stats = http_transport.get_latency_stats()["local.status"]
+    assert stats["count"] == 5 and stats["errors"] == 0
+    assert sum(stats["buckets"].values()) == 5
+
+
+def test_only_idempotent_calls_are_retried(flaky_server, monkeypatch):
+    monkeypatch.setattr(http_transport, "RETRY_BACKOFF", 0)
+    http_transport.close_all()
+
+    flaky_server["failures"] = 1
+    assert http_transport.post(flaky_server["url"] + "/send").status_code == 503
+    assert flaky_server["hits"] == 1
+
+    flaky_server.update(failures=2, hits=0)
+    assert http_transport.post(flaky_server["url"] + "/getStatus", retry=True).status_code == 200
+    assert flaky_server["hits"] == 3
+
+
+def test_status_checks_are_not_retried(flaky_server):
+    flaky_server["failures"] = 1
+    assert http_transport.get(flaky_server["url"] + "/status", retry=http_transport.RETRY_NONE).status_code == 503
+    assert flaky_server["hits"] == 1
+
+    # Servicio caído (puerto cerrado): falla enseguida, sin esperas entre reintentos de conexión
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    started = time.perf_counter()
+    with pytest.raises(http_transport.requests.ConnectionError):
+        http_transport.get(f"http://127.0.0.1:{port}/status", connect_timeout=2, retry=http_transport.RETRY_NONE)
+    assert time.perf_counter() - started < 0.4
+
+
+def test_latency_histogram_percentiles():
+    histogram = http_transport.LatencyHistogram(buckets=(10, 100, 1000))
+    for elapsed in [5] * 90 + [50] * 9 + [5000]:
+        histogram.observe(elapsed, error=elapsed > 1000)
+
+    snapshot = histogram.snapshot()
+    assert snapshot["p50_ms"] == 10 and snapshot["p95_ms"] == 100
+    assert snapshot["max_ms"] == 5000 and snapshot["errors"] == 1
+    assert snapshot["buckets"] == {"10": 90, "100": 9, "1000": 0, "inf": 1}
@@ -0,0 +1,175 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+
+
+# Implementación anterior de CashCountWindow._get_period_analytics, conservada como referencia.
+def legacy_period_analytics(start, end):
+    # Fetch Sales and Movements
+    conn = database.create_connection()
+    cur = conn.cursor()
+
+    # 1. SALES
+    # Fetch ID, payment methods, amounts, date
+    query_sales = """
+        SELECT id, payment_method, amount_paid, payment_method2, amount_paid2, sale_date
+        FROM sales 
+    """
+    cur.execute(query_sales)
+    sales_rows = cur.fetchall()
+
+    total_gross_sales = 0.0
+    total_discounts = 0.0
+    total_non_cash = 0.0
+
+    # Helper to parse multiple date formats
+    def parse_date(date_str):
+        if not date_str: return None
+        formats = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%d-%m-%Y"]
+        for fmt in formats:
+            try: return datetime.strptime(str(date_str), fmt)
+            except ValueError: continue
+        return None
+
+    start_dt = parse_date(start)
+    end_dt = parse_date(end)
+
+    if start_dt and end_dt:
+         for r in sales_rows:
+             # r: id, pm1, amt1, pm2, amt2, date
+             s_dt = parse_date(r[5])
+             if s_dt and start_dt <= s_dt <= end_dt:
+                 sale_id = r[0]
+                 pm1 = r[1]
+                 amt1 = r[2] or 0.0
+                 pm2 = r[3]
+                 amt2 = r[4] or 0.0
+
+                 # 1. Non-Cash Calculation
+                 non_cash = 0.0
+                 if pm1 != 'EFECTIVO': non_cash += amt1
+                 if pm2 != 'EFECTIVO': non_cash += amt2
+                 total_non_cash += non_cash
+
+                 # 2. Gross and Discount Calculation (All Sales)
+                 cur.execute("SELECT quantity_sold, price_per_unit, original_price FROM sale_details WHERE sale_id=?", (sale_id,))
+                 details = cur.fetchall()
+
+                 sale_gross = 0.0
+                 sale_discount = 0.0
+
+                 for d in details:
+                     qty = d[0] or 0
+                     price = d[1] or 0.0
+                     orig = d[2] or price # default to price if None
+                     if orig < price: orig = price # sanity check
+
+                     line_gross = qty * orig
+                     line_price = qty * price
+                     line_disc = line_gross - line_price
+
+                     sale_gross += line_gross
+                     sale_discount += line_disc
+
+                 total_gross_sales += sale_gross
+                 total_discounts += sale_discount
+
+
+    # 2. MOVEMENTS
+    query_movs = "SELECT movement_type, total_amount, date_time FROM inventory_movements"
+    cur.execute(query_movs)
+    mov_rows = cur.fetchall()
+
+    income_add = 0.0
+    purchases = 0.0
+    expenses = 0.0
+    anulados = 0.0
+    returns = 0.0
+
+    if start_dt and end_dt:
+        for type_, total, m_date_str in mov_rows:
+            m_dt = parse_date(m_date_str)
+            if m_dt and start_dt <= m_dt <= end_dt:
+                type_upper = type_.upper()
+                if type_upper == 'INGRESO':
+                    income_add += total
+                elif type_upper == 'COMPRA':
+                    purchases += total
+                elif type_upper in ['GASTO', 'SALIDA']:
+                    expenses += total
+                elif type_upper == 'ANULADO':
+                    anulados += total
+                elif type_upper in ['DEVOLUCION', 'DEVOLUCIÓN']:
+                    returns += total
+
+    conn.close()
+
+    return {
+        'total_gross_sales': total_gross_sales,
+        'non_cash_sales': total_non_cash,
+        'discounts': total_discounts,
+        'income_additional': income_add,
+        'purchases': purchases,
+        'expenses': expenses,
+        'anulados': anulados,
+        'returns': returns
+    }
+
+
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%d-%m-%Y"]
+MOVEMENT_TYPES = ["INGRESO", "SALIDA", "COMPRA", "GASTO", "ANULADO", "DEVOLUCION", "devolución", "ingreso", "OTRO"]
+PAYMENT_METHODS = ["EFECTIVO", "EFECTIVO", "YAPE", "TARJETA", None]
+
+
+def _generate_dataset(seed=7, sales=400, movements=120):
+    rnd = random.Random(seed)
+    base = datetime(2025, 3, 1)
+
+    def random_date():
+        return (base + timedelta(minutes=rnd.randint(0, 60 * 24 * 20))).strftime(rnd.choice(DATE_FORMATS))
+
+    with database.transaction() as conn:
+        for sale_id in range(1, sales + 1):
+            conn.execute("""INSERT INTO sales (id, issuer_id, customer_id, total_amount, sale_date, document_type, document_number,
+                                               payment_method, amount_paid, payment_method2, amount_paid2)
+                            VALUES (?, 1, 1, 0, ?, 'BOLETA', ?, ?, ?, ?, ?)""",
+                         (sale_id, random_date(), f"B001-{sale_id}", rnd.choice(PAYMENT_METHODS), round(rnd.uniform(1, 200), 2),
+                          rnd.choice(PAYMENT_METHODS), rnd.choice([None, 0.0, round(rnd.uniform(1, 50), 2)])))
+            for _ in range(rnd.randint(0, 4)):
+                price = round(rnd.uniform(0.5, 30), 2)
+                original = rnd.choice([None, 0.0, price, round(price * 1.2, 2), round(price * 0.8, 2)])
+                qty = rnd.choice([1, 2, 3, 0.5, 1.25])
+                conn.execute("""INSERT INTO sale_details (sale_id, product_id, quantity_sold, price_per_unit, subtotal, original_price)
+                                VALUES (?, 1, ?, ?, ?, ?)""", (sale_id, qty, price, qty * price, original))
+        for movement_id in range(1, movements + 1):
+            conn.execute("""INSERT INTO inventory_movements (movement_type, movement_number, date_time, total_amount)
+                            VALUES (?, ?, ?, ?)""",
+                         (rnd.choice(MOVEMENT_TYPES), f"M-{movement_id}", random_date(), round(rnd.uniform(1, 500), 2)))
+
+
+@pytest.mark.parametrize("start, end", [
+    ("2025-03-05 08:00:00", "2025-03-12 18:30:00"),
+    ("2025-03-01 00:00:00", "2025-03-31 23:59:59"),
+    ("2025-03-10", "2025-03-10 23:59:59"),
+    ("05/03/2025 00:00:00", "06/03/2025"),
+    ("2025-04-01 00:00:00", "2025-04-02 00:00:00"),
+    ("No Registrado", "2025-03-12 18:30:00"),
+])
+def test_matches_legacy_implementation(temp_db, start, end):
+    _generate_dataset()
+    expected = legacy_period_analytics(start, end)
+    result = database.get_period_analytics(start, end)
+
+    assert result.keys() == expected.keys()
+    for key, value in expected.items():
+        assert result[key] == pytest.approx(value), key
+
+
+def test_normalize_timestamp():
+    assert database.normalize_timestamp("21/01/2026 18:12:52") == "2026-01-21 18:12:52"
+    assert database.normalize_timestamp("21-01-2026") == "2026-01-21 00:00:00"
+    assert database.normalize_timestamp("2026-01-21") == "2026-01-21 00:00:00"
+    assert database.normalize_timestamp("ayer") is None
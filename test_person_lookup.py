@@ -0,0 +1,138 @@
+import threading
+
+import pytest
+
+pytest.importorskip("requests")
+import api_client
+import database
+import http_transport
+from apisunat_stub import ApisunatStubServer
+from person_lookup import NOT_FOUND_TTL, FOUND_TTL, PersonLookup, TypingPrefetch
+
+
+class FakeWidget:
+    """after/after_cancel de Tk: run_pending() ejecuta lo que sigue programado."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def after(self, ms, callback):
+        job = f"after#{len(self.jobs)}"
+        self.jobs[job] = callback
+        return job
+
+    def after_cancel(self, job):
+        self.jobs[job] = None
+
+    def run_pending(self):
+        for job, callback in list(self.jobs.items()):
+            if callback:
+                self.jobs[job] = None
+                callback()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def stub(temp_db, monkeypatch):
+    with ApisunatStubServer() as server:
+        monkeypatch.setattr(api_client, "API_BASE_URL", server.url)
+        http_transport.close_all()
+        yield server
+    http_transport.close_all()
+
+
+def test_api_response_is_persisted_until_it_expires(stub):
+    clock = Clock()
+    result = PersonLookup(clock=clock).lookup("12345678")
+    assert result["success"] and result["source"] == "api"
+    assert result["data"]["apellido_paterno"] == "PEREZ"
+
+    # Otro proceso (servicio nuevo) la lee de document_lookups
+    other = PersonLookup(clock=clock)
+    cached = other.lookup("12345678")
+    assert cached["source"] == "cache" and cached["data"] == result["data"]
+    assert len(stub.requests) == 1
+
+    clock.now += FOUND_TTL + 1
+    assert other.lookup("12345678")["source"] == "api"
+    assert len(stub.requests) == 2
+
+
+def test_not_found_is_cached_for_less_time_and_errors_are_not(stub):
+    clock = Clock()
+    service = PersonLookup(clock=clock)
+    assert service.lookup("87654321")["message"] == "No se encontraron resultados"
+    assert service.lookup("87654321")["source"] == "cache" and service.stats["negative"] == 1
+    clock.now += NOT_FOUND_TTL + 1
+    stub.people["87654321"] = {"nombre": "ANA"}
+    assert service.lookup("87654321")["data"]["nombre"] == "ANA"
+
+    stub.status = 500
+    assert not service.lookup("20999999999")["success"]
+    stub.status = None
+    assert service.lookup("20999999999")["source"] == "api"
+    assert len(stub.requests) == 4
+    # Documento inválido: ni caché ni red
+    assert service.lookup("123")["message"] == api_client.INVALID_DOCUMENT_MESSAGE
+    assert len(stub.requests) == 4
+
+
+def test_local_customers_are_used_first(stub):
+    database.add_party("12345678", "JUAN PEREZ ROJAS", "", "JR. CUSCO 5", "Cliente")
+    service = PersonLookup()
+    result = service.lookup("12345678")
+    assert result["source"] == "local" and result["data"]["nombre"] == "JUAN PEREZ ROJAS"
+    assert result["data"]["domicilio"]["direccion"] == "JR. CUSCO 5"
+    assert stub.requests == []
+    # La configuración del emisor necesita los datos completos de la API
+    assert service.lookup("12345678", prefer_local=False)["source"] == "api"
+
+
+def test_concurrent_lookups_share_one_request(stub):
+    stub.delay = 0.3
+    service = PersonLookup()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.lookup("20123456789"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 5 and all(r["data"]["nombre"] == "COMERCIAL EJEMPLO S.A.C." for r in results)
+    assert len(stub.requests) == 1 and service.stats["coalesced"] == 4
+
+
+def test_prefetch_warms_the_cache(stub):
+    service = PersonLookup()
+    service.prefetch(["20123456789", "12345678", "999"])
+    service.wait(5)
+    assert len(stub.requests) == 2
+    assert service.lookup("20123456789")["source"] == "cache"
+    assert len(stub.requests) == 2
+
+
+def test_typing_a_ruc_fetches_only_the_ruc(stub):
+    service = PersonLookup()
+    widget = FakeWidget()
+    typing = TypingPrefetch(widget, service)
+    ruc = "20123456789"
+    for i in range(1, len(ruc) + 1):
+        typing.typed(ruc[:i])     # pasa por "20123456" sin consultarlo
+    widget.run_pending()
+    service.wait(5)
+    assert stub.requests == ["/ruc/20123456789"]
+
+    # Un DNI se consulta cuando el campo deja de cambiar; con factura, nunca
+    typing.typed("12345678")
+    widget.run_pending()
+    typing.typed("87654321", ruc_only=True)
+    widget.run_pending()
+    service.wait(5)
+    assert stub.requests == ["/ruc/20123456789", "/dni/12345678"]
@@ -0,0 +1,73 @@
+import pytest
+
+import database
+import product_catalog
+
+
+@pytest.fixture
+def catalog(temp_db):
+    product_catalog.reset()
+    database.add_product("Arroz", 4.2, 10, "A1", "KGM", issuer_name="Empresa", issuer_address="Jr. Lima 1", category="Abarrotes")
+    database.add_product("Leche", 4.5, 5, "L1", "NIU", issuer_name="Empresa", issuer_address="Jr. Lima 1", category="Lácteos")
+    database.add_product("Pan", 0.3, 50, "P1", "NIU", issuer_name="Otra", issuer_address="Av. Sol 2")
+    yield product_catalog.get_catalog("Empresa", "Jr. Lima 1")
+    product_catalog.reset()
+
+
+def test_catalog_indexes(catalog):
+    assert catalog.names == ["Arroz", "Leche"]
+    assert catalog.find_code(" L1 ")["name"] == "Leche"
+    assert sorted(catalog.by_category) == ["Abarrotes", "Lácteos"]
+    assert catalog.rows() == database.get_all_products("Empresa", "Jr. Lima 1")
+    # Mismo filtro, mismo objeto: lo comparten todas las vistas
+    assert product_catalog.get_catalog("Empresa", "Jr. Lima 1") is catalog
+    assert len(product_catalog.get_catalog("Todas", None)) == 3
+
+
+def test_stock_change_is_applied_in_place(catalog):
+    arroz = catalog.get(1)
+    database.decrease_product_stock(1, 3)
+
+    assert catalog.sync() == {1}
+    assert catalog.get(1) is arroz and arroz["stock"] == 7
+    assert catalog.full_loads == 1
+    assert catalog.sync() == set()
+
+
+def test_inventory_edits_add_and_remove_products(catalog):
+    database.update_product(1, "Arroz Extra", 4.2, 10, "A2", "KGM", "Gravada", "Empresa", "Jr. Lima 1", "Granos")
+    new_id = database.add_product("Yogurt", 3.0, 8, "Y1", "NIU", issuer_name="Empresa", issuer_address="Jr. Lima 1", category="Lácteos")
+    database.delete_product(2)
+    database.update_product(3, "Pan", 0.4, 50, "P1", "NIU", "Gravada", "Otra", "Av. Sol 2")  # otro emisor: no entra
+
+    assert catalog.sync() == {1, 2, new_id}
+    assert catalog.names == ["Arroz Extra", "Yogurt"]
+    assert catalog.find_code("A1") is None and catalog.find_code("A2")["category"] == "Granos"
+    assert [p["name"] for p in catalog.by_category["Lácteos"]] == ["Yogurt"]
+    assert catalog.full_loads == 1
+
+
+def test_views_read_their_own_pending_changes(catalog):
+    view_a = view_b = catalog.data_version
+    database.decrease_product_stock(1, 1)
+    catalog.sync()
+    view_a, changed = catalog.changes_since(view_a)
+    assert changed == {1}
+
+    database.decrease_product_stock(2, 1)
+    catalog.sync()
+    assert catalog.changes_since(view_a)[1] == {2}
+    # La vista que no sincronizó recibe la unión de ambos cambios
+    assert catalog.changes_since(view_b)[1] == {1, 2}
+    assert catalog.changes_since(catalog.data_version)[1] == set()
+
+
+def test_pruned_feed_falls_back_to_full_load(catalog):
+    version = catalog.data_version
+    for _ in range(4):
+        database.decrease_product_stock(1, 1)
+    database.prune_stock_changes(keep=1)
+
+    assert catalog.sync() is None
+    assert catalog.full_loads == 2 and catalog.get(1)["stock"] == 6
+    assert catalog.changes_since(version)[1] is None
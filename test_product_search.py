@@ -0,0 +1,80 @@
+import threading
+
+import database
+import product_catalog
+from product_search import ProductSearchIndex, normalize
+
+
+def _products(*names_codes):
+    return [{'id': i, 'name': name, 'code': code} for i, (name, code) in enumerate(names_codes, 1)]
+
+
+def _names(results):
+    return [p['name'] for p in results]
+
+
+def test_normalize_folds_accents_case_and_spaces():
+    assert normalize("  Azúcar   RUBIA ") == "azucar rubia"
+    assert normalize("Ñandú") == "nandu"
+    assert normalize(None) == ""
+
+
+def test_search_matches_name_or_code_without_accents():
+    index = ProductSearchIndex(_products(("Azúcar Rubia", "AZ1"), ("Café Altomayo", "C7"), ("Harina", "H1")))
+    assert _names(index.search("azucar")) == ["Azúcar Rubia"]
+    assert _names(index.search("CAFE alto")) == ["Café Altomayo"]
+    assert _names(index.search("c7")) == ["Café Altomayo"]
+    assert index.search("xyz") == [] and index.search("  ") == []
+
+
+def test_short_queries_match_word_prefixes_only():
+    index = ProductSearchIndex(_products(("Arroz", None), ("Harina", None), ("Pan Árabe", None)))
+    # "ar" no trae "Harina": con 1-2 letras se busca al inicio de cada palabra
+    assert _names(index.search("ar")) == ["Arroz", "Pan Árabe"]
+    assert _names(index.search("ari")) == ["Harina"]
+
+
+def test_ranking_and_limit():
+    index = ProductSearchIndex(_products(
+        ("Galleta Soda", "G2"), ("Gaseosa Cola 500", "SODA"), ("Soda Cracker", "G1"), ("Hipersoda Limón", "G3")))
+    # Código exacto, nombre que empieza, palabra que empieza, contiene
+    assert _names(index.search("soda")) == ["Gaseosa Cola 500", "Soda Cracker", "Galleta Soda", "Hipersoda Limón"]
+    assert _names(index.search("soda", limit=2)) == ["Gaseosa Cola 500", "Soda Cracker"]
+
+
+def test_catalog_rebuilds_index_only_when_names_change(temp_db):
+    product_catalog.reset()
+    try:
+        database.add_product("Azúcar", 3.5, 10, "A1", "KGM")
+        database.add_product("Leche", 4.5, 5, "L1", "NIU")
+        catalog = product_catalog.get_catalog()
+        index = catalog.search_index()
+        assert _names(catalog.search("azu")) == ["Azúcar"]
+
+        database.decrease_product_stock(1, 2)
+        catalog.sync()
+        assert catalog.search_index() is index
+        assert catalog.search("azu")[0]["stock"] == 8
+
+        database.update_product(2, "Leche Evaporada", 4.5, 5, "L1", "NIU", "Gravada")
+        catalog.sync()
+        assert catalog.search_index() is not index
+        assert _names(catalog.search("evap")) == ["Leche Evaporada"]
+    finally:
+        product_catalog.reset()
+
+
+def test_prepare_search_builds_index_in_background(temp_db):
+    product_catalog.reset()
+    try:
+        database.add_product("Café", 9.0, 3, "C1", "NIU")
+        catalog = product_catalog.get_catalog()
+        catalog.prepare_search()
+        for thread in threading.enumerate():
+            if thread.name == "product-search-index":
+                thread.join(5)
+        index = catalog.search_index()
+        catalog.prepare_search()     # ya armado: no lanza otro hilo
+        assert catalog.search_index() is index and _names(catalog.search("cafe")) == ["Café"]
+    finally:
+        product_catalog.reset()
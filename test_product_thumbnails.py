@@ -0,0 +1,104 @@
+import io
+import sqlite3
+
+import pytest
+
+import database
+
+Image = pytest.importorskip("PIL.Image")
+import product_thumbnails
+
+
+def _png(size=(400, 200), color=(200, 30, 30)):
+    out = io.BytesIO()
+    Image.new("RGB", size, color).save(out, format="PNG")
+    return out.getvalue()
+
+
+def _service():
+    # Sin Tk: la "PhotoImage" es el PNG de la miniatura
+    return product_thumbnails.ThumbnailService(max_photos=2, photo_factory=lambda png: png)
+
+
+def _deliver(service):
+    service.wait(timeout=5)
+    return service.deliver()
+
+
+def test_product_queries_carry_image_hash_not_blob(temp_db):
+    image = _png()
+    product_id = database.add_product("Pan", 0.3, 10, "P1", "NIU", image=image)
+    database.add_product("Leche", 4.5, 5, "L1", "NIU")
+
+    rows = {row[1]: row for row in database.get_all_products()}
+    assert len(rows["Pan"][10]) == 40 and rows["Leche"][10] is None
+    assert database.get_product_image(product_id) == image
+
+    old_hash = rows["Pan"][10]
+    database.update_product(product_id, "Pan", 0.3, 10, "P1", "NIU", "Gravada", image=_png(color=(0, 0, 255)))
+    new_hash = database.get_all_products()[1][10]
+    assert new_hash != old_hash
+    # Sin imagen nueva se conserva la anterior y su hash
+    database.update_product(product_id, "Pan", 0.4, 10, "P1", "NIU", "Gravada")
+    assert database.get_all_products()[1][10] == new_hash
+
+
+def test_thumbnail_generated_once_and_persisted(temp_db, monkeypatch):
+    product_id = database.add_product("Pan", 0.3, 10, "P1", "NIU", image=_png())
+    image_hash = database.get_all_products()[0][10]
+    ready = []
+
+    service = _service()
+    assert service.get(product_id, image_hash, lambda p_id, photo: ready.append(p_id)) is None
+    assert service.get(product_id, image_hash) is None     # ya encargada: no se repite
+    assert _deliver(service) == 1 and ready == [str(product_id)]
+    assert service.generated == 1
+
+    thumb = Image.open(io.BytesIO(service.get(product_id, image_hash)))
+    assert thumb.size == (50, 25)
+    assert database.get_product_thumbnail(product_id, image_hash) is not None
+
+    # Otro proceso (servicio nuevo) la lee de la tabla sin volver a abrir la foto
+    monkeypatch.setattr(database, "get_product_image", lambda p_id: pytest.fail("no debe leer la foto"))
+    other = _service()
+    other.get(product_id, image_hash)
+    assert _deliver(other) == 1 and other.generated == 0
+
+
+def test_photo_cache_is_bounded_and_broken_images_are_not_retried(temp_db):
+    ids = [database.add_product(f"P{i}", 1.0, 1, f"C{i}", "NIU", image=_png(color=(i, i, i))) for i in range(3)]
+    hashes = {row[0]: row[10] for row in database.get_all_products()}
+    service = _service()
+    for p_id in ids:
+        service.get(p_id, hashes[p_id])
+    assert _deliver(service) == 3
+    assert len(service._photos) == 2 and service.get(ids[0], hashes[ids[0]]) is None
+
+    broken = database.add_product("Roto", 1.0, 1, "R", "NIU", image=b"no es imagen")
+    broken_hash = database.get_all_products()[-1][10]
+    service.get(broken, broken_hash)
+    _deliver(service)
+    assert service.get(broken, broken_hash) is None and not service.pending
+
+
+def test_database_errors_are_retried_on_the_next_get(temp_db, monkeypatch):
+    product_id = database.add_product("Pan", 0.3, 10, "P1", "NIU", image=_png())
+    image_hash = database.get_all_products()[0][10]
+    get_thumbnail = database.get_product_thumbnail
+    calls = []
+
+    def locked_once(p_id, i_hash):
+        calls.append(p_id)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return get_thumbnail(p_id, i_hash)
+
+    monkeypatch.setattr(database, "get_product_thumbnail", locked_once)
+    ready = []
+    service = _service()
+    service.get(product_id, image_hash, lambda p_id, photo: ready.append(p_id))
+    assert _deliver(service) == 0 and not service.pending
+
+    service.get(product_id, image_hash)
+    assert _deliver(service) == 1 and ready == [str(product_id)]
+    assert service.get(product_id, image_hash) is not None
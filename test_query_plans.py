@@ -0,0 +1,154 @@
+"""
+Regresión de planes de consulta: ejecuta cada función de lectura de database.py,
+captura las sentencias SQL que emite y revisa su EXPLAIN QUERY PLAN. Una consulta
+frecuente que vuelva a recorrer una tabla completa (SCAN) hace fallar la prueba.
+"""
+import inspect
+import re
+
+import pytest
+
+import database
+
+# Funciones (y llamadas de ejemplo) cuyas consultas se revisan.
+CALLS = {
+    "get_user_by_id": (1,),
+    "user_has_password": (1,),
+    "check_user_password": (1, "x"),
+    "get_product_stock": (1,),
+    "get_products_live_data": (["1", "2"],),
+    "get_products_by_ids": (["1", "2"],),
+    "get_all_products": ("Empresa", "Jr. Lima 1"),
+    "get_product_image": (1,),
+    "get_product_thumbnail": (1, "0" * 40),
+    "is_code_unique": ("A1", "Empresa", "Jr. Lima 1"),
+    "get_all_parties": ("Cliente",),
+    "get_or_create_customer": ("12345678", "Juan Perez", "", ""),
+    "get_full_sale_data": (1,),
+    "get_sale_details_by_sale_id": (1,),
+    "get_sales_for_cpe_rebuild": ("2026-01-21", "2026-01-21", ["PENDIENTE"], 1),
+    "get_correlative": (1, "BOLETA"),
+    "get_next_correlative": (1, "BOLETA"),
+    "checkout": (1, "BOLETA", ("87654321", "Ana", "", ""), [{'id': 1, 'name': 'Arroz', 'quantity': 1, 'price': 4.0, 'subtotal': 4.0}],
+                 4.0, "2026-01-21 12:00:00", "", "EFECTIVO", 4.0, None, 0.0, "CAJA", ""),
+    "get_all_sales_with_customer_name": ("Empresa", "Jr. Lima 1", "2026-01-21", "2026-01-21"),
+    "get_sales_history_page": ("Empresa", "Jr. Lima 1", "2026-01-21", "2026-01-21", "B001", ("2026-01-21 23:00:00", 9)),
+    "get_sales_history_totals": ("Empresa", "Jr. Lima 1", "2026-01-21", "2026-01-21", "B001"),
+    "get_next_movement_number": ("INGRESO",),
+    "record_movement": ("SALIDA", "Merma", 1, "Jr. Lima 1", [{'id': 1, 'quantity': 1, 'unit_of_measure': 'KGM', 'price': 4.0, 'subtotal': 4.0}],
+                        4.0, "2026-01-21 13:00:00"),
+    "get_movements": ("INGRESO", "2026-01-21", "2026-01-21", 1, "Jr. Lima 1"),
+    "get_movement_items": (1,),
+    "get_movement_full_data": (1,),
+    "get_daily_sales_total": (),
+    "get_last_closure": ("1",),
+    "get_cash_counts_history": ("1",),
+    "get_cash_count_by_id": (1,),
+    "get_sales_total_in_range": ("2026-01-21 00:00:00", "2026-01-21 23:59:59", "1"),
+    "get_temp_expenses": ("1",),
+    "get_stock_version": (),
+    "get_stock_changes_since": (0,),
+    "get_movement_totals_by_type_in_range": ("2026-01-21 00:00:00", "2026-01-21 23:59:59"),
+    "get_period_analytics": ("2026-01-21 00:00:00", "2026-01-21 23:59:59"),
+    "get_product_ranking_in_range": ("2026-01-21 00:00:00", "2026-01-21 23:59:59"),
+    "get_discount_details_in_range": ("2026-01-21 00:00:00", "2026-01-21 23:59:59"),
+    "get_documents_summary_in_range": ("2026-01-21 00:00:00", "2026-01-21 23:59:59"),
+    "get_pending_invoices_for_retry": (),
+    "get_cpe_retry_backlog": (),
+    "get_sale_for_retry": (1,),
+    "get_issuer_by_id": (1,),
+    "get_cpe_job": (1,),
+    "get_batchable_cpe_jobs": (),
+    "get_open_cpe_batches": (),
+    "search_customers_general": ("juan",),
+    "search_parties": ("12345678",),
+    "get_party_by_doc_number": ("12345678",),
+    "get_document_lookup": ("12345678",),
+}
+
+# Lecturas que recorren la tabla completa a propósito (listados completos, tablas
+# pequeñas de configuración o búsquedas LIKE '%texto%'), con el motivo.
+FULL_SCAN_ALLOWED = {
+    "get_all_users": "listado completo de usuarios (tabla pequeña)",
+    "get_user_by_credentials": "lower(username) sobre la tabla pequeña de usuarios",
+    "get_active_user_by_username": "lower(username) sobre la tabla pequeña de usuarios",
+    "get_users_by_permission": "permisos en CSV; tabla pequeña de usuarios",
+    "get_all_categories": "DISTINCT de categorías del catálogo completo",
+    "get_all_issuers": "listado completo de emisores",
+    "get_all_sales": "listado completo de ventas",
+    "get_customer_by_alias": "LIKE '%alias%' no puede usar índices",
+    "get_expenses_history": "listado/búsqueda LIKE del histórico de gastos",
+    "get_unique_expense_details": "DISTINCT del histórico de gastos",
+    "get_last_issued_correlative": "no consulta la base de datos",
+}
+
+# Pasos del plan que recorren una tabla entera (directamente o un índice completo)
+_SCAN_RE = re.compile(r"^SCAN (?!CONSTANT ROW)(\S+)(?: AS \S+)?(?: USING (?:COVERING )?INDEX \S+)?$")
+
+
+def _seed():
+    database.add_issuer("Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", "", "", "", "", "",
+                        "", "", "", "", "", "", "Gravada", "0000", "", "")
+    database.set_correlative(1, "BOLETA", "B001", 1)
+    database.add_product("Arroz", 4.0, 50, "A1", "KGM", issuer_name="Empresa", issuer_address="Jr. Lima 1")
+    database.add_product("Azucar", 3.0, 20, "A2", "KGM", issuer_name="Empresa", issuer_address="Jr. Lima 1")
+    database.add_user("admin", "x", "ventas")
+    database.checkout(1, "BOLETA", ("12345678", "Juan Perez", "", ""), [{'id': 1, 'name': 'Arroz', 'quantity': 2, 'price': 4.0, 'subtotal': 8.0}],
+                      8.0, "2026-01-21 10:00:00", "", "EFECTIVO", 8.0, None, 0.0, "CAJA", "")
+    database.record_movement("INGRESO", "Compra", 1, "Jr. Lima 1", [{'id': 2, 'quantity': 5, 'unit_of_measure': 'KGM', 'price': 3.0, 'subtotal': 15.0}],
+                             15.0, "2026-01-21 09:00:00")
+    database.add_temp_expense("1", "2026-01-21 11:00:00", "Taxi", 5.0)
+    database.save_cash_count({'caja_id': "1", 'start_time': "2026-01-21 00:00:00", 'end_time': "2026-01-21 20:00:00",
+                              'user_id': "1", 'system_cash': 0, 'counted_cash': 0, 'difference': 0, 'correlative': "Cierre-1"})
+
+
+def _capture(func, args):
+    """Ejecuta func(*args) y devuelve las sentencias SQL que emitió en la conexión del hilo."""
+    statements = []
+    with database.get_connection() as conn:
+        conn._raw.set_trace_callback(statements.append)
+        try:
+            func(*args)
+        finally:
+            conn._raw.set_trace_callback(None)
+    return [sql for sql in statements if re.match(r"\s*(SELECT|UPDATE|DELETE|WITH)\b", sql, re.IGNORECASE)]
+
+
+def _full_scans(sql):
+    with database.get_connection() as conn:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    return [row[-1] for row in plan if _SCAN_RE.match(row[-1])]
+
+
+@pytest.fixture
+def seeded_db(temp_db):
+    _seed()
+    return temp_db
+
+
+def test_every_query_function_is_checked():
+    query_functions = {name for name, obj in inspect.getmembers(database, inspect.isfunction)
+                       if obj.__module__ == "database" and re.match(r"(get|search|is|check|user_has)_", name)}
+    unchecked = query_functions - set(CALLS) - set(FULL_SCAN_ALLOWED) - {"get_connection", "get_connection_stats"}
+    assert not unchecked, f"Añadir a CALLS o FULL_SCAN_ALLOWED: {sorted(unchecked)}"
+
+
+@pytest.mark.parametrize("name", sorted(CALLS))
+def test_hot_queries_use_indexes(seeded_db, name):
+    statements = _capture(getattr(database, name), CALLS[name])
+    assert statements, f"{name} no ejecutó ninguna consulta"
+    for sql in statements:
+        assert not _full_scans(sql), f"{name}: recorrido completo en\n{sql}\n{_full_scans(sql)}"
+
+
+def test_secondary_indexes_exist(temp_db):
+    with database.get_connection() as conn:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    for sql in database.SECONDARY_INDEXES:
+        assert re.search(r"EXISTS (\w+)", sql).group(1) in names
+
+
+def test_full_scan_detection(temp_db):
+    assert _full_scans("SELECT * FROM sales WHERE observations = 'x'") == ["SCAN sales"]
+    assert _full_scans("SELECT * FROM sales s ORDER BY s.sale_ts") == ["SCAN s USING INDEX idx_sales_sale_ts"]
+    assert not _full_scans("SELECT * FROM sales WHERE sale_ts > '2026-01-01'")
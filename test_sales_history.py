@@ -0,0 +1,63 @@
+import database
+
+
+def _sale(sale_date, total, number):
+    return database.record_sale(1, 1, total, [], sale_date, "", "BOLETA", number, "EFECTIVO", total, None, 0.0, "CAJA", "")
+
+
+def _seed():
+    # Varias ventas con la misma hora para que el cursor tenga que desempatar por id
+    ids = []
+    for day in range(1, 6):
+        for n in range(3):
+            ids.append(_sale(f"2026-01-{day:02d} 10:00:00", 1000.0 + n, f"B001-{len(ids) + 1}"))
+    with database.transaction() as conn:
+        conn.execute("INSERT INTO sales (id, total_amount, sale_date, document_number) VALUES (100, 7, 'ayer', 'B001-100')")
+    return ids
+
+
+def _all_pages(limit, **filters):
+    rows, cursor = [], None
+    while True:
+        page = database.get_sales_history_page(after=cursor, limit=limit, **filters)
+        rows.extend(page)
+        if len(page) < limit:
+            return rows
+        cursor = (page[-1][-1], page[-1][0])
+
+
+def test_pages_concatenate_to_full_history(temp_db):
+    _seed()
+    expected = [row[0] for row in database.get_sales_history_page(limit=1000)]
+    assert expected[-1] == 100  # sin fecha reconocible, al final
+    assert expected[:3] == [15, 14, 13]
+
+    for limit in (1, 2, 4, 7):
+        assert [row[0] for row in _all_pages(limit)] == expected
+
+
+def test_filter_text_and_totals(temp_db):
+    _seed()
+    by_number = _all_pages(2, filter_text="B001-1")
+    assert sorted(row[0] for row in by_number) == [1, 10, 11, 12, 13, 14, 15, 100]
+
+    for text in ("1,001.00", "1001.00", "1001"):
+        assert {row[5] for row in _all_pages(2, filter_text=text)} == {1001.0}
+
+    # "%" y "_" se buscan literalmente
+    assert _all_pages(2, filter_text="B001_1") == []
+
+    count, total, diff = database.get_sales_history_totals(start_date="2026-01-02", end_date="2026-01-03", filter_text="cliente varios")
+    assert count == 6
+    assert total == 2 * (1000.0 + 1001.0 + 1002.0)
+    assert diff == 0.0
+
+
+def test_filter_text_ignores_case_of_accented_names(temp_db):
+    with database.transaction() as conn:
+        conn.execute("INSERT INTO customers (id, name, doc_number) VALUES (50, 'JOSÉ PEÑA', '12345678')")
+    sale_id = database.record_sale(1, 50, 20.0, [], "2026-01-02 10:00:00", "", "BOLETA", "B001-1", "EFECTIVO", 20.0, None, 0.0, "CAJA", "")
+
+    for text in ("peña", "josé peña", "PEÑA"):
+        assert [row[0] for row in _all_pages(2, filter_text=text)] == [sale_id]
+    assert database.get_sales_history_totals(filter_text="jOSÉ")[0] == 1
@@ -0,0 +1,68 @@
+import datetime
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def xml_generator():
+    for module in ("lxml", "signxml", "cryptography", "requests"):
+        pytest.importorskip(module)
+    import xml_generator
+    xml_generator.invalidate_signing_credentials()
+    return xml_generator
+
+
+def _pkcs12(password):
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import pkcs12
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "20123456789")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    return pkcs12.serialize_key_and_certificates(b"test", key, cert, None, serialization.BestAvailableEncryption(password.encode()))
+
+
+def test_credentials_are_loaded_once_per_certificate(xml_generator, tmp_path):
+    gen = xml_generator.XMLGenerator(str(tmp_path))
+    issuer = {"id": 1, "certificate": _pkcs12("clave"), "cert_password": "clave"}
+    before = xml_generator.get_signing_stats()
+
+    first = gen.get_credentials(issuer)
+    assert xml_generator.XMLGenerator(str(tmp_path)).get_credentials(issuer) is first
+
+    # Certificado nuevo para el mismo emisor: se vuelve a cargar
+    second = gen.get_credentials(dict(issuer, certificate=_pkcs12("clave")))
+    assert second is not first
+
+    stats = xml_generator.get_signing_stats()
+    assert stats["credential_loads"] - before["credential_loads"] == 2
+    assert stats["credential_hits"] - before["credential_hits"] == 1
+
+
+def test_update_issuer_invalidates_credentials(xml_generator, temp_db, tmp_path):
+    gen = xml_generator.XMLGenerator(str(tmp_path))
+    issuer = {"id": 1, "certificate": _pkcs12("clave"), "cert_password": "clave"}
+    first = gen.get_credentials(issuer)
+
+    database.update_issuer(1, "Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", issuer["certificate"],
+                           "", "", "", "", "", "", "", "", "", "", "Gravada", "0000", "clave", "")
+    assert gen.get_credentials(issuer) is not first
+
+
+def test_issuer_listeners_receive_changes(temp_db, monkeypatch):
+    changed = []
+    monkeypatch.setattr(database, "_issuer_listeners", [changed.append])
+    issuer_id = database.add_issuer("Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", "", "", "", "", "",
+                                    "", "", "", "", "", "", "Gravada", "0000", "", "")
+    database.update_issuer(issuer_id, "Empresa", "20123456789", "Jr. Lima 1", "", None, "", "", "", "", "", "", "", "", "", None,
+                           "", "", "", "", "", "", "", "", "", "", "Gravada", "0000", "", "")
+    database.delete_issuer(issuer_id)
+    assert changed == [issuer_id, issuer_id]
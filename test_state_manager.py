@@ -0,0 +1,64 @@
+import json
+
+import state_manager
+
+
+def _item(pid, qty):
+    return {"id": pid, "name": f"P{pid}", "quantity": qty, "price": 1.0, "subtotal": qty}
+
+
+def test_reserved_quantity_excludes_own_box(temp_db):
+    state_manager.save_box_state(1, {"cart": [_item(10, 2), _item(11, 1)]})
+    state_manager.save_box_state(2, {"cart": [_item(10, 3)]})
+
+    assert state_manager.get_global_reserved_quantity("10") == 5
+    assert state_manager.get_global_reserved_quantity(10, exclude_caja_id=2) == 2
+    assert state_manager.get_reserved_quantities(exclude_caja_id=1) == {"10": 3}
+
+
+def test_roundtrip_and_clear(temp_db):
+    state = {"cart": [_item(10, 2)], "doc_type": "BOLETA", "customer": {"doc": "1"}}
+    state_manager.save_box_state(3, state)
+    assert state_manager.load_all_states()["3"] == state
+    assert state_manager.has_pending_items()
+
+    state_manager.save_box_state(3, {"cart": []})
+    assert state_manager.load_all_states()["3"] == {"cart": []}
+    assert not state_manager.has_pending_items()
+
+    state_manager.clear_box_state(3)
+    assert "3" not in state_manager.load_all_states()
+
+
+def test_only_changed_lines_are_written(temp_db):
+    cart = [_item(i, 1) for i in range(50)]
+    state_manager.save_box_state(1, {"cart": cart})
+    with state_manager.database.get_connection() as conn:
+        before = conn.total_changes
+        cart[7] = _item(7, 4)
+        state_manager.save_box_state(1, {"cart": cart})
+        # Una línea del carrito + su fila en el feed de cambios de stock
+        assert conn.total_changes - before == 2
+    assert state_manager.get_global_reserved_quantity(7) == 4
+
+
+def test_legacy_json_is_imported_once(temp_db):
+    legacy = {"4": {"cart": [_item(20, 2)], "total": 2}}
+    with open(state_manager.STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(legacy, f)
+    state_manager._schema_ready.clear()
+
+    assert state_manager.get_global_reserved_quantity(20) == 2
+    assert state_manager.load_all_states()["4"]["total"] == 2
+    assert (temp_db / "sales_state.json.migrated").exists()
+
+
+def test_reservation_snapshot(temp_db):
+    state_manager.save_box_state(1, {"cart": [_item(10, 2)]})
+    state_manager.save_box_state(2, {"cart": [_item(10, 3), _item(11, 1.5)]})
+
+    snapshot = state_manager.ReservationSnapshot.load(exclude_caja_id=1)
+    assert snapshot.get(10) == 3
+    assert snapshot.get("11") == 1.5
+    assert snapshot.get(99) == 0.0
+    assert len(snapshot) == 2
@@ -0,0 +1,59 @@
+import database
+import state_manager
+
+
+def _item(pid, qty):
+    return {"id": pid, "name": f"P{pid}", "quantity": qty, "price": 1.0, "subtotal": qty}
+
+
+def test_idle_feed_reports_no_changes(temp_db):
+    version = database.get_stock_version()
+    assert database.get_stock_changes_since(version) == (version, set())
+
+
+def test_stock_and_cart_changes_are_versioned(temp_db):
+    database.add_product("A", 1.0, 10, "A1", "NIU")
+    database.add_product("B", 1.0, 10, "B1", "NIU")
+    version = database.get_stock_version()
+
+    database.decrease_product_stock(1, 2)
+    state_manager.save_box_state(7, {"cart": [_item(2, 1)]})
+    version2, changed = database.get_stock_changes_since(version)
+    assert version2 > version
+    assert changed == {"1", "2"}
+
+    # La línea 0 pasa del producto 2 al 1: ambos deben aparecer
+    state_manager.save_box_state(7, {"cart": [_item(1, 1)]})
+    version3, changed = database.get_stock_changes_since(version2)
+    assert changed == {"1", "2"}
+
+    state_manager.clear_box_state(7)
+    assert database.get_stock_changes_since(version3)[1] == {"1"}
+
+
+def test_unchanged_stock_does_not_bump_version(temp_db):
+    database.add_product("A", 1.0, 10, "A1", "NIU")
+    version = database.get_stock_version()
+    database.update_product(1, "A", 1.0, 10, "A1", "NIU", "Gravada")
+    assert database.get_stock_version() == version
+
+
+def test_pruned_feed_requests_full_refresh(temp_db):
+    database.add_product("A", 1.0, 10, "A1", "NIU")
+    version = database.get_stock_version()
+    for _ in range(5):
+        database.decrease_product_stock(1, 1)
+    database.prune_stock_changes(keep=2)
+
+    assert database.get_stock_changes_since(version)[1] is None
+    assert database.get_stock_changes_since(None)[1] is None
+    assert database.get_products_live_data(["1"]) == {1: ("A", 1.0, 5.0)}
+
+
+def test_fresh_database_runs_table_rebuild_migrations(temp_db):
+    # Los triggers de products se crean al final: v30 reconstruye products sin UNIQUE en el nombre
+    database.add_product("Pan", 0.3, 10, "P1", "NIU")
+    database.add_product("Pan", 0.5, 10, "P2", "NIU")
+    version = database.get_stock_version()
+    database.decrease_product_stock(2, 1)
+    assert database.get_stock_changes_since(version)[1] == {"2"}
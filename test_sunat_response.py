@@ -0,0 +1,49 @@
+import base64
+
+import sunat_response
+from sunat_stub import _cdr_zip, _envelope, _fault
+
+
+def _send_bill(cdr_b64, prefix="br"):
+    return _envelope(f'<{prefix}:sendBillResponse xmlns:{prefix}="http://service.sunat.gob.pe">'
+                     f'<applicationResponse>{cdr_b64}</applicationResponse></{prefix}:sendBillResponse>')
+
+
+def test_cdr_is_decoded_in_memory():
+    result = sunat_response.parse_response(_send_bill(_cdr_zip("20123456789-01-F001-1", "0", "La Factura numero F001-1, ha sido aceptada")))
+
+    assert (result.kind, result.status, result.response_code) == ("cdr", "ACEPTADO", "0")
+    assert result.note == "La Factura numero F001-1, ha sido aceptada"
+    assert result.reference_id == "20123456789-01-F001-1"
+    assert result.cdr_zip[:2] == b"PK" and result.cdr_error is None
+
+
+def test_observations_and_rejection_codes():
+    observed = sunat_response.parse_response(_send_bill(_cdr_zip("F001-2", "0", "Aceptada", notes=["4252 - Falta el código de producto"]), prefix="ns2"))
+    assert observed.accepted and observed.notes == ["4252 - Falta el código de producto"]
+    assert observed.note == "Aceptada | Observaciones: 4252 - Falta el código de producto"
+
+    rejected = sunat_response.parse_response(_send_bill(_cdr_zip("F001-3", "2017", "El numero de documento de identidad no es válido")))
+    assert rejected.rejected and rejected.response_code == "2017"
+    assert sunat_response.is_accepted_code("4000") and not sunat_response.is_accepted_code("0100")
+
+
+def test_fault_ticket_and_status_responses():
+    fault = sunat_response.parse_response(_fault("0111", "No tiene el perfil para enviar comprobantes electronicos").encode("utf-8"))
+    assert (fault.kind, fault.status, fault.fault_code) == ("fault", "RECHAZADO", "soap-env:Client.0111")
+
+    ticket = sunat_response.parse_response(_envelope('<br:sendSummaryResponse xmlns:br="http://service.sunat.gob.pe"><ticket>202600001</ticket></br:sendSummaryResponse>'))
+    assert (ticket.kind, ticket.status, ticket.note) == ("ticket", "PENDIENTE", "Ticket: 202600001")
+
+    in_process = sunat_response.parse_response(_envelope("<status><statusCode>98</statusCode></status>"))
+    assert (in_process.kind, in_process.status, in_process.note) == ("status", "PENDIENTE", "En proceso (SUNAT)")
+
+
+def test_unreadable_responses():
+    assert sunat_response.parse_response("No URL configured").status is None
+    assert sunat_response.parse_response("").kind == "unknown"
+
+    broken = sunat_response.parse_response(_send_bill(base64.b64encode(b"no es zip").decode()))
+    # Un CDR ilegible no dice si fue aceptado o rechazado: queda para getStatusCdr
+    assert broken.status is None and not broken.accepted
+    assert broken.cdr_error.startswith("CDR no es un zip válido") and broken.note == broken.cdr_error
@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("PIL")
+
+import tile_images
+
+
+def _legacy_gradient(width, height, rgb1, rgb2):
+    """Color de cada columna como lo calculaba GradientButton con una línea por columna."""
+    return [tuple(int(a + (b - a) * x / width) for a, b in zip(rgb1, rgb2)) for x in range(width)]
+
+
+def test_gradient_matches_per_column_drawing():
+    tile = tile_images.render_tile(120, 60, (0, 123, 255), (0, 86, 179), radius=10)
+    assert tile.size == (120, 60) and tile.mode == "RGBA"
+
+    expected = _legacy_gradient(120, 60, (0, 123, 255), (0, 86, 179))
+    for x in range(0, 120, 7):
+        assert all(abs(a - b) <= 2 for a, b in zip(tile.getpixel((x, 30))[:3], expected[x]))
+    # Cada columna es de un solo color y las esquinas quedan transparentes
+    assert tile.getpixel((50, 15)) == tile.getpixel((50, 45))
+    assert tile.getpixel((0, 0))[3] == 0 and tile.getpixel((60, 30))[3] == 255
+
+
+def test_border_and_focus_are_drawn():
+    plain = tile_images.render_tile(80, 40, (255, 255, 255), (255, 255, 255), radius=5)
+    framed = tile_images.render_tile(80, 40, (255, 255, 255), (255, 255, 255), radius=5, border_rgb=(255, 0, 0), focused=True)
+    assert plain.getpixel((40, 0))[:3] == (255, 255, 255)
+    assert framed.getpixel((40, 0))[:3] == (255, 0, 0)
+    # Un botón aún sin tamaño no falla al dibujar el marco
+    assert tile_images.render_tile(1, 1, (0, 0, 0), (0, 0, 0), radius=10, focused=True).size == (1, 1)
+
+
+def test_cache_is_lru():
+    cache = tile_images.TileImageCache(maxsize=2)
+    built = []
+
+    def factory(name):
+        return lambda: built.append(name) or name
+
+    assert cache.get("a", factory("a")) == "a"
+    cache.get("b", factory("b"))
+    cache.get("a", factory("a"))          # "a" pasa a ser el más reciente
+    cache.get("c", factory("c"))          # expulsa "b"
+    cache.get("a", factory("a"))
+    cache.get("b", factory("b"))
+
+    assert built == ["a", "b", "c", "b"]
+    assert len(cache) == 2
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 4
@@ -0,0 +1,77 @@
+from tile_pool import TilePool
+
+
+class FakeTile:
+    def __init__(self, options):
+        self.options = dict(options)
+        self.redraws = 0
+        self.grid_calls = []
+        self.visible = False
+        self.data = None
+
+    def update_options(self, **options):
+        changed = {k: v for k, v in options.items() if self.options.get(k) != v}
+        if changed:
+            self.options.update(changed)
+            self.redraws += 1
+        return bool(changed)
+
+    def grid(self, **kwargs):
+        self.grid_calls.append((kwargs["row"], kwargs["column"]))
+        self.visible = True
+
+    def grid_remove(self):
+        self.visible = False
+
+
+class FakeFrame:
+    def __init__(self):
+        self.columns = {}
+        self.rows = {}
+
+    def columnconfigure(self, index, weight):
+        self.columns[index] = weight
+
+    def rowconfigure(self, index, weight):
+        self.rows[index] = weight
+
+
+def _items(names, price=1.0):
+    return [({"id": n}, {"text": f"{n} S/ {price:.2f}", "color1": "#e0e0e0"}) for n in names]
+
+
+def test_tiles_are_reused_and_only_changes_redraw():
+    created = []
+    pool = TilePool(FakeFrame(), lambda options: created.append(FakeTile(options)) or created[-1], row_weight=True, padx=5)
+
+    first = pool.update(_items("abcde"), columns=4)
+    assert len(created) == 5 and [t.grid_calls for t in first][4] == [(1, 0)]
+
+    # Otra categoría con menos productos: mismos widgets, los sobrantes se ocultan
+    second = pool.update(_items("abx"), columns=4)
+    assert len(created) == 5 and second == created[:3]
+    assert [t.redraws for t in created] == [0, 0, 1, 0, 0]
+    assert [t.visible for t in created] == [True, True, True, False, False]
+    assert second[2].data == {"id": "x"} and created[3].data is None
+    # Sin cambio de columnas no se vuelve a ubicar ningún botón ya visible
+    assert [len(t.grid_calls) for t in created[:3]] == [1, 1, 1]
+
+    # Volver a mostrar más productos reusa los ocultos y los ubica de nuevo
+    pool.update(_items("abxde"), columns=4)
+    assert len(created) == 5 and created[3].visible and len(created[3].grid_calls) == 2
+
+
+def test_relayout_only_when_columns_change():
+    frame = FakeFrame()
+    pool = TilePool(frame, FakeTile, row_weight=True)
+    tiles = pool.update(_items("abcdef"), columns=5)
+    assert frame.rows == {0: 1, 1: 1}
+
+    assert not pool.relayout(5)
+    assert pool.relayout(4)
+    assert tiles[4].grid_calls[-1] == (1, 0)
+    assert frame.columns[4] == 0 and frame.columns[3] == 1
+    assert all(t.redraws == 0 for t in tiles)
+
+    pool.update(_items("ab"), columns=4)
+    assert frame.rows == {0: 1, 1: 0}
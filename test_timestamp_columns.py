@@ -0,0 +1,66 @@
+import database
+
+
+def _sale(sale_date, total=10.0, payment_method="EFECTIVO"):
+    return database.record_sale(1, 1, total, [], sale_date, "", "BOLETA", "B001-1", payment_method, total, None, 0.0, "CAJA", "")
+
+
+def _ts(table, column, row_id):
+    with database.get_connection() as conn:
+        return conn.execute(f"SELECT {column} FROM {table} WHERE id = ?", (row_id,)).fetchone()[0]
+
+
+def test_writers_populate_normalized_columns(temp_db):
+    sale_id = _sale("2026-01-21 18:12:52")
+    assert _ts("sales", "sale_ts", sale_id) == "2026-01-21 18:12:52"
+
+    database.record_movement("INGRESO", "", 1, "", [], 5.0, "21/01/2026 09:00:00")
+    assert _ts("inventory_movements", "date_ts", 1) == "2026-01-21 09:00:00"
+
+    database.add_temp_expense("1", "2026-01-21 10:00:00", "Taxi", 5.0)
+    count_id = database.save_cash_count({'caja_id': "1", 'start_time': "2026-01-21 00:00:00", 'end_time': "2026-01-21 20:00:00",
+                                         'user_id': "1", 'system_cash': 0, 'counted_cash': 0, 'difference': 0, 'correlative': "Cierre-1"})
+    assert _ts("cash_counts", "end_ts", count_id) == "2026-01-21 20:00:00"
+    assert _ts("expenses_history", "expense_ts", 1) == "2026-01-21 10:00:00"
+
+
+def test_external_writes_are_normalized_by_triggers(temp_db):
+    with database.transaction() as conn:
+        conn.execute("INSERT INTO sales (id, total_amount, sale_date) VALUES (1, 5, '05/02/2026 08:30:00')")
+    assert _ts("sales", "sale_ts", 1) == "2026-02-05 08:30:00"
+
+    with database.transaction() as conn:
+        conn.execute("UPDATE sales SET sale_date = '06-02-2026' WHERE id = 1")
+    assert _ts("sales", "sale_ts", 1) == "2026-02-06 00:00:00"
+
+
+def test_backfill_in_batches(temp_db):
+    dates = ["2025-12-31 23:59:59", "2026-01-01", "02/01/2026 10:00:00", "03/01/2026", "04-01-2026", "ayer", None]
+    with database.transaction() as conn:
+        for i, sale_date in enumerate(dates, start=1):
+            conn.execute("INSERT INTO sales (id, total_amount, sale_date) VALUES (?, 1, ?)", (i, sale_date))
+        conn.execute("UPDATE sales SET sale_ts = NULL")
+
+    with database.get_connection() as conn:
+        database._backfill_timestamp_column(conn, "sales", "sale_date", "sale_ts", batch_size=2)
+        values = [row[0] for row in conn.execute("SELECT sale_ts FROM sales ORDER BY id")]
+
+    assert values == ["2025-12-31 23:59:59", "2026-01-01 00:00:00", "2026-01-02 10:00:00",
+                      "2026-01-03 00:00:00", "2026-01-04 00:00:00", None, None]
+    assert values[:5] == [database.normalize_timestamp(d) for d in dates[:5]]
+
+
+def test_range_queries_use_normalized_columns(temp_db):
+    _sale("2026-01-20 23:00:00", 1.0)
+    _sale("21/01/2026 08:00:00", 2.0)
+    _sale("2026-01-21 22:00:00", 4.0, payment_method="YAPE")
+    _sale("22/01/2026", 8.0)
+
+    sales = database.get_all_sales_with_customer_name(start_date="2026-01-21", end_date="2026-01-21")
+    assert sorted(row[5] for row in sales) == [2.0, 4.0]
+    assert database.get_sales_total_in_range("2026-01-20 23:00:00", "2026-01-22 00:00:00", "1") == 10.0
+
+    with database.get_connection() as conn:
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT SUM(total_amount) FROM sales WHERE sale_ts > ? AND sale_ts <= ?",
+                            ("2026-01-20", "2026-01-22")).fetchall()
+    assert any("idx_sales_sale_ts" in row[-1] for row in plan)
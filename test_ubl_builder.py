@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def xml_generator():
+    for module in ("lxml", "signxml", "cryptography", "requests"):
+        pytest.importorskip(module)
+    import xml_generator
+    return xml_generator
+
+
+def _sale(type_name="BOLETA DE VENTA ELECTRÓNICA", series="B001", number=11, customer=None, items=None):
+    return {
+        "issuer": {"ruc": "20123456789", "name": "Empresa S.A.C.", "commercial_name": "Bodega", "address": "Jr. Lima 1", "establishment_code": "0000"},
+        "customer": customer or {"doc_type": "1", "doc_number": "12345678", "name": "Juan Perez", "address": ""},
+        "document": {"type_name": type_name, "series": series, "number": number, "issue_date": datetime(2026, 1, 10, 10, 30),
+                     "currency": "PEN"},
+        "items": items or [{"description": "Arroz", "quantity": 2, "price_unit_inc_igv": 4.2, "unit_code": "KGM"},
+                           {"description": "Azúcar & sal <x>", "quantity": 1.5, "price_unit_inc_igv": 3.0, "unit_code": ""}],
+    }
+
+
+@pytest.mark.parametrize("sale", [
+    _sale(),
+    _sale("FACTURA ELECTRÓNICA", "F001", 7, {"doc_number": "20987654321", "name": "Cliente SAC", "address": "Av. Sol 2"}),
+    _sale(customer={"doc_number": "", "name": "", "address": ""}, items=[{"description": "Pan", "quantity": 10, "price_unit_inc_igv": 0.3}]),
+])
+def test_template_builder_matches_full_builder(xml_generator, tmp_path, sale):
+    from lxml import etree
+
+    gen = xml_generator.XMLGenerator(str(tmp_path))
+    templated, name = gen._build_invoice_xml(sale, {})
+    full, full_name = gen._build_invoice_xml_full(sale, {})
+
+    assert name == full_name
+    assert etree.tostring(templated) == etree.tostring(full)
+
+
+def test_template_is_compiled_once_per_issuer(xml_generator, tmp_path):
+    gen = xml_generator.XMLGenerator(str(tmp_path))
+    xml_generator._invoice_templates.clear()
+    first, _ = gen._build_invoice_xml(_sale(number=1), {})
+    gen._build_invoice_xml(_sale(number=2), {})
+    assert len(xml_generator._invoice_templates) == 1
+
+    # Cada comprobante es una copia: completar uno no altera la plantilla ni los demás
+    first[3].text = "X"
+    assert gen._build_invoice_xml(_sale(number=3), {})[0][3].text == "B001-00000003"
+
+    moved = _sale()
+    moved["issuer"]["address"] = "Av. Nueva 5"
+    gen._build_invoice_xml(moved, {})
+    assert len(xml_generator._invoice_templates) == 2
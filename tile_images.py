@@ -0,0 +1,86 @@
+"""
+Fondos de los botones táctiles (GradientButton): degradado horizontal con esquinas
+redondeadas, borde y marco de foco.
+
+El degradado se arma con Image.linear_gradient + resize/composite (sin una línea por
+columna) y los fondos ya armados se guardan en un caché LRU, de modo que cambiar de
+categoría en la grilla táctil reutiliza los mismos fondos en vez de redibujarlos.
+"""
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw
+
+# Fondos distintos que se conservan (tamaño x colores x estado); cada uno pesa w*h*4 bytes
+TILE_CACHE_SIZE = 512
+
+
+class TileImageCache:
+    """Caché LRU de fondos de botones; el valor lo arma factory() la primera vez."""
+
+    def __init__(self, maxsize=TILE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory):
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            value = factory()
+            self._items[key] = value
+            if len(self._items) > self.maxsize:
+                # Los botones que todavía muestran la imagen expulsada conservan su propia referencia
+                self._items.popitem(last=False)
+            return value
+        self.hits += 1
+        self._items.move_to_end(key)
+        return value
+
+    def clear(self):
+        self._items.clear()
+        self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+    def __len__(self):
+        return len(self._items)
+
+
+# Caché compartido por todos los GradientButton (las PhotoImage valen para el único Tk de la app)
+tile_cache = TileImageCache()
+
+_ramp = None
+
+
+def _horizontal_ramp(width, height):
+    """Máscara 'L' que va de 0 (izquierda) a 255 (derecha)."""
+    global _ramp
+    if _ramp is None:
+        # linear_gradient es 256x256 y crece hacia abajo: una columna traspuesta es la fila 0..255
+        _ramp = Image.linear_gradient("L").crop((0, 0, 1, 256)).transpose(Image.Transpose.TRANSPOSE)
+    return _ramp.resize((width, 1), Image.Resampling.BILINEAR).resize((width, height), Image.Resampling.NEAREST)
+
+
+def render_tile(width, height, rgb1, rgb2, radius, border_rgb=None, focused=False):
+    """Fondo RGBA de width x height: degradado rgb1 -> rgb2, esquinas redondeadas, borde y foco."""
+    width, height = max(1, width), max(1, height)
+    tile = Image.composite(Image.new("RGBA", (width, height), tuple(rgb2) + (255,)),
+                           Image.new("RGBA", (width, height), tuple(rgb1) + (255,)),
+                           _horizontal_ramp(width, height))
+
+    corners = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(corners).rounded_rectangle((0, 0, width, height), radius=radius, fill=255)
+    tile.putalpha(corners)
+
+    if (border_rgb or focused) and min(width, height) > 4:   # el botón aún sin tamaño no lleva marco
+        draw = ImageDraw.Draw(tile)
+        if border_rgb:
+            draw.rounded_rectangle((0, 0, width - 1, height - 1), radius=radius, outline=tuple(border_rgb) + (255,), width=2)
+        if focused:
+            draw.rounded_rectangle((1, 1, width - 2, height - 2), radius=radius, outline="white", width=3)
+    return tile
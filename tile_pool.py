@@ -0,0 +1,78 @@
+"""
+Pool de botones para las grillas táctiles (productos y categorías).
+
+En vez de destruir y volver a crear todos los GradientButton en cada cambio de
+categoría, búsqueda o redimensionado, el pool conserva los botones ya creados y los
+reasigna a los nuevos datos: solo se reconfiguran los que cambian de texto, color o
+imagen, y solo se vuelven a ubicar en la grilla cuando cambia la cantidad de columnas.
+"""
+
+
+class TilePool:
+    """
+    Botones reutilizables de una grilla. factory(options) crea un botón nuevo; cada
+    botón debe aceptar update_options(**options) y guarda en .data el dato que muestra.
+    """
+
+    def __init__(self, parent, factory, row_weight=False, **grid_options):
+        self.parent = parent
+        self._factory = factory
+        self._row_weight = row_weight
+        self._grid_options = grid_options
+        self.tiles = []
+        self.columns = None
+        self.shown = 0            # botones visibles (los primeros de self.tiles)
+        self._rows = 0
+        self.created = 0
+        self.updated = 0
+
+    def update(self, items, columns):
+        """items: lista de (dato, opciones). Devuelve los botones visibles en ese orden."""
+        regrid = columns != self.columns
+        for index, (data, options) in enumerate(items):
+            if index < len(self.tiles):
+                tile = self.tiles[index]
+                if tile.update_options(**options):
+                    self.updated += 1
+                placed = index < self.shown and not regrid
+            else:
+                tile = self._factory(options)
+                self.tiles.append(tile)
+                self.created += 1
+                placed = False
+            tile.data = data
+            if not placed:
+                tile.grid(row=index // columns, column=index % columns, **self._grid_options)
+
+        # Los sobrantes se ocultan pero quedan en el pool para la próxima vista
+        for tile in self.tiles[len(items):self.shown]:
+            tile.grid_remove()
+            tile.data = None
+
+        self._configure_weights(len(items), columns)
+        self.shown = len(items)
+        self.columns = columns
+        return self.tiles[:self.shown]
+
+    def relayout(self, columns):
+        """Reubica los botones visibles con otra cantidad de columnas (sin tocar su contenido)."""
+        if columns == self.columns:
+            return False
+        for index, tile in enumerate(self.tiles[:self.shown]):
+            tile.grid(row=index // columns, column=index % columns, **self._grid_options)
+        self._configure_weights(self.shown, columns)
+        self.columns = columns
+        return True
+
+    def _configure_weights(self, count, columns):
+        # Columnas: las que sobran de la disposición anterior no deben repartir espacio
+        for col in range(max(columns, self.columns or 0)):
+            self.parent.columnconfigure(col, weight=1 if col < columns else 0)
+        if self._row_weight:
+            rows = (count + columns - 1) // columns
+            for row in range(max(rows, self._rows)):
+                self.parent.rowconfigure(row, weight=1 if row < rows else 0)
+            self._rows = rows
+
+    def visible(self):
+        return [(tile.data, tile) for tile in self.tiles[:self.shown]]
@@ -1,5 +1,5 @@
 import subprocess
-import requests
+import http_transport
 import time
 import os
 import threading
@@ -112,14 +112,14 @@ class BaileysManager:
     def is_running(self):
         try:
             # Check API status
-            response = requests.get(f"{self.api_url}/status", timeout=2)
+            response = http_transport.get(f"{self.api_url}/status", endpoint="whatsapp.status", connect_timeout=2, read_timeout=2, retry=http_transport.RETRY_NONE)
             return response.status_code == 200
         except:
             return False
 
     def get_status(self):
         try:
-            response = requests.get(f"{self.api_url}/status", timeout=5)
+            response = http_transport.get(f"{self.api_url}/status", endpoint="whatsapp.status", read_timeout=5, retry=http_transport.RETRY_NONE)
             if response.status_code == 200:
                 return response.json()
         except Exception as e:
@@ -128,7 +128,7 @@ class BaileysManager:
 
     def get_qr(self):
         try:
-            response = requests.get(f"{self.api_url}/qr", timeout=5)
+            response = http_transport.get(f"{self.api_url}/qr", endpoint="whatsapp.qr", read_timeout=5, retry=http_transport.RETRY_NONE)
             if response.status_code == 200:
                 return response.json()
         except:
@@ -138,14 +138,14 @@ class BaileysManager:
     def send_message(self, number, message):
         try:
             payload = {"number": number, "message": message}
-            response = requests.post(f"{self.api_url}/send", json=payload, timeout=10)
+            response = http_transport.post(f"{self.api_url}/send", json=payload, endpoint="whatsapp.send", read_timeout=10, retry=http_transport.RETRY_NONE)
             return response.json()
         except Exception as e:
             return {"success": False, "message": str(e)}
 
     def connect_service(self):
         try:
-            response = requests.post(f"{self.api_url}/connect", timeout=5)
+            response = http_transport.post(f"{self.api_url}/connect", endpoint="whatsapp.connect", read_timeout=5, retry=http_transport.RETRY_NONE)
             return response.json()
         except Exception as e:
             return {"success": False, "message": str(e)}
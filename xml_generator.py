@@ -1,3 +1,4 @@
+import copy
 import os
 import zipfile
 import base64
@@ -7,7 +8,191 @@ from signxml import XMLSigner, methods
 from cryptography.hazmat.primitives.serialization import pkcs12
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.backends import default_backend
-import requests
+import hashlib
+import threading
+import time
+
+import database
+import http_transport
+import sunat_response
+
+
+class SigningCredentials:
+    """Clave privada y certificado ya cargados de un emisor, con un XMLSigner reutilizable."""
+
+    def __init__(self, key, cert_pem, load_seconds):
+        self.key = key
+        self.cert_pem = cert_pem
+        self.load_seconds = load_seconds
+        self.signer = XMLSigner(
+            method=methods.enveloped,
+            signature_algorithm="rsa-sha256",
+            digest_algorithm="sha256",
+            c14n_algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"
+        )
+        # XMLSigner guarda estado durante sign(); los hilos de envío firman de a uno por emisor
+        self.lock = threading.Lock()
+
+
+# Caché de credenciales por emisor: issuer_id -> (hash del certificado y su contraseña, SigningCredentials).
+# Decodificar el PKCS#12 (derivación de clave incluida) solo ocurre la primera vez o si cambia el certificado.
+_credentials = {}
+_credentials_lock = threading.Lock()
+_signing_stats = {"credential_loads": 0, "credential_hits": 0, "load_seconds": 0.0, "signatures": 0, "sign_seconds": 0.0}
+
+
+def _credentials_hash(blob, password):
+    digest = hashlib.sha256(blob if isinstance(blob, bytes) else str(blob).encode())
+    digest.update(b"\0" + (password or "").encode())
+    return digest.hexdigest()
+
+
+def invalidate_signing_credentials(issuer_id=None):
+    """Descarta las credenciales cacheadas de un emisor (o de todos)."""
+    with _credentials_lock:
+        if issuer_id is None:
+            _credentials.clear()
+        else:
+            _credentials.pop(issuer_id, None)
+
+
+def get_signing_stats():
+    """Contadores y tiempos acumulados de carga de credenciales y de firma."""
+    with _credentials_lock:
+        return dict(_signing_stats)
+
+
+# update_issuer/delete_issuer avisan para no seguir firmando con un certificado reemplazado
+database.add_issuer_listener(invalidate_signing_credentials)
+
+
+_UBL_INVOICE = "{urn:oasis:names:specification:ubl:schema:xsd:Invoice-2}"
+_UBL_CAC = "{urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2}"
+_UBL_CBC = "{urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2}"
+_UBL_EXT = "{urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2}"
+INVOICE_NSMAP = {
+    None: "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2",
+    "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+    "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+    "ds": "http://www.w3.org/2000/09/xmldsig#",
+    "ext": "urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2"
+}
+
+
+def _node(parent, tag, text=None, **attrs):
+    elem = etree.SubElement(parent, tag, **attrs)
+    if text is not None:
+        elem.text = str(text)
+    return elem
+
+
+class InvoiceTemplate:
+    """
+    Invoice UBL precompilado para un emisor y dirección: espacios de nombres, extensión para la firma,
+    cac:Signature y AccountingSupplierParty ya armados. Los nodos que cambian por venta quedan vacíos
+    y se completan sobre una copia (copy.deepcopy es una copia en C del árbol de lxml).
+    """
+    # Posiciones de los nodos que se completan en el esqueleto (orden exigido por UBL 2.1)
+    ID, ISSUE_DATE, ISSUE_TIME, TYPE_CODE, NOTE, CURRENCY, CUSTOMER = 3, 4, 5, 6, 7, 8, 11
+
+    def __init__(self, issuer):
+        root = etree.Element(f"{_UBL_INVOICE}Invoice", nsmap=INVOICE_NSMAP)
+        _node(_node(_node(root, f"{_UBL_EXT}UBLExtensions"), f"{_UBL_EXT}UBLExtension"), f"{_UBL_EXT}ExtensionContent")
+        _node(root, f"{_UBL_CBC}UBLVersionID", "2.1")
+        _node(root, f"{_UBL_CBC}CustomizationID", "2.0")
+        for name in ("ID", "IssueDate", "IssueTime"):
+            _node(root, f"{_UBL_CBC}{name}", "")
+        _node(root, f"{_UBL_CBC}InvoiceTypeCode", "", listID="0101")
+        _node(root, f"{_UBL_CBC}Note", "", languageLocaleID="1000")
+        _node(root, f"{_UBL_CBC}DocumentCurrencyCode", "")
+
+        cac_sig = _node(root, f"{_UBL_CAC}Signature")
+        _node(cac_sig, f"{_UBL_CBC}ID", "APISUNAT")
+        sig_party = _node(cac_sig, f"{_UBL_CAC}SignatoryParty")
+        _node(_node(sig_party, f"{_UBL_CAC}PartyIdentification"), f"{_UBL_CBC}ID", issuer['ruc'])
+        _node(_node(sig_party, f"{_UBL_CAC}PartyName"), f"{_UBL_CBC}Name", issuer['name'])
+        ext_ref = _node(_node(cac_sig, f"{_UBL_CAC}DigitalSignatureAttachment"), f"{_UBL_CAC}ExternalReference")
+        _node(ext_ref, f"{_UBL_CBC}URI", issuer.get('fe_url', ''))
+
+        party = _node(_node(root, f"{_UBL_CAC}AccountingSupplierParty"), f"{_UBL_CAC}Party")
+        _node(_node(party, f"{_UBL_CAC}PartyIdentification"), f"{_UBL_CBC}ID", issuer['ruc'], schemeID="6")
+        _node(_node(party, f"{_UBL_CAC}PartyName"), f"{_UBL_CBC}Name", issuer.get('commercial_name') or issuer['name'])
+        legal = _node(party, f"{_UBL_CAC}PartyLegalEntity")
+        _node(legal, f"{_UBL_CBC}RegistrationName", issuer['name'])
+        reg_addr = _node(legal, f"{_UBL_CAC}RegistrationAddress")
+        _node(reg_addr, f"{_UBL_CBC}AddressTypeCode", issuer.get('establishment_code', '0000'))
+        _node(_node(reg_addr, f"{_UBL_CAC}AddressLine"), f"{_UBL_CBC}Line", issuer['address'])
+
+        # Customer: Party > [PartyIdentification > ID, PartyLegalEntity > [RegistrationName, RegistrationAddress > AddressLine > Line]]
+        party = _node(_node(root, f"{_UBL_CAC}AccountingCustomerParty"), f"{_UBL_CAC}Party")
+        _node(_node(party, f"{_UBL_CAC}PartyIdentification"), f"{_UBL_CBC}ID", "", schemeID="", schemeName="Documento de Identidad",
+              schemeAgencyName="PE:SUNAT", schemeURI="urn:pe:gob:sunat:cpe:see:gem:catalogos:catalogo06")
+        legal = _node(party, f"{_UBL_CAC}PartyLegalEntity")
+        _node(legal, f"{_UBL_CBC}RegistrationName", "")
+        _node(_node(_node(legal, f"{_UBL_CAC}RegistrationAddress"), f"{_UBL_CAC}AddressLine"), f"{_UBL_CBC}Line", "")
+        self.skeleton = root
+
+        self.payment_terms = etree.Element(f"{_UBL_CAC}PaymentTerms")
+        _node(self.payment_terms, f"{_UBL_CBC}ID", "FormaPago")
+        _node(self.payment_terms, f"{_UBL_CBC}PaymentMeansID", "Contado")
+
+        # TaxTotal > [TaxAmount, TaxSubtotal > [TaxableAmount, TaxAmount, TaxCategory]]
+        self.tax_total = etree.Element(f"{_UBL_CAC}TaxTotal")
+        _node(self.tax_total, f"{_UBL_CBC}TaxAmount", "", currencyID="")
+        subtotal = _node(self.tax_total, f"{_UBL_CAC}TaxSubtotal")
+        _node(subtotal, f"{_UBL_CBC}TaxableAmount", "", currencyID="PEN")
+        _node(subtotal, f"{_UBL_CBC}TaxAmount", "", currencyID="PEN")
+        self._igv_scheme(_node(_node(subtotal, f"{_UBL_CAC}TaxCategory"), f"{_UBL_CAC}TaxScheme"))
+
+        self.monetary_total = etree.Element(f"{_UBL_CAC}LegalMonetaryTotal")
+        for name in ("LineExtensionAmount", "TaxInclusiveAmount", "PayableAmount"):
+            _node(self.monetary_total, f"{_UBL_CBC}{name}", "", currencyID="PEN")
+
+        # InvoiceLine > [ID, InvoicedQuantity, LineExtensionAmount, PricingReference, TaxTotal, Item, Price]
+        line = self.line = etree.Element(f"{_UBL_CAC}InvoiceLine")
+        _node(line, f"{_UBL_CBC}ID", "")
+        _node(line, f"{_UBL_CBC}InvoicedQuantity", "", unitCode="")
+        _node(line, f"{_UBL_CBC}LineExtensionAmount", "", currencyID="PEN")
+        acp = _node(_node(line, f"{_UBL_CAC}PricingReference"), f"{_UBL_CAC}AlternativeConditionPrice")
+        _node(acp, f"{_UBL_CBC}PriceAmount", "", currencyID="PEN")
+        _node(acp, f"{_UBL_CBC}PriceTypeCode", "01")
+        line_tax = _node(line, f"{_UBL_CAC}TaxTotal")
+        _node(line_tax, f"{_UBL_CBC}TaxAmount", "", currencyID="PEN")
+        subtotal = _node(line_tax, f"{_UBL_CAC}TaxSubtotal")
+        _node(subtotal, f"{_UBL_CBC}TaxableAmount", "", currencyID="PEN")
+        _node(subtotal, f"{_UBL_CBC}TaxAmount", "", currencyID="PEN")
+        category = _node(subtotal, f"{_UBL_CAC}TaxCategory")
+        _node(category, f"{_UBL_CBC}Percent", "18")
+        _node(category, f"{_UBL_CBC}TaxExemptionReasonCode", "10")
+        self._igv_scheme(_node(category, f"{_UBL_CAC}TaxScheme"))
+        _node(_node(line, f"{_UBL_CAC}Item"), f"{_UBL_CBC}Description", "")
+        _node(_node(line, f"{_UBL_CAC}Price"), f"{_UBL_CBC}PriceAmount", "", currencyID="PEN")
+
+    @staticmethod
+    def _igv_scheme(scheme):
+        _node(scheme, f"{_UBL_CBC}ID", "1000")
+        _node(scheme, f"{_UBL_CBC}Name", "IGV")
+        _node(scheme, f"{_UBL_CBC}TaxTypeCode", "VAT")
+
+
+# Plantillas por contenido del bloque del emisor: si cambian sus datos se compila otra
+_invoice_templates = {}
+_invoice_templates_lock = threading.Lock()
+_INVOICE_TEMPLATES_MAX = 64
+
+
+def _invoice_template(issuer):
+    key = (issuer['ruc'], issuer['name'], issuer.get('commercial_name'), issuer['address'],
+           issuer.get('establishment_code', '0000'), issuer.get('fe_url', ''))
+    template = _invoice_templates.get(key)
+    if template is None:
+        template = InvoiceTemplate(issuer)
+        with _invoice_templates_lock:
+            if len(_invoice_templates) >= _INVOICE_TEMPLATES_MAX:
+                _invoice_templates.clear()
+            _invoice_templates[key] = template
+    return template
+
 
 class XMLGenerator:
     def __init__(self, base_dir):
@@ -15,8 +200,8 @@ class XMLGenerator:
         self.xml_dir = os.path.join(base_dir, "XML")
         self.cdr_dir = os.path.join(base_dir, "CDR")
         
-        if not os.path.exists(self.xml_dir): os.makedirs(self.xml_dir)
-        if not os.path.exists(self.cdr_dir): os.makedirs(self.cdr_dir)
+        os.makedirs(self.xml_dir, exist_ok=True)
+        os.makedirs(self.cdr_dir, exist_ok=True)
             
         self.ns = {
             'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2': 'Invoice',
@@ -32,36 +217,8 @@ class XMLGenerator:
         issuer_data should contain: certificate (blob), password (str, optional), fe_url (str)
         """
         try:
-            # 1. Generate XML Tree (Unsigned)
-            xml_tree, filename_base = self._build_invoice_xml(sale_data, issuer_data)
-            
-            # 2. Sign XML
-            cert_blob = issuer_data.get('certificate')
-            # Assuming no password for PEM or using SOL pass for PFX if needed (logic to be refined)
-            password = issuer_data.get('cert_password') or issuer_data.get('sol_pass') # Attempt to use sol_pass if pfx requires it?
-            
-            if not cert_blob:
-                raise ValueError("No certificate found for issuer")
-
-            pkey, cert_pem = self._load_key_and_cert(cert_blob, password)
-            signed_xml = self._sign_xml_ubl(xml_tree, pkey, cert_pem)
-            
-            # 3. Save Signed XML
-            xml_filename = f"{filename_base}.xml"
-            xml_path = os.path.join(self.xml_dir, xml_filename)
-            with open(xml_path, 'wb') as f:
-                f.write(etree.tostring(signed_xml, encoding='ISO-8859-1')) 
-            
-            # 4. Zip XML
-            # User request: "quiero que el xml zipeado se mantenga en la misma carpeta" (XML folder)
-            zip_filename = f"{filename_base}.zip"
-            zip_path = os.path.join(self.xml_dir, zip_filename)
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-                zf.write(xml_path, arcname=xml_filename)
-            
-            # Cleanup XML (User request: only keep zip)
-            if os.path.exists(xml_path):
-                os.remove(xml_path)
+            zip_path, zip_filename, filename_base = self.build_signed_zip(sale_data, issuer_data)
+            xml_path = os.path.join(self.xml_dir, f"{filename_base}.xml")
             
             # 5. Send to API
             fe_url = issuer_data.get('fe_url')
@@ -69,31 +226,22 @@ class XMLGenerator:
             if fe_url:
                 response = self._send_to_pse(zip_path, zip_filename, fe_url, issuer_data)
                 
-                # Try to extract and save CDR
-                try:
-                    import re
-                    # Look for applicationResponse (ignore namespace prefixes)
-                    match = re.search(r'<[^:]*:?applicationResponse>(.*?)</[^:]*:?applicationResponse>', response, re.DOTALL)
-                    if match:
-                        cdr_b64 = match.group(1)
-                        cdr_content = base64.b64decode(cdr_b64)
-                        
-                        cdr_filename = f"R-{filename_base}.zip"
-                        cdr_path = os.path.join(self.cdr_dir, cdr_filename)
-                        
-                        with open(cdr_path, 'wb') as f:
-                            f.write(cdr_content)
-                            
+                # CDR (zip en base64 dentro de applicationResponse): se decodifica en memoria y se guarda
+                sunat = sunat_response.parse_response(response)
+                if sunat.cdr_zip:
+                    try:
+                        cdr_path = self.save_cdr(sunat.cdr_zip, filename_base)
                         print(f"CDR Saved: {cdr_path}")
-                except Exception as e:
-                    print(f"Error saving CDR: {e}")
+                    except Exception as e:
+                        print(f"Error saving CDR: {e}")
 
                 return {
                     "success": True, 
                     "xml_path": xml_path, 
                     "zip_path": zip_path, 
                     "cdr_path": cdr_path,
-                    "response": response
+                    "response": response,
+                    "sunat": sunat
                 }
             else:
                 return {"success": True, "xml_path": xml_path, "zip_path": zip_path, "response": "No URL configured"}
@@ -102,7 +250,222 @@ class XMLGenerator:
             print(f"XML Process Error: {e}")
             return {"success": False, "error": str(e)}
 
+    def build_signed_zip(self, sale_data, issuer_data):
+        """Genera, firma y comprime el comprobante sin enviarlo. Retorna (zip_path, zip_filename, filename_base)."""
+        # 1. Generate XML Tree (Unsigned)
+        xml_tree, filename_base = self._build_invoice_xml(sale_data, issuer_data)
+        
+        # 2. Sign XML
+        credentials = self.get_credentials(issuer_data)
+        signed_xml = self._sign_xml_ubl(xml_tree, credentials)
+        
+        # 3. Save signed XML zipped
+        zip_path, zip_filename = self._write_signed_zip(signed_xml, filename_base)
+        return zip_path, zip_filename, filename_base
+
+    def _write_signed_zip(self, signed_xml, filename_base):
+        # 3. Save Signed XML
+        xml_filename = f"{filename_base}.xml"
+        xml_path = os.path.join(self.xml_dir, xml_filename)
+        with open(xml_path, 'wb') as f:
+            f.write(etree.tostring(signed_xml, encoding='ISO-8859-1')) 
+        
+        # 4. Zip XML
+        # User request: "quiero que el xml zipeado se mantenga en la misma carpeta" (XML folder)
+        zip_filename = f"{filename_base}.zip"
+        zip_path = os.path.join(self.xml_dir, zip_filename)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.write(xml_path, arcname=xml_filename)
+        
+        # Cleanup XML (User request: only keep zip)
+        if os.path.exists(xml_path):
+            os.remove(xml_path)
+        return zip_path, zip_filename
+
+    def build_daily_summary(self, issuer_data, reference_date, documents, sequence):
+        """
+        Resumen Diario (RC) de boletas emitidas en reference_date ('YYYY-MM-DD').
+        documents: lista de sale_data (mismo formato que generate_and_send). Retorna (zip_path, zip_filename).
+        """
+        ruc = issuer_data.get('ruc', '')
+        summary_id = f"RC-{reference_date.replace('-', '')}-{sequence}"
+        cac = "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+        sac = "urn:sunat:names:specification:ubl:peru:schema:xsd:SunatAggregateComponents-1"
+        ext = "urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2"
+        nsmap = {
+            None: "urn:sunat:names:specification:ubl:peru:schema:xsd:SummaryDocuments-1",
+            "cac": cac,
+            "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+            "ds": "http://www.w3.org/2000/09/xmldsig#",
+            "ext": ext,
+            "sac": sac
+        }
+        root = etree.Element("{urn:sunat:names:specification:ubl:peru:schema:xsd:SummaryDocuments-1}SummaryDocuments", nsmap=nsmap)
+        exts = etree.SubElement(root, f"{{{ext}}}UBLExtensions")
+        etree.SubElement(etree.SubElement(exts, f"{{{ext}}}UBLExtension"), f"{{{ext}}}ExtensionContent")
+
+        self._add_text_elem(root, "cbc", "UBLVersionID", "2.0")
+        self._add_text_elem(root, "cbc", "CustomizationID", "1.1")
+        self._add_text_elem(root, "cbc", "ID", summary_id)
+        self._add_text_elem(root, "cbc", "ReferenceDate", reference_date)
+        self._add_text_elem(root, "cbc", "IssueDate", datetime.now().strftime("%Y-%m-%d"))
+
+        cac_sig = etree.SubElement(root, f"{{{cac}}}Signature")
+        self._add_text_elem(cac_sig, "cbc", "ID", "APISUNAT")
+        sig_party = etree.SubElement(cac_sig, f"{{{cac}}}SignatoryParty")
+        self._add_text_elem(etree.SubElement(sig_party, f"{{{cac}}}PartyIdentification"), "cbc", "ID", ruc)
+        self._add_text_elem(etree.SubElement(sig_party, f"{{{cac}}}PartyName"), "cbc", "Name", issuer_data.get('name', ''))
+
+        supplier = etree.SubElement(root, f"{{{cac}}}AccountingSupplierParty")
+        self._add_text_elem(supplier, "cbc", "CustomerAssignedAccountID", ruc)
+        self._add_text_elem(supplier, "cbc", "AdditionalAccountID", "6")
+        legal = etree.SubElement(etree.SubElement(supplier, f"{{{cac}}}Party"), f"{{{cac}}}PartyLegalEntity")
+        self._add_text_elem(legal, "cbc", "RegistrationName", issuer_data.get('name', ''))
+
+        for idx, data in enumerate(documents, 1):
+            doc = data['document']
+            customer = data['customer']
+            try:
+                num = f"{int(doc['number']):08d}"
+            except:
+                num = str(doc['number'])
+            taxable, igv = self._calc_taxes(data['items'])
+
+            line = etree.SubElement(root, f"{{{sac}}}SummaryDocumentsLine")
+            self._add_text_elem(line, "cbc", "LineID", str(idx))
+            self._add_text_elem(line, "cbc", "DocumentTypeCode", "03")
+            self._add_text_elem(line, "cbc", "ID", f"{doc['series'] or 'B001'}-{num}")
+            cust = etree.SubElement(line, f"{{{cac}}}AccountingCustomerParty")
+            cust_doc_num = customer.get('doc_number') or "-"
+            self._add_text_elem(cust, "cbc", "CustomerAssignedAccountID", cust_doc_num)
+            self._add_text_elem(cust, "cbc", "AdditionalAccountID", {11: "6", 8: "1"}.get(len(cust_doc_num), "0"))
+            self._add_text_elem(etree.SubElement(line, f"{{{cac}}}Status"), "cbc", "ConditionCode", "1")
+            total = etree.SubElement(line, f"{{{sac}}}TotalAmount")
+            total.text = str(self._calc_total(data['items']))
+            total.set("currencyID", doc.get('currency', 'PEN'))
+            payment = etree.SubElement(line, f"{{{sac}}}BillingPayment")
+            self._add_text_elem(payment, "cbc", "PaidAmount", str(taxable)).set("currencyID", "PEN")
+            self._add_text_elem(payment, "cbc", "InstructionID", "01")
+            tax_total = etree.SubElement(line, f"{{{cac}}}TaxTotal")
+            self._add_text_elem(tax_total, "cbc", "TaxAmount", str(igv)).set("currencyID", "PEN")
+            ts = etree.SubElement(tax_total, f"{{{cac}}}TaxSubtotal")
+            self._add_text_elem(ts, "cbc", "TaxAmount", str(igv)).set("currencyID", "PEN")
+            tscheme = etree.SubElement(etree.SubElement(ts, f"{{{cac}}}TaxCategory"), f"{{{cac}}}TaxScheme")
+            self._add_text_elem(tscheme, "cbc", "ID", "1000")
+            self._add_text_elem(tscheme, "cbc", "Name", "IGV")
+            self._add_text_elem(tscheme, "cbc", "TaxTypeCode", "VAT")
+
+        signed_xml = self._sign_xml_ubl(root, self.get_credentials(issuer_data))
+        return self._write_signed_zip(signed_xml, f"{ruc}-{summary_id}")
+
+    def build_pack(self, issuer_data, zip_paths, sequence):
+        """Lote (sendPack): un zip con los XML firmados de varios comprobantes. Retorna (zip_path, zip_filename)."""
+        zip_filename = f"{issuer_data.get('ruc', '')}-LT-{datetime.now().strftime('%Y%m%d')}-{sequence}.zip"
+        zip_path = os.path.join(self.xml_dir, zip_filename)
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as pack:
+            for path in zip_paths:
+                with zipfile.ZipFile(path) as single:
+                    for name in single.namelist():
+                        pack.writestr(name, single.read(name))
+        return zip_path, zip_filename
+
+    def save_cdr(self, cdr_zip, filename_base):
+        """Guarda el zip del CDR (SunatResponse.cdr_zip) como CDR/R-<archivo>.zip y retorna su ruta."""
+        cdr_path = os.path.join(self.cdr_dir, f"R-{filename_base}.zip")
+        with open(cdr_path, 'wb') as f:
+            f.write(cdr_zip)
+        return cdr_path
+
     def _build_invoice_xml(self, data, issuer_data):
+        """Invoice UBL sin firmar a partir de la plantilla del emisor. Retorna (root, filename_base)."""
+        doc = data['document']
+        customer = data['customer']
+        items = data['items']
+        template = _invoice_template(data['issuer'])
+        inv_type, full_id, filename_base, is_boleta = self._document_ids(doc, data['issuer'])
+        currency = doc.get('currency', 'PEN')
+
+        root = copy.deepcopy(template.skeleton)
+        root[template.ID].text = full_id
+        root[template.ISSUE_DATE].text = doc['issue_date'].strftime("%Y-%m-%d")
+        root[template.ISSUE_TIME].text = doc['issue_date'].strftime("%H:%M:%S")
+        root[template.TYPE_CODE].text = inv_type
+        total_payable = self._calc_total(items)
+        root[template.NOTE].text = self._number_to_text(total_payable)
+        root[template.CURRENCY].text = currency
+
+        cust_doc_num, scheme, cust_name = self._customer_identity(customer)
+        party = root[template.CUSTOMER][0]
+        party[0][0].text = cust_doc_num
+        party[0][0].set("schemeID", scheme)
+        party[1][0].text = cust_name
+        party[1][1][0][0].text = customer.get('address') or "-"
+
+        if not is_boleta:
+            root.append(copy.deepcopy(template.payment_terms))
+
+        total_taxable, total_igv = self._calc_taxes(items)
+        tax_total = copy.deepcopy(template.tax_total)
+        tax_total[0].text = str(total_igv)
+        tax_total[0].set("currencyID", currency)
+        tax_total[1][0].text = str(total_taxable)
+        tax_total[1][1].text = str(total_igv)
+        root.append(tax_total)
+
+        monetary_total = copy.deepcopy(template.monetary_total)
+        monetary_total[0].text = str(total_taxable)
+        monetary_total[1].text = str(total_payable)
+        monetary_total[2].text = str(total_payable)
+        root.append(monetary_total)
+
+        for idx, item in enumerate(items, 1):
+            root.append(self._invoice_line(template, idx, item))
+
+        return root, filename_base
+
+    def _invoice_line(self, template, idx, item):
+        line = copy.deepcopy(template.line)
+        qty_val = float(item['quantity'])
+        p_inc = float(item['price_unit_inc_igv'])
+        p_base = p_inc / 1.18
+        line_ext = round(p_base * qty_val, 2)
+        line_igv = round(line_ext * 0.18, 2)
+
+        line[0].text = str(idx)
+        line[1].text = str(qty_val)
+        line[1].set("unitCode", item.get('unit_code', 'NIU') or 'NIU')
+        line[2].text = str(line_ext)
+        line[3][0][0].text = str(round(p_inc, 2))
+        line[4][0].text = str(line_igv)
+        line[4][1][0].text = str(line_ext)
+        line[4][1][1].text = str(line_igv)
+        line[5][0].text = str(item['description'])
+        line[6][0].text = str(round(p_base, 10))
+        return line
+
+    def _document_ids(self, doc, issuer):
+        """(tipo 01/03, serie-número, nombre de archivo, es_boleta) del comprobante."""
+        if "FACTURA" in doc['type_name'].upper():
+            inv_type, prefix, is_boleta = "01", doc['series'] or "F001", False
+        else:
+            inv_type, prefix, is_boleta = "03", doc['series'] or "B001", True
+        try:
+            num = f"{int(doc['number']):08d}"
+        except (TypeError, ValueError):
+            num = str(doc['number'])
+        full_id = f"{prefix}-{num}"
+        return inv_type, full_id, f"{issuer['ruc']}-{inv_type}-{full_id}", is_boleta
+
+    def _customer_identity(self, customer):
+        """(número de documento, schemeID del catálogo 06, nombre) del adquirente."""
+        cust_doc_num = customer.get('doc_number')
+        if not cust_doc_num: # Sin documento: "-" con tipo 0
+            return "-", "0", "CLIENTES VARIOS"
+        scheme = "6" if len(cust_doc_num) == 11 else "1" if len(cust_doc_num) == 8 else "0"
+        return cust_doc_num, scheme, customer['name']
+
+    def _build_invoice_xml_full(self, data, issuer_data):
+        """Construcción completa del árbol en cada venta, sin plantilla (referencia de _build_invoice_xml y de bench_ubl_builder.py)."""
         doc = data['document']
         issuer = data['issuer']
         customer = data['customer']
@@ -231,21 +594,7 @@ class XMLGenerator:
              self._add_text_elem(pt, "cbc", "PaymentMeansID", "Contado")
 
         # Calculations & Totals
-        total_igv = 0.0
-        total_taxable = 0.0
-        
-        for item in items:
-             p_inc_igv = float(item['price_unit_inc_igv'])
-             qty = float(item['quantity'])
-             # Base
-             p_base = p_inc_igv / 1.18
-             line_ext = p_base * qty
-             igv_line = line_ext * 0.18
-             total_igv += igv_line
-             total_taxable += line_ext
-
-        total_igv = round(total_igv, 2)
-        total_taxable = round(total_taxable, 2)
+        total_taxable, total_igv = self._calc_taxes(items)
         
         # Tax Total
         tax_total = etree.SubElement(root, f"{{urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2}}TaxTotal")
@@ -337,22 +686,48 @@ class XMLGenerator:
         elem.text = str(text)
         return elem
 
-    def _sign_xml_ubl(self, root, key, cert_pem):
+    def get_credentials(self, issuer_data):
+        """Credenciales de firma del emisor, desde la caché mientras no cambie su certificado."""
+        cert_blob = issuer_data.get('certificate')
+        # Assuming no password for PEM or using SOL pass for PFX if needed (logic to be refined)
+        password = issuer_data.get('cert_password') or issuer_data.get('sol_pass') # Attempt to use sol_pass if pfx requires it?
+
+        if not cert_blob:
+            raise ValueError("No certificate found for issuer")
+
+        issuer_id = issuer_data.get('id')
+        cert_hash = _credentials_hash(cert_blob, password)
+        with _credentials_lock:
+            cached = _credentials.get(issuer_id)
+            if cached and cached[0] == cert_hash:
+                _signing_stats["credential_hits"] += 1
+                return cached[1]
+
+        started = time.perf_counter()
+        key, cert_pem = self._load_key_and_cert(cert_blob, password)
+        credentials = SigningCredentials(key, cert_pem, time.perf_counter() - started)
+        with _credentials_lock:
+            _credentials[issuer_id] = (cert_hash, credentials)
+            _signing_stats["credential_loads"] += 1
+            _signing_stats["load_seconds"] += credentials.load_seconds
+        print(f"Credenciales de firma cargadas (emisor {issuer_id}) en {credentials.load_seconds * 1000:.1f} ms")
+        return credentials
+
+    def _sign_xml_ubl(self, root, credentials):
         """
         Signs the UBL following strict placement: 
         ext:UBLExtensions > ext:UBLExtension > ext:ExtensionContent > ds:Signature
         """
-        signer = XMLSigner(
-            method=methods.enveloped,
-            signature_algorithm="rsa-sha256",
-            digest_algorithm="sha256",
-            c14n_algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"
-        )
-        
         # signxml signs the root by default.
         # We need to sign, and then MOVE the signature to the ExtensionContent
         
-        signed_root = signer.sign(root, key=key, cert=cert_pem)
+        started = time.perf_counter()
+        with credentials.lock:
+            signed_root = credentials.signer.sign(root, key=credentials.key, cert=credentials.cert_pem)
+        elapsed = time.perf_counter() - started
+        with _credentials_lock:
+            _signing_stats["signatures"] += 1
+            _signing_stats["sign_seconds"] += elapsed
         
         # Find the signature
         ns = {'ds': 'http://www.w3.org/2000/09/xmldsig#', 'ext': 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2'}
@@ -384,17 +759,12 @@ class XMLGenerator:
         # Try loading as PFX
         try:
              p12 = pkcs12.load_key_and_certificates(blob, password.encode() if password else None, backend=default_backend())
+             # signxml acepta el objeto de clave directamente: no hace falta volver a serializarlo a PEM
              key = p12[0]
              cert = p12[1]
              # Convert cert to PEM for signxml
              cert_pem = cert.public_bytes(serialization.Encoding.PEM)
-             # Key to PEM
-             key_pem = key.private_bytes(
-                 encoding=serialization.Encoding.PEM,
-                 format=serialization.PrivateFormat.PKCS8,
-                 encryption_algorithm=serialization.NoEncryption()
-             )
-             return key_pem, cert_pem
+             return key, cert_pem
         except Exception as e:
              # Try plain PEM
              try:
@@ -410,6 +780,23 @@ class XMLGenerator:
              except:
                  raise e
 
+    def _calc_taxes(self, items):
+        """(valor de venta gravado, IGV) redondeados, con precios unitarios que incluyen IGV."""
+        total_igv = 0.0
+        total_taxable = 0.0
+        
+        for item in items:
+             p_inc_igv = float(item['price_unit_inc_igv'])
+             qty = float(item['quantity'])
+             # Base
+             p_base = p_inc_igv / 1.18
+             line_ext = p_base * qty
+             igv_line = line_ext * 0.18
+             total_igv += igv_line
+             total_taxable += line_ext
+
+        return round(total_taxable, 2), round(total_igv, 2)
+
     def _calc_total(self, items):
         total = 0.0
         for i in items:
@@ -448,10 +835,8 @@ class XMLGenerator:
         if text_int == "": text_int = "CERO"
         return f"{text_int} CON {decimal_part:02d}/100 SOLES"
 
-    def _send_to_pse(self, zip_path, zip_filename, url, issuer_data):
-        # SOAP Implementation for SUNAT
-        # Requires WS-Security with RUC+User and Password
-        
+    def _soap_envelope(self, issuer_data, body):
+        """Sobre SOAP con WS-Security (RUC+usuario SOL y clave) alrededor de la operación `body`."""
         ruc = issuer_data.get('ruc', '')
         sol_user = issuer_data.get('sol_user', '')
         sol_pass = issuer_data.get('sol_pass', '')
@@ -460,12 +845,7 @@ class XMLGenerator:
         # If sol_user doesn't start with RUC, prepending might be safer or leave as is if user entered full.
         # Usually users enter just the specific user. Let's try combining if purely numeric RUC is separate.
         username = f"{ruc}{sol_user}" if len(sol_user) < 11 else sol_user
-        
-        # Read Zip and B64 encode
-        with open(zip_path, "rb") as f:
-            zip_content = base64.b64encode(f.read()).decode('utf-8')
-
-        soap_env = f"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ser="http://service.sunat.gob.pe" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
+        return f"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ser="http://service.sunat.gob.pe" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
    <soapenv:Header>
       <wsse:Security>
          <wsse:UsernameToken>
@@ -475,23 +855,51 @@ class XMLGenerator:
       </wsse:Security>
    </soapenv:Header>
    <soapenv:Body>
-      <ser:sendBill>
-         <fileName>{zip_filename}</fileName>
-         <contentFile>{zip_content}</contentFile>
-      </ser:sendBill>
+      {body}
    </soapenv:Body>
 </soapenv:Envelope>"""
 
+    def _post_soap(self, url, envelope, action, retry=False):
+        # retry=True solo para consultas (getStatus/getStatusCdr): repetir un envío podría duplicarlo
         headers = {
             'Content-Type': 'text/xml;charset=UTF-8',
-            'SOAPAction': 'urn:sendBill'
+            'SOAPAction': f'urn:{action}'
         }
-        
+        r = http_transport.post(url, data=envelope, headers=headers, endpoint=f"sunat.{action}", read_timeout=45, retry=retry)
+        return r.text
+
+    def _send_zip(self, operation, zip_path, zip_filename, url, issuer_data):
+        # Read Zip and B64 encode
+        with open(zip_path, "rb") as f:
+            zip_content = base64.b64encode(f.read()).decode('utf-8')
+        body = f"""<ser:{operation}>
+         <fileName>{zip_filename}</fileName>
+         <contentFile>{zip_content}</contentFile>
+      </ser:{operation}>"""
+        return self._post_soap(url, self._soap_envelope(issuer_data, body), operation)
+
+    def _send_to_pse(self, zip_path, zip_filename, url, issuer_data):
+        # SOAP Implementation for SUNAT (sendBill)
+        # Requires WS-Security with RUC+User and Password
+        return self._send_zip("sendBill", zip_path, zip_filename, url, issuer_data)
+
+    def send_summary(self, zip_path, zip_filename, url, issuer_data):
+        """Envía un Resumen Diario (sendSummary). SUNAT responde con un ticket que se consulta con check_ticket_status."""
+        return self._send_for_ticket("sendSummary", zip_path, zip_filename, url, issuer_data)
+
+    def send_pack(self, zip_path, zip_filename, url, issuer_data):
+        """Envía un lote de comprobantes (sendPack); también responde con un ticket."""
+        return self._send_for_ticket("sendPack", zip_path, zip_filename, url, issuer_data)
+
+    def _send_for_ticket(self, operation, zip_path, zip_filename, url, issuer_data):
         try:
-            r = requests.post(url, data=soap_env, headers=headers, timeout=45)
-            return r.text
+            response = self._send_zip(operation, zip_path, zip_filename, url, issuer_data)
         except Exception as e:
-            raise e
+            return {'success': False, 'error': str(e)}
+        sunat = sunat_response.parse_response(response)
+        if not sunat.ticket:
+            return {'success': False, 'error': sunat.note or "Respuesta sin ticket", 'response': response, 'sunat': sunat}
+        return {'success': True, 'ticket': sunat.ticket, 'response': response, 'sunat': sunat}
 
     def check_cdr_status(self, issuer_data, type_code, series, number):
         """Consulta el estado de un comprobante (getStatusCdr)."""
@@ -513,79 +921,35 @@ class XMLGenerator:
              url = "https://e-beta.sunat.gob.pe/ol-ti-itcpfegem-beta/billConsultService"
         
         ruc = issuer_data.get('ruc', '')
-        sol_user = issuer_data.get('sol_user', '')
-        sol_pass = issuer_data.get('sol_pass', '')
-        username = f"{ruc}{sol_user}" if len(sol_user) < 11 else sol_user
-        
-        # SOAP Envelope
-        soap_env = f"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ser="http://service.sunat.gob.pe" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
-   <soapenv:Header>
-      <wsse:Security>
-         <wsse:UsernameToken>
-            <wsse:Username>{username}</wsse:Username>
-            <wsse:Password>{sol_pass}</wsse:Password>
-         </wsse:UsernameToken>
-      </wsse:Security>
-   </soapenv:Header>
-   <soapenv:Body>
-      <ser:getStatusCdr>
+        body = f"""<ser:getStatusCdr>
          <rucComprobante>{ruc}</rucComprobante>
          <tipoComprobante>{type_code}</tipoComprobante>
          <serieComprobante>{series}</serieComprobante>
          <numeroComprobante>{number}</numeroComprobante>
-      </ser:getStatusCdr>
-   </soapenv:Body>
-</soapenv:Envelope>"""
-
-        headers = {
-            'Content-Type': 'text/xml;charset=UTF-8',
-            'SOAPAction': 'urn:getStatusCdr'
-        }
+      </ser:getStatusCdr>"""
         
         try:
-            r = requests.post(url, data=soap_env, headers=headers, timeout=45)
+            response = self._post_soap(url, self._soap_envelope(issuer_data, body), "getStatusCdr", retry=True)
             # Parse response
             # Format: <statusCdr><content>BASE64</content><statusCode>X</statusCode><statusMessage>...</statusMessage></statusCdr>
             # Or Fault.
-            return {'success': True, 'response': r.text}
+            return {'success': True, 'response': response}
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def check_ticket_status(self, issuer_data, ticket):
-        """Consulta el estado de un ticket (getStatus)."""
-        url = "https://e-factura.sunat.gob.pe/ol-ti-itcpfegem/billService" # Same as sendBill often? Or separate?
-        # getStatus is in billService.
-        if "beta" in issuer_data.get('fe_url', ''):
-             url = "https://e-beta.sunat.gob.pe/ol-ti-itcpfegem-beta/billService"
+    def check_ticket_status(self, issuer_data, ticket, url=None):
+        """Consulta el estado de un ticket (getStatus). url: servicio donde se envió el lote (por defecto el de SUNAT)."""
+        if not url:
+            url = "https://e-factura.sunat.gob.pe/ol-ti-itcpfegem/billService" # Same as sendBill often? Or separate?
+            # getStatus is in billService.
+            if "beta" in issuer_data.get('fe_url', ''):
+                 url = "https://e-beta.sunat.gob.pe/ol-ti-itcpfegem-beta/billService"
 
-        ruc = issuer_data.get('ruc', '')
-        sol_user = issuer_data.get('sol_user', '')
-        sol_pass = issuer_data.get('sol_pass', '')
-        username = f"{ruc}{sol_user}" if len(sol_user) < 11 else sol_user
-        
-        soap_env = f"""<soapenv:Envelope xmlns:soapenv="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ser="http://service.sunat.gob.pe" xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd">
-   <soapenv:Header>
-      <wsse:Security>
-         <wsse:UsernameToken>
-            <wsse:Username>{username}</wsse:Username>
-            <wsse:Password>{sol_pass}</wsse:Password>
-         </wsse:UsernameToken>
-      </wsse:Security>
-   </soapenv:Header>
-   <soapenv:Body>
-      <ser:getStatus>
+        body = f"""<ser:getStatus>
          <ticket>{ticket}</ticket>
-      </ser:getStatus>
-   </soapenv:Body>
-</soapenv:Envelope>"""
-
-        headers = {
-            'Content-Type': 'text/xml;charset=UTF-8',
-            'SOAPAction': 'urn:getStatus'
-        }
+      </ser:getStatus>"""
         
         try:
-            r = requests.post(url, data=soap_env, headers=headers, timeout=45)
-            return {'success': True, 'response': r.text}
+            return {'success': True, 'response': self._post_soap(url, self._soap_envelope(issuer_data, body), "getStatus", retry=True)}
         except Exception as e:
             return {'success': False, 'error': str(e)}